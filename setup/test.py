@@ -68,6 +68,22 @@ def find_tests(which_tests=None):
         a(find_tests())
         from calibre.utils.test_lock import find_tests
         a(find_tests())
+        from calibre.web.fetch.test_cache import find_tests
+        a(find_tests())
+        from calibre.web.fetch.test_scheduler import find_tests
+        a(find_tests())
+        from calibre.devices.kobo.test_db import find_tests
+        a(find_tests())
+        from calibre.devices.smart_device_app.test import find_tests
+        a(find_tests())
+        from calibre.devices.usbms.test import find_tests
+        a(find_tests())
+        from calibre.utils.fonts.sfnt.test_subset import find_tests
+        a(find_tests())
+        from calibre.customize.test_manifest import find_tests
+        a(find_tests())
+        from calibre.ebooks.mobi.test_huffcdic import find_tests
+        a(find_tests())
     if ok('dbcli'):
         from calibre.db.cli.tests import find_tests
         a(find_tests())
@@ -550,11 +550,11 @@ class CatalogPlugin(Plugin):  # {{{
         Tab will be dynamically generated and added to the Catalog Options dialog in
         calibre.gui2.dialogs.catalog.py:Catalog
         '''
-        from calibre.customize.builtins import plugins as builtin_plugins
         from calibre.customize.ui import config
         from calibre.ptempfile import PersistentTemporaryDirectory
 
-        if not type(self) in builtin_plugins and self.name not in config['disabled_plugins']:
+        # Builtin plugins have no plugin_path
+        if self.plugin_path is not None and self.name not in config['disabled_plugins']:
             files_to_copy = ["%s.%s" % (self.name.lower(),ext) for ext in ["ui","py"]]
             resources = zipfile.ZipFile(self.plugin_path,'r')
 
@@ -3,595 +3,29 @@
 __license__   = 'GPL v3'
 __copyright__ = '2008, Kovid Goyal <kovid at kovidgoyal.net>'
 
-import os, glob, re
-from calibre import guess_type
-from calibre.customize import (FileTypePlugin, MetadataReaderPlugin,
-    MetadataWriterPlugin, PreferencesPlugin, InterfaceActionBase, StoreBase)
-from calibre.constants import numeric_version
-from calibre.ebooks.metadata.archive import ArchiveExtract, get_comic_metadata
-from calibre.ebooks.html.to_zip import HTML2ZIP
+from calibre.customize import PreferencesPlugin, InterfaceActionBase, StoreBase
+from calibre.customize.file_plugins import archive_plugins, metadata_readers, metadata_writers
 
 plugins = []
 
-# To archive plugins {{{
-
-
-class PML2PMLZ(FileTypePlugin):
-    name = 'PML to PMLZ'
-    author = 'John Schember'
-    description = _('Create a PMLZ archive containing the PML file '
-        'and all images in the directory pmlname_img or images. '
-        'This plugin is run every time you add '
-        'a PML file to the library.')
-    version = numeric_version
-    file_types = set(['pml'])
-    supported_platforms = ['windows', 'osx', 'linux']
-    on_import = True
-
-    def run(self, pmlfile):
-        import zipfile
-
-        of = self.temporary_file('_plugin_pml2pmlz.pmlz')
-        pmlz = zipfile.ZipFile(of.name, 'w')
-        pmlz.write(pmlfile, os.path.basename(pmlfile), zipfile.ZIP_DEFLATED)
-
-        pml_img = os.path.splitext(pmlfile)[0] + '_img'
-        i_img = os.path.join(os.path.dirname(pmlfile),'images')
-        img_dir = pml_img if os.path.isdir(pml_img) else i_img if \
-            os.path.isdir(i_img) else ''
-        if img_dir:
-            for image in glob.glob(os.path.join(img_dir, '*.png')):
-                pmlz.write(image, os.path.join('images', (os.path.basename(image))))
-        pmlz.close()
-
-        return of.name
-
-
-class TXT2TXTZ(FileTypePlugin):
-    name = 'TXT to TXTZ'
-    author = 'John Schember'
-    description = _('Create a TXTZ archive when a TXT file is imported '
-        'containing Markdown or Textile references to images. The referenced '
-        'images as well as the TXT file are added to the archive.')
-    version = numeric_version
-    file_types = set(['txt', 'text'])
-    supported_platforms = ['windows', 'osx', 'linux']
-    on_import = True
-
-    def _get_image_references(self, txt, base_dir):
-        from calibre.ebooks.oeb.base import OEB_IMAGES
-
-        images = []
-
-        # Textile
-        for m in re.finditer(ur'(?mu)(?:[\[{])?\!(?:\. )?(?P<path>[^\s(!]+)\s?(?:\(([^\)]+)\))?\!(?::(\S+))?(?:[\]}]|(?=\s|$))', txt):
-            path = m.group('path')
-            if path and not os.path.isabs(path) and guess_type(path)[0] in OEB_IMAGES and os.path.exists(os.path.join(base_dir, path)):
-                images.append(path)
-
-        # Markdown inline
-        for m in re.finditer(ur'(?mu)\!\[([^\]\[]*(\[[^\]\[]*(\[[^\]\[]*(\[[^\]\[]*(\[[^\]\[]*(\[[^\]\[]*(\[[^\]\[]*\])*[^\]\[]*\])*[^\]\[]*\])*[^\]\[]*\])*[^\]\[]*\])*[^\]\[]*\])*[^\]\[]*)\]\s*\((?P<path>[^\)]*)\)', txt):  # noqa
-            path = m.group('path')
-            if path and not os.path.isabs(path) and guess_type(path)[0] in OEB_IMAGES and os.path.exists(os.path.join(base_dir, path)):
-                images.append(path)
-
-        # Markdown reference
-        refs = {}
-        for m in re.finditer(ur'(?mu)^(\ ?\ ?\ ?)\[(?P<id>[^\]]*)\]:\s*(?P<path>[^\s]*)$', txt):
-            if m.group('id') and m.group('path'):
-                refs[m.group('id')] = m.group('path')
-        for m in re.finditer(ur'(?mu)\!\[([^\]\[]*(\[[^\]\[]*(\[[^\]\[]*(\[[^\]\[]*(\[[^\]\[]*(\[[^\]\[]*(\[[^\]\[]*\])*[^\]\[]*\])*[^\]\[]*\])*[^\]\[]*\])*[^\]\[]*\])*[^\]\[]*\])*[^\]\[]*)\]\s*\[(?P<id>[^\]]*)\]', txt):  # noqa
-            path = refs.get(m.group('id'), None)
-            if path and not os.path.isabs(path) and guess_type(path)[0] in OEB_IMAGES and os.path.exists(os.path.join(base_dir, path)):
-                images.append(path)
-
-        # Remove duplicates
-        return list(set(images))
-
-    def run(self, path_to_ebook):
-        from calibre.ebooks.metadata.opf2 import metadata_to_opf
-
-        with open(path_to_ebook, 'rb') as ebf:
-            txt = ebf.read()
-        base_dir = os.path.dirname(path_to_ebook)
-        images = self._get_image_references(txt, base_dir)
-
-        if images:
-            # Create TXTZ and put file plus images inside of it.
-            import zipfile
-            of = self.temporary_file('_plugin_txt2txtz.txtz')
-            txtz = zipfile.ZipFile(of.name, 'w')
-            # Add selected TXT file to archive.
-            txtz.write(path_to_ebook, os.path.basename(path_to_ebook), zipfile.ZIP_DEFLATED)
-            # metadata.opf
-            if os.path.exists(os.path.join(base_dir, 'metadata.opf')):
-                txtz.write(os.path.join(base_dir, 'metadata.opf'), 'metadata.opf', zipfile.ZIP_DEFLATED)
-            else:
-                from calibre.ebooks.metadata.txt import get_metadata
-                with open(path_to_ebook, 'rb') as ebf:
-                    mi = get_metadata(ebf)
-                opf = metadata_to_opf(mi)
-                txtz.writestr('metadata.opf', opf, zipfile.ZIP_DEFLATED)
-            # images
-            for image in images:
-                txtz.write(os.path.join(base_dir, image), image)
-            txtz.close()
-
-            return of.name
-        else:
-            # No images so just import the TXT file.
-            return path_to_ebook
-
-
-plugins += [HTML2ZIP, PML2PMLZ, TXT2TXTZ, ArchiveExtract,]
-# }}}
-
-# Metadata reader plugins {{{
-
-
-class ComicMetadataReader(MetadataReaderPlugin):
-
-    name = 'Read comic metadata'
-    file_types = set(['cbr', 'cbz'])
-    description = _('Extract cover from comic files')
-
-    def customization_help(self, gui=False):
-        return 'Read series number from volume or issue number. Default is volume, set this to issue to use issue number instead.'
-
-    def get_metadata(self, stream, ftype):
-        if hasattr(stream, 'seek') and hasattr(stream, 'tell'):
-            pos = stream.tell()
-            id_ = stream.read(3)
-            stream.seek(pos)
-            if id_ == b'Rar':
-                ftype = 'cbr'
-            elif id_.startswith(b'PK'):
-                ftype = 'cbz'
-        if ftype == 'cbr':
-            from calibre.utils.unrar import extract_cover_image
-        else:
-            from calibre.libunzip import extract_cover_image
-        from calibre.ebooks.metadata import MetaInformation
-        ret = extract_cover_image(stream)
-        mi = MetaInformation(None, None)
-        stream.seek(0)
-        if ftype in {'cbr', 'cbz'}:
-            series_index = self.site_customization
-            if series_index not in {'volume', 'issue'}:
-                series_index = 'volume'
-            try:
-                mi.smart_update(get_comic_metadata(stream, ftype, series_index=series_index))
-            except:
-                pass
-        if ret is not None:
-            path, data = ret
-            ext = os.path.splitext(path)[1][1:]
-            mi.cover_data = (ext.lower(), data)
-        return mi
-
-
-class CHMMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read CHM metadata'
-    file_types  = set(['chm'])
-    description = _('Read metadata from %s files') % 'CHM'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.chm.metadata import get_metadata
-        return get_metadata(stream)
-
-
-class EPUBMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read EPUB metadata'
-    file_types  = set(['epub'])
-    description = _('Read metadata from %s files')%'EPUB'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.epub import get_metadata, get_quick_metadata
-        if self.quick:
-            return get_quick_metadata(stream)
-        return get_metadata(stream)
-
-
-class FB2MetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read FB2 metadata'
-    file_types  = set(['fb2'])
-    description = _('Read metadata from %s files')%'FB2'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.fb2 import get_metadata
-        return get_metadata(stream)
-
-
-class HTMLMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read HTML metadata'
-    file_types  = set(['html'])
-    description = _('Read metadata from %s files')%'HTML'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.html import get_metadata
-        return get_metadata(stream)
-
-
-class HTMLZMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read HTMLZ metadata'
-    file_types  = set(['htmlz'])
-    description = _('Read metadata from %s files') % 'HTMLZ'
-    author      = 'John Schember'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.extz import get_metadata
-        return get_metadata(stream)
-
-
-class IMPMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read IMP metadata'
-    file_types  = set(['imp'])
-    description = _('Read metadata from %s files')%'IMP'
-    author      = 'Ashish Kulkarni'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.imp import get_metadata
-        return get_metadata(stream)
-
-
-class LITMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read LIT metadata'
-    file_types  = set(['lit'])
-    description = _('Read metadata from %s files')%'LIT'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.lit import get_metadata
-        return get_metadata(stream)
-
-
-class LRFMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read LRF metadata'
-    file_types  = set(['lrf'])
-    description = _('Read metadata from %s files')%'LRF'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.lrf.meta import get_metadata
-        return get_metadata(stream)
-
-
-class LRXMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read LRX metadata'
-    file_types  = set(['lrx'])
-    description = _('Read metadata from %s files')%'LRX'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.lrx import get_metadata
-        return get_metadata(stream)
-
-
-class MOBIMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read MOBI metadata'
-    file_types  = set(['mobi', 'prc', 'azw', 'azw3', 'azw4', 'pobi'])
-    description = _('Read metadata from %s files')%'MOBI'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.mobi import get_metadata
-        return get_metadata(stream)
-
-
-class ODTMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read ODT metadata'
-    file_types  = set(['odt'])
-    description = _('Read metadata from %s files')%'ODT'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.odt import get_metadata
-        return get_metadata(stream)
-
-
-class DocXMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read DOCX metadata'
-    file_types  = set(['docx'])
-    description = _('Read metadata from %s files')%'DOCX'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.docx import get_metadata
-        return get_metadata(stream)
-
-
-class OPFMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read OPF metadata'
-    file_types  = {'opf'}
-    description = _('Read metadata from %s files')%'OPF'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.opf import get_metadata
-        return get_metadata(stream)[0]
-
-
-class PDBMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read PDB metadata'
-    file_types  = set(['pdb', 'updb'])
-    description = _('Read metadata from %s files') % 'PDB'
-    author      = 'John Schember'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.pdb import get_metadata
-        return get_metadata(stream)
-
-
-class PDFMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read PDF metadata'
-    file_types  = set(['pdf'])
-    description = _('Read metadata from %s files')%'PDF'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.pdf import get_metadata, get_quick_metadata
-        if self.quick:
-            return get_quick_metadata(stream)
-        return get_metadata(stream)
-
-
-class PMLMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read PML metadata'
-    file_types  = set(['pml', 'pmlz'])
-    description = _('Read metadata from %s files') % 'PML'
-    author      = 'John Schember'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.pml import get_metadata
-        return get_metadata(stream)
-
-
-class RARMetadataReader(MetadataReaderPlugin):
-
-    name = 'Read RAR metadata'
-    file_types = set(['rar'])
-    description = _('Read metadata from e-books in RAR archives')
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.rar import get_metadata
-        return get_metadata(stream)
-
-
-class RBMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read RB metadata'
-    file_types  = set(['rb'])
-    description = _('Read metadata from %s files')%'RB'
-    author      = 'Ashish Kulkarni'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.rb import get_metadata
-        return get_metadata(stream)
-
-
-class RTFMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read RTF metadata'
-    file_types  = set(['rtf'])
-    description = _('Read metadata from %s files')%'RTF'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.rtf import get_metadata
-        return get_metadata(stream)
-
-
-class SNBMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read SNB metadata'
-    file_types  = set(['snb'])
-    description = _('Read metadata from %s files') % 'SNB'
-    author      = 'Li Fanxi'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.snb import get_metadata
-        return get_metadata(stream)
-
-
-class TOPAZMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read Topaz metadata'
-    file_types  = set(['tpz', 'azw1'])
-    description = _('Read metadata from %s files')%'MOBI'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.topaz import get_metadata
-        return get_metadata(stream)
-
-
-class TXTMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read TXT metadata'
-    file_types  = set(['txt'])
-    description = _('Read metadata from %s files') % 'TXT'
-    author      = 'John Schember'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.txt import get_metadata
-        return get_metadata(stream)
-
-
-class TXTZMetadataReader(MetadataReaderPlugin):
-
-    name        = 'Read TXTZ metadata'
-    file_types  = set(['txtz'])
-    description = _('Read metadata from %s files') % 'TXTZ'
-    author      = 'John Schember'
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.extz import get_metadata
-        return get_metadata(stream)
-
-
-class ZipMetadataReader(MetadataReaderPlugin):
-
-    name = 'Read ZIP metadata'
-    file_types = set(['zip', 'oebzip'])
-    description = _('Read metadata from e-books in ZIP archives')
-
-    def get_metadata(self, stream, ftype):
-        from calibre.ebooks.metadata.zip import get_metadata
-        return get_metadata(stream)
-
-
-plugins += [x for x in list(locals().values()) if isinstance(x, type) and
-                                        x.__name__.endswith('MetadataReader')]
-
-# }}}
-
-# Metadata writer plugins {{{
-
-
-class EPUBMetadataWriter(MetadataWriterPlugin):
-
-    name = 'Set EPUB metadata'
-    file_types = set(['epub'])
-    description = _('Set metadata in %s files')%'EPUB'
-
-    def set_metadata(self, stream, mi, type):
-        from calibre.ebooks.metadata.epub import set_metadata
-        q = self.site_customization or ''
-        set_metadata(stream, mi, apply_null=self.apply_null, force_identifiers=self.force_identifiers, add_missing_cover='disable-add-missing-cover' != q)
-
-    def customization_help(self, gui=False):
-        h = 'disable-add-missing-cover'
-        if gui:
-            h = '<i>' + h + '</i>'
-        return _('Enter {0} below to have the EPUB metadata writer plugin not'
-                 ' add cover images to EPUB files that have no existing cover image.').format(h)
-
-
-class FB2MetadataWriter(MetadataWriterPlugin):
-
-    name = 'Set FB2 metadata'
-    file_types = set(['fb2'])
-    description = _('Set metadata in %s files')%'FB2'
-
-    def set_metadata(self, stream, mi, type):
-        from calibre.ebooks.metadata.fb2 import set_metadata
-        set_metadata(stream, mi, apply_null=self.apply_null)
-
-
-class HTMLZMetadataWriter(MetadataWriterPlugin):
-
-    name        = 'Set HTMLZ metadata'
-    file_types  = set(['htmlz'])
-    description = _('Set metadata from %s files') % 'HTMLZ'
-    author      = 'John Schember'
-
-    def set_metadata(self, stream, mi, type):
-        from calibre.ebooks.metadata.extz import set_metadata
-        set_metadata(stream, mi)
-
-
-class LRFMetadataWriter(MetadataWriterPlugin):
-
-    name = 'Set LRF metadata'
-    file_types = set(['lrf'])
-    description = _('Set metadata in %s files')%'LRF'
-
-    def set_metadata(self, stream, mi, type):
-        from calibre.ebooks.lrf.meta import set_metadata
-        set_metadata(stream, mi)
-
-
-class MOBIMetadataWriter(MetadataWriterPlugin):
-
-    name        = 'Set MOBI metadata'
-    file_types  = set(['mobi', 'prc', 'azw', 'azw3', 'azw4'])
-    description = _('Set metadata in %s files')%'MOBI'
-    author      = 'Marshall T. Vandegrift'
-
-    def set_metadata(self, stream, mi, type):
-        from calibre.ebooks.metadata.mobi import set_metadata
-        set_metadata(stream, mi)
-
-
-class PDBMetadataWriter(MetadataWriterPlugin):
-
-    name        = 'Set PDB metadata'
-    file_types  = set(['pdb'])
-    description = _('Set metadata from %s files') % 'PDB'
-    author      = 'John Schember'
-
-    def set_metadata(self, stream, mi, type):
-        from calibre.ebooks.metadata.pdb import set_metadata
-        set_metadata(stream, mi)
-
-
-class PDFMetadataWriter(MetadataWriterPlugin):
-
-    name        = 'Set PDF metadata'
-    file_types  = set(['pdf'])
-    description = _('Set metadata in %s files') % 'PDF'
-    author      = 'Kovid Goyal'
-
-    def set_metadata(self, stream, mi, type):
-        from calibre.ebooks.metadata.pdf import set_metadata
-        set_metadata(stream, mi)
-
-
-class RTFMetadataWriter(MetadataWriterPlugin):
-
-    name = 'Set RTF metadata'
-    file_types = set(['rtf'])
-    description = _('Set metadata in %s files')%'RTF'
-
-    def set_metadata(self, stream, mi, type):
-        from calibre.ebooks.metadata.rtf import set_metadata
-        set_metadata(stream, mi)
-
-
-class TOPAZMetadataWriter(MetadataWriterPlugin):
-
-    name        = 'Set TOPAZ metadata'
-    file_types  = set(['tpz', 'azw1'])
-    description = _('Set metadata in %s files')%'TOPAZ'
-    author      = 'Greg Riker'
-
-    def set_metadata(self, stream, mi, type):
-        from calibre.ebooks.metadata.topaz import set_metadata
-        set_metadata(stream, mi)
-
-
-class TXTZMetadataWriter(MetadataWriterPlugin):
-
-    name        = 'Set TXTZ metadata'
-    file_types  = set(['txtz'])
-    description = _('Set metadata from %s files') % 'TXTZ'
-    author      = 'John Schember'
-
-    def set_metadata(self, stream, mi, type):
-        from calibre.ebooks.metadata.extz import set_metadata
-        set_metadata(stream, mi)
-
-
-class DocXMetadataWriter(MetadataWriterPlugin):
-
-    name        = 'Set DOCX metadata'
-    file_types  = set(['docx'])
-    description = _('Read metadata from %s files')%'DOCX'
-
-    def set_metadata(self, stream, mi, type):
-        from calibre.ebooks.metadata.docx import set_metadata
-        return set_metadata(stream, mi)
-
-
-plugins += [x for x in list(locals().values()) if isinstance(x, type) and
-                                        x.__name__.endswith('MetadataWriter')]
-
+# To archive plugins, metadata reader and writer plugins {{{
+# These are defined in calibre.customize.file_plugins
+plugins += archive_plugins + metadata_readers + metadata_writers
+# Still importable from here, as they used to be defined here
+from calibre.customize.file_plugins import (  # noqa
+    HTML2ZIP, ArchiveExtract, PML2PMLZ, TXT2TXTZ, ComicMetadataReader,
+    CHMMetadataReader, EPUBMetadataReader, FB2MetadataReader,
+    HTMLMetadataReader, HTMLZMetadataReader, IMPMetadataReader,
+    LITMetadataReader, LRFMetadataReader, LRXMetadataReader,
+    MOBIMetadataReader, ODTMetadataReader, DocXMetadataReader,
+    OPFMetadataReader, PDBMetadataReader, PDFMetadataReader,
+    PMLMetadataReader, RARMetadataReader, RBMetadataReader, RTFMetadataReader,
+    SNBMetadataReader, TOPAZMetadataReader, TXTMetadataReader,
+    TXTZMetadataReader, ZipMetadataReader, EPUBMetadataWriter,
+    FB2MetadataWriter, HTMLZMetadataWriter, LRFMetadataWriter,
+    MOBIMetadataWriter, PDBMetadataWriter, PDFMetadataWriter,
+    RTFMetadataWriter, TOPAZMetadataWriter, TXTZMetadataWriter,
+    DocXMetadataWriter)
 # }}}
 
 # Conversion plugins {{{
@@ -0,0 +1,197 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+'''
+The plugin manifest: for every installed plugin, the information needed to
+decide whether to use it for a task, such as its type, the file types it
+handles, its priority and version. The manifest is cached on disk, so that
+calibre.customize.ui can set up the plugin registry without importing,
+instantiating or initializing any plugins. A plugin is then only loaded when it
+is actually used.
+
+The cached manifest is discarded whenever calibre is upgraded or the ZIP files
+of the user installed plugins change. When running from source, it is also
+discarded when any of the modules that define builtin plugins change.
+'''
+
+import json
+import os
+import sys
+
+from calibre.constants import __version__, cache_dir, isfrozen
+
+MANIFEST_VERSION = 1
+FILE_TYPE_OCCASIONS = ('on_import', 'on_postimport', 'on_preprocess', 'on_postprocess')
+
+
+def manifest_path():
+    return os.path.join(cache_dir(), 'plugins-manifest.json')
+
+
+def plugin_kinds():
+    ''' The base classes that plugins are looked up by in the registry '''
+    from calibre.customize import (
+        CatalogPlugin, EditBookToolPlugin, FileTypePlugin, InterfaceActionBase,
+        LibraryClosedPlugin, MetadataReaderPlugin, MetadataWriterPlugin,
+        PreferencesPlugin, StoreBase, ViewerPlugin)
+    from calibre.customize.conversion import InputFormatPlugin, OutputFormatPlugin
+    from calibre.customize.profiles import InputProfile, OutputProfile
+    from calibre.devices.interface import DevicePlugin
+    from calibre.ebooks.metadata.sources.base import Source
+    return tuple((cls.__name__, cls) for cls in (
+        CatalogPlugin, EditBookToolPlugin, FileTypePlugin, InterfaceActionBase,
+        LibraryClosedPlugin, MetadataReaderPlugin, MetadataWriterPlugin,
+        PreferencesPlugin, StoreBase, ViewerPlugin, InputFormatPlugin,
+        OutputFormatPlugin, InputProfile, OutputProfile, DevicePlugin, Source))
+
+
+def describe(plugin, location, kinds):
+    ''' Return the manifest entry for the initialized plugin. location is
+    either the path to the ZIP file of the plugin or the module and class name
+    of a builtin plugin. '''
+    ans = {
+        'name': plugin.name,
+        'location': location,
+        'kinds': [name for name, cls in kinds if isinstance(plugin, cls)],
+        'version': list(plugin.version),
+        'priority': plugin.priority,
+        'supported_platforms': list(plugin.supported_platforms),
+        'file_types': sorted(getattr(plugin, 'file_types', None) or ()),
+    }
+    if 'OutputFormatPlugin' in ans['kinds']:
+        ans['file_type'] = plugin.file_type
+    if 'Source' in ans['kinds']:
+        ans['capabilities'] = sorted(plugin.capabilities)
+    if 'FileTypePlugin' in ans['kinds']:
+        ans['occasions'] = [x for x in FILE_TYPE_OCCASIONS if getattr(plugin, x, False)]
+    return ans
+
+
+def mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except EnvironmentError:
+        return None
+
+
+def source_files(modules):
+    ''' The source files of the modules, with their modification times. Only
+    used when running from source, as the builtin plugins can only change
+    along with the calibre version otherwise. '''
+    if isfrozen:
+        return []
+    ans = []
+    for name in sorted(modules):
+        path = getattr(sys.modules.get(name), '__file__', None)
+        if path:
+            if path.endswith(('.pyc', '.pyo')):
+                path = path[:-1]
+            ans.append([path, mtime(path)])
+    return ans
+
+
+def external_plugins_state(zip_paths):
+    ''' The state of the ZIP files of the user installed plugins, the cached
+    manifest is only valid if it was created for the same state. '''
+    ans = []
+    for name, path in zip_paths.iteritems():
+        try:
+            st = os.stat(path)
+        except EnvironmentError:
+            ans.append([name, path, None, None])
+        else:
+            ans.append([name, path, st.st_mtime, st.st_size])
+    return ans
+
+
+def read_manifest(path=None):
+    ''' Return the cached manifest or None if there is no cached manifest for
+    this version of calibre and its builtin plugins. The caller must still
+    check that it was created for the current external plugins. '''
+    try:
+        with open(path or manifest_path(), 'rb') as f:
+            ans = json.load(f)
+    except Exception:
+        return None
+    if ans.get('manifest_version') != MANIFEST_VERSION or ans.get('calibre_version') != __version__:
+        return None
+    for path, modified in ans['source_files']:
+        if mtime(path) != modified:
+            return None
+    return ans
+
+
+def write_manifest(builtin_names, external_state, entries, path=None):
+    from calibre.utils.filenames import atomic_rename
+    modules = {e['location'][0] for e in entries if isinstance(e['location'], list)}
+    data = {
+        'manifest_version': MANIFEST_VERSION,
+        'calibre_version': __version__,
+        'source_files': source_files(modules),
+        'builtin_names': sorted(builtin_names),
+        'external_plugins': external_state,
+        'plugins': entries,
+    }
+    path = path or manifest_path()
+    temp = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(temp, 'wb') as f:
+            json.dump(data, f, indent=0)
+        # Other calibre processes may be reading the manifest
+        atomic_rename(temp, path)
+    except Exception:
+        # The manifest is only a cache, calibre works without it
+        try:
+            os.remove(temp)
+        except EnvironmentError:
+            pass
+
+
+# Benchmark {{{
+STARTUP_COMMANDS = (
+    ('ebook-meta', '--version'),
+    ('calibredb', '--version'),
+    ('ebook-convert', '--version'),
+)
+
+
+def benchmark_startup(repeat=5):
+    ''' Print the time taken to start the main command line tools with and
+    without the cached manifest. Uses the tools found in PATH. '''
+    import subprocess, time
+    from distutils.spawn import find_executable
+
+    def run(cmd):
+        st = time.time()
+        with open(os.devnull, 'wb') as devnull:
+            subprocess.call(cmd, stdout=devnull, stderr=devnull)
+        return time.time() - st
+
+    def median(vals):
+        return sorted(vals)[len(vals) // 2]
+
+    for cmd in STARTUP_COMMANDS:
+        exe = find_executable(cmd[0])
+        if exe is None:
+            print(cmd[0], 'not found, skipping')
+            continue
+        cmd = (exe,) + cmd[1:]
+        cold = []
+        for i in xrange(repeat):
+            try:
+                os.remove(manifest_path())
+            except EnvironmentError:
+                pass
+            cold.append(run(cmd))
+        warm = [run(cmd) for i in xrange(repeat)]
+        print('%-15s without manifest: %.3fs  with manifest: %.3fs' % (cmd[0], median(cold), median(warm)))
+
+
+if __name__ == '__main__':
+    benchmark_startup()
+# }}}
@@ -0,0 +1,113 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import imp
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from collections import OrderedDict
+
+from calibre.constants import isfrozen
+from calibre.customize.manifest import read_manifest, write_manifest
+
+PLUGIN_MODULE = '''
+from calibre.customize import MetadataReaderPlugin
+
+
+class TestMetadataReader(MetadataReaderPlugin):
+
+    name = 'Test metadata reader'
+    file_types = {'tmr'}
+    priority = 3
+'''
+
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        # The cache directory does not exist yet
+        self.path = os.path.join(self.tdir, 'cache', 'plugins-manifest.json')
+        self.module_path = os.path.join(self.tdir, 'calibre_test_manifest_plugin.py')
+        with open(self.module_path, 'wb') as f:
+            f.write(PLUGIN_MODULE.encode('utf-8'))
+        self.module = imp.load_source('calibre_test_manifest_plugin', self.module_path)
+
+    def tearDown(self):
+        sys.modules.pop('calibre_test_manifest_plugin', None)
+        shutil.rmtree(self.tdir)
+
+    def build(self):
+        from calibre.customize.builtins import EPUBMetadataWriter, TXT2TXTZ
+        from calibre.customize.ui import load_all_plugins
+        return load_all_plugins(OrderedDict(), [self.module.TestMetadataReader, EPUBMetadataWriter, TXT2TXTZ])
+
+    def test_build(self):
+        loaded = self.build()
+        entries = {data['name']: data for data, plugin in loaded}
+        for data, plugin in loaded:
+            self.assertEqual(data['location'], [type(plugin).__module__, type(plugin).__name__])
+        self.assertEqual([data['name'] for data, plugin in loaded][0], 'Test metadata reader', 'Not sorted by priority')
+        e = entries['Test metadata reader']
+        self.assertEqual((e['kinds'], e['file_types'], e['priority']), (['MetadataReaderPlugin'], ['tmr'], 3))
+        e = entries['Set EPUB metadata']
+        self.assertEqual((e['kinds'], e['file_types']), (['MetadataWriterPlugin'], ['epub']))
+        e = entries['TXT to TXTZ']
+        self.assertEqual((e['kinds'], e['file_types'], e['occasions']), (['FileTypePlugin'], ['text', 'txt'], ['on_import']))
+
+    def test_load(self):
+        from calibre.customize.ui import PluginEntry
+        loaded = self.build()
+        write_manifest({'Set EPUB metadata'}, [], [data for data, plugin in loaded], path=self.path)
+        manifest = read_manifest(path=self.path)
+        self.assertIsNotNone(manifest, 'The manifest was not written')
+        self.assertEqual(manifest['builtin_names'], ['Set EPUB metadata'])
+        if not isfrozen:
+            self.assertIn([self.module_path, os.stat(self.module_path).st_mtime], manifest['source_files'])
+        entries = [PluginEntry(data) for data in manifest['plugins']]
+        self.assertEqual([e.name for e in entries], [data['name'] for data, plugin in loaded])
+        e = entries[0]
+        self.assertIsNone(e.plugin)
+        self.assertEqual((e.kinds, e.file_types, e.priority), ({'MetadataReaderPlugin'}, {'tmr'}, 3))
+        plugin = e.load()
+        self.assertIsInstance(plugin, self.module.TestMetadataReader)
+        self.assertIs(e.load(), plugin)
+
+    def test_invalidate(self):
+        write_manifest((), [], [data for data, plugin in self.build()], path=self.path)
+        self.assertIsNotNone(read_manifest(path=self.path))
+
+        def modify(**kw):
+            with open(self.path, 'rb') as f:
+                data = json.load(f)
+            data.update(kw)
+            with open(self.path, 'wb') as f:
+                json.dump(data, f)
+
+        modify(calibre_version='0.0.1')
+        self.assertIsNone(read_manifest(path=self.path), 'Not discarded when calibre is upgraded')
+        write_manifest((), [], [data for data, plugin in self.build()], path=self.path)
+        modify(manifest_version=0)
+        self.assertIsNone(read_manifest(path=self.path), 'Not discarded when the manifest format changes')
+        if not isfrozen:
+            write_manifest((), [], [data for data, plugin in self.build()], path=self.path)
+            st = os.stat(self.module_path)
+            os.utime(self.module_path, (st.st_atime, st.st_mtime + 10))
+            self.assertIsNone(read_manifest(path=self.path), 'Not discarded when a builtin plugin changes')
+        with open(self.path, 'wb') as f:
+            f.write(b'{"truncated')
+        self.assertIsNone(read_manifest(path=self.path))
+
+
+def find_tests():
+    return unittest.defaultTestLoader.loadTestsFromTestCase(ManifestTest)
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=4).run(find_tests())
@@ -2,28 +2,22 @@ from __future__ import with_statement
 __license__   = 'GPL v3'
 __copyright__ = '2008, Kovid Goyal <kovid at kovidgoyal.net>'
 
-import os, shutil, traceback, functools, sys
-from collections import defaultdict
+import os, shutil, traceback, functools, sys, importlib
+from collections import defaultdict, OrderedDict
 from itertools import chain
+from threading import Lock, RLock
 
-from calibre.customize import (CatalogPlugin, FileTypePlugin, PluginNotFound,
-                              MetadataReaderPlugin, MetadataWriterPlugin,
-                              InterfaceActionBase as InterfaceAction,
-                              PreferencesPlugin, platform, InvalidPlugin,
-                              StoreBase as Store, ViewerPlugin, EditBookToolPlugin,
-                              LibraryClosedPlugin)
-from calibre.customize.conversion import InputFormatPlugin, OutputFormatPlugin
+from calibre.customize import PluginNotFound, platform, InvalidPlugin
+from calibre.customize.manifest import (describe, external_plugins_state,
+                                        plugin_kinds, read_manifest, write_manifest)
 from calibre.customize.zipplugin import loader
-from calibre.customize.profiles import InputProfile, OutputProfile
-from calibre.customize.builtins import plugins as builtin_plugins
-from calibre.devices.interface import DevicePlugin
 from calibre.ebooks.metadata import MetaInformation
 from calibre.utils.config import (make_config_dir, Config, ConfigProxy,
                                  plugin_dir, OptionParser)
-from calibre.ebooks.metadata.sources.base import Source
 from calibre.constants import DEBUG, numeric_version
 
-builtin_names = frozenset(p.name for p in builtin_plugins)
+# Set by initialize_plugins()
+builtin_names = frozenset()
 BLACKLISTED_PLUGINS = frozenset({'Marvin XD', 'iOS reader applications'})
 
 
@@ -46,9 +40,9 @@ config = _config()
 
 
 def find_plugin(name):
-    for plugin in _initialized_plugins:
-        if plugin.name == name:
-            return plugin
+    for entry in _initialized_plugins:
+        if entry.name == name:
+            return entry.load()
 
 
 def load_plugin(path_to_zip_file):  # {{{
@@ -131,27 +125,26 @@ def reread_filetype_plugins():
     _on_postprocess      = defaultdict(list)
     _on_postadd          = []
 
-    for plugin in _initialized_plugins:
-        if isinstance(plugin, FileTypePlugin):
-            for ft in plugin.file_types:
-                if plugin.on_import:
-                    _on_import[ft].append(plugin)
-                if plugin.on_postimport:
-                    _on_postimport[ft].append(plugin)
-                    _on_postadd.append(plugin)
-                if plugin.on_preprocess:
-                    _on_preprocess[ft].append(plugin)
-                if plugin.on_postprocess:
-                    _on_postprocess[ft].append(plugin)
+    for entry in _initialized_plugins:
+        if 'FileTypePlugin' in entry.kinds:
+            for ft in entry.file_types:
+                if 'on_import' in entry.occasions:
+                    _on_import[ft].append(entry)
+                if 'on_postimport' in entry.occasions:
+                    _on_postimport[ft].append(entry)
+                    _on_postadd.append(entry)
+                if 'on_preprocess' in entry.occasions:
+                    _on_preprocess[ft].append(entry)
+                if 'on_postprocess' in entry.occasions:
+                    _on_postprocess[ft].append(entry)
 
 
 def plugins_for_ft(ft, occasion):
     op = {
         'import':_on_import, 'preprocess':_on_preprocess, 'postprocess':_on_postprocess, 'postimport':_on_postimport,
     }[occasion]
-    for p in chain(op.get(ft, ()), op.get('*', ())):
-        if not is_disabled(p):
-            yield p
+    for p in load(p for p in chain(op.get(ft, ()), op.get('*', ())) if not is_disabled(p)):
+        yield p
 
 
 def _run_filetype_plugins(path_to_file, ft=None, occasion='preprocess'):
@@ -201,9 +194,7 @@ def run_plugins_on_postimport(db, book_id, fmt):
 
 def run_plugins_on_postadd(db, book_id, fmt_map):
     customization = config['plugin_customization']
-    for plugin in _on_postadd:
-        if is_disabled(plugin):
-            continue
+    for plugin in load(p for p in _on_postadd if not is_disabled(p)):
         plugin.site_customization = customization.get(plugin.name, '')
         with plugin:
             try:
@@ -233,15 +224,11 @@ def plugin_customization(plugin):
 
 
 def input_profiles():
-    for plugin in _initialized_plugins:
-        if isinstance(plugin, InputProfile):
-            yield plugin
+    return plugins_of_kind('InputProfile')
 
 
 def output_profiles():
-    for plugin in _initialized_plugins:
-        if isinstance(plugin, OutputProfile):
-            yield plugin
+    return plugins_of_kind('OutputProfile')
 # }}}
 
 # Interface Actions # {{{
@@ -249,11 +236,9 @@ def output_profiles():
 
 def interface_actions():
     customization = config['plugin_customization']
-    for plugin in _initialized_plugins:
-        if isinstance(plugin, InterfaceAction):
-            if not is_disabled(plugin):
-                plugin.site_customization = customization.get(plugin.name, '')
-                yield plugin
+    for plugin in plugins_of_kind('InterfaceActionBase', include_disabled=False):
+        plugin.site_customization = customization.get(plugin.name, '')
+        yield plugin
 # }}}
 
 # Preferences Plugins # {{{
@@ -261,11 +246,9 @@ def interface_actions():
 
 def preferences_plugins():
     customization = config['plugin_customization']
-    for plugin in _initialized_plugins:
-        if isinstance(plugin, PreferencesPlugin):
-            if not is_disabled(plugin):
-                plugin.site_customization = customization.get(plugin.name, '')
-                yield plugin
+    for plugin in plugins_of_kind('PreferencesPlugin', include_disabled=False):
+        plugin.site_customization = customization.get(plugin.name, '')
+        yield plugin
 # }}}
 
 # Library Closed Plugins # {{{
@@ -273,18 +256,14 @@ def preferences_plugins():
 
 def available_library_closed_plugins():
     customization = config['plugin_customization']
-    for plugin in _initialized_plugins:
-        if isinstance(plugin, LibraryClosedPlugin):
-            if not is_disabled(plugin):
-                plugin.site_customization = customization.get(plugin.name, '')
-                yield plugin
+    for plugin in plugins_of_kind('LibraryClosedPlugin', include_disabled=False):
+        plugin.site_customization = customization.get(plugin.name, '')
+        yield plugin
 
 
 def has_library_closed_plugins():
-    for plugin in _initialized_plugins:
-        if isinstance(plugin, LibraryClosedPlugin):
-            if not is_disabled(plugin):
-                return True
+    for entry in entries_of_kind('LibraryClosedPlugin', include_disabled=False):
+        return True
     return False
 # }}}
 
@@ -293,10 +272,9 @@ def has_library_closed_plugins():
 
 def store_plugins():
     customization = config['plugin_customization']
-    for plugin in _initialized_plugins:
-        if isinstance(plugin, Store):
-            plugin.site_customization = customization.get(plugin.name, '')
-            yield plugin
+    for plugin in plugins_of_kind('StoreBase'):
+        plugin.site_customization = customization.get(plugin.name, '')
+        yield plugin
 
 
 def available_store_plugins():
@@ -306,17 +284,11 @@ def available_store_plugins():
 
 
 def stores():
-    stores = set([])
-    for plugin in store_plugins():
-        stores.add(plugin.name)
-    return stores
+    return {entry.name for entry in entries_of_kind('StoreBase')}
 
 
 def available_stores():
-    stores = set([])
-    for plugin in available_store_plugins():
-        stores.add(plugin.name)
-    return stores
+    return {entry.name for entry in entries_of_kind('StoreBase', include_disabled=False)}
 
 # }}}
 
@@ -332,41 +304,43 @@ def reread_metadata_plugins():
     global _metadata_writers
     _metadata_readers = defaultdict(list)
     _metadata_writers = defaultdict(list)
-    for plugin in _initialized_plugins:
-        if isinstance(plugin, MetadataReaderPlugin):
-            for ft in plugin.file_types:
-                _metadata_readers[ft].append(plugin)
-        elif isinstance(plugin, MetadataWriterPlugin):
-            for ft in plugin.file_types:
-                _metadata_writers[ft].append(plugin)
+    for entry in _initialized_plugins:
+        if 'MetadataReaderPlugin' in entry.kinds:
+            for ft in entry.file_types:
+                _metadata_readers[ft].append(entry)
+        elif 'MetadataWriterPlugin' in entry.kinds:
+            for ft in entry.file_types:
+                _metadata_writers[ft].append(entry)
 
 
 def metadata_readers():
-    ans = set([])
-    for plugins in _metadata_readers.values():
-        for plugin in plugins:
-            ans.add(plugin)
-    return ans
+    return set(load(set(chain.from_iterable(_metadata_readers.itervalues()))))
 
 
 def metadata_writers():
-    ans = set([])
-    for plugins in _metadata_writers.values():
-        for plugin in plugins:
-            ans.add(plugin)
-    return ans
+    return set(load(set(chain.from_iterable(_metadata_writers.itervalues()))))
 
 
 class QuickMetadata(object):
 
+    # Re-entrant, so that metadata can be read in several threads at once
+    # (used when scanning devices)
+
     def __init__(self):
-        self.quick = False
+        self.depth = 0
+        self.lock = Lock()
+
+    @property
+    def quick(self):
+        return self.depth > 0
 
     def __enter__(self):
-        self.quick = True
+        with self.lock:
+            self.depth += 1
 
     def __exit__(self, *args):
-        self.quick = False
+        with self.lock:
+            self.depth -= 1
 
 
 quick_metadata = QuickMetadata()
@@ -402,23 +376,27 @@ class ForceIdentifiers(object):
 force_identifiers = ForceIdentifiers()
 
 
+# The plugins are shared, and their settings are changed for every call, so
+# each one is used by only one thread at a time
+metadata_reader_locks = {}
+
+
 def get_file_type_metadata(stream, ftype):
     mi = MetaInformation(None, None)
 
     ftype = ftype.lower().strip()
     if ftype in _metadata_readers:
-        for plugin in _metadata_readers[ftype]:
-            if not is_disabled(plugin):
-                with plugin:
-                    try:
-                        plugin.quick = quick_metadata.quick
-                        if hasattr(stream, 'seek'):
-                            stream.seek(0)
-                        mi = plugin.get_metadata(stream, ftype.lower().strip())
-                        break
-                    except:
-                        traceback.print_exc()
-                        continue
+        for plugin in load(p for p in _metadata_readers[ftype] if not is_disabled(p)):
+            with metadata_reader_locks.setdefault(plugin.name, Lock()), plugin:
+                try:
+                    plugin.quick = quick_metadata.quick
+                    if hasattr(stream, 'seek'):
+                        stream.seek(0)
+                    mi = plugin.get_metadata(stream, ftype.lower().strip())
+                    break
+                except:
+                    traceback.print_exc()
+                    continue
     return mi
 
 
@@ -426,22 +404,21 @@ def set_file_type_metadata(stream, mi, ftype, report_error=None):
     ftype = ftype.lower().strip()
     if ftype in _metadata_writers:
         customization = config['plugin_customization']
-        for plugin in _metadata_writers[ftype]:
-            if not is_disabled(plugin):
-                with plugin:
-                    try:
-                        plugin.apply_null = apply_null_metadata.apply_null
-                        plugin.force_identifiers = force_identifiers.force_identifiers
-                        plugin.site_customization = customization.get(plugin.name, '')
-                        plugin.set_metadata(stream, mi, ftype.lower().strip())
-                        break
-                    except:
-                        if report_error is None:
-                            from calibre import prints
-                            prints('Failed to set metadata for the', ftype.upper(), 'format of:', getattr(mi, 'title', ''), file=sys.stderr)
-                            traceback.print_exc()
-                        else:
-                            report_error(mi, ftype, traceback.format_exc())
+        for plugin in load(p for p in _metadata_writers[ftype] if not is_disabled(p)):
+            with plugin:
+                try:
+                    plugin.apply_null = apply_null_metadata.apply_null
+                    plugin.force_identifiers = force_identifiers.force_identifiers
+                    plugin.site_customization = customization.get(plugin.name, '')
+                    plugin.set_metadata(stream, mi, ftype.lower().strip())
+                    break
+                except:
+                    if report_error is None:
+                        from calibre import prints
+                        prints('Failed to set metadata for the', ftype.upper(), 'format of:', getattr(mi, 'title', ''), file=sys.stderr)
+                        traceback.print_exc()
+                    else:
+                        report_error(mi, ftype, traceback.format_exc())
 
 
 def can_set_metadata(ftype):
@@ -500,56 +477,50 @@ def remove_plugin(plugin_or_name):
 
 
 def input_format_plugins():
-    for plugin in _initialized_plugins:
-        if isinstance(plugin, InputFormatPlugin):
-            yield plugin
+    return plugins_of_kind('InputFormatPlugin')
 
 
 def plugin_for_input_format(fmt):
     customization = config['plugin_customization']
-    for plugin in input_format_plugins():
-        if fmt.lower() in plugin.file_types:
-            plugin.site_customization = customization.get(plugin.name, None)
-            return plugin
+    fmt = fmt.lower()
+    for plugin in load(e for e in entries_of_kind('InputFormatPlugin') if fmt in e.file_types):
+        plugin.site_customization = customization.get(plugin.name, None)
+        return plugin
 
 
 def all_input_formats():
     formats = set()
-    for plugin in input_format_plugins():
-        for format in plugin.file_types:
+    for entry in entries_of_kind('InputFormatPlugin'):
+        for format in entry.file_types:
             formats.add(format)
     return formats
 
 
 def available_input_formats():
     formats = set()
-    for plugin in input_format_plugins():
-        if not is_disabled(plugin):
-            for format in plugin.file_types:
-                formats.add(format)
+    for entry in entries_of_kind('InputFormatPlugin', include_disabled=False):
+        for format in entry.file_types:
+            formats.add(format)
     formats.add('zip'), formats.add('rar')
     return formats
 
 
 def output_format_plugins():
-    for plugin in _initialized_plugins:
-        if isinstance(plugin, OutputFormatPlugin):
-            yield plugin
+    return plugins_of_kind('OutputFormatPlugin')
 
 
 def plugin_for_output_format(fmt):
     customization = config['plugin_customization']
-    for plugin in output_format_plugins():
-        if fmt.lower() == plugin.file_type:
-            plugin.site_customization = customization.get(plugin.name, None)
-            return plugin
+    fmt = fmt.lower()
+    for plugin in load(e for e in entries_of_kind('OutputFormatPlugin') if fmt == e.file_type):
+        plugin.site_customization = customization.get(plugin.name, None)
+        return plugin
 
 
 def available_output_formats():
     formats = set([])
-    for plugin in output_format_plugins():
-        if not is_disabled(plugin):
-            formats.add(plugin.file_type)
+    for entry in entries_of_kind('OutputFormatPlugin', include_disabled=False):
+        formats.add(entry.file_type)
     return formats
 
 # }}}
@@ -558,24 +529,21 @@ def available_output_formats():
 
 
 def catalog_plugins():
-    for plugin in _initialized_plugins:
-        if isinstance(plugin, CatalogPlugin):
-            yield plugin
+    return plugins_of_kind('CatalogPlugin')
 
 
 def available_catalog_formats():
     formats = set([])
-    for plugin in catalog_plugins():
-        if not is_disabled(plugin):
-            for format in plugin.file_types:
-                formats.add(format)
+    for entry in entries_of_kind('CatalogPlugin', include_disabled=False):
+        for format in entry.file_types:
+            formats.add(format)
     return formats
 
 
 def plugin_for_catalog_format(fmt):
-    for plugin in catalog_plugins():
-        if fmt.lower() in plugin.file_types:
-            return plugin
+    fmt = fmt.lower()
+    for plugin in load(e for e in entries_of_kind('CatalogPlugin') if fmt in e.file_types):
+        return plugin
 
 # }}}
 
@@ -583,22 +551,18 @@ def plugin_for_catalog_format(fmt):
 
 
 def device_plugins(include_disabled=False):
-    for plugin in _initialized_plugins:
-        if isinstance(plugin, DevicePlugin):
-            if include_disabled or not is_disabled(plugin):
-                if platform in plugin.supported_platforms:
-                    if getattr(plugin, 'plugin_needs_delayed_initialization',
-                            False):
-                        plugin.do_delayed_plugin_initialization()
-                    yield plugin
+    for plugin in load(e for e in entries_of_kind('DevicePlugin', include_disabled=include_disabled)
+                       if platform in e.supported_platforms):
+        if getattr(plugin, 'plugin_needs_delayed_initialization',
+                False):
+            plugin.do_delayed_plugin_initialization()
+        yield plugin
 
 
 def disabled_device_plugins():
-    for plugin in _initialized_plugins:
-        if isinstance(plugin, DevicePlugin):
-            if is_disabled(plugin):
-                if platform in plugin.supported_platforms:
-                    yield plugin
+    for plugin in load(e for e in entries_of_kind('DevicePlugin')
+                       if is_disabled(e) and platform in e.supported_platforms):
+        yield plugin
 # }}}
 
 # Metadata sources2 {{{
@@ -606,49 +570,43 @@ def disabled_device_plugins():
 
 def metadata_plugins(capabilities):
     capabilities = frozenset(capabilities)
-    for plugin in all_metadata_plugins():
-        if plugin.capabilities.intersection(capabilities) and \
-                not is_disabled(plugin):
-            yield plugin
+    for plugin in load(e for e in entries_of_kind('Source', include_disabled=False)
+                       if e.capabilities.intersection(capabilities)):
+        yield plugin
 
 
 def all_metadata_plugins():
-    for plugin in _initialized_plugins:
-        if isinstance(plugin, Source):
-            yield plugin
+    return plugins_of_kind('Source')
 
 
 def patch_metadata_plugins(possibly_updated_plugins):
     patches = {}
-    for i, plugin in enumerate(_initialized_plugins):
-        if isinstance(plugin, Source) and plugin.name in builtin_names:
-            pup = possibly_updated_plugins.get(plugin.name)
+    for i, entry in enumerate(_initialized_plugins):
+        if 'Source' in entry.kinds and entry.name in builtin_names:
+            pup = possibly_updated_plugins.get(entry.name)
             if pup is not None:
-                if pup.version > plugin.version and pup.minimum_calibre_version <= numeric_version:
+                if pup.version > entry.version and pup.minimum_calibre_version <= numeric_version:
                     patches[i] = pup(None)
                     # Metadata source plugins dont use initialize() but that
                     # might change in the future, so be safe.
                     patches[i].initialize()
     for i, pup in patches.iteritems():
-        _initialized_plugins[i] = pup
+        entry = _initialized_plugins[i]
+        _initialized_plugins[i] = PluginEntry(describe(pup, entry.location, plugin_kinds()), pup)
 # }}}
 
 # Viewer plugins {{{
 
 
 def all_viewer_plugins():
-    for plugin in _initialized_plugins:
-        if isinstance(plugin, ViewerPlugin):
-            yield plugin
+    return plugins_of_kind('ViewerPlugin')
 # }}}
 
 # Editor plugins {{{
 
 
 def all_edit_book_tool_plugins():
-    for plugin in _initialized_plugins:
-        if isinstance(plugin, EditBookToolPlugin):
-            yield plugin
+    return plugins_of_kind('EditBookToolPlugin')
 # }}}
 
 # Initialize plugins {{{
@@ -674,29 +632,120 @@ def has_external_plugins():
     return bool(config['plugins'])
 
 
+class PluginEntry(object):
+
+    '''
+    An entry in the plugin registry, with the information from the plugin
+    manifest needed to look up plugins. The plugin itself is only imported and
+    initialized when it is first used, via :meth:`load`.
+    '''
+
+    __slots__ = ('name', 'location', 'kinds', 'version', 'priority', 'supported_platforms',
+                 'file_types', 'file_type', 'capabilities', 'occasions', 'plugin', 'failed')
+
+    def __init__(self, data, plugin=None):
+        self.name, self.location = data['name'], data['location']
+        self.kinds = frozenset(data['kinds'])
+        self.version = tuple(data['version'])
+        self.priority = data['priority']
+        self.supported_platforms = frozenset(data['supported_platforms'])
+        self.file_types = frozenset(data['file_types'])
+        self.file_type = data.get('file_type')
+        self.capabilities = frozenset(data.get('capabilities', ()))
+        self.occasions = frozenset(data.get('occasions', ()))
+        self.plugin, self.failed = plugin, False
+
+    def __repr__(self):
+        return 'PluginEntry(%r, %r)' % (self.name, self.location)
+
+    def load(self):
+        ''' Return the initialized plugin or None if it could not be loaded '''
+        if self.plugin is not None or self.failed:
+            return self.plugin
+        with load_lock:
+            if self.plugin is None and not self.failed:
+                ostdout, ostderr = sys.stdout, sys.stderr
+                try:
+                    if isinstance(self.location, list):
+                        module, name = self.location
+                        cls, zfp = getattr(importlib.import_module(module), name), None
+                    else:
+                        zfp = self.location
+                        cls = load_plugin(zfp)
+                    self.plugin = initialize_plugin(cls, zfp)
+                except:
+                    self.failed = True
+                    print 'Failed to initialize plugin:', repr(self.location)
+                    if DEBUG:
+                        traceback.print_exc()
+                finally:
+                    # Prevent a custom plugin from overriding stdout/stderr as
+                    # this breaks ipython
+                    sys.stdout, sys.stderr = ostdout, ostderr
+        return self.plugin
+
+
+load_lock = RLock()
+
+
+def load(entries):
+    for entry in entries:
+        plugin = entry.load()
+        if plugin is not None:
+            yield plugin
+
+
+def entries_of_kind(kind, include_disabled=True):
+    for entry in _initialized_plugins:
+        if kind in entry.kinds and (include_disabled or not is_disabled(entry)):
+            yield entry
+
+
+def plugins_of_kind(kind, include_disabled=True):
+    return load(entries_of_kind(kind, include_disabled=include_disabled))
+
+
 def initialize_plugins(perf=False):
-    global _initialized_plugins
+    global _initialized_plugins, builtin_names
     _initialized_plugins = []
+    manifest = read_manifest()
+    if manifest is None:
+        from calibre.customize.builtins import plugins as builtin_plugins
+        builtin_names = frozenset(p.name for p in builtin_plugins)
+    else:
+        builtin_plugins = None
+        builtin_names = frozenset(manifest['builtin_names'])
     conflicts = [name for name in config['plugins'] if name in
             builtin_names]
     for p in conflicts:
         remove_plugin(p)
-    external_plugins = config['plugins'].copy()
-    for name in BLACKLISTED_PLUGINS:
-        external_plugins.pop(name, None)
+    external_plugins = OrderedDict()
+    for name, path in sorted(config['plugins'].iteritems()):
+        if name not in BLACKLISTED_PLUGINS:
+            zfp = os.path.join(plugin_dir, name+'.zip')
+            external_plugins[name] = zfp if os.path.exists(zfp) else path
+    external_state = external_plugins_state(external_plugins)
+    if not perf and manifest is not None and manifest['external_plugins'] == external_state:
+        _initialized_plugins = [PluginEntry(x) for x in manifest['plugins']]
+    else:
+        if builtin_plugins is None:
+            from calibre.customize.builtins import plugins as builtin_plugins
+        loaded = load_all_plugins(external_plugins, builtin_plugins, perf)
+        _initialized_plugins = [PluginEntry(data, plugin) for data, plugin in loaded]
+        write_manifest(builtin_names, external_state, [data for data, plugin in loaded])
+    reread_filetype_plugins()
+    reread_metadata_plugins()
+
+
+def load_all_plugins(external_plugins, builtin_plugins, perf=False):
+    ans = []
+    kinds = plugin_kinds()
     ostdout, ostderr = sys.stdout, sys.stderr
     if perf:
-        from collections import defaultdict
         import time
         times = defaultdict(lambda:0)
-    for zfp in list(external_plugins) + builtin_plugins:
+    for zfp in external_plugins.values() + builtin_plugins:
         try:
-            if not isinstance(zfp, type):
-                # We have a plugin name
-                pname = zfp
-                zfp = os.path.join(plugin_dir, zfp+'.zip')
-                if not os.path.exists(zfp):
-                    zfp = external_plugins[pname]
             try:
                 plugin = load_plugin(zfp) if not isinstance(zfp, type) else zfp
             except PluginNotFound:
@@ -706,7 +755,8 @@ def initialize_plugins(perf=False):
             plugin = initialize_plugin(plugin, None if isinstance(zfp, type) else zfp)
             if perf:
                 times[plugin.name] = time.time() - st
-            _initialized_plugins.append(plugin)
+            location = [zfp.__module__, zfp.__name__] if isinstance(zfp, type) else zfp
+            ans.append((describe(plugin, location, kinds), plugin))
         except:
             print 'Failed to initialize plugin:', repr(zfp)
             if DEBUG:
@@ -717,16 +767,15 @@ def initialize_plugins(perf=False):
     if perf:
         for x in sorted(times, key=lambda x:times[x]):
             print ('%50s: %.3f'%(x, times[x]))
-    _initialized_plugins.sort(cmp=lambda x,y:cmp(x.priority, y.priority), reverse=True)
-    reread_filetype_plugins()
-    reread_metadata_plugins()
+    ans.sort(cmp=lambda x,y:cmp(x[1].priority, y[1].priority), reverse=True)
+    return ans
 
 
 initialize_plugins()
 
 
 def initialized_plugins():
-    for plugin in _initialized_plugins:
+    for plugin in load(_initialized_plugins):
         yield plugin
 
 # }}}
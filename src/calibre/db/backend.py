@@ -10,6 +10,7 @@ __docformat__ = 'restructuredtext en'
 # Imports {{{
 import os, shutil, uuid, json, glob, time, cPickle, hashlib, errno, sys
 from functools import partial
+from threading import RLock
 
 import apsw
 
@@ -37,7 +38,7 @@ from calibre.utils.formatter_functions import (load_user_template_functions,
             formatter_functions)
 from calibre.db.tables import (OneToOneTable, ManyToOneTable, ManyToManyTable,
         SizeTable, FormatsTable, AuthorsTable, IdentifiersTable, PathTable,
-        CompositeTable, UUIDTable, RatingTable)
+        CompositeTable, UUIDTable, RatingTable, DBBackedMap)
 # }}}
 
 '''
@@ -342,6 +343,8 @@ class DB(object):
             traceback.print_exc()
 
         self.field_metadata = FieldMetadata()
+        self.lazy_read_lock = RLock()
+        self.string_pool = None
 
         self.library_path = os.path.abspath(library_path)
         self.dbpath = os.path.join(library_path, 'metadata.db')
@@ -1250,20 +1253,75 @@ class DB(object):
         ''' Return last modified time as a UTC datetime object '''
         return utcfromtimestamp(os.stat(self.dbpath).st_mtime)
 
-    def read_tables(self):
+    def read_tables(self, lazy=False, keep_large_text_in_db=False, compact=False):
         '''
-        Read all data from the db into the python in-memory tables
+        Read all data from the db into the python in-memory tables. If lazy is
+        True, the data for each table is only read when it is first used. If
+        keep_large_text_in_db is also True, the values of comments like fields
+        are never read into memory, instead they are read from the db, one
+        book at a time, as needed. If compact is True, the data is stored in
+        the maps from calibre.db.compact, which use much less memory than
+        dicts, at the cost of slightly slower access.
         '''
 
-        with self.conn:  # Use a single transaction, to ensure nothing modifies the db while we are reading
+        for table in self.tables.itervalues():
+            table.compact = compact
+        if lazy:
             for table in self.tables.itervalues():
-                try:
-                    table.read(self)
-                except:
-                    prints('Failed to read table:', table.name)
-                    import pprint
-                    pprint.pprint(table.metadata)
-                    raise
+                # Discard data from any previous read
+                for name in table.__dict__.pop('lazily_read', ()):
+                    delattr(table, name)
+                if keep_large_text_in_db and (table.name == 'comments' or (
+                        table.metadata['datatype'] == 'comments' and type(table) is OneToOneTable)):
+                    table.book_col_map = DBBackedMap(self, table)
+                else:
+                    table.lazy_loader = self.read_table
+            return
+
+        # Equal strings from different tables are stored only once
+        self.string_pool = {} if compact else None
+        try:
+            with self.conn:  # Use a single transaction, to ensure nothing modifies the db while we are reading
+                for table in self.tables.itervalues():
+                    try:
+                        table.read(self)
+                    except:
+                        prints('Failed to read table:', table.name)
+                        import pprint
+                        pprint.pprint(table.metadata)
+                        raise
+        finally:
+            self.string_pool = None
+
+    def read_table(self, table):
+        ''' Read the data for a table whose reading was deferred by
+        read_tables(lazy=True). Safe to call from multiple threads. '''
+        with self.lazy_read_lock:
+            if table.lazy_loader is None:
+                return  # Read by another thread while we were waiting
+            # Read into a copy and then add all the data at once, so that
+            # other threads never see partially read data
+            ans = table.__class__.__new__(table.__class__)
+            ans.__dict__.update(table.__dict__)
+            ans.lazy_loader = None
+            try:
+                with self.conn:
+                    ans.read(self)
+            except:
+                prints('Failed to read table:', table.name)
+                raise
+            lazily_read = set(ans.__dict__) - set(table.__dict__)
+            table.__dict__.update({k:ans.__dict__[k] for k in lazily_read})
+            table.lazily_read = lazily_read
+            table.lazy_loader = None
+
+    def read_deferred_tables(self):
+        ''' Read the data for all tables that have not been read yet '''
+        tables = [t for t in self.tables.itervalues() if t.lazy_loader is not None]
+        if tables:
+            with self.conn:
+                for table in tables:
+                    self.read_table(table)
 
     def format_abspath(self, book_id, fmt, fname, path):
         path = os.path.join(self.library_path, path)
@@ -19,6 +19,7 @@ from calibre.constants import iswindows, preferred_encoding
 from calibre.customize.ui import run_plugins_on_import, run_plugins_on_postimport, run_plugins_on_postadd
 from calibre.db import SPOOL_SIZE, _get_next_series_num_for_list
 from calibre.db.categories import get_categories
+from calibre.db.device_matching import DeviceBookIndex, MATCH_FIELDS
 from calibre.db.locking import create_locks, DowngradeLockError, SafeReadLock
 from calibre.db.errors import NoSuchFormat
 from calibre.db.fields import create_field, IDENTITY, InvalidLinkTable
@@ -69,6 +70,48 @@ def wrap_simple(lock, func):
     return call_func_with_lock
 
 
+class TableReadingLock(object):
+
+    ''' The write lock of a cache whose tables are read lazily. The code that
+    changes the db assumes that the data in the in-memory tables is the data
+    from before the change, so acquiring this lock first reads all the tables
+    that have not been read yet. '''
+
+    def __init__(self, lock, backend):
+        self.lock, self.backend = lock, backend
+
+    def acquire(self):
+        self.lock.acquire()
+        try:
+            self.backend.read_deferred_tables()
+        except:
+            self.lock.release()
+            raise
+
+    def release(self, *args):
+        self.lock.release()
+
+    __enter__ = acquire
+    __exit__ = release
+
+    def owns_lock(self):
+        return self.lock.owns_lock()
+
+
+# Write API methods that do not change the in-memory tables and so can be used
+# without reading all the lazily read tables
+TABLE_INDEPENDENT_WRITE_API = frozenset((
+    'ensure_has_search_category', 'initialize_dynamic', 'initialize_template_cache',
+    'set_user_template_functions', 'clear_composite_caches', 'clear_search_caches',
+    'clear_caches', 'reload_from_db', 'set_pref', 'commit_dirty_cache',
+    'add_custom_book_data', 'delete_custom_book_data', 'delete_conversion_options',
+    'set_conversion_options', 'refresh_ondevice', 'saved_search_set_all',
+    'saved_search_delete', 'saved_search_add', 'saved_search_rename',
+    'change_search_locations', 'refresh_search_locations', 'close',
+    'set_last_read_position',
+))
+
+
 def run_import_plugins(path_or_stream, fmt):
     fmt = fmt.lower()
     if hasattr(path_or_stream, 'seek'):
@@ -106,19 +149,37 @@ class Cache(object):
     SQLITE is simply used as a way to read and write from metadata.db robustly.
     All table reading/sorting/searching/caching logic is re-implemented. This
     was necessary for maximum performance and flexibility.
+
+    With lazy_tables=True, the data for each field is only read from
+    metadata.db when the field is first used, which makes startup much faster
+    for short lived processes that use only a few fields. All the remaining
+    tables are read as soon as anything is changed. With
+    keep_large_text_in_db=True as well, the values of comments like fields
+    are never all held in memory, but read for each book as needed.
+
+    With compact_tables=True, the data is held in the array backed maps from
+    calibre.db.compact instead of dicts, which uses much less memory for very
+    large libraries, at the cost of somewhat slower access.
     '''
 
-    def __init__(self, backend):
+    def __init__(self, backend, lazy_tables=False, keep_large_text_in_db=False, compact_tables=False):
         self.backend = backend
+        self.lazy_tables, self.keep_large_text_in_db = lazy_tables, keep_large_text_in_db
+        self.compact_tables = compact_tables
         self.fields = {}
         self.composites = {}
         self.read_lock, self.write_lock = create_locks()
+        table_independent_write_lock = self.write_lock
+        if lazy_tables:
+            self.write_lock = TableReadingLock(self.write_lock, backend)
         self.format_metadata_cache = defaultdict(dict)
         self.formatter_template_cache = {}
         self.dirtied_cache = {}
         self.dirtied_sequence = 0
         self.cover_caches = set()
+        self.rule_caches = set()
         self.clear_search_cache_count = 0
+        self.device_book_index = DeviceBookIndex()
 
         # Implement locking for all simple read/write API methods
         # An unlocked version of the method is stored with the name starting
@@ -131,7 +192,8 @@ class Cache(object):
                 # Save original function
                 setattr(self, '_'+name, func)
                 # Wrap it in a lock
-                lock = self.read_lock if ira else self.write_lock
+                lock = self.read_lock if ira else (
+                    table_independent_write_lock if name in TABLE_INDEPENDENT_WRITE_API else self.write_lock)
                 setattr(self, name, wrap_simple(lock, func))
 
         self._search_api = Search(self, 'saved_searches', self.field_metadata.get_search_terms())
@@ -220,6 +282,8 @@ class Cache(object):
     def clear_search_caches(self, book_ids=None):
         self.clear_search_cache_count += 1
         self._search_api.update_or_clear(self, book_ids)
+        for rc in self.rule_caches:
+            rc.invalidate(book_ids or None)
 
     @read_api
     def last_modified(self):
@@ -237,6 +301,9 @@ class Cache(object):
                 self.format_metadata_cache.pop(book_id, None)
         else:
             self.format_metadata_cache.clear()
+        self.device_book_index.invalidate(book_ids or None)
+        for rc in self.rule_caches:
+            rc.invalidate(book_ids or None)
         if search_cache:
             self._clear_search_caches(book_ids)
 
@@ -247,9 +314,12 @@ class Cache(object):
         with self.backend.conn:  # Prevent other processes, such as calibredb from interrupting the reload by locking the db
             self.backend.prefs.load_from_db()
             self._search_api.saved_searches.load_from_db()
-            for field in self.fields.itervalues():
-                if hasattr(field, 'table'):
-                    field.table.read(self.backend)  # Reread data from metadata.db
+            if self.lazy_tables:
+                self.backend.read_tables(lazy=True, keep_large_text_in_db=self.keep_large_text_in_db, compact=self.compact_tables)
+            else:
+                for field in self.fields.itervalues():
+                    if hasattr(field, 'table'):
+                        field.table.read(self.backend)  # Reread data from metadata.db
 
     @property
     def field_metadata(self):
@@ -355,7 +425,7 @@ class Cache(object):
         Initialize this cache with data from the backend.
         '''
         with self.write_lock:
-            self.backend.read_tables()
+            self.backend.read_tables(lazy=self.lazy_tables, keep_large_text_in_db=self.keep_large_text_in_db, compact=self.compact_tables)
             bools_are_tristate = self.backend.prefs['bools_are_tristate']
 
             for field, table in self.backend.tables.iteritems():
@@ -991,6 +1061,16 @@ class Cache(object):
         '''
         return self._search_api(self, query, restriction, virtual_fields=virtual_fields, book_ids=book_ids)
 
+    @read_api
+    def explain_search(self, query, virtual_fields=None, book_ids=None):
+        '''
+        Run the specified query, bypassing the search cache, and return a
+        description of the plan used to evaluate it, with the estimated cost
+        and the actual time taken by every step. Useful for debugging slow
+        searches.
+        '''
+        return self._search_api.explain(self, query, virtual_fields=virtual_fields, book_ids=book_ids)
+
     @read_api
     def books_in_virtual_library(self, vl, search_restriction=None):
         ' Return the set of books in the specified virtual library '
@@ -1098,6 +1178,8 @@ class Cache(object):
         if dirtied and update_path and do_path_update:
             self._update_path(dirtied, mark_as_dirtied=False)
 
+        if dirtied and name in MATCH_FIELDS:
+            self.device_book_index.invalidate(dirtied)
         self._mark_as_dirty(dirtied)
 
         return dirtied
@@ -1243,6 +1325,19 @@ class Cache(object):
     def remove_cover_cache(self, cover_cache):
         self.cover_caches.discard(cover_cache)
 
+    @write_api
+    def add_rule_cache(self, rule_cache):
+        ''' Register a cache of the results of the coloring and icon rules,
+        such as :class:`calibre.db.rule_results.RuleResults`, its invalidate
+        method is called with the ids of the books that changed. '''
+        if not callable(rule_cache.invalidate):
+            raise ValueError('Rule caches must have an invalidate method')
+        self.rule_caches.add(rule_cache)
+
+    @write_api
+    def remove_rule_cache(self, rule_cache):
+        self.rule_caches.discard(rule_cache)
+
     @write_api
     def set_metadata(self, book_id, mi, ignore_errors=False, force_changes=False,
                      set_title=True, set_authors=True, allow_case_change=False):
@@ -1558,6 +1653,7 @@ class Cache(object):
             self.backend.execute('INSERT INTO books(id, title, series_index, author_sort) VALUES (?, ?, ?, ?)',
                          (force_id, mi.title, series_index, aus))
         book_id = self.backend.last_insert_rowid()
+        self.device_book_index.invalidate((book_id,))
 
         mi.timestamp = utcnow() if mi.timestamp is None else mi.timestamp
         mi.pubdate = UNDEFINED_DATE if mi.pubdate is None else mi.pubdate
@@ -1732,6 +1828,8 @@ class Cache(object):
                 self._set_field(field, {book_id:self._fast_field_for(f, book_id) + extra for book_id in books})
 
         if affected_books:
+            if field in MATCH_FIELDS:
+                self.device_book_index.invalidate(affected_books)
             if field == 'authors':
                 self._set_field('author_sort',
                                 {k:' & '.join(v) for k, v in self._author_sort_strings_for_books(affected_books).iteritems()})
@@ -1754,6 +1852,8 @@ class Cache(object):
         affected_books = field.table.remove_items(item_ids, self.backend,
                                                   restrict_to_book_ids=restrict_to_book_ids)
         if affected_books:
+            if field.name in MATCH_FIELDS:
+                self.device_book_index.invalidate(affected_books)
             if hasattr(field, 'index_field'):
                 self._set_field(field.index_field.name, {bid:1.0 for bid in affected_books})
             else:
@@ -1899,6 +1999,20 @@ class Cache(object):
     def lookup_by_uuid(self, uuid):
         return self.fields['uuid'].table.lookup_by_uuid(uuid)
 
+    @read_api
+    def match_device_books(self, books):
+        '''
+        Match books on a device to the books in this library, by uuid, and
+        failing that by title along with the application_id or db_id of the
+        book, its authors or its author sort. Returns a list with a pair
+        ``(book_id, how)`` for every book, where ``how`` is one of ``'UUID'``,
+        ``'APP_ID'``, ``'DB_ID'``, ``'AUTHOR'`` or ``'AUTH_SORT'``, or ``(None,
+        None)`` if the book has no match.
+        '''
+        index = self.device_book_index
+        index.refresh(self)
+        return [index.match(self, book) for book in books]
+
     @write_api
     def delete_custom_column(self, label=None, num=None):
         self.backend.delete_custom_column(label, num)
@@ -2161,6 +2275,16 @@ class Cache(object):
             if report_progress is not None:
                 report_progress(i+1, len(book_ids), mi)
 
+    @api
+    def parallel_embed_metadata(self, book_ids, only_fmts=None, report_error=None, report_progress=None, max_workers=None):
+        ''' Same as :meth:`embed_metadata` except that the book files are
+        rewritten in a pool of worker processes, with the database locked
+        only briefly, to read the metadata and to update the database with
+        the rewritten files. Use it to update large numbers of books. '''
+        from calibre.db.embed import embed_metadata
+        embed_metadata(self, book_ids, only_fmts=only_fmts, report_error=report_error,
+                       report_progress=report_progress, max_workers=max_workers)
+
     @read_api
     def get_last_read_positions(self, book_id, fmt, user):
         fmt = fmt.upper()
@@ -2202,24 +2326,25 @@ class Cache(object):
             exporter.add_file(f, dbkey)
         os.remove(pt.name)
         metadata = {'format_data':format_metadata, 'metadata.db':dbkey, 'total':total}
+        items = []
         for i, book_id in enumerate(book_ids):
-            if abort is not None and abort.is_set():
-                return
-            if progress is not None:
-                progress(self._field_for('title', book_id), i + 1, total)
             format_metadata[book_id] = {}
             for fmt in self._formats(book_id):
-                mdata = self.format_metadata(book_id, fmt)
                 key = '%s:%s:%s' % (key_prefix, book_id, fmt)
-                format_metadata[book_id][fmt] = key
-                with exporter.start_file(key, mtime=mdata.get('mtime')) as dest:
-                    self._copy_format_to(book_id, fmt, dest, report_file_size=dest.ensure_space)
-            cover_key = '%s:%s:%s' % (key_prefix, book_id, '.cover')
-            with exporter.start_file(cover_key) as dest:
-                if not self.copy_cover_to(book_id, dest, report_file_size=dest.ensure_space):
-                    dest.discard()
-                else:
-                    format_metadata[book_id]['.cover'] = cover_key
+                items.append((key, self._format_abspath(book_id, fmt), (i, book_id, fmt)))
+            path = self._field_for('path', book_id)
+            if path:
+                key = '%s:%s:%s' % (key_prefix, book_id, '.cover')
+                items.append((key, self.backend.cover_abspath(book_id, path.replace('/', os.sep)), (i, book_id, '.cover')))
+        last = -1
+        for (i, book_id, fmt), present in exporter.add_files((item for item in items if item[1]), abort=abort):
+            if present:
+                format_metadata[book_id][fmt] = '%s:%s:%s' % (key_prefix, book_id, fmt)
+            if progress is not None and i != last:
+                progress(exporter.throughput(self._field_for('title', book_id)), i + 1, total)
+            last = i
+        if abort is not None and abort.is_set():
+            return
         exporter.set_metadata(library_key, metadata)
         if progress is not None:
             progress(_('Completed'), total, total)
@@ -2240,24 +2365,38 @@ def import_library(library_key, importer, library_path, progress=None, abort=Non
     cache = Cache(DB(library_path, load_user_formatter_functions=False))
     cache.init()
     format_data = {int(book_id):data for book_id, data in metadata['format_data'].iteritems()}
+    items = []
     for i, (book_id, fmt_key_map) in enumerate(format_data.iteritems()):
-        if abort is not None and abort.is_set():
-            return
         title = cache._field_for('title', book_id)
-        if progress is not None:
-            progress(title, i + 1, total)
-        cache._update_path((book_id,), mark_as_dirtied=False)
+        items.append((None, None, (i, book_id, title, None)))
         for fmt, fmtkey in fmt_key_map.iteritems():
             if fmt == '.cover':
-                stream = importer.start_file(fmtkey, _('Cover for %s') % title)
-                path = cache._field_for('path', book_id).replace('/', os.sep)
-                cache.backend.set_cover(book_id, path, stream, no_processing=True)
+                description = _('Cover for %s') % title
             else:
-                stream = importer.start_file(fmtkey, _('{0} format for {1}').format(fmt.upper(), title))
-                size, fname = cache._do_add_format(book_id, fmt, stream, mtime=stream.mtime)
-                cache.fields['formats'].table.update_fmt(book_id, fmt, fname, size, cache.backend)
-            stream.close()
-        cache.dump_metadata({book_id})
+                description = _('{0} format for {1}').format(fmt.upper(), title)
+            items.append((fmtkey, description, (i, book_id, title, fmt)))
+    last_book_id = None
+    for (i, book_id, title, fmt), stream in importer.read_files(items, abort=abort):
+        if fmt is None:
+            # Start of a new book
+            if last_book_id is not None:
+                cache.dump_metadata({last_book_id})
+            last_book_id = book_id
+            if progress is not None:
+                progress(importer.throughput(title), i + 1, total)
+            cache._update_path((book_id,), mark_as_dirtied=False)
+            continue
+        if fmt == '.cover':
+            path = cache._field_for('path', book_id).replace('/', os.sep)
+            cache.backend.set_cover(book_id, path, stream, no_processing=True)
+        else:
+            size, fname = cache._do_add_format(book_id, fmt, stream, mtime=stream.mtime)
+            cache.fields['formats'].table.update_fmt(book_id, fmt, fname, size, cache.backend)
+        stream.close()
+    if abort is not None and abort.is_set():
+        return
+    if last_book_id is not None:
+        cache.dump_metadata({last_book_id})
     if progress is not None:
         progress(_('Completed'), total, total)
     return cache
@@ -0,0 +1,91 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import shlex
+import sys
+
+'''
+The batch command. It is run by calibredb itself, running the other commands
+in turn, so unlike the cmd_* modules it has no implementation() for a server
+to run.
+'''
+
+from calibre import prints
+from calibre.constants import preferred_encoding
+
+
+def option_parser(get_parser, args):
+    parser = get_parser(
+        _(
+            '''\
+%prog batch [options] [file]
+
+Run many commands, read from file, or from standard input if no file is \
+specified. Each line contains one command, exactly as it would be specified \
+to calibredb, but without the calibredb program name and the global options, \
+for example:
+
+add --duplicates /path/to/book.epub
+set_metadata --field tags:fiction 23
+
+Empty lines and lines starting with # are ignored. All the commands use a \
+single connection to the library, which is much faster than running \
+calibredb for every command, especially for libraries on a calibre Content \
+server.
+'''
+        )
+    )
+    parser.add_option(
+        '--stop-on-error',
+        default=False,
+        action='store_true',
+        help=_('Stop at the first command that fails, instead of running all remaining commands')
+    )
+    return parser
+
+
+def run_line(line, dbctx):
+    from calibre.db.cli.main import CLIENT_COMMANDS, COMMANDS, option_parser_for, run_cmd
+    args = [x.decode(preferred_encoding) for x in shlex.split(line)]
+    if args[0] not in COMMANDS or args[0] in CLIENT_COMMANDS:
+        raise SystemExit(_('Unknown command: {}').format(args[0]))
+    parser = option_parser_for(args[0], args[1:])()
+    opts, cmd_args = parser.parse_args(args[1:])
+    try:
+        return run_cmd(args[0], opts, cmd_args, dbctx)
+    finally:
+        if dbctx.is_remote:
+            # The files queued by a command that failed before it was sent
+            # must not be sent with the next command
+            dbctx.uploads = []
+
+
+def main(opts, args, dbctx):
+    f = lopen(args[0], 'rb') if args else sys.stdin
+    failed = 0
+    with f:
+        for lnum, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith(b'#'):
+                continue
+            try:
+                ret = run_line(line, dbctx)
+            except SystemExit as err:
+                ret = err.code
+                if ret is not None and not isinstance(ret, int):
+                    prints(ret, file=sys.stderr)
+                    ret = 1
+            except Exception:
+                import traceback
+                traceback.print_exc()
+                ret = 1
+            if ret:
+                failed += 1
+                prints(_('The command on line {0} failed: {1}').format(
+                    lnum, line.decode(preferred_encoding, 'replace')), file=sys.stderr)
+                if opts.stop_on_error:
+                    break
+    return 1 if failed else 0
@@ -6,11 +6,11 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import os
 import sys
-from io import BytesIO
 from optparse import OptionGroup, OptionValueError
 
 from calibre import prints
 from calibre.db.adding import compile_rule, recursive_import, import_book_directory, import_book_directory_multiple
+from calibre.db.cli.transport import to_stream
 from calibre.ebooks.metadata import MetaInformation, string_to_authors
 from calibre.ebooks.metadata.book.serialize import read_cover
 from calibre.ebooks.metadata.meta import get_metadata
@@ -21,12 +21,6 @@ readonly = False
 version = 0  # change this if you change signature of implementation()
 
 
-def to_stream(data):
-    ans = BytesIO(data[1])
-    ans.name = data[0]
-    return ans
-
-
 def empty(db, notify_changes, is_remote, args):
     mi = args[0]
     ids, duplicates = db.add_books([(mi, {})])
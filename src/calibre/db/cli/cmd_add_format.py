@@ -5,8 +5,8 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import os
-from io import BytesIO
 
+from calibre.db.cli.transport import to_stream
 from calibre.srv.changes import formats_added
 
 readonly = False
@@ -16,7 +16,7 @@ version = 0  # change this if you change signature of implementation()
 def implementation(db, notify_changes, book_id, data, fmt, replace):
     is_remote = notify_changes is not None
     if is_remote:
-        data = BytesIO(data[1])
+        data = to_stream(data)
     added = db.add_format(book_id, fmt, data, replace=replace)
     if is_remote and added:
         notify_changes(formats_added({book_id: (fmt,)}))
@@ -4,6 +4,8 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import time
+
 from calibre import prints
 from calibre.db.cli import integers_from_string
 from calibre.srv.changes import formats_added
@@ -55,8 +57,17 @@ def main(opts, args, dbctx):
     def progress(i, title):
         prints(_('Processed {0} ({1} of {2})').format(title, i, len(ids)))
 
-    for i, book_id in enumerate(ids):
-        title = dbctx.run('embed_metadata', book_id, only_fmts)
-        progress(i+1, title or _('No book with id: {}').format(book_id))
+    start = time.time()
+    if not dbctx.is_remote and dbctx.daemon is None:
+        # Rewrite the files in worker processes
+        dbctx.db.new_api.parallel_embed_metadata(
+            ids, only_fmts=only_fmts, report_progress=lambda i, total, mi: progress(i, mi.title))
+    else:
+        for i, book_id in enumerate(ids):
+            title = dbctx.run('embed_metadata', book_id, only_fmts)
+            progress(i+1, title or _('No book with id: {}').format(book_id))
+    elapsed = max(time.time() - start, 0.001)
+    prints(_('Processed {0} books in {1:.1f} seconds ({2:.1f} books per second)').format(
+        len(ids), elapsed, len(ids) / elapsed))
 
     return 0
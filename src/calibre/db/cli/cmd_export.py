@@ -6,6 +6,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import os
 
+from calibre import prints
 from calibre.db.cli import integers_from_string
 from calibre.db.errors import NoSuchFormat
 from calibre.library.save_to_disk import (
@@ -88,6 +89,19 @@ an opf file). You can get id numbers from the search command.
         switch = '--' + pref
         parser.add_option(switch, default=opt.default, help=opt.help, dest=pref)
 
+    parser.add_option(
+        '--mirror',
+        default=False,
+        action='store_true',
+        help=_(
+            'Keep the export directory as a mirror of the library. What was exported is'
+            ' recorded in the directory, so that running the same export again only exports'
+            ' the books that have changed since, and removes the files of books whose paths'
+            ' have changed or that have been deleted from the library. Only works with'
+            ' local libraries.'
+        )
+    )
+
     for pref in ('replace_whitespace', 'to_lowercase'):
         opt = c.get_option(pref)
         switch = '--' + pref.replace('_', '-')
@@ -119,13 +133,25 @@ def export(opts, dbctx, book_id, dest, dbproxy, length, first):
     mi, plugboards, formats, library_id, template_funcs = dbctx.run(
         'export', 'setup', book_id, opts.formats
     )
-    if dbctx.is_remote and first:
+    if (dbctx.is_remote or dbctx.daemon is not None) and first:
         load_user_template_functions(library_id, template_funcs)
     return do_save_book_to_disk(
         dbproxy, book_id, mi, plugboards, formats, dest, opts, length
     )
 
 
+def mirror(opts, dbctx, book_ids, dest):
+    if dbctx.is_remote or dbctx.daemon is not None:
+        raise SystemExit(_(
+            'The --mirror option can only be used with local libraries, when no calibredb daemon is running'))
+    from calibre.library.save_to_disk import mirror_to_disk
+    failures = mirror_to_disk(dbctx.db, book_ids, dest, opts)
+    for book_id, title, tb in failures:
+        prints(_('Failed to export {0} (id: {1})').format(title, book_id))
+        prints(tb)
+    return 0
+
+
 def main(opts, args, dbctx):
     if len(args) < 1 and not opts.all:
         raise SystemExit(_('You must specify some ids or the %s option') % '--all')
@@ -136,6 +162,8 @@ def main(opts, args, dbctx):
         for arg in args:
             book_ids |= set(integers_from_string(arg))
     dest = os.path.abspath(os.path.expanduser(opts.to_dir))
+    if opts.mirror:
+        return mirror(opts, dbctx, book_ids, dest)
     dbproxy = DBProxy(dbctx)
     dest, opts, length = sanitize_args(dest, opts)
     for i, book_id in enumerate(book_ids):
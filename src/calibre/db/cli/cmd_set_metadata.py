@@ -7,6 +7,7 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import os
 
 from calibre import prints
+from calibre.db.cli.transport import to_stream
 from calibre.ebooks.metadata.book.base import field_from_string
 from calibre.ebooks.metadata.book.serialize import read_cover
 from calibre.ebooks.metadata.opf import get_metadata
@@ -44,7 +45,7 @@ def implementation(db, notify_changes, action, *args):
                             mi.series_index = val  # extra has no effect for the builtin series field
                 elif field == 'cover':
                     if is_remote:
-                        mi.cover_data = None, val[1]
+                        mi.cover_data = None, to_stream(val).read()
                     else:
                         mi.cover = val
                         read_cover(mi)
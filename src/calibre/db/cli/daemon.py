@@ -0,0 +1,272 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+'''
+A daemon that keeps a local library open and runs the commands of other
+calibredb processes for it. The commands are sent over a Unix domain socket,
+using the same implementation(db, notify_changes, *args) protocol as the
+commands sent to a calibre server. Since the daemon runs on the same computer,
+the commands use paths to files directly, just as when the library is opened
+by calibredb itself.
+
+The daemon command, that starts and stops the daemon, is run by calibredb
+itself, so unlike the cmd_* modules it has no implementation() for a server to
+run.
+'''
+
+import errno
+import hashlib
+import os
+import select
+import socket
+import stat
+import tempfile
+import traceback
+from contextlib import closing
+from threading import Lock, Thread
+
+from calibre import as_unicode, prints
+from calibre.constants import iswindows
+from calibre.db.cli import module_for_cmd
+from calibre.db.cli.transport import CHUNK_SIZE, HEADER_SIZE
+from calibre.utils.ipc import eintr_retry_call
+from calibre.utils.serialize import msgpack_dumps, msgpack_loads
+
+
+def socket_dir():
+    return os.path.join(tempfile.gettempdir(), 'calibredb-daemon-%d' % os.geteuid())
+
+
+def is_safe(path):
+    ' Only use a socket directory that cannot be tampered with by other users '
+    try:
+        st = os.lstat(path)
+    except EnvironmentError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.geteuid() and not stat.S_IMODE(st.st_mode) & 0o077
+
+
+def socket_address(library_path):
+    path = os.path.realpath(library_path)
+    if isinstance(path, type('')):
+        path = path.encode('utf-8')
+    return os.path.join(socket_dir(), hashlib.sha1(path).hexdigest()[:20] + '.socket')
+
+
+# Messages {{{
+def send_msg(sock, data):
+    data = msgpack_dumps(data)
+    eintr_retry_call(sock.sendall, HEADER_SIZE.pack(len(data)) + data)
+
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = eintr_retry_call(sock.recv, min(size, CHUNK_SIZE))
+        if not chunk:
+            raise EOFError('The connection was closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_msg(sock):
+    size = HEADER_SIZE.unpack(recv_exactly(sock, HEADER_SIZE.size))[0]
+    return msgpack_loads(recv_exactly(sock, size))
+# }}}
+
+
+class Client(object):
+
+    ''' The connection of a calibredb process to the daemon '''
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def close(self):
+        self.sock.close()
+
+    def request(self, **msg):
+        send_msg(self.sock, msg)
+        return recv_msg(self.sock)
+
+    def run(self, name, m, *args):
+        ans = self.request(action='run', cmd=name, version=getattr(m, 'version', 0), cwd=os.getcwdu(), args=args)
+        if 'err' in ans:
+            if ans['tb']:
+                prints(ans['tb'])
+            raise SystemExit(ans['err'])
+        return ans['result']
+
+    def stop(self):
+        self.request(action='stop')
+
+
+def connect(library_path):
+    ''' Return a :class:`Client` connected to the daemon for the library at
+    library_path or None if no daemon is running for it. '''
+    if iswindows or not is_safe(socket_dir()):
+        return None
+    address = socket_address(library_path)
+    if not os.path.exists(address):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+    except socket.error:
+        # A daemon that was killed leaves its socket behind
+        sock.close()
+        return None
+    return Client(sock)
+
+
+class Daemon(object):
+
+    def __init__(self, library_path):
+        self.library_path = os.path.realpath(library_path)
+        self.address = socket_address(self.library_path)
+        # Commands are run one at a time, as they change the working directory
+        self.lock = Lock()
+        self.shutting_down = False
+        self.ldb = self.listener = None
+
+    def start(self):
+        from calibre.db.legacy import LibraryDatabase
+        if iswindows:
+            raise SystemExit(_('The calibredb daemon is not supported on Windows'))
+        try:
+            os.mkdir(socket_dir(), 0o700)
+        except EnvironmentError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        if not is_safe(socket_dir()):
+            raise SystemExit(_('The directory {} is accessible by other users, refusing to use it').format(socket_dir()))
+        # Read all tables up front, so that commands never have to
+        self.ldb = LibraryDatabase(self.library_path)
+        try:
+            os.remove(self.address)
+        except EnvironmentError as err:
+            if err.errno != errno.ENOENT:
+                raise
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.address)
+        self.listener.listen(16)
+
+    def serve_forever(self):
+        try:
+            while not self.shutting_down:
+                try:
+                    readable = select.select([self.listener], [], [], 0.5)[0]
+                except select.error as err:
+                    if err.args[0] == errno.EINTR:
+                        continue
+                    raise
+                if readable:
+                    try:
+                        conn = self.listener.accept()[0]
+                    except socket.error:
+                        continue
+                    t = Thread(name='CDBDaemonConnection', target=self.handle, args=(conn,))
+                    t.daemon = True
+                    t.start()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+            try:
+                os.remove(self.address)
+            except EnvironmentError:
+                pass
+        with self.lock:
+            if self.ldb is not None:
+                self.ldb.close()
+                self.ldb = None
+
+    def handle(self, conn):
+        with closing(conn):
+            while not self.shutting_down:
+                try:
+                    msg = recv_msg(conn)
+                except EOFError:
+                    break
+                except Exception:
+                    traceback.print_exc()
+                    break
+                action = msg.get('action')
+                if action == 'run':
+                    ans = self.run(msg)
+                elif action == 'stop':
+                    self.shutting_down = True
+                    ans = {'result': None}
+                else:
+                    ans = {'err': 'Unknown action: {}'.format(action), 'tb': ''}
+                send_msg(conn, ans)
+
+    def run(self, msg):
+        try:
+            m = module_for_cmd(msg['cmd'])
+            if getattr(m, 'version', 0) != msg['version']:
+                return {'err': 'The {} command is not available in version: {}'.format(msg['cmd'], msg['version']), 'tb': ''}
+            if getattr(m, 'no_remote', False):
+                return {'err': 'The {} command cannot be run by the daemon'.format(msg['cmd']), 'tb': ''}
+            with self.lock:
+                if self.ldb is None:
+                    return {'err': 'The daemon is shutting down', 'tb': ''}
+                os.chdir(msg['cwd'])
+                return {'result': m.implementation(self.ldb.new_api, None, *msg['args'])}
+        except (Exception, SystemExit) as err:
+            return {'err': as_unicode(err), 'tb': traceback.format_exc()}
+
+
+# The daemon command {{{
+def option_parser(get_parser, args):
+    parser = get_parser(
+        _(
+            '''\
+%prog daemon [options]
+
+Keep a local library open and run the commands of other calibredb programs \
+for it, so that they do not have to open the library themselves. This makes \
+running many calibredb commands, one after the other, much faster. The daemon \
+runs until it is interrupted or stopped with the --stop option. While it \
+runs, other calibre programs cannot use the library and the commands that \
+cannot be used with remote libraries cannot be used either. Not available on \
+Windows.
+'''
+        )
+    )
+    parser.add_option(
+        '--stop',
+        default=False,
+        action='store_true',
+        help=_('Stop the daemon running for the library')
+    )
+    return parser
+
+
+def main(opts, args, dbctx):
+    if dbctx.is_remote:
+        raise SystemExit(_('The daemon can only be used with local libraries'))
+    if dbctx.daemon is not None:
+        if opts.stop:
+            dbctx.daemon.stop()
+            prints(_('Daemon stopped'))
+            return 0
+        raise SystemExit(_('A calibredb daemon is already running for this library'))
+    if opts.stop:
+        raise SystemExit(_('No calibredb daemon is running for this library'))
+    daemon = Daemon(dbctx.library_path)
+    daemon.start()
+    prints(_('Serving the library at {} on {}').format(daemon.library_path, daemon.address))
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+# }}}
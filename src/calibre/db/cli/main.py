@@ -5,15 +5,18 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import httplib
+import importlib
 import json
 import os
 import sys
 from urllib import urlencode
 from urlparse import urlparse, urlunparse
 
-from calibre import browser, prints
+from calibre import browser, get_proxies, prints
 from calibre.constants import __appname__, __version__, iswindows
 from calibre.db.cli import module_for_cmd
+from calibre.db.cli.daemon import connect as connect_to_daemon
+from calibre.db.cli.transport import Connection, UPLOAD_MIME, inline_uploads, upload_body, upload_marker
 from calibre.db.legacy import LibraryDatabase
 from calibre.utils.config import OptionParser, prefs
 from calibre.utils.localization import localize_user_manual_link
@@ -25,14 +28,23 @@ COMMANDS = (
     'set_metadata', 'export', 'catalog', 'saved_searches', 'add_custom_column',
     'custom_columns', 'remove_custom_column', 'set_custom', 'restore_database',
     'check_library', 'list_categories', 'backup_metadata', 'clone', 'embed_metadata',
-    'search'
+    'search', 'batch', 'daemon'
 )
+# Commands that calibredb runs itself, instead of having them run on the
+# library, by a server or a daemon
+CLIENT_COMMANDS = {'batch': 'calibre.db.cli.batch', 'daemon': 'calibre.db.cli.daemon'}
+
+
+def cli_module_for_cmd(cmd):
+    if cmd in CLIENT_COMMANDS:
+        return importlib.import_module(CLIENT_COMMANDS[cmd])
+    return module_for_cmd(cmd)
 
 
 def option_parser_for(cmd, args=()):
 
     def cmd_option_parser():
-        return module_for_cmd(cmd).option_parser(get_parser, args)
+        return cli_module_for_cmd(cmd).option_parser(get_parser, args)
 
     return cmd_option_parser
 
@@ -49,9 +61,12 @@ def send_message(msg=''):
 
 
 def run_cmd(cmd, opts, args, dbctx):
-    m = module_for_cmd(cmd)
+    m = cli_module_for_cmd(cmd)
     if dbctx.is_remote and getattr(m, 'no_remote', False):
         raise SystemExit(_('The {} command is not supported with remote (server based) libraries').format(cmd))
+    if dbctx.daemon is not None and getattr(m, 'no_remote', False):
+        raise SystemExit(_('The {} command cannot be used while a calibredb daemon is running for the library.'
+                           ' Stop it first with: calibredb daemon --stop').format(cmd))
     ret = m.main(opts, args, dbctx)
     # if not dbctx.is_remote and not opts.dont_notify_gui and not getattr(m, 'readonly', False):
     #     send_message()
@@ -137,6 +152,8 @@ class DBCtx(object):
     def __init__(self, opts):
         self.library_path = opts.library_path or prefs['library_path']
         self.url = None
+        # A calibredb daemon running for the library
+        self.daemon = None
         if self.library_path is None:
             raise SystemExit(
                 'No saved library path, either run the GUI or use the'
@@ -153,12 +170,22 @@ class DBCtx(object):
             if username and password:
                 self.br.add_password(self.url, username, password)
                 self.has_credentials = True
+            # Files to be sent with the next command
+            self.uploads = []
+            # Set to False when the server turns out to be too old to
+            # understand streamed uploads
+            self.server_supports_uploads = True
+            # Requests go over a single keep-alive connection, unless a proxy
+            # has to be used, which the browser takes care of
+            self.connection = None if get_proxies().get(parts.scheme) else Connection(self.url, username, password)
+            self.url_path = urlparse(self.url).path
             if self.library_id == '-':
                 self.list_libraries()
                 raise SystemExit()
         else:
             self.library_path = os.path.expanduser(self.library_path)
-            if not singleinstance('db'):
+            self.daemon = connect_to_daemon(self.library_path)
+            if self.daemon is None and not singleinstance('db'):
                 ext = '.exe' if iswindows else ''
                 raise SystemExit(_(
                     'Another calibre program such as {} or the main calibre program is running.'
@@ -174,45 +201,82 @@ class DBCtx(object):
     @property
     def db(self):
         if self._db is None:
-            self._db = LibraryDatabase(self.library_path)
+            # Most commands use only a few fields, so only read the tables
+            # they need
+            self._db = LibraryDatabase(self.library_path, lazy_tables=True)
         return self._db
 
     def path(self, path):
         if self.is_remote:
-            with lopen(path, 'rb') as f:
-                return path, f.read()
+            # The file is streamed from disk when the command is run
+            self.uploads.append(path)
+            return path, upload_marker(len(self.uploads) - 1)
         return path
 
     def run(self, name, *args):
         m = module_for_cmd(name)
         if self.is_remote:
             return self.remote_run(name, m, *args)
+        if self.daemon is not None:
+            return self.daemon.run(name, m, *args)
         return m.implementation(self.db.new_api, None, *args)
 
-    def interpret_http_error(self, err):
-        if err.code == httplib.UNAUTHORIZED:
+    def interpret_http_error(self, code, reason):
+        if code == httplib.UNAUTHORIZED:
             if self.has_credentials:
                 raise SystemExit('The username/password combination is incorrect')
             raise SystemExit('A username and password is required to access this server')
-        if err.code == httplib.FORBIDDEN:
-            raise SystemExit(err.reason)
-        if err.code == httplib.NOT_FOUND:
-            raise SystemExit(err.reason)
+        if code == httplib.FORBIDDEN:
+            raise SystemExit(reason)
+        if code == httplib.NOT_FOUND:
+            raise SystemExit(reason)
+
+    def remote_request(self, path, body, content_type, idempotent):
+        ''' POST body, a bytestring or the result of upload_body(), to path
+        and return the status, reason and data of the response. '''
+        headers = {'Accept': MSGPACK_MIME, 'Content-Type': content_type}
+        if self.connection is None:
+            from mechanize import HTTPError, Request
+            if not isinstance(body, bytes):
+                body = b''.join(body[1]())
+            rq = Request(self.url + path, data=body, headers=headers)
+            try:
+                res = self.br.open_novisit(rq)
+                return httplib.OK, 'OK', res.read()
+            except HTTPError as err:
+                return err.code, err.reason, None
+        if not isinstance(body, bytes):
+            self.connection.authenticate(self.url_path + '/ajax/library-info')
+        return self.connection.request('POST', self.url_path + path, body, headers, idempotent=idempotent)
 
     def remote_run(self, name, m, *args):
-        from mechanize import HTTPError, Request
         from calibre.utils.serialize import msgpack_loads, msgpack_dumps
-        url = self.url + '/cdb/cmd/{}/{}'.format(name, getattr(m, 'version', 0))
+        path = '/cdb/cmd/{}/{}'.format(name, getattr(m, 'version', 0))
         if self.library_id:
-            url += '?' + urlencode({'library_id':self.library_id})
-        rq = Request(url, data=msgpack_dumps(args),
-                     headers={'Accept': MSGPACK_MIME, 'Content-Type': MSGPACK_MIME})
+            path += '?' + urlencode({'library_id':self.library_id})
+        uploads = self.uploads
+        # Commands that do not change the library are safe to send again
+        idempotent = getattr(m, 'readonly', False)
+        status = None
         try:
-            res = self.br.open_novisit(rq)
-            ans = msgpack_loads(res.read())
-        except HTTPError as err:
-            self.interpret_http_error(err)
-            raise
+            if uploads and self.server_supports_uploads:
+                status, reason, raw = self.remote_request(path, upload_body(args, uploads), UPLOAD_MIME, idempotent)
+                if status == httplib.BAD_REQUEST:
+                    # Older servers reject streamed uploads, send the files
+                    # inline, as they expect, instead
+                    self.server_supports_uploads = False
+                    status = None
+            if status is None:
+                if uploads:
+                    args = inline_uploads(args, uploads)
+                status, reason, raw = self.remote_request(path, msgpack_dumps(args), MSGPACK_MIME, idempotent)
+        finally:
+            # The files are sent only with this command, even if it fails
+            self.uploads = []
+        if status != httplib.OK:
+            self.interpret_http_error(status, reason)
+            raise SystemExit('The server returned an error: {} {}'.format(status, reason))
+        ans = msgpack_loads(raw)
         if 'err' in ans:
             prints(ans['tb'])
             raise SystemExit(ans['err'])
@@ -225,7 +289,7 @@ class DBCtx(object):
             res = self.br.open_novisit(url)
             ans = json.loads(res.read())
         except HTTPError as err:
-            self.interpret_http_error(err)
+            self.interpret_http_error(err.code, err.reason)
             raise
         library_map, default_library = ans['library_map'], ans['default_library']
         for lid in sorted(library_map, key=lambda lid: (lid != default_library, lid)):
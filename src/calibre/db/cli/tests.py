@@ -10,11 +10,18 @@ __docformat__ = 'restructuredtext en'
 Test the CLI of the calibre database management tool
 '''
 import csv
+import os
+import socket
 import unittest
+from contextlib import closing
 from cStringIO import StringIO
+from threading import Event, Thread
 
 
+from calibre.constants import iswindows
 from calibre.db.cli.cmd_check_library import _print_check_library_results
+from calibre.db.tests.base import BaseTest
+from calibre.srv.tests.base import LibraryBaseTest
 
 
 class Checker(object):
@@ -92,5 +99,197 @@ class PrintCheckLibraryResultsTest(unittest.TestCase):
         self.assertEqual(parsed_result, [[self.check[1], data[0][0], data[0][1]]])
 
 
+class UploadTest(unittest.TestCase):
+
+    def test_upload_body(self):
+        ' Test the encoding of uploaded files in the request body '
+        import os
+        from io import BytesIO
+        from calibre.db.cli.transport import (
+            CHUNK_SIZE, read_upload_body, to_stream, upload_body, upload_marker)
+        from calibre.ptempfile import TemporaryDirectory
+        with TemporaryDirectory('_cdb_upload') as tdir:
+            contents = [os.urandom(3 * CHUNK_SIZE + 7), b'', b'small']
+            paths = []
+            for i, data in enumerate(contents):
+                paths.append(os.path.join(tdir, '%d.epub' % i))
+                with open(paths[-1], 'wb') as f:
+                    f.write(data)
+            args = ['add_books', [[{'x':1}, {'EPUB':(paths[0], upload_marker(0))}],
+                                  [None, {'TXT':(paths[1], upload_marker(1)), 'PDF':(paths[2], upload_marker(2))}]]]
+            size, chunks = upload_body(args, paths)
+            body = BytesIO()
+            for chunk in chunks():
+                self.assertLessEqual(len(chunk), max(CHUNK_SIZE, 1024))
+                body.write(chunk)
+            self.assertEqual(size, body.tell())
+            ans = read_upload_body(body)
+        self.assertEqual(ans[0], 'add_books')
+        self.assertEqual(ans[1][0][0], {'x':1})
+        streams = [to_stream(ans[1][0][1]['EPUB']), to_stream(ans[1][1][1]['TXT']), to_stream(ans[1][1][1]['PDF'])]
+        self.assertEqual([s.name for s in streams], paths)
+        self.assertEqual([s.read() for s in reversed(streams)], list(reversed(contents)))
+        s = streams[0]
+        s.seek(10)
+        self.assertEqual(s.read(5), contents[0][10:15])
+        self.assertEqual(s.tell(), 15)
+        s.seek(-3, os.SEEK_END)
+        self.assertEqual(s.read(), contents[0][-3:])
+        self.assertEqual(s.read(), b'')
+        self.assertEqual(to_stream(['name', b'data']).read(), b'data')
+        body.seek(0, os.SEEK_END), body.write(b'extra')
+        self.assertRaises(ValueError, read_upload_body, body)
+
+
+class ClosingServer(Thread):
+
+    ''' A HTTP server that answers the first request on every connection and
+    then closes the connection, either right away or, if drop is True, after
+    reading the next request. '''
+
+    daemon = True
+
+    def __init__(self, drop):
+        Thread.__init__(self, name='ClosingServer')
+        self.drop = drop
+        self.received = []
+        self.closed = Event()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('localhost', 0))
+        self.listener.listen(5)
+        self.url = 'http://localhost:%d' % self.listener.getsockname()[1]
+
+    def run(self):
+        while True:
+            try:
+                conn = self.listener.accept()[0]
+            except socket.error:
+                break
+            with closing(conn):
+                f = conn.makefile('rb')
+                if self.read_request(f):
+                    conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+                    if self.drop:
+                        self.read_request(f)
+                f.close()
+            self.closed.set()
+
+    def read_request(self, f):
+        if not f.readline():
+            return False
+        size = 0
+        for line in iter(f.readline, b'\r\n'):
+            if line.lower().startswith(b'content-length:'):
+                size = int(line.partition(b':')[2])
+        self.received.append(f.read(size))
+        return True
+
+    def close(self):
+        self.listener.shutdown(socket.SHUT_RDWR)
+        self.listener.close()
+
+
+class RemoteTest(LibraryBaseTest):
+
+    def test_connection(self):
+        ' Test that requests are sent again only when that is safe '
+        import httplib
+        from calibre.db.cli.transport import Connection
+        server = ClosingServer(drop=False)
+        server.start()
+        try:
+            c = Connection(server.url)
+            self.assertEqual(c.request('POST', '/', b'1')[:2], (httplib.OK, 'OK'))
+            self.assertTrue(server.closed.wait(5))
+            # The closed connection is noticed before the request is sent
+            self.assertEqual(c.request('POST', '/', b'2')[2], b'ok')
+            self.assertEqual(server.received, [b'1', b'2'])
+            c.close()
+        finally:
+            server.close()
+        server = ClosingServer(drop=True)
+        server.start()
+        try:
+            c = Connection(server.url)
+            c.request('POST', '/', b'1')
+            # The server received the request, so it must not be sent again
+            self.assertRaises((httplib.HTTPException, socket.error), c.request, 'POST', '/', b'2')
+            self.assertEqual(server.received, [b'1', b'2'])
+            c.request('POST', '/', b'3')
+            self.assertEqual(c.request('POST', '/', b'4', idempotent=True)[2], b'ok')
+            self.assertEqual(server.received, [b'1', b'2', b'3', b'4', b'4'])
+            c.close()
+        finally:
+            server.close()
+
+    def test_cdb_run(self):
+        ' Test running commands on a server, including ones that upload files '
+        import httplib
+        from calibre.db.cli.transport import Connection, UPLOAD_MIME, upload_body, upload_marker
+        from calibre.ptempfile import TemporaryDirectory
+        from calibre.utils.serialize import MSGPACK_MIME, msgpack_dumps, msgpack_loads
+        with self.create_server(local_write=True) as server, TemporaryDirectory('_cdb_run') as tdir:
+            c = Connection('http://localhost:%d' % server.address[1])
+
+            def run(name, args, paths=()):
+                body, ct = (upload_body(args, paths), UPLOAD_MIME) if paths else (msgpack_dumps(args), MSGPACK_MIME)
+                status, reason, data = c.request('POST', '/cdb/cmd/%s/0' % name, body, {
+                    'Accept': MSGPACK_MIME, 'Content-Type': ct})
+                self.assertEqual(status, httplib.OK, reason)
+                ans = msgpack_loads(data)
+                self.assertNotIn('err', ans, ans.get('tb'))
+                return ans['result']
+
+            self.assertEqual(set(run('search', ['id:1 or id:2'])), {1, 2})
+            sock = c.conn.sock
+            self.assertEqual(set(run('search', ['id:2'])), {2})
+            self.assertIs(c.conn.sock, sock, 'The connection was not kept alive')
+            path = os.path.join(tdir, 'book.fmt3')
+            data = os.urandom(100 * 1024)
+            with open(path, 'wb') as f:
+                f.write(data)
+            self.assertTrue(run('add_format', [1, (path, upload_marker(0)), 'FMT3', True], [path]))
+            db = server.handler.router.ctx.library_broker.get(None)
+            self.assertEqual(db.format(1, 'FMT3'), data)
+            c.close()
+
+
+class DaemonTest(BaseTest):
+
+    @unittest.skipIf(iswindows, 'The daemon uses Unix domain sockets')
+    def test_daemon(self):
+        ' Test running commands via the calibredb daemon '
+        from threading import Thread
+        from calibre.db.cli import module_for_cmd
+        from calibre.db.cli.daemon import Daemon, connect
+        from calibre.db.cli.main import cli_module_for_cmd
+        self.assertIsNone(connect(self.library_path))
+        daemon = Daemon(self.library_path)
+        daemon.start()
+        t = Thread(target=daemon.serve_forever)
+        t.daemon = True
+        t.start()
+        client = connect(self.library_path)
+        self.assertIsNotNone(client)
+        try:
+            run = client.run
+            self.assertEqual(run('search', module_for_cmd('search'), 'id:1 or id:2'), {1, 2})
+            self.assertEqual(run('show_metadata', module_for_cmd('show_metadata'), 1).title, 'Title Two')
+            self.assertIsNone(run('show_metadata', module_for_cmd('show_metadata'), 100))
+            self.assertRaises(SystemExit, run, 'restore_database', module_for_cmd('restore_database'))
+            # Commands run by calibredb itself cannot be run by the daemon
+            self.assertRaises(SystemExit, run, 'daemon', cli_module_for_cmd('daemon'))
+            client.stop()
+        finally:
+            client.close()
+        t.join(5)
+        self.assertFalse(t.is_alive())
+        self.assertIsNone(connect(self.library_path))
+
+
 def find_tests():
-    return unittest.defaultTestLoader.loadTestsFromTestCase(PrintCheckLibraryResultsTest)
+    ans = unittest.defaultTestLoader.loadTestsFromTestCase(PrintCheckLibraryResultsTest)
+    ans.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(UploadTest))
+    ans.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(RemoteTest))
+    ans.addTests(unittest.defaultTestLoader.loadTestsFromTestCase(DaemonTest))
+    return ans
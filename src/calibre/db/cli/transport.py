@@ -0,0 +1,293 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+'''
+Sending commands, and the files they need, to a calibre server.
+
+Commands that upload files send a request body made up of a length prefixed,
+msgpack encoded header with the arguments of the command, followed by the raw
+contents of the files. The files are streamed from disk, in chunks, by the
+client. The server spools the request body to disk and the command reads the
+files directly from the spooled body, so neither side ever holds a whole file
+in memory.
+'''
+
+import base64
+import httplib
+import os
+import select
+import socket
+import struct
+from hashlib import md5
+from io import BytesIO
+from urlparse import urlparse
+
+from calibre.constants import __appname__, __version__
+from calibre.utils.serialize import msgpack_dumps, msgpack_loads
+
+UPLOAD_MIME = 'application/x-calibre-cdb-upload'
+UPLOAD_KEY = '__calibre_cdb_upload__'
+CHUNK_SIZE = 64 * 1024
+HEADER_SIZE = struct.Struct(b'!Q')
+
+
+def native_string(x):
+    ''' httplib builds the request in a native string, any unicode in the
+    request line or headers would make it fail to add a body that is not
+    ASCII. '''
+    return x.encode('utf-8') if isinstance(x, unicode) else x
+
+
+def to_stream(data):
+    ''' Convert the (name, data) pair for an uploaded file that a command
+    receives on the server into a file like object. '''
+    ans = data[1] if hasattr(data[1], 'read') else BytesIO(data[1])
+    ans.name = data[0]
+    return ans
+
+
+# Uploading {{{
+def upload_marker(index):
+    return {UPLOAD_KEY: index}
+
+
+def upload_body(args, paths):
+    ''' Return the size of the request body for the command args, which
+    refer to the files in paths by upload_marker(), and a function that
+    returns an iterator over the body, in chunks. '''
+    sizes = [os.path.getsize(path) for path in paths]
+    header = msgpack_dumps({'args': args, 'sizes': sizes})
+    header = HEADER_SIZE.pack(len(header)) + header
+
+    def chunks():
+        yield header
+        for path, size in zip(paths, sizes):
+            with lopen(path, 'rb') as f:
+                while size > 0:
+                    data = f.read(min(size, CHUNK_SIZE))
+                    if not data:
+                        raise EnvironmentError('%s was truncated while being sent' % path)
+                    size -= len(data)
+                    yield data
+
+    return len(header) + sum(sizes), chunks
+
+
+class FileSlice(object):
+
+    ''' A read only file like object for the part of f starting at start '''
+
+    def __init__(self, f, start, size):
+        self.f, self.start, self.size = f, start, size
+        self.pos, self.name, self.closed = 0, None, False
+
+    def read(self, n=-1):
+        n = self.size - self.pos if n is None or n < 0 else min(n, self.size - self.pos)
+        if n < 1:
+            return b''
+        self.f.seek(self.start + self.pos)
+        ans = self.f.read(n)
+        self.pos += len(ans)
+        return ans
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self.pos
+        elif whence == os.SEEK_END:
+            pos += self.size
+        self.pos = max(0, pos)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.closed = True
+
+
+def read_upload_body(f):
+    ''' Return the command arguments from a request body created by
+    upload_body(), with the file data replaced by file like objects that read
+    it from f. '''
+    f.seek(0)
+    header_size = HEADER_SIZE.unpack(f.read(HEADER_SIZE.size))[0]
+    header = msgpack_loads(f.read(header_size))
+    pos, files = HEADER_SIZE.size + header_size, []
+    for size in header['sizes']:
+        files.append(FileSlice(f, pos, size))
+        pos += size
+    f.seek(0, os.SEEK_END)
+    if f.tell() != pos:
+        raise ValueError('The size of the request body does not match its header')
+    return replace_markers(header['args'], files.__getitem__)
+
+
+def inline_uploads(args, paths):
+    ''' Replace the upload_marker()s in args with the contents of the files in
+    paths, the way the files were sent to servers that do not support streamed
+    uploads. '''
+
+    def read(index):
+        with lopen(paths[index], 'rb') as f:
+            return f.read()
+
+    return replace_markers(args, read)
+
+
+def replace_markers(x, func):
+    if isinstance(x, dict):
+        if len(x) == 1 and UPLOAD_KEY in x:
+            return func(x[UPLOAD_KEY])
+        return {k:replace_markers(v, func) for k, v in x.iteritems()}
+    if isinstance(x, (list, tuple)):
+        return [replace_markers(v, func) for v in x]
+    return x
+# }}}
+
+
+class Connection(object):
+
+    '''
+    A persistent HTTP connection to a calibre server. All requests made by a
+    calibredb process go over it, using HTTP keep-alive, instead of opening a
+    new connection for every command. Handles basic and digest
+    authentication, remembering the challenge from the server so that
+    subsequent requests are authenticated up front.
+    '''
+
+    def __init__(self, url, username=None, password=None):
+        parts = urlparse(url)
+        self.is_https = parts.scheme == 'https'
+        self.host, self.port = parts.hostname, parts.port
+        self.username, self.password = username, password
+        self.user_agent = '{} {}'.format(__appname__, __version__)
+        self.conn = None
+        self.challenge = None
+        self.nonce_count = 0
+        # Whether the whole of the last request was sent to the server
+        self.request_sent = False
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def is_stale(self):
+        ''' True if the server has closed the kept-alive connection. An idle
+        connection becomes readable only when the server closes it. '''
+        try:
+            return bool(select.select([self.conn.sock], [], [], 0)[0])
+        except (select.error, socket.error, ValueError):
+            return True
+
+    @property
+    def has_credentials(self):
+        return bool(self.username and self.password)
+
+    def authorization(self, method, path):
+        c = self.challenge
+        if c is None:
+            return
+        if c['scheme'] == 'basic':
+            return 'Basic ' + base64.standard_b64encode(
+                ('%s:%s' % (self.username, self.password)).encode('utf-8')).decode('ascii')
+        self.nonce_count += 1
+        nc, cnonce = '%08x' % self.nonce_count, os.urandom(8).encode('hex')
+
+        def H(x):
+            return md5(x.encode('utf-8')).hexdigest().decode('ascii')
+
+        ha1 = H('%s:%s:%s' % (self.username, c['realm'], self.password))
+        ha2 = H('%s:%s' % (method, path))
+        if c.get('qop'):
+            response = H(':'.join((ha1, c['nonce'], nc, cnonce, 'auth', ha2)))
+        else:
+            response = H(':'.join((ha1, c['nonce'], ha2)))
+        ans = 'Digest username="%s", realm="%s", nonce="%s", uri="%s", algorithm="MD5", response="%s"' % (
+            self.username, c['realm'], c['nonce'], path, response)
+        if c.get('qop'):
+            ans += ', qop=auth, nc=%s, cnonce="%s"' % (nc, cnonce)
+        if c.get('opaque'):
+            ans += ', opaque="%s"' % c['opaque']
+        return ans
+
+    def update_challenge(self, header):
+        ''' Remember the authentication challenge from the server, returns
+        False if retrying the request with it is pointless. '''
+        from calibre.srv.utils import parse_http_dict
+        scheme, rest = (header or '').partition(' ')[::2]
+        scheme = scheme.lower()
+        if scheme not in ('basic', 'digest'):
+            return False
+        c = parse_http_dict(rest.strip())
+        c['scheme'] = scheme
+        retry = self.challenge is None or c.get('stale', '').lower() == 'true'
+        self.challenge, self.nonce_count = c, 0
+        return retry
+
+    def send(self, method, path, body, headers):
+        if self.conn is None:
+            self.conn = (httplib.HTTPSConnection if self.is_https else httplib.HTTPConnection)(native_string(self.host), self.port)
+        conn = self.conn
+        self.request_sent = False
+        conn.putrequest(native_string(method), native_string(path), skip_accept_encoding=True)
+        for k, v in headers.iteritems():
+            conn.putheader(native_string(k), native_string(v))
+        if body is None:
+            conn.endheaders()
+        elif isinstance(body, bytes):
+            conn.putheader(b'Content-Length', b'%d' % len(body))
+            conn.endheaders(body)
+        else:
+            size, chunks = body
+            conn.putheader(b'Content-Length', b'%d' % size)
+            conn.endheaders()
+            for chunk in chunks():
+                conn.send(chunk)
+        self.request_sent = True
+        res = conn.getresponse()
+        return res.status, res.reason, res.getheader('WWW-Authenticate'), res.read()
+
+    def request(self, method, path, body=None, headers=None, idempotent=None):
+        ''' Make a request and return its status, reason and response data.
+        body can be None, a bytestring or a (size, chunks) pair as returned by
+        upload_body(). If the server closes the kept-alive connection, the
+        request is sent again on a new connection, but only if it was not
+        sent completely or is idempotent, so that the server never runs a
+        command twice. idempotent defaults to True for GET and HEAD requests. '''
+        if idempotent is None:
+            idempotent = method in ('GET', 'HEAD')
+        headers = dict(headers or {})
+        headers['User-Agent'] = self.user_agent
+        retried = False
+        while True:
+            auth = self.authorization(method, path)
+            if auth:
+                headers['Authorization'] = auth
+            if self.conn is not None and self.conn.sock is not None and self.is_stale():
+                self.close()
+            reused = self.conn is not None and self.conn.sock is not None
+            try:
+                status, reason, challenge, data = self.send(method, path, body, headers)
+            except (httplib.HTTPException, socket.error):
+                self.close()
+                if reused and not retried and (idempotent or not self.request_sent):
+                    # The server closed the kept-alive connection, sending
+                    # the request again is safe as the server either did not
+                    # receive all of it or it changes nothing
+                    retried = True
+                    continue
+                raise
+            if status == httplib.UNAUTHORIZED and self.has_credentials and self.update_challenge(challenge):
+                continue
+            return status, reason, data
+
+    def authenticate(self, path):
+        ''' Get the authentication challenge from the server with a request
+        that has no body, so that a large upload does not have to be sent
+        twice. '''
+        if self.has_credentials and self.challenge is None:
+            self.request('GET', path)
@@ -0,0 +1,332 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2017, Kovid Goyal <kovid at kovidgoyal.net>'
+
+'''
+Compact replacements for the dicts that hold the data of the tables, used for
+very large libraries, see Cache(compact_tables=True).
+
+Book and item ids are small positive integers, so instead of hashing them, the
+maps here use them as indices into lists and arrays. This avoids storing a
+separate int object for every key and value as well as the overhead of dict
+entries, sets and tuples. The maps support the subset of the dict API used by
+the rest of calibre.db.
+'''
+
+from array import array
+from itertools import izip
+
+_missing, DELETED = object(), object()
+INT_MAX = 2**31 - 1
+
+
+def interner(db):
+    ''' Return a function that maps equal strings to a single shared object,
+    sharing strings with all other tables being read at the same time. '''
+    return ({} if db.string_pool is None else db.string_pool).setdefault
+
+
+class MapMixin(object):
+
+    ''' The dict API, implemented in terms of get(), __setitem__(),
+    __delitem__(), iterkeys() and __len__() '''
+
+    def __getitem__(self, key):
+        ans = self.get(key, _missing)
+        if ans is _missing:
+            raise KeyError(key)
+        return ans
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def iteritems(self):
+        get = self.get
+        return ((key, get(key)) for key in self.iterkeys())
+
+    def itervalues(self):
+        return (val for key, val in self.iteritems())
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def copy(self):
+        return dict(self.iteritems())
+
+    def pop(self, key, default=_missing):
+        ans = self.get(key, _missing)
+        if ans is _missing:
+            if default is _missing:
+                raise KeyError(key)
+            return default
+        del self[key]
+        return ans
+
+    def setdefault(self, key, default=None):
+        ans = self.get(key, _missing)
+        if ans is _missing:
+            ans = self[key] = default
+        return ans
+
+    def update(self, *args, **kwargs):
+        for key, val in dict(*args, **kwargs).iteritems():
+            self[key] = val
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.copy())
+
+
+class ObjectColumn(MapMixin):
+
+    ''' Maps book ids to arbitrary values, stored in a list indexed by book id '''
+
+    def __init__(self, rows=()):
+        self.values, self.length = [], 0
+        for key, val in rows:
+            self[key] = val
+
+    def get(self, key, default=None):
+        try:
+            ans = self.values[key]
+        except (IndexError, TypeError):
+            return default
+        return default if ans is _missing or key < 0 else ans
+
+    def __setitem__(self, key, val):
+        values = self.values
+        if key < 0:
+            raise KeyError(key)
+        if key >= len(values):
+            # Grow geometrically, so that adding keys in order is fast
+            values.extend([_missing] * max(key + 1 - len(values), len(values) // 8))
+        if values[key] is _missing:
+            self.length += 1
+        values[key] = val
+
+    def __delitem__(self, key):
+        if self.get(key, _missing) is _missing:
+            raise KeyError(key)
+        self.values[key] = _missing
+        self.length -= 1
+
+    def __len__(self):
+        return self.length
+
+    def iterkeys(self):
+        return (key for key, val in enumerate(self.values) if val is not _missing)
+
+    def iteritems(self):
+        return ((key, val) for key, val in enumerate(self.values) if val is not _missing)
+
+
+class ArrayColumn(MapMixin):
+
+    '''
+    Maps book ids to numbers, stored in an array indexed by book id. Values
+    that do not have the type of the array, such as None or numbers that are
+    too large, are stored in a dict instead. The flags say where the value for
+    each id is: 0 means there is no value, 1 that it is in the array and 2 that
+    it is in the dict.
+    '''
+
+    def __init__(self, typecode, value_type, rows=()):
+        self.values, self.flags, self.other = array(typecode), bytearray(), {}
+        self.value_type, self.length = value_type, 0
+        for key, val in rows:
+            self[key] = val
+
+    def get(self, key, default=None):
+        try:
+            flag = self.flags[key]
+        except (IndexError, TypeError):
+            return default
+        if flag == 1 and key > -1:
+            return self.value_type(self.values[key])
+        return self.other[key] if flag == 2 and key > -1 else default
+
+    def __setitem__(self, key, val):
+        flags = self.flags
+        if key < 0:
+            raise KeyError(key)
+        if key >= len(flags):
+            num = max(key + 1 - len(flags), len(flags) // 8)
+            flags.extend(bytearray(num))
+            self.values.extend(array(self.values.typecode, [0]) * num)
+        flag = flags[key]
+        if flag == 0:
+            self.length += 1
+        elif flag == 2:
+            del self.other[key]
+        if type(val) is self.value_type:
+            try:
+                self.values[key] = val
+            except OverflowError:
+                pass
+            else:
+                flags[key] = 1
+                return
+        self.other[key] = val
+        flags[key] = 2
+
+    def __delitem__(self, key):
+        if self.get(key, _missing) is _missing:
+            raise KeyError(key)
+        if self.flags[key] == 2:
+            del self.other[key]
+        self.flags[key] = 0
+        self.length -= 1
+
+    def __len__(self):
+        return self.length
+
+    def iterkeys(self):
+        return (key for key, flag in enumerate(self.flags) if flag)
+
+
+def int_column(rows=()):
+    return ArrayColumn(b'i', int, rows)
+
+
+def column_map(datatype, rows, intern=None):
+    ''' Return a compact map of book id to value for the (book_id, value)
+    pairs in rows. '''
+    if datatype == 'int':
+        return int_column(rows)
+    if datatype == 'float':
+        return ArrayColumn(b'd', float, rows)
+    if datatype == 'bool':
+        return ArrayColumn(b'b', bool, rows)
+    if intern is not None and datatype == 'text':
+        rows = ((key, intern(val, val) if isinstance(val, unicode) else val) for key, val in rows)
+    return ObjectColumn(rows)
+
+
+class LinkMap(MapMixin):
+
+    '''
+    Maps ids to groups of ids, for example book ids to the tuple of tag ids
+    for the book, or a tag id to the set of book ids that have the tag. The
+    groups are stored CSR style, in two arrays: the ids in the group for key
+    are values[offsets[key]:offsets[key+1]]. The arrays are never modified,
+    changes are stored in a dict that overrides them.
+
+    Like a defaultdict, if default_factory is not None, looking up a missing
+    key with [] inserts default_factory() for the key. As sets are
+    mutable, looking up a set with [] stores it in the dict of changes, so that
+    it can be modified in place. get() always returns a new set, and so must
+    not be used to modify the set.
+    '''
+
+    def __init__(self, keys, values, group=tuple, default_factory=None):
+        self.group, self.default_factory = group, default_factory
+        self.changes = {}
+        offsets = array(b'i', [0]) * ((max(keys) + 2) if keys else 1)
+        # Count the values for every key
+        length = 0
+        for key in keys:
+            key += 1
+            if not offsets[key]:
+                length += 1
+            offsets[key] += 1
+        self.length = length
+        total = 0
+        for i, count in enumerate(offsets):
+            total += count
+            offsets[i] = total
+        # Place the values, keeping the order they have for each key
+        pos = offsets[:-1]
+        self.values = vals = array(b'i' if max(values or (0,)) <= INT_MAX else b'l', [0]) * len(values)
+        for key, val in izip(keys, values):
+            i = pos[key]
+            vals[i] = val
+            pos[key] = i + 1
+        self.offsets = offsets
+
+    def base_has(self, key):
+        try:
+            return key > -1 and self.offsets[key] != self.offsets[key + 1]
+        except (IndexError, TypeError):
+            return False
+
+    def get(self, key, default=None):
+        ans = self.changes.get(key, _missing)
+        if ans is not _missing:
+            return default if ans is DELETED else ans
+        try:
+            start, end = self.offsets[key], self.offsets[key + 1]
+        except (IndexError, TypeError):
+            return default
+        if start == end or key < 0:
+            return default
+        return self.group(self.values[start:end])
+
+    def __getitem__(self, key):
+        ans = self.get(key, _missing)
+        if ans is _missing:
+            if self.default_factory is None:
+                raise KeyError(key)
+            ans = self[key] = self.default_factory()
+        elif self.group is set and key not in self.changes:
+            # Keep the set so that changes made to it in place are not lost
+            self.changes[key] = ans
+        return ans
+
+    def __setitem__(self, key, val):
+        if self.get(key, _missing) is _missing:
+            self.length += 1
+        self.changes[key] = val
+
+    def __delitem__(self, key):
+        if self.get(key, _missing) is _missing:
+            raise KeyError(key)
+        if self.base_has(key):
+            self.changes[key] = DELETED
+        else:
+            del self.changes[key]
+        self.length -= 1
+
+    def __len__(self):
+        return self.length
+
+    def iteritems(self):
+        changes, offsets, values, group = self.changes, self.offsets, self.values, self.group
+        start = 0
+        for key in xrange(len(offsets) - 1):
+            end = offsets[key + 1]
+            if start != end and key not in changes:
+                yield key, group(values[start:end])
+            start = end
+        for key, val in changes.iteritems():
+            if val is not DELETED:
+                yield key, val
+
+    def iterkeys(self):
+        return (key for key, val in self.iteritems())
+
+
+def link_maps(rows, many_many=True):
+    ''' Return the compact (book_col_map, col_book_map) for the (book_id,
+    item_id) pairs in rows. For many-many tables, the ids in book_col_map are
+    in the order of rows. '''
+    books, items = array(b'l'), array(b'l')
+    for book_id, item_id in rows:
+        books.append(book_id), items.append(item_id)
+    if many_many:
+        bcm = LinkMap(books, items)
+    else:
+        bcm = int_column(izip(books, items))
+    cbm = LinkMap(items, books, group=set, default_factory=set)
+    return bcm, cbm
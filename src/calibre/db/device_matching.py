@@ -0,0 +1,150 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+'''
+Matching of the books on a device to the books in the library. Books are
+matched by uuid, and failing that by title along with the id the device has
+for the book, its authors or its author sort. The indexes of the library by
+title are built the first time they are used and after that only the books that
+have changed are re-indexed.
+'''
+
+import re
+from threading import Lock
+
+from calibre.ebooks.metadata import authors_to_string
+
+string_pat = re.compile(r'(?u)\W|[_]')
+# The fields books are indexed by, the index is only invalidated when they change
+MATCH_FIELDS = frozenset(('title', 'authors', 'author_sort'))
+
+
+def clean_string(x):
+    x = x.lower() if x else ''
+    return string_pat.sub('', x)
+
+
+# The indexes map keys to a book id, or to a tuple of book ids if many books
+# have the same key, as that uses much less memory than sets for large
+# libraries
+
+def add_id(index, key, book_id):
+    ids = index.get(key)
+    if ids is None:
+        index[key] = book_id
+    elif isinstance(ids, tuple):
+        if book_id not in ids:
+            index[key] = ids + (book_id,)
+    elif ids != book_id:
+        index[key] = (ids, book_id)
+
+
+def remove_id(index, key, book_id):
+    ids = index.get(key)
+    if isinstance(ids, tuple):
+        ids = tuple(x for x in ids if x != book_id)
+        index[key] = ids[0] if len(ids) == 1 else ids
+    elif ids == book_id:
+        del index[key]
+
+
+def ids_for(index, key):
+    ids = index.get(key, ())
+    return ids if isinstance(ids, tuple) else (ids,)
+
+
+class DeviceBookIndex(object):
+
+    '''
+    The index used by :meth:`calibre.db.cache.Cache.match_device_books`. The
+    cache calls :meth:`invalidate` when books are added or removed or the
+    fields in MATCH_FIELDS change, the changed books are re-indexed the next
+    time books are matched.
+    '''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.titles, self.authors, self.author_sorts = {}, {}, {}
+        self.book_keys = {}
+        self.dirtied = None  # None means all books must be indexed
+
+    def invalidate(self, book_ids=None):
+        if self.dirtied is not None:
+            if book_ids is None:
+                self.dirtied = None
+            else:
+                self.dirtied.update(book_ids)
+
+    def unindex(self, book_id):
+        keys = self.book_keys.pop(book_id, None)
+        if keys is not None:
+            title, authors, author_sort = keys
+            remove_id(self.titles, title, book_id)
+            if authors:
+                remove_id(self.authors, (title, authors), book_id)
+            if author_sort:
+                remove_id(self.author_sorts, (title, author_sort), book_id)
+
+    def index(self, book_id, title, authors, author_sort):
+        title, authors, author_sort = clean_string(title), clean_string(''.join(authors)), clean_string(author_sort)
+        self.book_keys[book_id] = title, authors, author_sort
+        add_id(self.titles, title, book_id)
+        if authors:
+            add_id(self.authors, (title, authors), book_id)
+        if author_sort:
+            add_id(self.author_sorts, (title, author_sort), book_id)
+
+    def refresh(self, cache):
+        ' Must be called with the read lock of cache held '
+        with self.lock:
+            if self.dirtied is None:
+                self.titles, self.authors, self.author_sorts = {}, {}, {}
+                self.book_keys = {}
+                book_ids = cache._all_book_ids()
+            else:
+                book_ids = {book_id for book_id in self.dirtied if cache._has_id(book_id)}
+                for book_id in self.dirtied:
+                    self.unindex(book_id)
+            self.dirtied = set()
+            if book_ids:
+                titles = cache._all_field_for('title', book_ids)
+                authors = cache._all_field_for('authors', book_ids)
+                author_sorts = cache._all_field_for('author_sort', book_ids)
+                for book_id in book_ids:
+                    self.index(book_id, titles[book_id], authors[book_id], author_sorts[book_id])
+
+    def match(self, cache, book):
+        ''' Return the id of the book in the library that matches book and how
+        it was matched, or (None, None). '''
+        uuid = getattr(book, 'uuid', None)
+        if uuid:
+            book_id = cache._lookup_by_uuid(uuid)
+            if book_id is not None:
+                return book_id, 'UUID'
+        title = clean_string(book.title)
+        ids = ids_for(self.titles, title)
+        if not ids:
+            return None, None
+        # The title matches, the book matches if the id the device has for
+        # it, its authors or its author sort also match
+        app_id = getattr(book, 'application_id', None)
+        if app_id in ids:
+            return app_id, 'APP_ID'
+        # Sonys know their db_id independent of the application_id
+        db_id = getattr(book, 'db_id', None)
+        if db_id in ids:
+            return db_id, 'DB_ID'
+        if book.authors:
+            # Compare against both author and author sort, because either can
+            # appear as the author. If there are many books with the same title
+            # and author, use the last one added, as we cannot tell the
+            # difference between them.
+            key = title, clean_string(authors_to_string(book.authors))
+            for index, how in ((self.authors, 'AUTHOR'), (self.author_sorts, 'AUTH_SORT')):
+                ids = ids_for(index, key)
+                if ids:
+                    return max(ids), how
+        return None, None
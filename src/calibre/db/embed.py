@@ -0,0 +1,215 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+'''
+Embed the metadata from the database into the book files of many books, using
+a pool of worker processes. The metadata for a chunk of books is read under
+the read lock, the workers rewrite copies of the book files and the rewritten
+files are moved into place, with the database updated, under the write lock,
+one chunk at a time. So the library remains usable while the books are
+processed.
+'''
+
+import os
+import shutil
+from io import BytesIO
+from Queue import Empty
+
+from calibre import prints
+from calibre.utils.filenames import atomic_rename
+
+CHUNK_SIZE = 8  # books per job
+MIN_BOOKS_FOR_POOL = 2 * CHUNK_SIZE
+TEMP_SUFFIX = '.calibre-embed'
+
+
+def safe_remove(path):
+    try:
+        os.remove(path)
+    except EnvironmentError:
+        pass
+
+
+def serialize_metadata(mi):
+    ''' The metadata as sent to the worker processes, an OPF and the cover
+    data, since the Metadata objects from the database refer to it and so
+    cannot be pickled. '''
+    from calibre.ebooks.metadata.opf2 import metadata_to_opf
+    # metadata_to_opf() sets missing languages, und is left out of the OPF
+    languages = mi.languages
+    opf = metadata_to_opf(mi, default_lang='und')
+    mi.languages = languages
+    return opf, mi.cover_data
+
+
+def deserialize_metadata(opf, cover_data):
+    from calibre.ebooks.metadata.opf2 import OPF
+    mi = OPF(BytesIO(opf), populate_spine=False, try_to_guess_cover=False).to_book_metadata()
+    mi.cover_data = cover_data
+    return mi
+
+
+def embed_in_files(tasks):
+    ''' Run in the worker processes. Embed metadata into copies of the book
+    files, returning the path and size of the copy and any errors for every
+    file. '''
+    from calibre.customize.ui import apply_null_metadata
+    from calibre.ebooks.metadata.meta import set_metadata
+    from calibre.ebooks.metadata.opf2 import pretty_print
+    ans, metadata = [], {}
+    for book_id, fmt, path, opf, cover_data in tasks:
+        mi = metadata.get(book_id)
+        if mi is None:
+            mi = metadata[book_id] = deserialize_metadata(opf, cover_data)
+        errors = []
+        temp, size = path + TEMP_SUFFIX, None
+        try:
+            shutil.copyfile(path, temp)
+            with lopen(temp, 'r+b') as stream:
+                with apply_null_metadata, pretty_print:
+                    set_metadata(stream, mi, stream_type=fmt, report_error=lambda mi, fmt, tb: errors.append(tb))
+                stream.seek(0, os.SEEK_END)
+                size = stream.tell()
+        except Exception:
+            import traceback
+            errors.append(traceback.format_exc())
+        if errors:
+            safe_remove(temp)
+            temp = None
+        ans.append((temp, size, errors))
+    return ans
+
+
+def snapshot(cache, book_ids, only_fmts):
+    ''' Return the metadata of the books and the files to embed it into '''
+    tasks, metadata = [], {}
+    with cache.safe_read_lock:
+        field = cache.fields['formats']
+        for book_id in book_ids:
+            fmts = field.table.book_col_map.get(book_id, ())
+            if not fmts:
+                continue
+            try:
+                path = cache._field_for('path', book_id).replace('/', os.sep)
+            except Exception:
+                continue
+            metadata[book_id] = mi = cache.get_metadata(book_id, get_cover=True, cover_as_data=True)
+            for fmt in fmts:
+                if only_fmts is not None and fmt.lower() not in only_fmts:
+                    continue
+                try:
+                    name = field.format_fname(book_id, fmt)
+                except Exception:
+                    continue
+                if name and path:
+                    fpath = cache.backend.format_abspath(book_id, fmt, name, path)
+                    if fpath is not None:
+                        st = os.stat(fpath)
+                        tasks.append((book_id, fmt, fpath, mi, name, (st.st_size, st.st_mtime)))
+    return tasks, metadata
+
+
+def commit(cache, tasks, results, report_error):
+    ''' Move the rewritten files into place, unless the original files were
+    changed while they were being rewritten, and update the database. '''
+    sizes = {}
+    with cache.write_lock:
+        field = cache.fields['formats']
+        for (book_id, fmt, path, mi, name, stat), (temp, size, errors) in zip(tasks, results):
+            for tb in errors:
+                if report_error is None:
+                    prints('Failed to set metadata for the', fmt.upper(), 'format of:', mi.title)
+                    prints(tb)
+                else:
+                    report_error(mi, fmt, tb)
+            if temp is None:
+                continue
+            try:
+                st = os.stat(path)
+                unchanged = (st.st_size, st.st_mtime) == stat and field.format_fname(book_id, fmt) == name
+            except Exception:
+                unchanged = False
+            if not unchanged:
+                safe_remove(temp)
+                continue
+            atomic_rename(temp, path)
+            cache.format_metadata_cache[book_id].get(fmt, {})['size'] = size
+            sizes[book_id] = field.table.update_fmt(book_id, fmt, name, size, cache.backend)
+        if sizes:
+            cache.fields['size'].table.update_sizes(sizes)
+
+
+def chunks(items, size=CHUNK_SIZE):
+    for i in xrange(0, len(items), size):
+        yield items[i:i+size]
+
+
+def embed_metadata(cache, book_ids, only_fmts=None, report_error=None, report_progress=None, max_workers=None):
+    book_ids = tuple(book_ids)
+    if len(book_ids) < MIN_BOOKS_FOR_POOL or max_workers == 0:
+        return cache.embed_metadata(book_ids, only_fmts=only_fmts, report_error=report_error, report_progress=report_progress)
+    if only_fmts:
+        only_fmts = {f.lower() for f in only_fmts}
+    else:
+        only_fmts = None
+
+    from calibre.utils.ipc.pool import Pool, Failure
+    pool = Pool(max_workers=max_workers, name='EmbedMetadata')
+    # Limit the number of chunks in flight, so that the metadata, including
+    # covers, of only a few books is in memory at any time
+    max_pending = 2 * pool.max_workers
+    pending = {}
+    todo = chunks(book_ids)
+    total, done = len(book_ids), 0
+
+    def progress(done, chunk, metadata):
+        for book_id in chunk:
+            done += 1
+            mi = metadata.get(book_id)
+            if mi is not None and report_progress is not None:
+                report_progress(done, total, mi)
+        return done
+
+    try:
+        job_id = 0
+        while True:
+            while len(pending) < max_pending:
+                chunk = next(todo, None)
+                if chunk is None:
+                    break
+                tasks, metadata = snapshot(cache, chunk, only_fmts)
+                if tasks:
+                    job_id += 1
+                    pending[job_id] = chunk, tasks, metadata
+                    serialized = {book_id: serialize_metadata(metadata[book_id]) for book_id in {t[0] for t in tasks}}
+                    pool(job_id, __name__, 'embed_in_files', [t[:3] + serialized[t[0]] for t in tasks])
+                else:
+                    done = progress(done, chunk, metadata)
+            if not pending:
+                break
+            try:
+                worker_result = pool.results.get(True, 0.1)
+            except Empty:
+                if pool.failed:
+                    raise Failure(pool.terminal_failure)
+                continue
+            if worker_result.is_terminal_failure:
+                raise Failure(pool.terminal_failure)
+            # The chunk stays pending until it is committed, so that its
+            # rewritten files are removed below if anything fails
+            chunk, tasks, metadata = pending[worker_result.id]
+            result = worker_result.result
+            if result.err is not None:
+                raise Exception('Failed to embed metadata with error: %s\n%s' % (result.err, result.traceback))
+            commit(cache, tasks, result.value, report_error)
+            del pending[worker_result.id]
+            done = progress(done, chunk, metadata)
+    finally:
+        pool.shutdown(), pool.join()
+        # Remove the rewritten files of jobs that were never committed
+        for chunk, tasks, metadata in pending.itervalues():
+            for t in tasks:
+                safe_remove(t[2] + TEMP_SUFFIX)
@@ -70,7 +70,8 @@ class LibraryDatabase(object):
 
     def __init__(self, library_path,
             default_prefs=None, read_only=False, is_second_db=False,
-            progress_callback=lambda x, y:True, restore_all_prefs=False):
+            progress_callback=lambda x, y:True, restore_all_prefs=False, lazy_tables=False,
+            compact_tables=False):
 
         self.is_second_db = is_second_db
         self.listeners = set()
@@ -79,7 +80,7 @@ class LibraryDatabase(object):
                     read_only=read_only, restore_all_prefs=restore_all_prefs,
                     progress_callback=progress_callback,
                     load_user_formatter_functions=not is_second_db)
-        cache = self.new_api = Cache(backend)
+        cache = self.new_api = Cache(backend, lazy_tables=lazy_tables, compact_tables=compact_tables)
         cache.init()
         self.data = View(cache)
         self.id = self.data.index_to_id
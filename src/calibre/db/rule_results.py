@@ -0,0 +1,230 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+'''
+Precomputed results of the column coloring and icon rules of the book list.
+Evaluating the templates of the rules is too slow to do while the cells of
+the book list are painted, so the results for all books are computed by a
+background thread and stored in compact arrays, one per column, indexed by
+book id. The cache calls :meth:`RuleResults.invalidate` when books change and
+their results are computed again, by the thread or when they are displayed.
+'''
+
+from array import array
+from collections import OrderedDict
+from threading import Event, Lock, Thread, local
+
+from calibre.ebooks.metadata.book.formatter import SafeFormat
+
+BATCH_SIZE = 100
+# The arrays store indices into the list of distinct results
+NOT_COMPUTED, NO_RESULT = 0, 1
+
+
+def normalize_rules(rules):
+    return tuple(tuple(rule) for rule in rules)
+
+
+def rule_targets(color_rules, icon_rules):
+    ''' Map what the rules set, the color of a column or of the row, the icons
+    shown instead of the value of a column and the icons shown along with it,
+    to the rules that set it, in order. '''
+    ans = OrderedDict()
+    for key, fmt in color_rules:
+        ans.setdefault(('color', key), []).append(('color', fmt))
+    for kind, key, fmt in icon_rules:
+        if kind in ('icon_only', 'icon_only_composed'):
+            ans.setdefault(('icon_only', key), []).append((kind, fmt))
+        if kind.startswith('icon'):
+            ans.setdefault(('icon', key), []).append((kind, fmt))
+    return ans
+
+
+class RuleResults(object):
+
+    '''
+    The results of the rules for all books. Use :meth:`result` to get the
+    result for a target from :func:`rule_targets` and a book. The result of
+    color rules is the first result that is_valid_color accepts and that of
+    icon rules the names of the icons joined by colons.
+    '''
+
+    def __init__(self, color_rules, icon_rules, is_valid_color=bool):
+        self.color_rules, self.icon_rules = normalize_rules(color_rules), normalize_rules(icon_rules)
+        self.is_valid_color = is_valid_color
+        self.targets = tuple(rule_targets(self.color_rules, self.icon_rules).iteritems())
+        self.icons_with_text = frozenset(key for kind, key, fmt in self.icon_rules if kind in ('icon', 'icon_composed'))
+        self.lock = Lock()
+        self.tls = local()
+        self.clear()
+        self.values, self.value_map = [None, None], {}
+        # Books invalidated while results are being computed must not be
+        # stored, the generations are used to tell them apart
+        self.generation = self.reset_generation = self.computing = 0
+        self.invalidated = {}
+        self.pending, self.shutting_down = Event(), False
+        self.worker = None
+
+    def clear(self):
+        self.arrays = {target: array(b'H') for target, rules in self.targets}
+
+    def rules_changed(self, color_rules, icon_rules):
+        return normalize_rules(color_rules) != self.color_rules or normalize_rules(icon_rules) != self.icon_rules
+
+    # Evaluation {{{
+    def evaluate(self, db, book_id):
+        try:
+            formatter, template_cache = self.tls.formatter, self.tls.template_cache
+        except AttributeError:
+            formatter, template_cache = self.tls.formatter, self.tls.template_cache = SafeFormat(), {}
+        mi = db.get_proxy_metadata(book_id)
+        outputs = {}
+
+        def run(fmt):
+            ans = outputs.get(fmt)
+            if ans is None:
+                ans = outputs[fmt] = formatter.safe_format(fmt, mi, '', mi, column_name=fmt, template_cache=template_cache)
+            return ans
+
+        ans = {}
+        for target, rules in self.targets:
+            result = None
+            if target[0] == 'color':
+                for kind, fmt in rules:
+                    color = run(fmt)
+                    if self.is_valid_color(color):
+                        result = color
+                        break
+            else:
+                icons = []
+                for kind, fmt in rules:
+                    rule_icons = run(fmt)
+                    if not rule_icons:
+                        continue
+                    icon_list = [ic.strip() for ic in rule_icons.split(':')]
+                    icons.extend(icon_list)
+                    if icon_list and not kind.endswith('_composed'):
+                        break
+                result = ':'.join(icons) or None
+            ans[target] = result
+        return ans
+
+    def compute(self, db, book_ids):
+        ''' Compute and store the results for book_ids. Returns a map of book id
+        to the results for that book. '''
+        with self.lock:
+            start = self.generation
+            self.computing += 1
+        ans = {}
+        try:
+            for book_id in book_ids:
+                ans[book_id] = self.evaluate(db, book_id)
+        finally:
+            with self.lock:
+                self.computing -= 1
+                if self.reset_generation <= start:
+                    for book_id, results in ans.iteritems():
+                        if self.invalidated.get(book_id, 0) <= start:
+                            self.store(book_id, results)
+                if not self.computing:
+                    self.invalidated.clear()
+        return ans
+    # }}}
+
+    # Storage {{{
+    def value_index(self, value):
+        if value is None:
+            return NO_RESULT
+        ans = self.value_map.get(value)
+        if ans is None:
+            ans = self.value_map[value] = len(self.values)
+            self.values.append(value)
+            if ans == 0x10000:
+                # Many distinct results, use larger array items
+                self.arrays = {target: array(b'L', arr) for target, arr in self.arrays.iteritems()}
+        return ans
+
+    def store(self, book_id, results):
+        indices = {target: self.value_index(result) for target, result in results.iteritems()}
+        for target, arr in self.arrays.iteritems():
+            if book_id >= len(arr):
+                arr.extend(array(arr.typecode, [NOT_COMPUTED]) * max(book_id + 1 - len(arr), len(arr) // 8))
+            arr[book_id] = indices[target]
+
+    def is_computed(self, book_id):
+        for arr in self.arrays.itervalues():
+            try:
+                return arr[book_id] != NOT_COMPUTED
+            except IndexError:
+                return False
+        return True
+
+    def result(self, db, target, book_id):
+        ''' Return the result for target and book_id, computing the results
+        for the book if they are not known. '''
+        arr = self.arrays.get(target)
+        if arr is None:
+            return None
+        try:
+            idx = arr[book_id]
+        except IndexError:
+            idx = NOT_COMPUTED
+        if idx == NOT_COMPUTED:
+            return self.compute(db, (book_id,))[book_id][target]
+        return self.values[idx]
+
+    def invalidate(self, book_ids=None):
+        with self.lock:
+            self.generation += 1
+            if book_ids is None:
+                self.reset_generation = self.generation
+                self.clear()
+            else:
+                arrays = self.arrays.values()
+                for book_id in book_ids:
+                    for arr in arrays:
+                        if book_id < len(arr):
+                            arr[book_id] = NOT_COMPUTED
+                    if self.computing:
+                        self.invalidated[book_id] = self.generation
+        self.pending.set()
+    # }}}
+
+    # Background computation {{{
+    def start(self, db):
+        ''' Compute the results for all books of db in a thread, till
+        :meth:`shutdown` is called '''
+        if self.targets:
+            self.worker = Thread(target=self.run, args=(db,), name='RuleResults')
+            self.worker.daemon = True
+            self.pending.set()
+            self.worker.start()
+
+    def run(self, db):
+        while True:
+            self.pending.wait()
+            self.pending.clear()
+            if self.shutting_down:
+                break
+            try:
+                book_ids = [book_id for book_id in sorted(db.all_book_ids()) if not self.is_computed(book_id)]
+                for i in xrange(0, len(book_ids), BATCH_SIZE):
+                    if self.shutting_down:
+                        return
+                    self.compute(db, [book_id for book_id in book_ids[i:i+BATCH_SIZE] if not self.is_computed(book_id)])
+            except Exception:
+                if self.shutting_down:
+                    break
+                import traceback
+                traceback.print_exc()
+
+    def shutdown(self):
+        # Do not wait for the thread, it might be waiting for a lock on the
+        # database held by the caller
+        self.shutting_down = True
+        self.pending.set()
+        self.worker = None
+    # }}}
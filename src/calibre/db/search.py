@@ -485,6 +485,63 @@ class Parser(SearchQueryParser):  # {{{
         self.virtual_field_used = False
         return SearchQueryParser.parse(self, *args, **kwargs)
 
+    def estimate_cost(self, location, query):
+        # The cost is relative to checking one value of a one-to-one field
+        # for a single book. Many-one and many-many fields check every value
+        # in the field rather than every candidate, so their cost depends on
+        # the number of distinct values per book.
+        if location == 'vl':
+            return 0.1, 0.5
+        if location == 'search':
+            return 10.0, 0.5
+        if len(location) > 1 and location.startswith('@'):
+            if location[1:] in self.grouped_search_terms:
+                location = location[1:]
+            else:
+                return 20.0, 0.5
+        location = self.field_metadata.search_term_to_field_key(icu_lower(location.strip()))
+        if isinstance(location, list):
+            return sum(self.estimate_cost(loc, query)[0] for loc in location), 0.5
+        if location == 'all':
+            return 50.0, 0.3
+        try:
+            field = self.dbcache.fields[location]
+        except KeyError:
+            if location in self.virtual_fields:
+                # Evaluation of virtual fields can be skipped when there are
+                # no candidates left, mark them as used here so that the
+                # results are not cached
+                self.virtual_field_used = True
+            return 10.0, 0.5
+
+        num_books = max(1, len(self.all_book_ids))
+        dt = field.metadata['datatype']
+        if field.is_many:
+            num_values = len(field.table.id_map)
+            cost = max(0.1, num_values / num_books)
+            with_values = len(field.table.book_col_map) / num_books
+        else:
+            num_values = num_books
+            cost = 1.0
+            with_values = 0.5
+        if field.is_composite:
+            cost *= 20
+        elif dt == 'comments' or location == 'comments':
+            # The builtin comments field has the text datatype
+            cost *= 5
+
+        q = query.lower()
+        if q in ('true', 'false'):
+            return cost, (with_values if q == 'true' else 1 - with_values)
+        if dt in ('datetime', 'rating', 'int', 'float', 'bool') or (field.is_multiple and q[:1] == '#'):
+            return cost, 0.3
+        matchkind, q = _matchkind(query)
+        if matchkind == EQUALS_MATCH:
+            return cost, min(0.5, 1 / max(1, num_values))
+        if matchkind == REGEXP_MATCH:
+            return cost * 8, 0.3
+        return cost * 2, 0.2
+
     def get_matches(self, location, query, candidates=None,
                     allow_recursion=True):
         # If candidates is not None, it must not be modified. Changing its
@@ -867,6 +924,18 @@ class Search(object):
             prefs['limit_search_columns_to'], self.all_search_locations,
             virtual_fields, self.saved_searches.lookup, self.parse_cache)
 
+    def explain(self, dbcache, query, virtual_fields=None, book_ids=None):
+        ''' Run the search for query, without using the cache, and return a
+        description of how it was evaluated. '''
+        if isinstance(query, bytes):
+            query = query.decode('utf-8')
+        sqp = self.create_parser(dbcache, virtual_fields)
+        try:
+            sqp.all_book_ids = dbcache._all_book_ids(type=set) if book_ids is None else book_ids
+            return sqp.explain(query.strip())
+        finally:
+            sqp.dbcache = sqp.lookup_saved_search = None
+
     def __call__(self, dbcache, query, search_restriction, virtual_fields=None, book_ids=None):
         '''
         Return the set of ids of all records that match the specified
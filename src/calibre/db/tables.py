@@ -13,6 +13,7 @@ from collections import defaultdict
 from calibre.constants import plugins
 from calibre.utils.date import parse_date, UNDEFINED_DATE, utc_tz
 from calibre.ebooks.metadata import author_to_author_sort
+from calibre.db.compact import column_map, int_column, interner, link_maps
 
 _c_speedup = plugins['speedup'][0].parse_date
 
@@ -49,6 +50,13 @@ null = object()
 
 class Table(object):
 
+    # Set when reading the data for this table from the db has been deferred
+    # until it is first used, see DB.read_tables()
+    lazy_loader = None
+    # Set to store the data for this table in the compact maps from
+    # calibre.db.compact, see DB.read_tables()
+    compact = False
+
     def __init__(self, name, metadata, link_table=None):
         self.name, self.metadata = name, metadata
         self.sort_alpha = metadata.get('is_multiple', False) and metadata.get('display', {}).get('sort_alpha', False)
@@ -65,6 +73,14 @@ class Table(object):
         self.link_table = (link_table if link_table else
                 'books_%s_link'%self.metadata['table'])
 
+    def __getattr__(self, name):
+        # Only called for attributes that do not exist, such as the data maps
+        # of a table that has not been read yet
+        if self.lazy_loader is None or name.startswith('__'):
+            raise AttributeError(name)
+        self.lazy_loader(self)
+        return object.__getattribute__(self, name)
+
     def remove_books(self, book_ids, db):
         return set()
 
@@ -107,16 +123,21 @@ class OneToOneTable(Table):
             self.metadata['column'], self.metadata['table']))
         if self.unserialize is None:
             try:
-                self.book_col_map = dict(query)
+                self.book_col_map = self.map_from_rows(query, db)
             except UnicodeDecodeError:
                 # The db is damaged, try to work around it by ignoring
                 # failures to decode utf-8
                 query = db.execute('SELECT {0}, cast({1} as blob) FROM {2}'.format(idcol,
                     self.metadata['column'], self.metadata['table']))
-                self.book_col_map = {k:bytes(val).decode('utf-8', 'replace') for k, val in query}
+                self.book_col_map = self.map_from_rows(((k, bytes(val).decode('utf-8', 'replace')) for k, val in query), db)
         else:
             us = self.unserialize
-            self.book_col_map = {book_id:us(val) for book_id, val in query}
+            self.book_col_map = self.map_from_rows(((book_id, us(val)) for book_id, val in query), db)
+
+    def map_from_rows(self, rows, db):
+        if self.compact:
+            return column_map(self.metadata['datatype'], rows, interner(db))
+        return dict(rows)
 
     def remove_books(self, book_ids, db):
         clean = set()
@@ -127,6 +148,89 @@ class OneToOneTable(Table):
         return clean
 
 
+class DBBackedMap(object):
+
+    '''
+    Used in place of the book_col_map of a one-one table whose values are
+    large, such as comments, so that they are never all held in memory. Values
+    are read from the db as needed. Changes to the map are ignored, since the
+    db is always updated as well.
+    '''
+
+    def __init__(self, db, table):
+        self.db, self.unserialize = db, table.unserialize
+        m = table.metadata
+        self.idcol, self.column, self.table = 'id' if m['table'] == 'books' else 'book', m['column'], m['table']
+
+    def query(self, template, *args):
+        try:
+            # Fetch eagerly to catch decoding errors here
+            return self.db.get(template.format(self.idcol, self.column, self.table), *args)
+        except UnicodeDecodeError:
+            # The db is damaged, try to work around it by ignoring failures to
+            # decode utf-8, as OneToOneTable.read() does
+            rows = self.db.get(template.format(self.idcol, 'cast(%s as blob)' % self.column, self.table), *args)
+            return [tuple(bytes(x).decode('utf-8', 'replace') if isinstance(x, buffer) else x for x in row) for row in rows]
+
+    def get(self, book_id, default=None):
+        for val, in self.query('SELECT {1} FROM {2} WHERE {0}=?', (book_id,)):
+            return val if self.unserialize is None else self.unserialize(val)
+        return default
+
+    def __getitem__(self, book_id):
+        ans = self.get(book_id, null)
+        if ans is null:
+            raise KeyError(book_id)
+        return ans
+
+    def __contains__(self, book_id):
+        return self.get(book_id, null) is not null
+
+    def __len__(self):
+        return self.query('SELECT COUNT(*) FROM {2}')[0][0]
+
+    def iterkeys(self):
+        return (book_id for book_id, in self.query('SELECT {0} FROM {2}'))
+    __iter__ = iterkeys
+
+    def iteritems(self):
+        us = self.unserialize
+        rows = self.query('SELECT {0}, {1} FROM {2}')
+        return iter(rows) if us is None else ((book_id, us(val)) for book_id, val in rows)
+
+    def itervalues(self):
+        return (val for book_id, val in self.iteritems())
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def copy(self):
+        return dict(self.iteritems())
+
+    def pop(self, book_id, *args):
+        ans = self.get(book_id, null)
+        if ans is null:
+            if args:
+                return args[0]
+            raise KeyError(book_id)
+        return ans
+
+    def update(self, *args, **kwargs):
+        pass
+
+    def __setitem__(self, book_id, val):
+        pass
+
+    def __delitem__(self, book_id):
+        pass
+
+
 class PathTable(OneToOneTable):
 
     def set_path(self, book_id, path, db):
@@ -141,7 +245,7 @@ class SizeTable(OneToOneTable):
         query = db.execute(
             'SELECT books.id, (SELECT MAX(uncompressed_size) FROM data '
             'WHERE data.book=books.id) FROM books')
-        self.book_col_map = dict(query)
+        self.book_col_map = int_column(query) if self.compact else dict(query)
 
     def update_sizes(self, size_map):
         self.book_col_map.update(size_map)
@@ -207,13 +311,22 @@ class ManyToOneTable(Table):
     def read_id_maps(self, db):
         query = db.execute('SELECT id, {0} FROM {1}'.format(
             self.metadata['column'], self.metadata['table']))
-        if self.unserialize is None:
+        if self.compact:
+            intern, us = interner(db), self.unserialize
+            if us is not None:
+                query = ((item_id, us(val)) for item_id, val in query)
+            self.id_map = {item_id:(intern(val, val) if isinstance(val, unicode) else val) for item_id, val in query}
+        elif self.unserialize is None:
             self.id_map = dict(query)
         else:
             us = self.unserialize
             self.id_map = {book_id:us(val) for book_id, val in query}
 
     def read_maps(self, db):
+        if self.compact:
+            self.book_col_map, self.col_book_map = link_maps(db.execute(
+                'SELECT book, {0} FROM {1}'.format(self.metadata['link_column'], self.link_table)), many_many=False)
+            return
         cbm = self.col_book_map
         bcm = self.book_col_map
         for book, item_id in db.execute(
@@ -372,6 +485,10 @@ class ManyToManyTable(ManyToOneTable):
     do_clean_on_remove = True
 
     def read_maps(self, db):
+        if self.compact:
+            self.book_col_map, self.col_book_map = link_maps(db.execute(
+                self.selectq.format(self.metadata['link_column'], self.link_table)))
+            return
         bcm = defaultdict(list)
         cbm = self.col_book_map
         for book, item_id in db.execute(
@@ -56,11 +56,11 @@ class BaseTest(unittest.TestCase):
         db.conn.close()
         return dest
 
-    def init_cache(self, library_path=None):
+    def init_cache(self, library_path=None, **kwargs):
         from calibre.db.backend import DB
         from calibre.db.cache import Cache
         backend = DB(library_path or self.library_path)
-        cache = Cache(backend)
+        cache = Cache(backend, **kwargs)
         cache.init()
         return cache
 
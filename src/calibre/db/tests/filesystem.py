@@ -170,6 +170,67 @@ class FilesystemTest(BaseTest):
                         self.assertEqual(cache.format(book_id, fmt), ic.format(book_id, fmt))
                         self.assertEqual(cache.format_metadata(book_id, fmt)['mtime'], cache.format_metadata(book_id, fmt)['mtime'])
 
+    def test_incremental_export(self):
+        from calibre.db.cache import import_library
+        from calibre.utils.exim import Exporter, Importer
+        cache = self.init_cache()
+        with TemporaryDirectory('export_lib') as tdir1, TemporaryDirectory('export_lib') as tdir2, \
+                TemporaryDirectory('export_lib') as tdir3, TemporaryDirectory('import_lib') as idir:
+            exporter = Exporter(tdir1)
+            cache.export_library('l', exporter)
+            exporter.commit()
+            cache.add_format(1, 'FMT1', BytesIO(b'changed book1fmt1'), run_hooks=False)
+            exporter = Exporter(tdir2, previous=Importer(tdir1))
+            cache.export_library('l', exporter)
+            exporter.commit()
+            copied = {k for k, v in exporter.file_metadata.iteritems() if len(v) < 6}
+            self.assertEqual(copied, {'6c:::metadata.db', '6c:1:FMT1'})
+            cache.add_format(2, 'FMT1', BytesIO(b'changed book2fmt1'), run_hooks=False)
+            exporter = Exporter(tdir3, previous=Importer(tdir2), verify_digests=True)
+            cache.export_library('l', exporter)
+            exporter.commit()
+            copied = {k for k, v in exporter.file_metadata.iteritems() if len(v) < 6}
+            self.assertEqual(copied, {'6c:::metadata.db', '6c:2:FMT1'})
+            importer = Importer(tdir3)
+            self.assertEqual(len(importer.previous_exports), 2)
+            ic = import_library('l', importer, idir)
+            self.assertFalse(importer.corrupted_files)
+            self.assertEqual(cache.all_book_ids(), ic.all_book_ids())
+            for book_id in cache.all_book_ids():
+                self.assertEqual(cache.cover(book_id), ic.cover(book_id), 'Covers not identical for book: %d' % book_id)
+                for fmt in cache.formats(book_id):
+                    self.assertEqual(cache.format(book_id, fmt), ic.format(book_id, fmt))
+            ic.close()
+
+    def test_mirror_to_disk(self):
+        from calibre.library.save_to_disk import config, mirror_to_disk
+        cache = self.init_cache(self.cloned_library)
+        opts = config().parse()
+        opts.template, opts.update_metadata = '{title}', False
+        with TemporaryDirectory('mirror') as tdir:
+            def saved():
+                return {os.path.relpath(os.path.join(dirpath, f), tdir).replace(os.sep, '/')
+                        for dirpath, dirnames, filenames in os.walk(tdir) for f in filenames} - {'.calibre-mirror.json'}
+
+            def mirror():
+                processed = []
+                mirror_to_disk(cache, cache.all_book_ids(), tdir, opts, callback=lambda *a: processed.append(a[0]) or True, max_workers=0)
+                return saved(), sorted(processed)
+
+            first, processed = mirror()
+            self.assertEqual(processed, [1, 2, 3])
+            # {title} is the title sort, book 1 is Title Two and book 2 is
+            # Title One, with the sort One
+            self.assertTrue({'Title Two.fmt1', 'Title Two.fmt2', 'One.fmt1'}.issubset(first))
+            mtimes = {x:os.path.getmtime(os.path.join(tdir, x)) for x in first}
+            self.assertEqual(mirror()[0], first)
+            self.assertEqual(mtimes, {x:os.path.getmtime(os.path.join(tdir, x)) for x in first})
+            cache.set_field('title', {1: 'Renamed'})
+            cache.remove_books((2,))
+            files = mirror()[0]
+            self.assertIn('Renamed.fmt1', files)
+            self.assertFalse({x for x in files if x.startswith(('One.', 'Title Two.'))})
+
     def test_find_books_in_directory(self):
         from calibre.db.adding import find_books_in_directory, compile_rule
         strip = lambda files: frozenset({os.path.basename(x) for x in files})
@@ -6,7 +6,7 @@ from __future__ import (unicode_literals, division, absolute_import,
 __license__ = 'GPL v3'
 __copyright__ = '2013, Kovid Goyal <kovid at kovidgoyal.net>'
 
-import os, cProfile
+import os, cProfile, time
 from tempfile import gettempdir
 
 from calibre.db.legacy import LibraryDatabase
@@ -40,5 +40,227 @@ def main():
     show_stats(stats)
     print ('Stats saved to', stats)
 
+
+def measure_startup(path, lazy_tables):
+    from calibre.utils.mem import memory
+    before = memory()
+    st = time.time()
+    db = LibraryDatabase(path, lazy_tables=lazy_tables)
+    # What calibredb list --fields title needs
+    cache = db.new_api
+    cache.all_field_for('title', cache.multisort([('title', True)]))
+    taken = time.time() - st
+    ans = taken, memory(before)
+    db.close()
+    return ans
+
+
+def benchmark_startup(path='~/test library'):
+    ''' Compare the startup time and memory usage of reading all tables with
+    reading them lazily, each in a fresh process. Run with:
+    calibre-debug -c "from calibre.db.tests.profiling import benchmark_startup; benchmark_startup()" '''
+    from calibre.utils.ipc.simple_worker import fork_job
+    path = os.path.abspath(os.path.expanduser(path))
+    for lazy_tables in (False, True):
+        taken, mem = fork_job(__name__, 'measure_startup', (path, lazy_tables))['result']
+        print ('%s tables: startup took %.2f seconds and %.1f MB of memory' % (
+            'Lazily read' if lazy_tables else 'Read all', taken, mem))
+
+
+def measure_compact(path, compact_tables):
+    from calibre.utils.mem import memory
+    before = memory()
+    db = LibraryDatabase(path, compact_tables=compact_tables)
+    cache = db.new_api
+    mem = memory(before)
+    book_ids = tuple(cache.all_book_ids())
+    field = cache.fields['tags']
+    item_ids = tuple(field)
+    st = time.time()
+    for book_id in book_ids:
+        field.for_book(book_id)
+    for_book = (time.time() - st) / max(1, len(book_ids))
+    st = time.time()
+    for item_id in item_ids:
+        field.books_for(item_id)
+    books_for = (time.time() - st) / max(1, len(item_ids))
+    st = time.time()
+    cache.search('tags:"=Fiction" or tags:"=History"')
+    search = time.time() - st
+    db.close()
+    return mem, for_book, books_for, search
+
+
+def benchmark_compact(path='~/test library'):
+    ''' Compare the memory used by the in-memory cache and the speed of
+    accessing it, with the data held in dicts and in the compact maps, each in
+    a fresh process. Run with:
+    calibre-debug -c "from calibre.db.tests.profiling import benchmark_compact; benchmark_compact()" '''
+    from calibre.utils.ipc.simple_worker import fork_job
+    path = os.path.abspath(os.path.expanduser(path))
+    for compact_tables in (False, True):
+        mem, for_book, books_for, search = fork_job(__name__, 'measure_compact', (path, compact_tables))['result']
+        print ('%s: %.1f MB of memory, tags for_book: %.2f us, tags books_for: %.2f us, search: %.3f seconds' % (
+            'Compact maps' if compact_tables else 'Dicts', mem, for_book * 1e6, books_for * 1e6, search))
+
+
+def create_synthetic_library(path, num_books, num_authors):
+    ''' Quickly create a library with only titles and authors. Every
+    title is shared by a few books, with different authors. '''
+    from calibre.db.backend import DB
+    backend = DB(path)
+    with backend.conn:
+        backend.executemany('INSERT INTO authors (id, name, sort) VALUES (?, ?, ?)', (
+            (i, 'Author %d Name' % i, 'Name, Author %d' % i) for i in xrange(1, num_authors + 1)))
+        backend.executemany('INSERT INTO books (id, title, author_sort) VALUES (?, ?, ?)', (
+            (i, 'Title number %d' % (i // 3), 'Name, Author %d' % (i % num_authors + 1)) for i in xrange(1, num_books + 1)))
+        backend.executemany('INSERT INTO books_authors_link (book, author) VALUES (?, ?)', (
+            (i, i % num_authors + 1) for i in xrange(1, num_books + 1)))
+    backend.close()
+
+
+def legacy_match_device_books(db, books):
+    ''' Matching as it was done by the GUI, with a cache of the library built
+    with the legacy API '''
+    import re
+    from calibre.ebooks.metadata import authors_to_string
+    string_pat = re.compile(r'(?u)\W|[_]')
+
+    def clean_string(x):
+        x = x.lower() if x else ''
+        return string_pat.sub('', x)
+
+    title_cache, uuid_cache = {}, {}
+    for id_ in db.data.iterallids():
+        title = clean_string(db.title(id_, index_is_id=True))
+        d = title_cache.setdefault(title, {'authors':{}, 'author_sort':{}, 'db_ids':{}})
+        authors = clean_string(db.authors(id_, index_is_id=True))
+        if authors:
+            d['authors'][authors] = id_
+        if db.author_sort(id_, index_is_id=True):
+            d['author_sort'][clean_string(db.author_sort(id_, index_is_id=True))] = id_
+        d['db_ids'][id_] = id_
+        uuid_cache[db.uuid(id_, index_is_id=True)] = id_
+    ans = []
+    for book in books:
+        if book.uuid in uuid_cache:
+            ans.append(uuid_cache[book.uuid])
+            continue
+        d = title_cache.get(clean_string(book.title))
+        book_id = None
+        if d is not None:
+            if book.application_id in d['db_ids']:
+                book_id = book.application_id
+            else:
+                authors = clean_string(authors_to_string(book.authors))
+                book_id = d['authors'].get(authors, d['author_sort'].get(authors))
+        ans.append(book_id)
+    return ans
+
+
+def benchmark_device_matching(num_books=400000, num_device_books=20000):
+    ''' Compare matching the books on a device to the books in a synthetic
+    library, with the legacy API as the GUI used to and with the index in
+    calibre.db.device_matching. Run with:
+    calibre-debug -c "from calibre.db.tests.profiling import benchmark_device_matching; benchmark_device_matching()" '''
+    import shutil
+    from collections import namedtuple
+    from calibre.ptempfile import PersistentTemporaryDirectory
+    Book = namedtuple('Book', 'title authors uuid application_id')
+    path = PersistentTemporaryDirectory('_device_matching')
+    try:
+        st = time.time()
+        create_synthetic_library(path, num_books, num_books // 10)
+        db = LibraryDatabase(path)
+        cache = db.new_api
+        print ('Created a library with %d books in %.1f seconds' % (num_books, time.time() - st))
+        book_ids = sorted(cache.all_book_ids())[::max(1, num_books // num_device_books)][:num_device_books]
+        titles, authors, uuids = (cache.all_field_for(f, book_ids) for f in ('title', 'authors', 'uuid'))
+        # A third of the books are matched by uuid, a third by title and
+        # author and a third are not in the library
+        books = []
+        for i, book_id in enumerate(book_ids):
+            kind = i % 3
+            books.append(Book(titles[book_id] if kind < 2 else 'Not in library %d' % i, list(authors[book_id]),
+                              uuids[book_id] if kind == 0 else None, None))
+        for name, func in (
+                ('Legacy API', lambda: legacy_match_device_books(db, books)),
+                ('Index, first match', lambda: cache.match_device_books(books)),
+                ('Index, no changes', lambda: cache.match_device_books(books)),
+                ('Index, after 100 books changed', lambda: (
+                    cache.device_book_index.invalidate(book_ids[:100]), cache.match_device_books(books)))):
+            st = time.time()
+            func()
+            print ('%s: %.2f seconds' % (name, time.time() - st))
+        db.close()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def benchmark_rule_results(num_books=400000, num_rules=12):
+    ''' Compare evaluating the coloring and icon rules of the book list for
+    every cell, as the GUI used to, with the results computed by
+    calibre.db.rule_results. Run with:
+    calibre-debug -c "from calibre.db.tests.profiling import benchmark_rule_results; benchmark_rule_results()" '''
+    import shutil
+    from calibre.db.rule_results import RuleResults
+    from calibre.ebooks.metadata.book.formatter import SafeFormat
+    from calibre.library.coloring import color_row_key
+    from calibre.ptempfile import PersistentTemporaryDirectory
+    path = PersistentTemporaryDirectory('_rule_results')
+    try:
+        st = time.time()
+        create_synthetic_library(path, num_books, num_books // 10)
+        db = LibraryDatabase(path)
+        cache = db.new_api
+        print ('Created a library with %d books in %.1f seconds' % (num_books, time.time() - st))
+        color_rules, icon_rules = [], []
+        for i in xrange(num_rules):
+            key = ('title', 'authors', color_row_key)[i % 3]
+            color_rules.append((key, "program: contains(field('%s'), '%d', 'red', '')" % (
+                'authors' if key == color_row_key else key, i)))
+            icon_rules.append(('icon', 'authors', "program: contains(field('title'), '%d', 'icon%d.png', '')" % (i, i)))
+        book_ids = sorted(cache.all_book_ids())
+        formatter, template_cache = SafeFormat(), {}
+
+        def legacy():
+            # Every rule of a column is evaluated for each of its cells, here
+            # the title and authors cells of every book
+            for book_id in book_ids:
+                mi = cache.get_proxy_metadata(book_id)
+                for key in ('title', 'authors'):
+                    for k, fmt in color_rules:
+                        if k in (key, color_row_key):
+                            formatter.safe_format(fmt, mi, '', mi, column_name=fmt, template_cache=template_cache)
+                for kind, k, fmt in icon_rules:
+                    formatter.safe_format(fmt, mi, '', mi, column_name=fmt, template_cache=template_cache)
+
+        rr = RuleResults(color_rules, icon_rules)
+        cache.add_rule_cache(rr)
+        targets = [target for target, rules in rr.targets]
+
+        def lookup():
+            for book_id in book_ids:
+                for target in targets:
+                    rr.result(cache, target, book_id)
+
+        def recompute():
+            cache.clear_search_caches(book_ids[:100])
+            rr.compute(cache, [book_id for book_id in book_ids if not rr.is_computed(book_id)])
+
+        for name, func in (
+                ('Legacy, evaluated per cell', legacy),
+                ('Computing all results', lambda: rr.compute(cache, book_ids)),
+                ('Looking up all results', lookup),
+                ('Recomputing after 100 books changed', recompute)):
+            st = time.time()
+            func()
+            taken = time.time() - st
+            print ('%s: %.2f seconds (%d books/second)' % (name, taken, len(book_ids) / max(taken, 1e-6)))
+        cache.remove_rule_cache(rr)
+        db.close()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
 if __name__ == '__main__':
     main()
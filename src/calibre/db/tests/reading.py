@@ -516,6 +516,120 @@ class ReadingTest(BaseTest):
         se({2}, cache.books_in_virtual_library('1', 'id:1 or id:2'))
     # }}}
 
+    def test_search_planning(self):  # {{{
+        ' Test reordering of search terms and explain output '
+        cache = self.init_cache()
+        se = self.assertSetEqual
+        sqp = cache._search_api.create_parser(cache)
+        sqp.all_book_ids = cache._all_book_ids(type=set)
+        plan = sqp.plan(sqp.parser.parse('comments:"~a.+b" and tags:"=Tag One" and title:one', sqp.locations))
+        self.assertEqual(plan[0], 'and')
+        self.assertEqual([x[1] for x in plan[1:]], ['tags', 'title', 'comments'])
+        self.assertGreater(sqp.estimate_cost('comments', 'x')[0], sqp.estimate_cost('title', 'x')[0])
+        plan = sqp.plan(sqp.parser.parse('(a or b) or (c or not d)', sqp.locations))
+        self.assertEqual(plan[0], 'or')
+        self.assertEqual(len(plan), 5)
+        for query, result in {
+            'comments:"~Comments.+Two" and tags:"=Tag One"': {1},
+            'tags:"=Tag One" or comments:~.': {1, 2},
+            'not tags:"=Tag One" and title:unknown': {3},
+            '(title:one or title:two) and (authors:unknown or not authors:unknown)': {1, 2},
+            'tags:=nonexistent and title:one': set(),
+        }.iteritems():
+            se(cache.search(query), result, query)
+        ans = cache.explain_search('tags:=nonexistent and not title:one')
+        self.assertIn('tags:=nonexistent', ans)
+        self.assertIn('not evaluated', ans)
+    # }}}
+
+    def test_lazy_tables(self):  # {{{
+        ' Test reading the tables from the db when they are first used '
+        from calibre.db.tables import DBBackedMap
+        cache = self.init_cache()
+        book_ids = cache.all_book_ids()
+
+        def pending(cache):
+            return {name for name, table in cache.backend.tables.iteritems() if table.lazy_loader is not None}
+
+        for kw in ({}, {'keep_large_text_in_db':True}):
+            lazy = self.init_cache(lazy_tables=True, **kw)
+            self.assertIn('tags', pending(lazy))
+            self.assertEqual(lazy.field_for('title', 1), cache.field_for('title', 1))
+            self.assertNotIn('title', pending(lazy))
+            self.assertIn('tags', pending(lazy))
+            self.assertEqual(lazy.all_book_ids(), book_ids)
+            for field in cache.fields:
+                self.assertEqual({book_id:cache.field_for(field, book_id) for book_id in book_ids},
+                                 {book_id:lazy.field_for(field, book_id) for book_id in book_ids}, field)
+            for query in ('tags:"=Tag One"', 'comments:"~Comments.+Two"', 'title:one or authors:unknown', 'formats:fmt1'):
+                self.assertSetEqual(cache.search(query), lazy.search(query), query)
+            fields = [('series', True), ('timestamp', False), ('title', True)]
+            self.assertEqual(cache.multisort(fields), lazy.multisort(fields))
+            self.assertEqual(cache.get_metadata(1).comments, lazy.get_metadata(1).comments)
+            self.assertEqual(kw.get('keep_large_text_in_db', False), isinstance(lazy.fields['comments'].table.book_col_map, DBBackedMap))
+            lazy.close()
+
+        # Changing anything reads all remaining tables first
+        lazy = self.init_cache(lazy_tables=True, keep_large_text_in_db=True)
+        lazy.set_field('comments', {1:'Changed'})
+        self.assertFalse(pending(lazy))
+        self.assertEqual(lazy.field_for('comments', 1), 'Changed')
+        lazy.set_field('tags', {2:('Lazy tag',)})
+        lazy.reload_from_db()
+        self.assertIn('tags', pending(lazy))
+        self.assertEqual(lazy.field_for('tags', 2), ('Lazy tag',))
+        lazy.remove_books((2,))
+        self.assertNotIn(2, lazy.all_book_ids())
+        self.assertIsNone(lazy.field_for('comments', 2))
+        lazy.close()
+        cache = self.init_cache()
+        self.assertEqual(cache.field_for('comments', 1), 'Changed')
+        self.assertNotIn(2, cache.all_book_ids())
+    # }}}
+
+    def test_compact_tables(self):  # {{{
+        ' Test storing the table data in the compact maps '
+        from calibre.db.compact import ArrayColumn, LinkMap
+        compact_path = self.cloned_library
+        cache, compact = self.init_cache(), self.init_cache(compact_path, compact_tables=True)
+        self.assertIsInstance(compact.fields['tags'].table.book_col_map, LinkMap)
+        self.assertIsInstance(compact.fields['series_index'].table.book_col_map, ArrayColumn)
+
+        def check(cache, compact, exclude=()):
+            book_ids = cache.all_book_ids()
+            self.assertEqual(compact.all_book_ids(), book_ids)
+            for field in cache.fields:
+                if field in exclude:
+                    continue
+                self.assertEqual({book_id:cache.field_for(field, book_id) for book_id in book_ids},
+                                 {book_id:compact.field_for(field, book_id) for book_id in book_ids}, field)
+            for field in ('tags', 'series', 'authors', '#tags', '#series'):
+                for item_id in cache.all_field_ids(field):
+                    self.assertEqual(cache.books_for_field(field, item_id), compact.books_for_field(field, item_id))
+                self.assertEqual(cache.get_usage_count_by_id(field), compact.get_usage_count_by_id(field))
+            for query in ('tags:"=Tag One"', 'series:one', 'title:one or authors:unknown', '#tags:"=My Tag One"'):
+                self.assertSetEqual(cache.search(query), compact.search(query), query)
+            fields = [('series', True), ('timestamp', False), ('title', True)]
+            self.assertEqual(cache.multisort(fields), compact.multisort(fields))
+        check(cache, compact)
+
+        # Changes are made to both representations in the same way, in
+        # separate copies of the library
+        for c in (cache, compact):
+            c.set_field('tags', {1:('Compact tag', 'Tag One'), 2:()})
+            c.set_field('series', {1:'Series One', 3:'A new series'})
+            c.set_field('series_index', {1:7.5})
+            c.set_field('#yesno', {1:False, 2:None})
+            c.rename_items('tags', {c.get_item_id('tags', 'Tag Two'):'Tag One'})
+            c.remove_items('series', (c.get_item_id('series', 'A new series'),))
+            c.remove_books((3,))
+        # The changes were made at different times
+        exclude = ('last_modified',)
+        check(cache, compact, exclude)
+        cache.close(), compact.close()
+        check(self.init_cache(), self.init_cache(compact_path, compact_tables=True), exclude)
+    # }}}
+
     def test_search_caching(self):  # {{{
         ' Test caching of searches '
         from calibre.db.search import LRUCache
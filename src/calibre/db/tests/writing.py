@@ -728,6 +728,136 @@ class WritingTest(BaseTest):
             ae(c.field_for('tags', 3), (t.id_map[lid], t.id_map[norm]))
     # }}}
 
+    def test_match_device_books(self):  # {{{
+        ' Test matching books on a device to the books in the library, as the library changes '
+        from calibre.ebooks.metadata.book.base import Metadata
+        cache = self.init_cache()
+        Book = namedtuple('Book', 'title authors uuid application_id')
+
+        def match(*books):
+            return cache.match_device_books([Book(*b) for b in books])
+
+        self.assertEqual(match(
+            ('Wrong title', [], cache.field_for('uuid', 2), None),
+            ('Title Two', ['Author Two', 'Author One'], None, None),
+            ('title two', ['Two, Author & One, Author'], None, 7),
+            ('Title One', ['Someone'], None, 2),
+            ('Title One', ['Someone'], None, None),
+            ('Not in library', ['Author One'], None, 1),
+        ), [(2, 'UUID'), (1, 'AUTHOR'), (1, 'AUTH_SORT'), (2, 'APP_ID'), (None, None), (None, None)])
+        # Changes that do not affect matching keep the index
+        cache.refresh_ondevice()
+        cache.saved_search_add('x', 'id:1')
+        cache.saved_search_delete('x')
+        cache.set_field('tags', {2:['Changed']})
+        cache.clear_search_caches(())
+        self.assertEqual(cache.device_book_index.dirtied, set())
+        cache.set_field('title', {2:'Changed'})
+        self.assertEqual(cache.device_book_index.dirtied, {2})
+        self.assertEqual(match(('Title One', ['Author One'], None, None), ('Changed', ['Author One'], None, None)),
+                         [(None, None), (2, 'AUTHOR')])
+        book_id = cache.create_book_entry(Metadata('Changed', ['Author One']))
+        self.assertEqual(match(('Changed', ['Author One'], None, None)), [(book_id, 'AUTHOR')])
+        cache.rename_items('authors', {cache.get_item_id('authors', 'Author One'): 'Renamed'})
+        self.assertEqual(match(('Changed', ['Author One'], None, None), ('Changed', ['Renamed'], None, None)),
+                         [(None, None), (book_id, 'AUTHOR')])
+        cache.remove_books((book_id,), permanent=True)
+        self.assertEqual(match(('Changed', ['Renamed'], None, None)), [(2, 'AUTHOR')])
+    # }}}
+
+    def test_rule_results(self):  # {{{
+        ' Test the precomputed results of the coloring and icon rules, as the library changes '
+        from calibre.db.rule_results import RuleResults
+        from calibre.library.coloring import color_row_key
+        cache = self.init_cache()
+        rr = RuleResults(
+            [('title', ''), ('title', '{title}'), (color_row_key, '{publisher}')],
+            [('icon_composed', 'tags', 'a.png'), ('icon', 'tags', '{title}.png'), ('icon_only', 'series', '')])
+        cache.add_rule_cache(rr)
+        self.assertEqual(rr.icons_with_text, {'tags'})
+        self.assertFalse(rr.rules_changed([('title', ''), ('title', '{title}'), (color_row_key, '{publisher}')], rr.icon_rules))
+        self.assertTrue(rr.rules_changed([], rr.icon_rules))
+        book_ids = sorted(cache.all_book_ids())
+        rr.compute(cache, book_ids)
+        for book_id in book_ids:
+            title = cache.field_for('title', book_id)
+            self.assertTrue(rr.is_computed(book_id))
+            self.assertEqual(rr.result(cache, ('color', 'title'), book_id), title)
+            self.assertEqual(rr.result(cache, ('color', color_row_key), book_id), cache.field_for('publisher', book_id))
+            self.assertEqual(rr.result(cache, ('icon', 'tags'), book_id), 'a.png:%s.png' % title)
+            self.assertIsNone(rr.result(cache, ('icon_only', 'series'), book_id))
+            self.assertIsNone(rr.result(cache, ('color', 'authors'), book_id))
+        cache.set_field('title', {2:'Changed'})
+        self.assertFalse(rr.is_computed(2))
+        self.assertTrue(rr.is_computed(1))
+        self.assertEqual(rr.result(cache, ('color', 'title'), 2), 'Changed')
+        self.assertTrue(rr.is_computed(2))
+
+        # Results for books changed while they are computed are not stored
+        class ChangingCache(object):
+
+            def get_proxy_metadata(self, book_id):
+                rr.invalidate((book_id,))
+                return cache.get_proxy_metadata(book_id)
+        rr.invalidate((1,))
+        rr.compute(ChangingCache(), (1,))
+        self.assertFalse(rr.is_computed(1))
+        self.assertEqual(rr.invalidated, {})
+        rr.compute(cache, (1,))
+        self.assertTrue(rr.is_computed(1))
+
+        cache.remove_books((2,), permanent=True)
+        self.assertFalse(rr.is_computed(2))
+        rr.invalidate()
+        self.assertFalse(rr.is_computed(1))
+        rr.start(cache)
+        try:
+            for i in xrange(100):
+                if all(rr.is_computed(book_id) for book_id in cache.all_book_ids()):
+                    break
+                rr.worker.join(0.05)
+            self.assertTrue(all(rr.is_computed(book_id) for book_id in cache.all_book_ids()), 'Results not computed in the background')
+        finally:
+            rr.shutdown()
+        cache.remove_rule_cache(rr)
+        cache.set_field('title', {1:'Changed'})
+        self.assertTrue(rr.is_computed(1))
+    # }}}
+
+    def test_parallel_embed_metadata(self):  # {{{
+        ' Test embedding metadata into the book files of many books with a pool of worker processes '
+        import cPickle, os
+        from calibre.db.embed import MIN_BOOKS_FOR_POOL, TEMP_SUFFIX, serialize_metadata
+        from calibre.ebooks.metadata.book.base import Metadata
+        from calibre.ebooks.metadata.meta import get_metadata
+        cache = self.init_cache()
+        # The metadata of the books must be picklable to be sent to the workers
+        mi = cache.get_metadata(1, get_cover=True, cover_as_data=True)
+        languages = mi.languages
+        cPickle.loads(cPickle.dumps(serialize_metadata(mi), -1))
+        self.assertEqual(mi.languages, languages)
+        with open(P('quick_start/eng.epub'), 'rb') as f:
+            epub = f.read()
+        ids = cache.add_books([(Metadata('Book %d' % i, ['Author %d' % i]), {'EPUB': BytesIO(epub)})
+                              for i in xrange(MIN_BOOKS_FOR_POOL + 1)], run_hooks=False)[0]
+        self.assertGreaterEqual(len(ids), MIN_BOOKS_FOR_POOL)
+        cache.set_field('title', {book_id:'Changed %d' % book_id for book_id in ids})
+        cache.set_field('tags', {book_id:['Tag %d' % book_id, 'Embedded'] for book_id in ids})
+        errors, progress = [], []
+        cache.parallel_embed_metadata(ids, report_error=lambda mi, fmt, tb: errors.append(tb),
+                                      report_progress=lambda done, total, mi: progress.append(done), max_workers=2)
+        self.assertEqual(errors, [])
+        self.assertEqual(progress, list(xrange(1, len(ids) + 1)))
+        for book_id in ids:
+            path = cache.format_abspath(book_id, 'EPUB')
+            self.assertFalse(os.path.exists(path + TEMP_SUFFIX))
+            with open(path, 'rb') as f:
+                fmi = get_metadata(f, 'epub')
+            self.assertEqual(fmi.title, 'Changed %d' % book_id)
+            self.assertEqual(sorted(fmi.tags), ['Embedded', 'Tag %d' % book_id])
+            self.assertEqual(cache.format_metadata(book_id, 'EPUB')['size'], os.path.getsize(path))
+    # }}}
+
     def test_preferences(self):  # {{{
         ' Test getting and setting of preferences, especially with mutable objects '
         cache = self.init_cache()
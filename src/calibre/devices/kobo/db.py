@@ -0,0 +1,163 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+'''
+Batched changes to the database on Kobo devices. Writing to the database over
+USB is slow, so instead of a query, and often a commit, per book, the current
+state of the tables is read with one query, the changes are worked out in
+memory and they are written with one executemany() per kind of change. Use
+them inside a transaction, so that the database is written to only once.
+'''
+
+import time
+
+DEFAULT_DATE_LAST_READ = '1970-01-01T00:00:00'
+MAX_VARIABLES = 500  # SQLite allows at most 999 variables in a statement
+
+
+def chunks(items, size=MAX_VARIABLES):
+    for i in xrange(0, len(items), size):
+        yield items[i:i+size]
+
+
+class DatabaseChanges(object):
+
+    '''
+    The changes made to the database when syncing collections and series.
+    Make the changes with the set_* and remove_* methods, which return
+    whether they changed anything, and write them with :meth:`apply`.
+    '''
+
+    def __init__(self, connection, timestamp_format):
+        self.connection = connection
+        self.timestamp = time.strftime(timestamp_format, time.gmtime())
+        self._read_status = self._shelf_content = None
+        self.read_status = {}
+        self.favourites = set()
+        self.shelf_additions, self.shelf_undeletions, self.shelf_removals = [], [], []
+        self.series = {}
+
+    def query(self, sql, values=()):
+        cursor = self.connection.cursor()
+        try:
+            return list(cursor.execute(sql, values))
+        finally:
+            cursor.close()
+
+    # Current state {{{
+    @property
+    def current_read_status(self):
+        if self._read_status is None:
+            self._read_status = {
+                cid: (status, date or DEFAULT_DATE_LAST_READ) for cid, status, date in self.query(
+                    'SELECT ContentID, ReadStatus, DateLastRead FROM content WHERE BookID IS NULL')}
+        return self._read_status
+
+    @property
+    def current_shelf_content(self):
+        ' A map of ContentID to a map of the shelves it is on to their _IsDeleted values '
+        if self._shelf_content is None:
+            self._shelf_content = ans = {}
+            for shelf, cid, deleted in self.query('SELECT ShelfName, ContentId, _IsDeleted FROM ShelfContent'):
+                ans.setdefault(cid, {})[shelf] = deleted
+        return self._shelf_content
+    # }}}
+
+    def set_readstatus(self, cid, status):
+        current = self.current_read_status
+        current_status, date = current.get(cid, (0, DEFAULT_DATE_LAST_READ))
+        if status == current_status:
+            return False
+        current[cid] = self.read_status[cid] = (status, date)
+        return True
+
+    def set_favouritesindex(self, cid):
+        self.favourites.add(cid)
+        return True
+
+    def set_bookshelf(self, cid, shelf):
+        shelves = self.current_shelf_content.setdefault(cid, {})
+        deleted = shelves.get(shelf)
+        if deleted is None:
+            self.shelf_additions.append((shelf, cid, self.timestamp))
+        elif deleted == 'true':
+            self.shelf_undeletions.append((shelf, cid))
+        else:
+            return False
+        shelves[shelf] = 'false'
+        return True
+
+    def remove_from_bookshelves(self, cid, keep=()):
+        ''' Remove the book from all the shelves it is on, except the shelves in
+        keep. Returns the shelves it was removed from. '''
+        shelves = self.current_shelf_content.get(cid, {})
+        ans = [shelf for shelf in shelves if shelf not in keep]
+        for shelf in ans:
+            del shelves[shelf]
+            self.shelf_removals.append((shelf, cid))
+        return ans
+
+    def set_series(self, cid, series, series_number):
+        self.series[cid] = (series, series_number)
+        return True
+
+    def apply(self):
+        ''' Write the changes made since the last call and return the number of
+        changes written. '''
+        cursor = self.connection.cursor()
+        count = 0
+        try:
+            if self.read_status:
+                cursor.executemany(
+                    "UPDATE content SET ReadStatus=?, FirstTimeReading='false', DateLastRead=? WHERE BookID IS NULL AND ContentID=?",
+                    [(status, date, cid) for cid, (status, date) in self.read_status.iteritems()])
+                count += len(self.read_status)
+            if self.favourites:
+                try:
+                    cursor.executemany(
+                        'UPDATE content SET FavouritesIndex=1 WHERE BookID IS NULL AND ContentID=?', [(cid,) for cid in self.favourites])
+                except Exception as e:
+                    # Older firmware does not have the FavouritesIndex column
+                    if 'no such column' not in str(e):
+                        raise
+                count += len(self.favourites)
+            if self.shelf_additions:
+                cursor.executemany(
+                    "INSERT INTO ShelfContent (ShelfName, ContentId, DateModified, _IsDeleted, _IsSynced) VALUES (?, ?, ?, 'false', 'false')",
+                    self.shelf_additions)
+            if self.shelf_undeletions:
+                cursor.executemany("UPDATE ShelfContent SET _IsDeleted='false' WHERE ShelfName=? AND ContentId=?", self.shelf_undeletions)
+            if self.shelf_removals:
+                cursor.executemany('DELETE FROM ShelfContent WHERE ShelfName=? AND ContentId=?', self.shelf_removals)
+            count += len(self.shelf_additions) + len(self.shelf_undeletions) + len(self.shelf_removals)
+            if self.series:
+                cursor.executemany(
+                    'UPDATE content SET Series=?, SeriesNumber=? WHERE BookID IS NULL AND ContentID=?',
+                    [(series, number, cid) for cid, (series, number) in self.series.iteritems()])
+                count += len(self.series)
+        finally:
+            cursor.close()
+        self.read_status, self.favourites, self.series = {}, set(), {}
+        self.shelf_additions, self.shelf_undeletions, self.shelf_removals = [], [], []
+        return count
+
+
+def set_file_sizes(connection, sizes):
+    ''' Set the file size of the books in sizes, a map of ContentID to size,
+    that are in the database with a different size. Returns the ContentIDs of
+    the books that were changed. '''
+    cursor = connection.cursor()
+    try:
+        current = {}
+        for chunk in chunks(tuple(sizes)):
+            current.update(cursor.execute(
+                'SELECT ContentID, ___FileSize FROM content WHERE ContentType = 6 AND ContentID IN (%s)' % ','.join('?' * len(chunk)), chunk))
+        changed = [cid for cid, size in current.iteritems() if int(size or 0) != sizes[cid]]
+        if changed:
+            cursor.executemany('UPDATE content SET ___FileSize=? WHERE ContentID=? AND ContentType = 6', [(sizes[cid], cid) for cid in changed])
+    finally:
+        cursor.close()
+    return changed
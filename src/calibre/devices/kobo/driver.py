@@ -2024,10 +2024,12 @@ class KOBOTOUCH(KOBO):
 
         if self.dbversion >= 53:
             try:
-                with closing(self.device_database_connection()) as connection:
+                from calibre.devices.kobo.db import set_file_sizes
+                with closing(self.device_database_connection()) as connection, connection:
                     cursor = connection.cursor()
                     cleanup_query = "DELETE FROM content WHERE ContentID = ? AND Accessibility = 1 AND IsDownloaded = 'false'"
 
+                    cleanup_values, sizes = [], {}
                     for fname, cycle in result:
                         show_debug = self.is_debugging_title(fname)
                         contentID = self.contentid_from_path(fname, 6)
@@ -2035,17 +2037,19 @@ class KOBOTOUCH(KOBO):
                             debug_print('KoboTouch:upload_books: fname=', fname)
                             debug_print('KoboTouch:upload_books: contentID=', contentID)
 
-                        cleanup_values = (contentID,)
-#                        debug_print('KoboTouch:upload_books: Delete record left if deleted on Touch')
-                        cursor.execute(cleanup_query, cleanup_values)
-
-                        self.set_filesize_in_device_database(connection, contentID, fname)
+                        cleanup_values.append((contentID,))
+                        if os.path.exists(fname):
+                            sizes[contentID] = os.stat(self.normalize_path(fname)).st_size
 
                         if not self.upload_covers:
                             imageID = self.imageid_from_contentid(contentID)
                             self.delete_images(imageID, fname)
 
+#                    debug_print('KoboTouch:upload_books: Delete records left if deleted on Touch')
+                    cursor.executemany(cleanup_query, cleanup_values)
                     cursor.close()
+                    updated = set_file_sizes(connection, sizes)
+                    debug_print('KoboTouch:upload_books - file sizes updated=%d' % len(updated))
             except Exception as e:
                 debug_print('KoboTouch:upload_books - Exception:  %s'%str(e))
 
@@ -2313,7 +2317,11 @@ class KOBOTOUCH(KOBO):
         # the last book from the collection the list of books is empty
         # and the removal of the last book would not occur
 
-        with closing(self.device_database_connection()) as connection:
+        # All the changes are made in a single transaction, with the changes
+        # for the books batched, see calibre.devices.kobo.db
+        from calibre.devices.kobo.db import DatabaseChanges
+        with closing(self.device_database_connection()) as connection, connection:
+            changes = DatabaseChanges(connection, self.TIMESTAMP_STRING)
 
             if self.manage_collections:
                 if collections:
@@ -2367,12 +2375,12 @@ class KOBOTOUCH(KOBO):
                                 if category not in book.device_collections:
                                     if show_debug:
                                         debug_print('        Setting bookshelf on device')
-                                    self.set_bookshelf(connection, book, category)
+                                    self.set_bookshelf(changes, book, category)
                                     category_added = True
                             elif category in readstatuslist.keys():
                                 debug_print("KoboTouch:update_device_database_collections - about to set_readstatus - category='%s'"%(category, ))
                                 # Manage ReadStatus
-                                self.set_readstatus(connection, book.contentID, readstatuslist.get(category))
+                                changes.set_readstatus(book.contentID, readstatuslist.get(category))
                                 category_added = True
 
                             elif category == 'Shortlist' and self.dbversion >= 14:
@@ -2382,7 +2390,7 @@ class KOBOTOUCH(KOBO):
                                 if not self.supports_bookshelves:
                                     if show_debug:
                                         debug_print('            and about to set it - %s'%book.title)
-                                    self.set_favouritesindex(connection, book.contentID)
+                                    changes.set_favouritesindex(book.contentID)
                                     category_added = True
                             elif category in accessibilitylist.keys():
                                 # Do not manage the Accessibility List
@@ -2419,12 +2427,14 @@ class KOBOTOUCH(KOBO):
                         if show_debug:
                             debug_print("KoboTouch:update_device_database_collections - book.title=%s" % book.title)
                         if update_series_details:
-                            self.set_series(connection, book)
+                            self.set_series(changes, book)
                         if self.manage_collections and bookshelf_attribute:
                             if show_debug:
                                 debug_print("KoboTouch:update_device_database_collections - about to remove a book from shelves book.title=%s" % book.title)
-                            self.remove_book_from_device_bookshelves(connection, book)
+                            self.remove_book_from_device_bookshelves(changes, book)
                             book.device_collections.extend(book.kobo_collections)
+                n = changes.apply()
+                debug_print("KoboTouch:update_device_database_collections - changes written=%d" % n)
                 if not prefs['manage_device_metadata'] == 'manual' and delete_empty_collections:
                     debug_print("KoboTouch:update_device_database_collections - about to clear empty bookshelves")
                     self.delete_empty_bookshelves(connection)
@@ -2432,6 +2442,8 @@ class KOBOTOUCH(KOBO):
 
                 self.dump_bookshelves(connection)
 
+            changes.apply()
+
         debug_print('KoboTouch:update_device_database_collections - Finished ')
 
     def rebuild_collections(self, booklist, oncard):
@@ -2606,7 +2618,7 @@ class KOBOTOUCH(KOBO):
             debug_print("KoboTouch:_upload_cover - Exception string: %s"%err)
             raise
 
-    def remove_book_from_device_bookshelves(self, connection, book):
+    def remove_book_from_device_bookshelves(self, changes, book):
         show_debug = self.is_debugging_title(book.title)  # or True
 
         remove_shelf_list = set(book.current_shelves) - set(book.device_collections)
@@ -2622,63 +2634,9 @@ class KOBOTOUCH(KOBO):
         if len(remove_shelf_list) == 0:
             return
 
-        query = 'DELETE FROM ShelfContent WHERE ContentId = ?'
-
-        values = [book.contentID,]
-
-        if book.device_collections:
-            placeholder = '?'
-            placeholders = ','.join(placeholder for unused in book.device_collections)
-            query += ' and ShelfName not in (%s)' % placeholders
-            values.extend(book.device_collections)
-
-        if show_debug:
-            debug_print('KoboTouch:remove_book_from_device_bookshelves query="%s"'%query)
-            debug_print('KoboTouch:remove_book_from_device_bookshelves values="%s"'%values)
-
-        cursor = connection.cursor()
-        cursor.execute(query, values)
-        cursor.close()
-
-    def set_filesize_in_device_database(self, connection, contentID, fpath):
-        show_debug = self.is_debugging_title(fpath)
+        removed = changes.remove_from_bookshelves(book.contentID, keep=frozenset(book.device_collections))
         if show_debug:
-            debug_print('KoboTouch:set_filesize_in_device_database contentID="%s"'%contentID)
-
-        test_query = 'SELECT ___FileSize '     \
-                        'FROM content '        \
-                        'WHERE ContentID = ? ' \
-                        ' AND ContentType = 6'
-        test_values = (contentID, )
-
-        updatequery = 'UPDATE content '         \
-                        'SET ___FileSize = ? '  \
-                        'WHERE ContentId = ? '  \
-                        'AND ContentType = 6'
-
-        cursor = connection.cursor()
-        cursor.execute(test_query, test_values)
-        try:
-            result = cursor.next()
-        except StopIteration:
-            result = None
-
-        if result is None:
-            if show_debug:
-                debug_print('        Did not find a record - new book on device')
-        elif os.path.exists(fpath):
-            file_size = os.stat(self.normalize_path(fpath)).st_size
-            if show_debug:
-                debug_print('        Found a record - will update - ___FileSize=', result[0], ' file_size=', file_size)
-            if file_size != int(result[0]):
-                update_values = (file_size, contentID, )
-                cursor.execute(updatequery, update_values)
-                if show_debug:
-                    debug_print('        Size updated.')
-
-        cursor.close()
-
-#        debug_print("KoboTouch:set_filesize_in_device_database - end")
+            debug_print('KoboTouch:remove_book_from_device_bookshelves removed from shelves=', removed)
 
     def delete_empty_bookshelves(self, connection):
         debug_print("KoboTouch:delete_empty_bookshelves - start")
@@ -2746,7 +2704,7 @@ class KOBOTOUCH(KOBO):
 
         return bookshelves
 
-    def set_bookshelf(self, connection, book, shelfName):
+    def set_bookshelf(self, changes, book, shelfName):
         show_debug = self.is_debugging_title(book.title)
         if show_debug:
             debug_print('KoboTouch:set_bookshelf book.ContentID="%s"'%book.contentID)
@@ -2757,30 +2715,9 @@ class KOBOTOUCH(KOBO):
                 debug_print('        book already on shelf.')
             return
 
-        test_query = 'SELECT _IsDeleted FROM ShelfContent WHERE ShelfName = ? and ContentId = ?'
-        test_values = (shelfName, book.contentID, )
-        addquery = 'INSERT INTO ShelfContent ("ShelfName","ContentId","DateModified","_IsDeleted","_IsSynced") VALUES (?, ?, ?, "false", "false")'
-        add_values = (shelfName, book.contentID, time.strftime(self.TIMESTAMP_STRING, time.gmtime()), )
-        updatequery = 'UPDATE ShelfContent SET _IsDeleted = "false" WHERE ShelfName = ? and ContentId = ?'
-        update_values = (shelfName, book.contentID, )
-
-        cursor = connection.cursor()
-        cursor.execute(test_query, test_values)
-        try:
-            result = cursor.next()
-        except StopIteration:
-            result = None
-
-        if result is None:
-            if show_debug:
-                debug_print('        Did not find a record - adding')
-            cursor.execute(addquery, add_values)
-        elif result[0] == 'true':
-            if show_debug:
-                debug_print('        Found a record - updating - result=', result)
-            cursor.execute(updatequery, update_values)
-
-        cursor.close()
+        changed = changes.set_bookshelf(book.contentID, shelfName)
+        if show_debug:
+            debug_print('        Adding or undeleting record' if changed else '        Found a record')
 
 #        debug_print("KoboTouch:set_bookshelf - end")
 
@@ -2864,7 +2801,7 @@ class KOBOTOUCH(KOBO):
 
         debug_print("KoboTouch:remove_from_bookshelf - end")
 
-    def set_series(self, connection, book):
+    def set_series(self, changes, book):
         show_debug = self.is_debugging_title(book.title)
         if show_debug:
             debug_print('KoboTouch:set_series book.kobo_series="%s"'%book.kobo_series)
@@ -2883,25 +2820,17 @@ class KOBOTOUCH(KOBO):
                     debug_print('KoboTouch:set_series - series info the same - not changing')
                 return
 
-        update_query = 'UPDATE content SET Series=?, SeriesNumber==? where BookID is Null and ContentID = ?'
         if book.series is None:
-            update_values = (None, None, book.contentID, )
+            update_values = (None, None, )
         elif book.series_index is None:         # This should never happen, but...
-            update_values = (book.series, None, book.contentID, )
+            update_values = (book.series, None, )
         else:
-            update_values = (book.series, "%g"%book.series_index, book.contentID, )
+            update_values = (book.series, "%g"%book.series_index, )
 
-        cursor = connection.cursor()
-        try:
-            if show_debug:
-                debug_print('KoboTouch:set_series - about to set - parameters:', update_values)
-            cursor.execute(update_query, update_values)
-            self.series_set += 1
-        except:
-            debug_print('    Database Exception:  Unable to set series info')
-            raise
-        finally:
-            cursor.close()
+        if show_debug:
+            debug_print('KoboTouch:set_series - about to set - parameters:', update_values)
+        changes.set_series(book.contentID, *update_values)
+        self.series_set += 1
 
         if show_debug:
             debug_print("KoboTouch:set_series - end")
@@ -0,0 +1,82 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import unittest
+
+import apsw
+
+from calibre.devices.kobo.db import DatabaseChanges, set_file_sizes
+
+# The parts of the schema of KoboReader.sqlite used when syncing
+SCHEMA = '''
+CREATE TABLE content (
+    ContentID TEXT NOT NULL, ContentType TEXT NOT NULL, BookID TEXT,
+    ReadStatus INTEGER DEFAULT 0, FirstTimeReading BOOL DEFAULT true, DateLastRead TEXT,
+    FavouritesIndex INTEGER DEFAULT -1, Series TEXT, SeriesNumber TEXT, ___FileSize INT,
+    PRIMARY KEY (ContentID, ContentType));
+CREATE TABLE ShelfContent (
+    ShelfName TEXT, ContentId TEXT, DateModified TEXT, _IsDeleted BOOL, _IsSynced BOOL,
+    PRIMARY KEY (ShelfName, ContentId));
+'''
+
+
+def book_id(i):
+    return 'file:///mnt/onboard/book%d.epub' % i
+
+
+class KoboDatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = conn = apsw.Connection(':memory:')
+        c = conn.cursor()
+        c.execute(SCHEMA)
+        c.executemany(
+            "INSERT INTO content (ContentID, ContentType, ReadStatus, DateLastRead, ___FileSize) VALUES (?, 6, ?, ?, 100)",
+            [(book_id(i), i % 3, '2017-01-0%dT00:00:00' % (i + 1) if i else None) for i in range(5)])
+        c.executemany(
+            "INSERT INTO ShelfContent VALUES (?, ?, '2017-01-01T00:00:00Z', ?, 'true')",
+            [('Fiction', book_id(0), 'false'), ('Fiction', book_id(1), 'true'), ('Old', book_id(0), 'false')])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def query(self, sql):
+        return list(self.conn.cursor().execute(sql))
+
+    def test_database_changes(self):
+        changes = DatabaseChanges(self.conn, '%Y-%m-%dT%H:%M:%SZ')
+        self.assertFalse(changes.set_readstatus(book_id(1), 1))
+        self.assertTrue(changes.set_readstatus(book_id(0), 2))
+        self.assertTrue(changes.set_readstatus(book_id(0), 1))
+        self.assertFalse(changes.set_bookshelf(book_id(0), 'Fiction'))
+        self.assertTrue(changes.set_bookshelf(book_id(1), 'Fiction'))
+        self.assertTrue(changes.set_bookshelf(book_id(2), 'Fiction'))
+        self.assertEqual(changes.remove_from_bookshelves(book_id(0), keep={'Fiction'}), ['Old'])
+        self.assertEqual(changes.remove_from_bookshelves(book_id(2)), ['Fiction'])
+        self.assertTrue(changes.set_series(book_id(3), 'Series', '2'))
+        with self.conn:
+            self.assertEqual(changes.apply(), 6)
+        self.assertEqual(changes.apply(), 0)
+
+        self.assertEqual(self.query("SELECT ReadStatus, FirstTimeReading, DateLastRead FROM content WHERE ContentID='%s'" % book_id(0)),
+                         [(1, 'false', '1970-01-01T00:00:00')])
+        self.assertEqual(self.query('SELECT ShelfName, ContentId, _IsDeleted FROM ShelfContent ORDER BY ContentId'),
+                         [('Fiction', book_id(0), 'false'), ('Fiction', book_id(1), 'false')])
+        self.assertEqual(self.query('SELECT ContentID FROM content WHERE Series IS NOT NULL'), [(book_id(3),)])
+
+    def test_file_sizes(self):
+        with self.conn:
+            changed = set_file_sizes(self.conn, {book_id(0): 100, book_id(1): 200, book_id(9): 300})
+        self.assertEqual(changed, [book_id(1)])
+        self.assertEqual(self.query('SELECT ContentID FROM content WHERE ___FileSize = 200'), [(book_id(1),)])
+
+
+def find_tests():
+    return unittest.defaultTestLoader.loadTestsFromTestCase(KoboDatabaseTest)
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=4).run(find_tests())
@@ -9,7 +9,6 @@ Created on 29 Jun 2012
 '''
 import socket, select, json, os, traceback, time, sys, random
 import posixpath
-from collections import defaultdict
 import hashlib, threading
 import Queue
 
@@ -22,6 +21,7 @@ from calibre.constants import numeric_version, DEBUG, cache_dir
 from calibre.devices.errors import (OpenFailed, OpenFeedback, ControlError, TimeoutError,
                                     InitialConnectionError, PacketError)
 from calibre.devices.interface import DevicePlugin, currently_connected_device
+from calibre.devices.smart_device_app.metadata_cache import MetadataCache
 from calibre.devices.usbms.books import Book, CollectionsBookList
 from calibre.devices.usbms.deviceconfig import DeviceConfig
 from calibre.devices.usbms.driver import USBMS
@@ -225,6 +225,9 @@ class SMART_DEVICE_APP(DeviceConfig, DevicePlugin):
     PROTOCOL_VERSION            = 1
     MAX_CLIENT_COMM_TIMEOUT     = 300.0  # Wait at most N seconds for an answer
     MAX_UNSUCCESSFUL_CONNECTS   = 5
+    # Books per message when the client can exchange metadata in batches
+    METADATA_BATCH_SIZE         = 100
+    METADATA_COMPRESSIONS       = ['zlib']
 
     SEND_NOOP_EVERY_NTH_PROBE   = 5
     DISCONNECT_AFTER_N_SECONDS  = 30*60  # 30 minutes
@@ -264,6 +267,7 @@ class SMART_DEVICE_APP(DeviceConfig, DevicePlugin):
         'SET_CALIBRE_DEVICE_INFO': 1,
         'SET_CALIBRE_DEVICE_NAME': 2,
         'TOTAL_SPACE'            : 4,
+        'BOOK_METADATA_BATCH'    : 20,
     }
     reverse_opcodes = dict([(v, k) for k,v in opcodes.iteritems()])
 
@@ -541,20 +545,65 @@ class SMART_DEVICE_APP(DeviceConfig, DevicePlugin):
         res = {}
         for k,v in arg.iteritems():
             if isinstance(v, (Book, Metadata)):
-                res[k] = self.json_codec.encode_book_metadata(v)
-                series = v.get('series', None)
-                if series:
-                    tsorder = tweaks['save_template_title_series_sorting']
-                    series = title_sort(series, order=tsorder)
-                else:
-                    series = ''
-                self._debug('series sort = ', series)
-                res[k]['_series_sort_'] = series
+                res[k] = self._encode_book(v)
             else:
                 res[k] = v
         from calibre.utils.config import to_json
         return json.dumps([op, res], encoding='utf-8', default=to_json)
 
+    def _encode_book(self, book):
+        ans = self.json_codec.encode_book_metadata(book)
+        series = book.get('series', None)
+        if series:
+            tsorder = tweaks['save_template_title_series_sorting']
+            series = title_sort(series, order=tsorder)
+        else:
+            series = ''
+        ans['_series_sort_'] = series
+        return ans
+
+    # Metadata batches. Clients that say they can, exchange the metadata for
+    # many books in a single BOOK_METADATA_BATCH message, instead of one
+    # message per book. The books in a batch are a list, or that list as
+    # compressed JSON, encoded in base64, if a compression was negotiated.
+
+    def _encode_metadata_batch(self, books, **extra):
+        books = [self._encode_book(b) if isinstance(b, (Book, Metadata)) else b for b in books]
+        if self.metadata_compression == 'zlib':
+            import zlib
+            from base64 import standard_b64encode
+            from calibre.utils.config import to_json
+            books = standard_b64encode(zlib.compress(json.dumps(books, encoding='utf-8', default=to_json), 6))
+            extra['compression'] = 'zlib'
+        extra['books'] = books
+        return extra
+
+    def _decode_metadata_batch(self, arg):
+        books = arg['books']
+        compression = arg.get('compression')
+        if compression == 'zlib':
+            import zlib
+            from base64 import standard_b64decode
+            from calibre.utils.config import from_json
+            books = json.loads(zlib.decompress(standard_b64decode(books)), object_hook=from_json)
+        elif compression:
+            raise PacketError('Unknown compression for metadata: %r' % compression)
+        return books
+
+    def _receive_book_records(self, count):
+        ''' Yield the count (opcode, result) pairs the client sends for books,
+        one per book, whether the client sends them in batches or not '''
+        received = 0
+        while received < count:
+            opcode, result = self._receive_from_client(print_debug_info=False)
+            if opcode == 'BOOK_METADATA_BATCH':
+                for r in self._decode_metadata_batch(result):
+                    received += 1
+                    yield 'OK', r
+            else:
+                received += 1
+                yield opcode, result
+
     # Network functions
 
     def _read_binary_from_net(self, length):
@@ -731,7 +780,7 @@ class SMART_DEVICE_APP(DeviceConfig, DevicePlugin):
                     return None
                 lastmod = parse_date(lastmod)
             if key in self.device_book_cache and self.device_book_cache[key]['book'].last_modified == lastmod:
-                self.device_book_cache[key]['last_used'] = now()
+                self.device_book_cache.touch(key, now())
                 return self.device_book_cache[key]['book'].deepcopy(lambda : SDBook('', ''))
         except:
             traceback.print_exc()
@@ -769,7 +818,6 @@ class SMART_DEVICE_APP(DeviceConfig, DevicePlugin):
 
     def _read_metadata_cache(self):
         self._debug('device uuid', self.device_uuid)
-        from calibre.utils.config import from_json
         try:
             old_cache_file_name = os.path.join(cache_dir(),
                            'device_drivers_' + self.__class__.__name__ +
@@ -791,65 +839,21 @@ class SMART_DEVICE_APP(DeviceConfig, DevicePlugin):
         cache_file_name = os.path.join(cache_dir(),
                            'wireless_device_' + self.device_uuid +
                                 '_metadata_cache.json')
-        self.device_book_cache = defaultdict(dict)
+        self.device_book_cache = MetadataCache(cache_file_name)
+        self.device_book_cache.read(lambda raw: self.json_codec.raw_to_book(raw, SDBook, self.PREFIX))
         self.known_metadata = {}
-        try:
-            count = 0
-            if os.path.exists(cache_file_name):
-                with lopen(cache_file_name, mode='rb') as fd:
-                    while True:
-                        rec_len = fd.readline()
-                        if len(rec_len) != 8:
-                            break
-                        raw = fd.read(int(rec_len))
-                        book = json.loads(raw.decode('utf-8'), object_hook=from_json)
-                        key = book.keys()[0]
-                        metadata = self.json_codec.raw_to_book(book[key]['book'],
-                                                            SDBook, self.PREFIX)
-                        book[key]['book'] = metadata
-                        self.device_book_cache.update(book)
-
-                        lpath = metadata.get('lpath')
-                        self.known_metadata[lpath] = metadata
-                        count += 1
-            self._debug('loaded', count, 'cache items')
-        except:
-            traceback.print_exc()
-            self.device_book_cache = defaultdict(dict)
-            self.known_metadata = {}
-            try:
-                if os.path.exists(cache_file_name):
-                    os.remove(cache_file_name)
-            except:
-                traceback.print_exc()
+        for entry in self.device_book_cache.itervalues():
+            metadata = entry['book']
+            self.known_metadata[metadata.get('lpath')] = metadata
+        self._debug('loaded', len(self.device_book_cache), 'cache items')
 
     def _write_metadata_cache(self):
         self._debug()
         from calibre.utils.date import now
-        now_ = now()
-        from calibre.utils.config import to_json
         try:
-            purged = 0
-            count = 0
-            prefix = os.path.join(cache_dir(),
-                        'wireless_device_' + self.device_uuid + '_metadata_cache')
-            with lopen(prefix + '.tmp', mode='wb') as fd:
-                for key,book in self.device_book_cache.iteritems():
-                    if (now_ - book['last_used']).days > self.PURGE_CACHE_ENTRIES_DAYS:
-                        purged += 1
-                        continue
-                    json_metadata = defaultdict(dict)
-                    json_metadata[key]['book'] = self.json_codec.encode_book_metadata(book['book'])
-                    json_metadata[key]['last_used'] = book['last_used']
-                    result = json.dumps(json_metadata, indent=2, default=to_json)
-                    fd.write("%0.7d\n"%(len(result)+1))
-                    fd.write(result)
-                    fd.write('\n')
-                    count += 1
+            purged = self.device_book_cache.purge(now(), self.PURGE_CACHE_ENTRIES_DAYS)
+            count = self.device_book_cache.write(self.json_codec.encode_book_metadata)
             self._debug('wrote', count, 'entries, purged', purged, 'entries')
-
-            from calibre.utils.filenames import atomic_rename
-            atomic_rename(fd.name, prefix + '.json')
         except:
             traceback.print_exc()
 
@@ -884,8 +888,7 @@ class SMART_DEVICE_APP(DeviceConfig, DevicePlugin):
             new_book = book.deepcopy()
             self.known_metadata[lpath] = new_book
             if key:
-                self.device_book_cache[key]['book'] = new_book
-                self.device_book_cache[key]['last_used'] = now()
+                self.device_book_cache[key] = {'book': new_book, 'last_used': now()}
 
     # Force close a socket. The shutdown permits the close even if data transfer
     # is in progress
@@ -1048,7 +1051,9 @@ class SMART_DEVICE_APP(DeviceConfig, DevicePlugin):
                     'lastModifiedFormat': tweaks['gui_last_modified_display_format'],
                     'calibre_version': numeric_version,
                     'canSupportUpdateBooks': True,
-                    'canSupportLpathChanges': True})
+                    'canSupportLpathChanges': True,
+                    'canSupportMetadataBatches': True,
+                    'metadataCompressions': self.METADATA_COMPRESSIONS})
             if opcode != 'OK':
                 # Something wrong with the return. Close the socket
                 # and continue.
@@ -1100,6 +1105,12 @@ class SMART_DEVICE_APP(DeviceConfig, DevicePlugin):
                                     result.get('setTempMarkWhenReadInfoSynced', False)
             self._debug('Will set temp mark when syncing read',
                                     self.set_temp_mark_when_syncing_read)
+            self.client_batches_metadata = result.get('willBatchMetadata', False)
+            self._debug('Will batch metadata', self.client_batches_metadata)
+            self.metadata_compression = result.get('metadataCompression', None)
+            if self.metadata_compression not in self.METADATA_COMPRESSIONS:
+                self.metadata_compression = None
+            self._debug('Metadata compression', self.metadata_compression)
 
             if not self.settings().extra_customization[self.OPT_USE_METADATA_CACHE]:
                 self.client_can_use_metadata_cache = False
@@ -1290,8 +1301,7 @@ class SMART_DEVICE_APP(DeviceConfig, DevicePlugin):
             if will_use_cache:
                 books_on_device = []
                 self._debug('caching. count=', count)
-                for i in range(0, count):
-                    opcode, result = self._receive_from_client(print_debug_info=False)
+                for opcode, result in self._receive_book_records(count):
                     books_on_device.append(result)
 
                 self._debug('received all books. count=', count)
@@ -1337,16 +1347,19 @@ class SMART_DEVICE_APP(DeviceConfig, DevicePlugin):
                 count = len(books_to_send)
                 self._debug('caching. Need count from device', count)
 
-                self._call_client('NOOP', {'count': count},
-                                  print_debug_info=False, wait_for_response=False)
-                for priKey in books_to_send:
-                    self._call_client('NOOP', {'priKey':priKey},
-                                  print_debug_info=False, wait_for_response=False)
+                if self.client_batches_metadata:
+                    self._call_client('NOOP', {'count': count, 'priKeys': books_to_send},
+                                      print_debug_info=False, wait_for_response=False)
+                else:
+                    self._call_client('NOOP', {'count': count},
+                                      print_debug_info=False, wait_for_response=False)
+                    for priKey in books_to_send:
+                        self._call_client('NOOP', {'priKey':priKey},
+                                      print_debug_info=False, wait_for_response=False)
 
-            for i in range(0, count):
+            for i, (opcode, result) in enumerate(self._receive_book_records(count)):
                 if (i % 100) == 0:
                     self._debug('getting book metadata. Done', i, 'of', count)
-                opcode, result = self._receive_from_client(print_debug_info=False)
                 if opcode == 'OK':
                     try:
                         if '_series_sort_' in result:
@@ -1407,22 +1420,35 @@ class SMART_DEVICE_APP(DeviceConfig, DevicePlugin):
                 books_to_send.append(book)
 
         count = len(books_to_send)
+        supports_sync = bool(self.is_read_sync_col) or bool(self.is_read_date_sync_col)
         self._call_client('SEND_BOOKLISTS', {'count': count,
                      'collections': coldict,
                      'willStreamMetadata': True,
-                     'supportsSync': (bool(self.is_read_sync_col) or
-                                      bool(self.is_read_date_sync_col))},
+                     'supportsSync': supports_sync},
                      wait_for_response=False)
 
         if count:
+            batch = []
             for i,book in enumerate(books_to_send):
-                self._debug('sending metadata for book', book.lpath, book.title)
                 self._set_known_metadata(book)
-                opcode, result = self._call_client(
+                if self.client_batches_metadata:
+                    # The batch is sent once it is full, without waiting for
+                    # the client to process the previous one
+                    batch.append(self._encode_book(book))
+                    if len(batch) == self.METADATA_BATCH_SIZE or i + 1 == count:
+                        start = i + 1 - len(batch)
+                        self._debug('sending metadata for books', start, 'to', i)
+                        self._call_client(
+                            'BOOK_METADATA_BATCH', self._encode_metadata_batch(
+                                batch, index=start, count=count, supportsSync=supports_sync),
+                            print_debug_info=False, wait_for_response=False)
+                        batch = []
+                else:
+                    self._debug('sending metadata for book', book.lpath, book.title)
+                    self._call_client(
                         'SEND_BOOK_METADATA',
                         {'index': i, 'count': count, 'data': book,
-                         'supportsSync': (bool(self.is_read_sync_col) or
-                                          bool(self.is_read_date_sync_col))},
+                         'supportsSync': supports_sync},
                         print_debug_info=False,
                         wait_for_response=False)
 
@@ -1855,13 +1881,15 @@ class SMART_DEVICE_APP(DeviceConfig, DevicePlugin):
             self.device_socket = None
             self.json_codec = JsonCodec()
             self.known_metadata = {}
-            self.device_book_cache = defaultdict(dict)
+            self.device_book_cache = MetadataCache(None)
             self.debug_time = time.time()
             self.debug_start_time = time.time()
             self.max_book_packet_len = 0
             self.noop_counter = 0
             self.connection_attempts = {}
             self.client_wants_uuid_file_names = False
+            self.client_batches_metadata = False
+            self.metadata_compression = None
             self.is_read_sync_col = None
             self.is_read_date_sync_col = None
             self.have_checked_sync_columns = False
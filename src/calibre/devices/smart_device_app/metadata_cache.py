@@ -0,0 +1,137 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+'''
+The local cache of the metadata of the books on a wireless device. The cache
+file is a log of records, each the length of the record on a line of its own
+followed by the JSON for a single entry, with later records for a key
+replacing earlier ones and a null entry removing the key. Only the entries
+changed since the last write are appended to the file and it is rewritten,
+without the replaced records, once they make up most of it.
+'''
+
+import json
+
+from calibre.utils.filenames import atomic_rename
+
+COMPACT_THRESHOLD = 1000  # Never rewrite files with fewer replaced records
+
+
+def format_record(key, entry):
+    from calibre.utils.config import to_json
+    result = json.dumps({key: entry}, default=to_json)
+    return b'%0.7d\n%s\n' % (len(result) + 1, result.encode('utf-8'))
+
+
+def read_records(f):
+    ''' Yield the (key, entry) pairs in the file. Raises ValueError at an
+    incomplete record, which is left if writing to the file is interrupted. '''
+    from calibre.utils.config import from_json
+    while True:
+        rec_len = f.readline()
+        if len(rec_len) != 8:
+            if rec_len:
+                raise ValueError('Incomplete record')
+            break
+        raw = f.read(int(rec_len))
+        if len(raw) != int(rec_len):
+            raise ValueError('Incomplete record')
+        record = json.loads(raw.decode('utf-8'), object_hook=from_json)
+        for key, entry in record.iteritems():
+            yield key, entry
+
+
+class MetadataCache(dict):
+
+    '''
+    A map of cache keys to entries of the form ``{'book': book, 'last_used':
+    date}``. Entries must be replaced, not changed, so that the changes are
+    written by :meth:`write`, except for the last used date, which is changed
+    by :meth:`touch`.
+    '''
+
+    def __init__(self, path):
+        dict.__init__(self)
+        self.path = path
+        self.dirtied = set()
+        self.num_records = 0
+        self.needs_rewrite = True
+
+    def __setitem__(self, key, entry):
+        dict.__setitem__(self, key, entry)
+        self.dirtied.add(key)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.dirtied.add(key)
+
+    def pop(self, key, *args):
+        if key in self:
+            self.dirtied.add(key)
+        return dict.pop(self, key, *args)
+
+    def touch(self, key, now):
+        ' Set the last used date of the entry for key, if it is on a different day '
+        entry = self[key]
+        if entry['last_used'].date() != now.date():
+            entry['last_used'] = now
+            self.dirtied.add(key)
+
+    def read(self, raw_to_book):
+        ''' Read the cache file, using raw_to_book to convert the JSON for the
+        books to book objects. If the file is damaged, the entries before the
+        damage are kept and the file is rewritten on the next write. '''
+        dict.clear(self)
+        self.dirtied.clear()
+        self.num_records = 0
+        self.needs_rewrite = False
+        try:
+            with lopen(self.path, 'rb') as f:
+                for key, entry in read_records(f):
+                    self.num_records += 1
+                    if entry is None:
+                        dict.pop(self, key, None)
+                    else:
+                        entry['book'] = raw_to_book(entry['book'])
+                        dict.__setitem__(self, key, entry)
+        except EnvironmentError:
+            self.needs_rewrite = True
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            self.needs_rewrite = True
+
+    def purge(self, now, max_days):
+        ' Remove the entries not used for max_days and return their number '
+        purged = [key for key, entry in self.iteritems() if (now - entry['last_used']).days > max_days]
+        for key in purged:
+            del self[key]
+        return len(purged)
+
+    def write(self, encode_book):
+        ''' Write the changes to the cache file, returning the number of
+        records written. '''
+        if self.path is None or (not self.dirtied and not self.needs_rewrite):
+            return 0
+        replaced = self.num_records + len(self.dirtied) - len(self)
+        if self.needs_rewrite or replaced > max(COMPACT_THRESHOLD, len(self)):
+            keys, mode, path = tuple(self), 'wb', self.path + '.tmp'
+        else:
+            keys, mode, path = tuple(self.dirtied), 'ab', self.path
+        with lopen(path, mode) as f:
+            for key in keys:
+                entry = self.get(key)
+                if entry is not None:
+                    entry = {'book': encode_book(entry['book']), 'last_used': entry['last_used']}
+                f.write(format_record(key, entry))
+        if mode == 'wb':
+            atomic_rename(path, self.path)
+            self.num_records = len(keys)
+            self.needs_rewrite = False
+        else:
+            self.num_records += len(keys)
+        self.dirtied.clear()
+        return len(keys)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+from threading import Thread
+
+from calibre.devices.smart_device_app.driver import SDBook, SMART_DEVICE_APP
+from calibre.devices.smart_device_app.metadata_cache import MetadataCache
+from calibre.ebooks.metadata.book.json_codec import JsonCodec
+from calibre.utils.config import from_json, to_json
+from calibre.utils.date import now
+
+
+class Settings(object):
+
+    extra_customization = [''] * 20
+
+
+class BookList(list):
+
+    def get_collections(self, attrs):
+        return {}
+
+
+class FakeClient(Thread):
+
+    ''' Plays the part of the app on the device. script is called with the
+    client and must send and receive the messages of the conversation. '''
+
+    def __init__(self, sock, script):
+        Thread.__init__(self, name='FakeClient')
+        self.daemon = True
+        self.sock, self.script = sock, script
+        self.buf = b''
+        self.received, self.error = [], None
+
+    def run(self):
+        try:
+            self.script(self)
+        except Exception as err:
+            import traceback
+            traceback.print_exc()
+            self.error = err
+
+    def send(self, op, arg):
+        s = json.dumps([SMART_DEVICE_APP.opcodes[op], arg], default=to_json).encode('utf-8')
+        self.sock.sendall((b'%d' % len(s)) + s)
+
+    def read(self, n):
+        while len(self.buf) < n:
+            data = self.sock.recv(65536)
+            if not data:
+                raise EOFError('calibre closed the connection')
+            self.buf += data
+        ans, self.buf = self.buf[:n], self.buf[n:]
+        return ans
+
+    def receive(self):
+        length = b''
+        while not length.endswith(b'['):
+            length += self.read(1)
+        total = int(length[:-1])
+        op, arg = json.loads(b'[' + self.read(total - 1), object_hook=from_json)
+        ans = SMART_DEVICE_APP.reverse_opcodes[op], arg
+        self.received.append(ans)
+        return ans
+
+
+def create_book(i):
+    book = SDBook('', 'book %d.epub' % i)
+    book.title, book.authors = 'Title %d' % i, ['Author %d' % i]
+    book.uuid, book.last_modified = 'uuid-%d' % i, now()
+    return book
+
+
+class SmartDeviceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        calibre_sock, client_sock = socket.socketpair()
+        self.client_sock = client_sock
+        self.driver = d = SMART_DEVICE_APP(None)
+        d.settings = Settings
+        d.device_socket = calibre_sock
+        d.json_codec = JsonCodec()
+        d.known_metadata = {}
+        d.device_book_cache = MetadataCache(os.path.join(self.tdir, 'cache.json'))
+        d.noop_counter = 0
+        d.client_can_use_metadata_cache = d.client_cache_uses_lpaths = True
+        d.client_batches_metadata, d.metadata_compression = True, 'zlib'
+        d.is_read_sync_col = d.is_read_date_sync_col = None
+        d.have_bad_sync_columns = False
+
+    def tearDown(self):
+        for s in (self.driver.device_socket, self.client_sock):
+            s.close()
+        shutil.rmtree(self.tdir)
+
+    def run_client(self, script, func, *args):
+        client = FakeClient(self.client_sock, script)
+        client.start()
+        ans = func(*args)
+        client.join(10)
+        self.assertFalse(client.is_alive(), 'Fake client did not finish')
+        self.assertIsNone(client.error)
+        return client, ans
+
+    def test_send_metadata_batches(self):
+        books = BookList(create_book(i) for i in range(250))
+        for compression in ('zlib', None):
+            self.driver.known_metadata = {}
+            self.driver.metadata_compression = compression
+            titles = []
+
+            def script(client):
+                op, arg = client.receive()
+                self.assertEqual((op, arg['count']), ('SEND_BOOKLISTS', len(books)))
+                while len(titles) < arg['count']:
+                    op, batch = client.receive()
+                    self.assertEqual(op, 'BOOK_METADATA_BATCH')
+                    self.assertEqual(batch['index'], len(titles))
+                    titles.extend(b['title'] for b in self.driver._decode_metadata_batch(batch))
+            client, ans = self.run_client(script, self.driver.sync_booklists, (books, None, None))
+            self.assertEqual(titles, [b.title for b in books])
+            self.assertEqual(len(client.received), 4, 'Metadata not sent in batches')
+
+    def test_receive_metadata_batches(self):
+        d = self.driver
+        books = [create_book(i) for i in range(10)]
+        for book in books[:6]:
+            d._set_known_metadata(book)
+
+        def script(client):
+            op, arg = client.receive()
+            self.assertEqual(op, 'GET_BOOK_COUNT')
+            client.send('OK', {'count': len(books)})
+            records = [{'priKey': i, 'uuid': b.uuid, 'lpath': b.lpath, 'extension': 'epub',
+                        'last_modified': b.last_modified} for i, b in enumerate(books)]
+            client.send('BOOK_METADATA_BATCH', d._encode_metadata_batch(records[:5]))
+            client.send('BOOK_METADATA_BATCH', d._encode_metadata_batch(records[5:]))
+            op, arg = client.receive()
+            self.assertEqual((op, arg['priKeys']), ('NOOP', [6, 7, 8, 9]))
+            client.send('BOOK_METADATA_BATCH', d._encode_metadata_batch(books[6:]))
+        client, bl = self.run_client(script, d.books)
+        self.assertEqual(sorted(b.title for b in bl), sorted(b.title for b in books))
+
+    def test_metadata_cache(self):
+        path = os.path.join(self.tdir, 'mc.json')
+        cache = MetadataCache(path)
+
+        def read():
+            c = MetadataCache(path)
+            c.read(lambda x: x)
+            return c
+        for i in range(5):
+            cache[str(i)] = {'book': {'title': str(i)}, 'last_used': now()}
+        self.assertEqual(cache.write(lambda x: x), 5)
+        self.assertEqual(cache.write(lambda x: x), 0)
+        cache['1'] = {'book': {'title': 'changed'}, 'last_used': now()}
+        del cache['2']
+        size = os.path.getsize(path)
+        self.assertEqual(cache.write(lambda x: x), 2)
+        self.assertGreater(os.path.getsize(path), size, 'The cache was not appended to')
+        c = read()
+        self.assertEqual(c, cache)
+        self.assertEqual(c.num_records, 7)
+        with open(path, 'ab') as f:
+            f.write(b'0000100\n{"incomplete')
+        c = read()
+        self.assertEqual(c, cache)
+        self.assertTrue(c.needs_rewrite)
+        self.assertEqual(c.write(lambda x: x), 4)
+        self.assertEqual(read().num_records, 4)
+
+
+def find_tests():
+    return unittest.defaultTestLoader.loadTestsFromTestCase(SmartDeviceTest)
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=4).run(find_tests())
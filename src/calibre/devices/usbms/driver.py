@@ -10,7 +10,7 @@ driver. It is intended to be subclassed with the relevant parts implemented
 for a particular device.
 '''
 
-import os, time, json, shutil
+import os, stat, time, json, shutil
 from itertools import cycle
 
 from calibre.constants import numeric_version
@@ -19,7 +19,7 @@ from calibre.constants import filesystem_encoding, DEBUG
 from calibre.devices.usbms.cli import CLI
 from calibre.devices.usbms.device import Device
 from calibre.devices.usbms.books import BookList, Book
-from calibre.ebooks.metadata.book.json_codec import JsonCodec
+from calibre.devices.usbms.metadata_store import MetadataStore
 
 BASE_TIME = None
 
@@ -72,6 +72,48 @@ def safe_walk(top, topdown=True, onerror=None, followlinks=False):
         yield top, dirs, nondirs
 
 
+def snapshot_files(top, recurse=True, accept=lambda filename, path: True, followlinks=False):
+    ''' Return a list of (path, filename, size, mtime) for the files under top
+    accepted by accept(), in a single pass over the filesystem. Unlike
+    safe_walk() the one stat() per entry that is needed to find directories
+    also gives the size and modification time of files, so there is no
+    need to stat() the books separately. '''
+    ans = []
+    join, islink = os.path.join, os.path.islink
+
+    def scan(top):
+        try:
+            names = os.listdir(top)
+        except os.error:
+            return
+        dirs = []
+        for name in names:
+            if isinstance(name, bytes):
+                try:
+                    name = name.decode(filesystem_encoding)
+                except UnicodeDecodeError:
+                    debug_print('Skipping undecodeable file: %r' % name)
+                    continue
+            if not recurse and not accept(name, top):
+                continue
+            path = join(top, name)
+            try:
+                st = os.stat(path)
+            except os.error:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                dirs.append(path)
+            elif not recurse or accept(name, top):
+                ans.append((top, name, st.st_size, st.st_mtime))
+        if recurse:
+            for path in dirs:
+                if followlinks or not islink(path):
+                    scan(path)
+
+    scan(top)
+    return ans
+
+
 # CLI must come before Device as it implements the CLI functions that
 # are inherited from the device interface in Device.
 class USBMS(CLI, Device):
@@ -99,6 +141,10 @@ class USBMS(CLI, Device):
 
     SCAN_FROM_ROOT = False
 
+    # The number of threads used to read metadata from new or changed books
+    # when scanning the device
+    SCAN_THREADS = 4
+
     def _update_driveinfo_record(self, dinfo, prefix, location_code, name=None):
         from calibre.utils.date import now, isoformat
         import uuid
@@ -219,29 +265,19 @@ class USBMS(CLI, Device):
             bl_cache[b.lpath] = idx
 
         all_formats = self.formats_to_scan_for()
-
-        def update_booklist(filename, path, prefix):
-            changed = False
-            if path_to_ext(filename) in all_formats and self.is_allowed_book_file(filename, path, prefix):
-                try:
-                    lpath = os.path.join(path, filename).partition(self.normalize_path(prefix))[2]
-                    if lpath.startswith(os.sep):
-                        lpath = lpath[len(os.sep):]
-                    lpath = lpath.replace('\\', '/')
-                    idx = bl_cache.get(lpath, None)
-                    if idx is not None:
-                        bl_cache[lpath] = None
-                        if self.update_metadata_item(bl[idx]):
-                            # print 'update_metadata_item returned true'
-                            changed = True
-                    else:
-                        if bl.add_book(self.book_from_path(prefix, lpath),
-                                              replace_metadata=False):
-                            changed = True
-                except:  # Probably a filename encoding error
-                    import traceback
-                    traceback.print_exc()
-            return changed
+        store = getattr(bl, 'metadata_store', None)
+        previous_stats = {} if store is None else store.stats
+        prefix_path = self.normalize_path(prefix)
+
+        def accept(filename, path):
+            return (filename != self.METADATA_CACHE and path_to_ext(filename) in all_formats and
+                    self.is_allowed_book_file(filename, path, prefix))
+
+        # Snapshot the size and mtime of all book files and compare with the
+        # snapshot from the last scan, only changed and new files need to
+        # have their metadata read.
+        self.report_progress(0, _('Getting list of books on device...'))
+        stats, to_read = {}, []
         if isinstance(ebook_dirs, basestring):
             ebook_dirs = [ebook_dirs]
         for ebook_dir in ebook_dirs:
@@ -255,27 +291,55 @@ class USBMS(CLI, Device):
             debug_print('USBMS: scan from root', self.SCAN_FROM_ROOT, ebook_dir)
             if not os.path.exists(ebook_dir):
                 continue
-            # Get all books in the ebook_dir directory
-            if self.SUPPORTS_SUB_DIRS or self.SUPPORTS_SUB_DIRS_FOR_SCAN:
-                # build a list of files to check, so we can accurately report progress
-                flist = []
-                for path, dirs, files in safe_walk(ebook_dir):
-                    for filename in files:
-                        if filename != self.METADATA_CACHE:
-                            flist.append({'filename': self.path_to_unicode(filename),
-                                          'path':self.path_to_unicode(path)})
-                for i, f in enumerate(flist):
-                    self.report_progress(i/float(len(flist)), _('Getting list of books on device...'))
-                    changed = update_booklist(f['filename'], f['path'], prefix)
-                    if changed:
-                        need_sync = True
-            else:
-                paths = os.listdir(ebook_dir)
-                for i, filename in enumerate(paths):
-                    self.report_progress((i+1) / float(len(paths)), _('Getting list of books on device...'))
-                    changed = update_booklist(self.path_to_unicode(filename), ebook_dir, prefix)
-                    if changed:
+            recurse = self.SUPPORTS_SUB_DIRS or self.SUPPORTS_SUB_DIRS_FOR_SCAN
+            for path, filename, size, mtime in snapshot_files(ebook_dir, recurse=recurse, accept=accept):
+                lpath = os.path.join(self.path_to_unicode(path), self.path_to_unicode(filename)).partition(prefix_path)[2]
+                if lpath.startswith(os.sep):
+                    lpath = lpath[len(os.sep):]
+                lpath = lpath.replace('\\', '/')
+                if lpath in stats:
+                    continue
+                stats[lpath] = st = [size, mtime]
+                idx = bl_cache.get(lpath, None)
+                if idx is not None:
+                    bl_cache[lpath] = None
+                    if previous_stats.get(lpath) == st:
+                        continue
+                to_read.append((lpath, idx))
+        debug_print('USBMS: found %d book files, %d new or changed' % (len(stats), len(to_read)))
+
+        failed = object()
+
+        def read_metadata(item):
+            lpath, idx = item
+            try:
+                if idx is None:
+                    return self.book_from_path(prefix, lpath)
+                return self.update_metadata_item(bl[idx])
+            except Exception:  # Probably a filename encoding error
+                import traceback
+                traceback.print_exc()
+                return failed
+
+        pool = None
+        if len(to_read) > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(self.SCAN_THREADS, len(to_read)))
+        try:
+            results = (pool.imap if pool is not None else map)(read_metadata, to_read)
+            for i, ((lpath, idx), result) in enumerate(zip(to_read, results)):
+                self.report_progress((i+1) / float(len(to_read)), _('Getting list of books on device...'))
+                if result is failed:
+                    # Try again on the next scan
+                    del stats[lpath]
+                elif idx is None:
+                    if bl.add_book(result, replace_metadata=False):
                         need_sync = True
+                elif result:
+                    need_sync = True
+        finally:
+            if pool is not None:
+                pool.terminate()
 
         # Remove books that are no longer in the filesystem. Cache contains
         # indices into the booklist if book not in filesystem, None otherwise
@@ -287,6 +351,10 @@ class USBMS(CLI, Device):
 
         debug_print('USBMS: count found in cache: %d, count of files in metadata: %d, need_sync: %s' %
             (len(bl_cache), len(bl), need_sync))
+        if store is not None:
+            store.update_stats(stats)
+            # Left stale by a device that was unplugged without ejecting
+            self.track_legacy_metadata_cache(store)
         if need_sync:  # self.count_found_in_bl != len(bl) or need_sync:
             if oncard == 'cardb':
                 self.sync_booklists((None, None, bl))
@@ -294,6 +362,8 @@ class USBMS(CLI, Device):
                 self.sync_booklists((None, bl, None))
             else:
                 self.sync_booklists((bl, None, None))
+        elif store is not None:
+            store.write_stats()
 
         self.report_progress(1.0, _('Getting list of books on device...'))
         debug_print('USBMS: Finished fetching list of books from device. oncard=', oncard)
@@ -432,7 +502,6 @@ class USBMS(CLI, Device):
     # at the end just before the return
     def sync_booklists(self, booklists, end_session=True):
         debug_print('USBMS: starting sync_booklists')
-        json_codec = JsonCodec()
 
         if not os.path.exists(self.normalize_path(self._main_prefix)):
             os.makedirs(self.normalize_path(self._main_prefix))
@@ -442,9 +511,22 @@ class USBMS(CLI, Device):
                     isinstance(booklists[listid], self.booklist_class)):
                 if not os.path.exists(prefix):
                     os.makedirs(self.normalize_path(prefix))
-                with lopen(self.normalize_path(os.path.join(prefix, self.METADATA_CACHE)), 'wb') as f:
-                    json_codec.encode_to_file(f, booklists[listid])
-                    fsync(f)
+                # Only the changed records are appended to the store. The
+                # legacy metadata cache, used by other software, has to be
+                # rewritten completely, thumbnails included, so it is written
+                # only when it is missing and otherwise brought up to date
+                # once, when the device is ejected. The tradeoff is that it
+                # is stale if the device is unplugged without ejecting, until
+                # it is next ejected, calibre itself always uses the store.
+                path = self.normalize_path(os.path.join(prefix, self.METADATA_CACHE))
+                bl = booklists[listid]
+                store = getattr(bl, 'metadata_store', None)
+                if store is None or store.legacy_path != path:
+                    store = bl.metadata_store = MetadataStore(path)
+                store.sync(bl)
+                if not os.path.exists(path):
+                    store.write_legacy()
+                self.track_legacy_metadata_cache(store)
         write_prefix(self._main_prefix, 0)
         write_prefix(self._card_a_prefix, 1)
         write_prefix(self._card_b_prefix, 2)
@@ -459,6 +541,28 @@ class USBMS(CLI, Device):
         self.report_progress(1.0, _('Sending metadata to device...'))
         debug_print('USBMS: finished sync_booklists')
 
+    def track_legacy_metadata_cache(self, store):
+        stores = getattr(self, 'stale_metadata_stores', None)
+        if stores is None:
+            stores = self.stale_metadata_stores = {}
+        if store.legacy_dirty:
+            stores[store.legacy_path] = store
+
+    def write_legacy_metadata_caches(self):
+        ''' Bring the legacy metadata caches that are stale up to date, called
+        when the device is ejected. '''
+        stores, self.stale_metadata_stores = getattr(self, 'stale_metadata_stores', None) or {}, {}
+        for store in stores.itervalues():
+            try:
+                store.flush_legacy()
+            except Exception:
+                import traceback
+                traceback.print_exc()
+
+    def eject(self):
+        self.write_legacy_metadata_caches()
+        Device.eject(self)
+
     @classmethod
     def build_template_regexp(cls):
         from calibre.devices.utils import build_template_regexp
@@ -483,20 +587,14 @@ class USBMS(CLI, Device):
 
     @classmethod
     def parse_metadata_cache(cls, bl, prefix, name):
-        json_codec = JsonCodec()
-        need_sync = False
-        cache_file = cls.normalize_path(os.path.join(prefix, name))
-        if os.access(cache_file, os.R_OK):
-            try:
-                with lopen(cache_file, 'rb') as f:
-                    json_codec.decode_from_file(f, bl, cls.book_class, prefix)
-            except:
-                import traceback
-                traceback.print_exc()
-                bl = []
-                need_sync = True
-        else:
+        store = MetadataStore(cls.normalize_path(os.path.join(prefix, name)))
+        try:
+            need_sync = store.load(bl, cls.book_class, prefix)
+        except:
+            import traceback
+            traceback.print_exc()
             need_sync = True
+        bl.metadata_store = store
         return need_sync
 
     @classmethod
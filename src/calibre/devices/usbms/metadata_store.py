@@ -0,0 +1,316 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2017, Kovid Goyal <kovid at kovidgoyal.net>'
+
+'''
+Incrementally updated store for the metadata of books on USBMS devices.
+
+The legacy metadata cache (metadata.calibre) is a single JSON document with
+embedded thumbnails that has to be rewritten completely whenever anything
+changes. The store keeps the same records in two files next to it:
+
+    metadata.calibre.records -- One compact JSON array per line. The file
+        starts with a snapshot of all records and is followed by a journal of
+        changes, which is replayed on load.
+    metadata.calibre.thumbs -- The raw thumbnail data, records refer to it by
+        offset and length.
+
+The records file also holds a snapshot of the size and modification time of
+the book files, from the last scan of the device, so that the next scan only
+has to read metadata from files that changed.
+
+Syncing only appends the records that changed and the new thumbnails. The
+files are compacted when the journal gets too long. The legacy file is still
+read, when the store is missing or the legacy file has been written by
+something else since the store was last synced, and it is written by
+write_legacy() so that other software and older calibre versions can use it.
+Rewriting it is as expensive as the full rewrite the store avoids, so the store
+only marks it as stale, persistently, when records change and the driver
+writes it once, when the device is ejected.
+'''
+
+import os, json
+
+from calibre import fsync, prints
+from calibre.constants import DEBUG
+from calibre.ebooks.metadata.book.json_codec import JsonCodec, normalize_thumbnail, encode_thumbnail
+from calibre.utils.filenames import atomic_rename
+
+VERSION = 1
+RECORDS_EXT, THUMBS_EXT = '.records', '.thumbs'
+
+
+def dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), sort_keys=True)
+
+
+def file_stamp(path):
+    try:
+        st = os.stat(path)
+    except EnvironmentError:
+        return None
+    return [st.st_size, st.st_mtime]
+
+
+def stamps_equal(a, b):
+    if a is None or b is None:
+        return a is b
+    return a[0] == b[0] and abs(a[1] - b[1]) < 0.01
+
+
+class MetadataStore(object):
+
+    def __init__(self, legacy_path):
+        self.legacy_path = legacy_path
+        self.records_path = legacy_path + RECORDS_EXT
+        self.thumbs_path = legacy_path + THUMBS_EXT
+        self.codec = JsonCodec()
+        self.reset()
+
+    def reset(self):
+        # Map of lpath to (record, thumbnail reference, thumbnail)
+        self.entries = {}
+        # Map of lpath to [size, mtime] of the book files on the device
+        self.stats, self.pending_stats = {}, {}
+        self.journal_length = 0
+        self.records_size = self.thumbs_size = None
+        self.legacy_stamp = None
+        self.needs_compaction = True
+        # True if the legacy file does not have the current records
+        self.legacy_dirty = False
+
+    # Reading {{{
+    def load(self, booklist, book_class, prefix):
+        ''' Read the books from the store into booklist, falling back to the
+        legacy metadata cache if the store is unusable. Returns True if the
+        store had to be initialized from the legacy file or from scratch,
+        meaning the store should be synced. '''
+        try:
+            loaded = self.load_store()
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            loaded = False
+        if loaded:
+            for lpath, (record, thumb_ref, thumbnail) in self.entries.iteritems():
+                book = self.codec.raw_to_book(record, book_class, prefix)
+                if book is not None:
+                    if thumbnail is not None:
+                        book.thumbnail = thumbnail
+                    booklist.append(book)
+            return False
+        self.reset()
+        self.load_legacy(booklist, book_class, prefix)
+        return True
+
+    def load_store(self):
+        legacy_stamp = file_stamp(self.legacy_path)
+        if not os.access(self.records_path, os.R_OK):
+            return False
+        entries, stats, journal_length, stamp = {}, {}, 0, None
+        good_size, needs_compaction = 0, False
+        with lopen(self.records_path, 'rb') as f:
+            header = json.loads(f.readline())
+            if header[0] != 'h' or header[1]['version'] > VERSION:
+                return False
+            stamp = header[1].get('legacy')
+            legacy_dirty = header[1].get('legacy_dirty', False)
+            good_size = f.tell()
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('Truncated record')
+                    item = json.loads(line)
+                except ValueError:
+                    # An interrupted write, ignore the rest of the journal
+                    needs_compaction = True
+                    break
+                good_size += len(line)
+                journal_length += 1
+                op = item[0]
+                if op == 's':
+                    record, thumb_ref = item[1], item[2]
+                    entries[record['lpath']] = (record, thumb_ref, None)
+                    legacy_dirty = True
+                elif op == 'd':
+                    entries.pop(item[1], None)
+                    stats.pop(item[1], None)
+                    legacy_dirty = True
+                elif op == 't':
+                    for lpath, stat in item[1].iteritems():
+                        if stat is None:
+                            stats.pop(lpath, None)
+                        else:
+                            stats[lpath] = stat
+                elif op == 'l':
+                    stamp, legacy_dirty = item[1], False
+        if legacy_stamp is not None and not stamps_equal(legacy_stamp, stamp):
+            # The legacy file was written by something else after the store
+            if DEBUG:
+                prints('Metadata cache', self.legacy_path, 'was changed externally, ignoring', self.records_path)
+            return False
+        thumbs_size = 0
+        if os.access(self.thumbs_path, os.R_OK):
+            with lopen(self.thumbs_path, 'rb') as f:
+                thumbs = f.read()
+            thumbs_size = len(thumbs)
+            for lpath, (record, thumb_ref, thumbnail) in entries.iteritems():
+                if thumb_ref is not None:
+                    width, height, offset, length = thumb_ref
+                    if offset + length <= thumbs_size:
+                        entries[lpath] = (record, thumb_ref, (width, height, thumbs[offset:offset+length]))
+                    else:
+                        entries[lpath] = (record, None, None)
+                        needs_compaction = True
+        self.entries, self.journal_length, self.legacy_stamp = entries, journal_length, stamp
+        self.stats, self.pending_stats = stats, {}
+        self.records_size, self.thumbs_size = good_size, thumbs_size
+        self.needs_compaction = needs_compaction
+        self.legacy_dirty = legacy_dirty
+        return True
+
+    def load_legacy(self, booklist, book_class, prefix):
+        if os.access(self.legacy_path, os.R_OK):
+            with lopen(self.legacy_path, 'rb') as f:
+                self.codec.decode_from_file(f, booklist, book_class, prefix)
+            # The records will be written from this legacy data on the next sync
+            self.legacy_stamp = file_stamp(self.legacy_path)
+    # }}}
+
+    # Writing {{{
+    def update_stats(self, stats):
+        ''' Replace the snapshot of the book files with stats, the changes
+        are written on the next sync() or write_stats(). '''
+        for lpath in set(self.stats) - set(stats):
+            self.pending_stats[lpath] = None
+        for lpath, stat in stats.iteritems():
+            if self.stats.get(lpath) != stat:
+                self.pending_stats[lpath] = stat
+        self.stats = stats
+
+    def write_stats(self):
+        ''' Write just the changes to the snapshot of the book files, if
+        any. A store that has never been synced is left alone, the snapshot
+        is written along with the records by sync(). '''
+        if self.pending_stats and self.records_size is not None:
+            self.append_records([['t', self.pending_stats]])
+            self.pending_stats = {}
+
+    def encode(self, book):
+        # Round trip through JSON so that the record compares equal to the
+        # same record read back from the store
+        return json.loads(dumps(self.codec.encode_book_metadata(book, exclude=('thumbnail',))))
+
+    def sync(self, booklist):
+        ''' Write the records of all books in booklist that have changed since
+        the last sync, or since the store was loaded. Returns True if any
+        records changed. '''
+        if self.records_size is None and self.legacy_stamp is None:
+            self.legacy_stamp = file_stamp(self.legacy_path)
+        changes, thumbnails, seen = [], [], set()
+        thumbs_size = self.thumbs_size or 0
+        for book in booklist:
+            record = self.encode(book)
+            lpath = book.lpath
+            seen.add(lpath)
+            thumbnail = normalize_thumbnail(book.get('thumbnail', None))
+            old = self.entries.get(lpath)
+            if old is not None and old[0] == record and (old[2] is thumbnail or old[2] == thumbnail):
+                continue
+            thumb_ref = None
+            if thumbnail is not None:
+                if old is not None and old[2] == thumbnail:
+                    thumb_ref = old[1]
+                else:
+                    thumb_ref = [thumbnail[0], thumbnail[1], thumbs_size, len(thumbnail[2])]
+                    thumbs_size += len(thumbnail[2])
+                    thumbnails.append(thumbnail[2])
+            self.entries[lpath] = (record, thumb_ref, thumbnail)
+            changes.append(['s', record, thumb_ref])
+        for lpath in set(self.entries) - seen:
+            del self.entries[lpath]
+            changes.append(['d', lpath])
+            if self.stats.pop(lpath, None) is not None:
+                self.pending_stats.pop(lpath, None)
+        changed = bool(changes)
+        if changed:
+            self.legacy_dirty = True
+        if self.pending_stats:
+            changes.append(['t', self.pending_stats])
+
+        if self.needs_compaction or self.journal_length + len(changes) > max(1000, 2 * len(self.entries)):
+            self.compact()
+            return changed
+        if not changes:
+            return changed
+        if thumbnails:
+            with lopen(self.thumbs_path, 'r+b' if self.thumbs_size else 'wb') as f:
+                f.seek(self.thumbs_size or 0), f.truncate()
+                f.write(b''.join(thumbnails))
+                fsync(f)
+            self.thumbs_size = thumbs_size
+        self.append_records(changes)
+        self.pending_stats = {}
+        return changed
+
+    def append_records(self, items):
+        data = b''.join(dumps(item) + b'\n' for item in items)
+        with lopen(self.records_path, 'r+b') as f:
+            # Discard the remains of any previously interrupted write
+            f.seek(self.records_size), f.truncate()
+            f.write(data)
+            fsync(f)
+        self.records_size += len(data)
+        self.journal_length += len(items)
+
+    def compact(self):
+        ''' Rewrite the store so that it contains only the current records
+        and thumbnails. '''
+        thumbnails, entries, pos = [], {}, 0
+        lines = [dumps(['h', {'version': VERSION, 'legacy': self.legacy_stamp, 'legacy_dirty': self.legacy_dirty}])]
+        for lpath, (record, thumb_ref, thumbnail) in self.entries.iteritems():
+            if thumbnail is not None:
+                thumb_ref = [thumbnail[0], thumbnail[1], pos, len(thumbnail[2])]
+                thumbnails.append(thumbnail[2])
+                pos += len(thumbnail[2])
+            entries[lpath] = (record, thumb_ref, thumbnail)
+            lines.append(dumps(['s', record, thumb_ref]))
+        if self.stats:
+            lines.append(dumps(['t', self.stats]))
+        data = b''.join(x + b'\n' for x in lines)
+        for path, raw in ((self.thumbs_path, b''.join(thumbnails)), (self.records_path, data)):
+            with lopen(path + '.tmp', 'wb') as f:
+                f.write(raw)
+                fsync(f)
+            atomic_rename(path + '.tmp', path)
+        self.entries, self.journal_length = entries, len(self.entries)
+        self.records_size, self.thumbs_size = len(data), pos
+        self.needs_compaction = False
+        self.pending_stats = {}
+
+    def write_legacy(self):
+        ''' Write the legacy metadata cache from the current records. '''
+        books = []
+        for record, thumb_ref, thumbnail in self.entries.itervalues():
+            record = record.copy()
+            record['thumbnail'] = encode_thumbnail(thumbnail)
+            books.append(record)
+        with lopen(self.legacy_path, 'wb') as f:
+            f.write(json.dumps(books, separators=(',', ':'), encoding='utf-8'))
+            fsync(f)
+        self.legacy_stamp = file_stamp(self.legacy_path)
+        self.legacy_dirty = False
+        if self.records_size is None:
+            self.compact()
+        else:
+            self.append_records([['l', self.legacy_stamp]])
+
+    def flush_legacy(self):
+        ''' Write the legacy metadata cache if it is stale or missing. '''
+        if self.legacy_dirty or not os.path.exists(self.legacy_path):
+            self.write_legacy()
+    # }}}
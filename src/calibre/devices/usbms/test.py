@@ -0,0 +1,153 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from calibre.devices.usbms.books import Book, BookList
+from calibre.devices.usbms.driver import USBMS
+from calibre.devices.usbms.metadata_store import MetadataStore
+from calibre.ebooks.metadata.book.base import Metadata
+from calibre.ebooks.metadata.book.json_codec import JsonCodec
+
+
+class Settings(object):
+
+    format_map = ['epub']
+    extra_customization = None
+    read_metadata = False
+
+
+class ScanDevice(USBMS):
+
+    FORMATS = ['epub']
+    MUST_READ_METADATA = True
+    SUPPORTS_SUB_DIRS = True
+    read_paths = []
+
+    @classmethod
+    def settings(cls):
+        return Settings
+
+    @classmethod
+    def metadata_from_path(cls, path):
+        name = os.path.basename(path)
+        cls.read_paths.append(name)
+        return Metadata(name.rpartition('.')[0], ['Author'])
+
+
+def create_book(prefix, lpath, title, thumbnail=None):
+    book = Book(prefix, lpath, size=10, other=Metadata(title, ['Author']))
+    if thumbnail is not None:
+        book.thumbnail = thumbnail
+    return book
+
+
+class USBMSTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tdir = tempfile.mkdtemp()
+        self.prefix = self.tdir + os.sep
+        self.path = os.path.join(self.tdir, 'metadata.calibre')
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir)
+
+    def load(self):
+        bl = BookList(None, self.prefix, None)
+        store = MetadataStore(self.path)
+        need_sync = store.load(bl, Book, self.prefix)
+        return store, need_sync, {b.lpath: (b.title, b.thumbnail) for b in bl}
+
+    def test_metadata_store(self):
+        bl = BookList(None, self.prefix, None)
+        for i in range(5):
+            bl.append(create_book(self.prefix, 'book%d.epub' % i, 'Title %d' % i, (1, 1, b'thumb%d' % i) if i % 2 else None))
+        expected = {b.lpath: (b.title, b.thumbnail) for b in bl}
+        store = MetadataStore(self.path)
+        self.assertTrue(store.sync(bl))
+        store.write_legacy()
+        self.assertEqual(self.load()[1:], (False, expected))
+
+        size = os.path.getsize(store.records_path)
+        self.assertFalse(store.sync(bl))
+        self.assertEqual(os.path.getsize(store.records_path), size)
+
+        bl[1].title = 'Changed'
+        del bl[4]
+        self.assertTrue(store.sync(bl))
+        self.assertGreater(os.path.getsize(store.records_path), size, 'The changes were not appended')
+        expected = {b.lpath: (b.title, b.thumbnail) for b in bl}
+        store.write_legacy()
+        self.assertEqual(self.load()[1:], (False, expected))
+
+        # An interrupted write leaves the earlier records usable
+        with open(store.records_path, 'ab') as f:
+            f.write(b'["s",{"lpath"')
+        store, need_sync, books = self.load()
+        self.assertEqual((need_sync, books), (False, expected))
+        self.assertTrue(store.needs_compaction)
+
+        # The legacy cache written by something else takes precedence
+        other = BookList(None, self.prefix, None)
+        other.append(create_book(self.prefix, 'other.epub', 'Other'))
+        with open(self.path, 'wb') as f:
+            JsonCodec().encode_to_file(f, other)
+        os.utime(self.path, (0, 0))
+        store, need_sync, books = self.load()
+        self.assertEqual((need_sync, books), (True, {'other.epub': ('Other', None)}))
+
+    def test_scan(self):
+        d = ScanDevice(None)
+        d._main_prefix, d._card_a_prefix, d._card_b_prefix = self.prefix, None, None
+        d.report_progress = lambda *args: None
+
+        def write(name, data=b'book'):
+            path = os.path.join(self.tdir, *name.split('/'))
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'ab') as f:
+                f.write(data)
+
+        def scan():
+            del ScanDevice.read_paths[:]
+            bl = d.books()
+            return sorted(ScanDevice.read_paths), sorted(b.lpath for b in bl)
+
+        for name in ('a.epub', 'sub/b.epub', 'c.txt'):
+            write(name)
+        self.assertEqual(scan(), (['a.epub', 'b.epub'], ['a.epub', 'sub/b.epub']))
+        self.assertTrue(os.path.exists(self.path), 'The legacy metadata cache was not written')
+        self.assertEqual(scan(), ([], ['a.epub', 'sub/b.epub']))
+
+        write('a.epub', b'changed')
+        write('d.epub')
+        os.remove(os.path.join(self.tdir, 'sub', 'b.epub'))
+        self.assertEqual(scan(), (['a.epub', 'd.epub'], ['a.epub', 'd.epub']))
+        self.assertEqual(scan(), ([], ['a.epub', 'd.epub']))
+
+        def legacy():
+            ans = []
+            with open(self.path, 'rb') as f:
+                JsonCodec().decode_from_file(f, ans, Book, self.prefix)
+            return sorted(b.lpath for b in ans)
+
+        # The legacy metadata cache is written only when the device is ejected
+        self.assertEqual(legacy(), ['a.epub', 'sub/b.epub'])
+        d.write_legacy_metadata_caches()
+        self.assertEqual(legacy(), ['a.epub', 'd.epub'], 'The legacy metadata cache is stale')
+        self.assertEqual(scan(), ([], ['a.epub', 'd.epub']))
+        self.assertFalse(d.stale_metadata_stores, 'The legacy metadata cache would be rewritten needlessly')
+
+
+def find_tests():
+    return unittest.defaultTestLoader.loadTestsFromTestCase(USBMSTest)
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=4).run(find_tests())
@@ -92,7 +92,10 @@ cpalmdoc_memcmp( Byte *a, Byte *b, Py_ssize_t len) {
 static Py_ssize_t
 cpalmdoc_rfind(Byte *data, Py_ssize_t pos, Py_ssize_t chunk_length) {
     Py_ssize_t i;
-    for (i = pos - chunk_length; i > -1; i--) 
+    // Matches further back than 2047 bytes cannot be encoded, so there is no
+    // point searching for them
+    Py_ssize_t limit = MAX(0, pos - 2047);
+    for (i = pos - chunk_length; i >= limit; i--)
         if (cpalmdoc_memcmp(data+i, data+pos, chunk_length)) return i;
     return pos;
 }
@@ -105,10 +108,11 @@ cpalmdoc_do_compress(buffer *b, char *output) {
     Byte c, n;
     bool found;
     char *head;
-    buffer temp; 
+    Byte temp_data[8];
+    buffer temp;
+    // Called without the GIL, so must not use the python memory allocator
     head = output;
-    temp.data = (Byte *)PyMem_Malloc(sizeof(Byte)*8); temp.len = 0;
-    if (temp.data == NULL) return 0;
+    temp.data = temp_data; temp.len = 0;
     while (i < b->len) {
         c = b->data[i];
         //do repeats
@@ -152,7 +156,6 @@ cpalmdoc_do_compress(buffer *b, char *output) {
             for (j=0; j < temp.len; j++) *(output++) = (char)temp.data[j];
         }
     }
-    PyMem_Free(temp.data);
     return output - head;
 }
 
@@ -171,11 +174,13 @@ cpalmdoc_compress(PyObject *self, PyObject *args) {
         b.data[j] = (_input[j] < 0) ? _input[j]+256 : _input[j];
     b.len = input_len;
     // Make the output buffer larger than the input as sometimes
-    // compression results in a larger block
-    output = (char *)PyMem_Malloc(sizeof(char) * (int)(1.25*b.len));
-    if (output == NULL) return PyErr_NoMemory();
+    // compression results in a larger block, at worst every byte is written
+    // as binary data, taking two bytes
+    output = (char *)PyMem_Malloc(sizeof(char) * 2 * b.len);
+    if (output == NULL) { PyMem_Free(b.data); return PyErr_NoMemory(); }
+    Py_BEGIN_ALLOW_THREADS
     j = cpalmdoc_do_compress(&b, output);
-    if ( j == 0) return PyErr_NoMemory();
+    Py_END_ALLOW_THREADS
     ans = Py_BuildValue("s#", output, j);
     PyMem_Free(output);
     PyMem_Free(b.data);
@@ -40,9 +40,9 @@ def datetime_to_string(dateval):
     return isoformat(dateval)
 
 
-def encode_thumbnail(thumbnail):
+def normalize_thumbnail(thumbnail):
     '''
-    Encode the image part of a thumbnail, then return the 3 part tuple
+    Return the thumbnail as a 3 part (width, height, data) tuple
     '''
     from calibre.utils.imghdr import identify
     if thumbnail is None:
@@ -55,6 +55,18 @@ def encode_thumbnail(thumbnail):
             thumbnail = (width, height, thumbnail)
         except Exception:
             return None
+    elif isinstance(thumbnail, list):
+        thumbnail = tuple(thumbnail)
+    return thumbnail
+
+
+def encode_thumbnail(thumbnail):
+    '''
+    Encode the image part of a thumbnail, then return the 3 part tuple
+    '''
+    thumbnail = normalize_thumbnail(thumbnail)
+    if thumbnail is None:
+        return None
     return (thumbnail[0], thumbnail[1], b64encode(str(thumbnail[2])))
 
 
@@ -139,10 +151,11 @@ class JsonCodec(object):
             result.append(self.encode_book_metadata(book))
         return result
 
-    def encode_book_metadata(self, book):
+    def encode_book_metadata(self, book, exclude=()):
         result = {}
         for key in SERIALIZABLE_FIELDS:
-            result[key] = self.encode_metadata_attr(book, key)
+            if key not in exclude:
+                result[key] = self.encode_metadata_attr(book, key)
         return result
 
     def encode_metadata_attr(self, book, key):
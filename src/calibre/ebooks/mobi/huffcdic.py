@@ -13,9 +13,16 @@ and igorsk.
 '''
 
 import struct
+from Queue import Empty
 
 from calibre.ebooks.mobi import MobiError
 
+# Codes of at most this many bits are decoded with a single table lookup
+TABLE_BITS = 16
+# Below this many records the cost of launching worker processes dominates
+MIN_RECORDS_FOR_POOL = 256
+CHUNK_SIZE = 64
+
 
 class Reader(object):
 
@@ -44,6 +51,11 @@ class Reader(object):
             self.maxcode += (((maxcode + 1) << (32 - codelen)) - 1, )
 
         self.dictionary = []
+        # The fully expanded dictionary entries, None for entries that have
+        # not been expanded yet
+        self.expanded = []
+        self.table = None
+        self.long_codes = {}
 
     def load_cdic(self, cdic):
         if cdic[0:8] != b'CDIC\x00\x00\x00\x10':
@@ -56,9 +68,95 @@ class Reader(object):
             blen, = h(cdic, 16+off)
             slice = cdic[18+off:18+off+(blen&0x7fff)]
             return (slice, blen&0x8000)
-        self.dictionary += map(getslice, struct.unpack_from(b'>%dH' % n, cdic, 16))
+        entries = map(getslice, struct.unpack_from(b'>%dH' % n, cdic, 16))
+        self.dictionary += entries
+        self.expanded += [slice if flag else None for slice, flag in entries]
+
+    def build_table(self):
+        ''' Build the table that maps the first TABLE_BITS bits of a code to
+        (code length, dictionary index) for all codes of at most TABLE_BITS
+        bits, longer codes map to None. The code length and index of such
+        codes depend only on their first TABLE_BITS bits. '''
+        table = []
+        extra = TABLE_BITS - 8
+        shift = 32 - TABLE_BITS
+        mincode, maxcode = self.mincode, self.maxcode
+        for prefix, (codelen, term, dmaxcode) in enumerate(self.dict1):
+            if term and codelen <= 8:
+                # All codes starting with this byte have the same length
+                table.extend([(codelen, (dmaxcode - (prefix << 24)) >> (32 - codelen))] * (1 << extra))
+                continue
+            for p in xrange(prefix << extra, (prefix + 1) << extra):
+                code, cl, mc = p << shift, codelen, dmaxcode
+                if not term:
+                    while cl <= TABLE_BITS and code < mincode[cl]:
+                        cl += 1
+                    if cl <= TABLE_BITS:
+                        mc = maxcode[cl]
+                table.append((cl, (mc - code) >> (32 - cl)) if cl <= TABLE_BITS else None)
+        self.table = table
 
     def unpack(self, data):
+        if self.table is None:
+            self.build_table()
+        q, table, expanded, long_codes = self.q, self.table, self.expanded, self.long_codes
+        shift = 32 - TABLE_BITS
+
+        bitsleft = len(data) * 8
+        data += b'\x00\x00\x00\x00\x00\x00\x00\x00'
+        pos = 0
+        x, = q(data, pos)
+        n = 32
+
+        s = []
+        append = s.append
+        while True:
+            if n <= 0:
+                pos += 4
+                x, = q(data, pos)
+                n += 32
+            code = (x >> n) & 0xffffffff
+
+            entry = table[code >> shift]
+            if entry is None:
+                # Codes longer than TABLE_BITS are rare, cache them by their
+                # first 24 bits
+                entry = long_codes.get(code >> 8)
+                if entry is None:
+                    codelen, term, maxcode = self.dict1[code >> 24]
+                    if not term:
+                        while code < self.mincode[codelen]:
+                            codelen += 1
+                        maxcode = self.maxcode[codelen]
+                    entry = (codelen, (maxcode - code) >> (32 - codelen))
+                    if codelen <= 24:
+                        long_codes[code >> 8] = entry
+            codelen, r = entry
+
+            n -= codelen
+            bitsleft -= codelen
+            if bitsleft < 0:
+                break
+
+            slice_ = expanded[r]
+            if slice_ is None:
+                slice_ = self.expand(r)
+            append(slice_)
+        return b''.join(s)
+
+    def expand(self, r):
+        entry = self.dictionary[r]
+        if entry is None:
+            raise MobiError('Recursive entry in the HUFF/CDIC dictionary')
+        self.dictionary[r] = None
+        try:
+            ans = self.expanded[r] = self.unpack(entry[0])
+        finally:
+            self.dictionary[r] = entry
+        return ans
+
+    def unpack_reference(self, data):
+        ' The original bit by bit decoder, used to check the output of unpack() '
         q = self.q
 
         bitsleft = len(data) * 8
@@ -90,7 +188,7 @@ class Reader(object):
             slice_, flag = self.dictionary[r]
             if not flag:
                 self.dictionary[r] = None
-                slice_ = self.unpack(slice_)
+                slice_ = self.unpack_reference(slice_)
                 self.dictionary[r] = (slice_, 1)
             s.append(slice_)
         return b''.join(s)
@@ -108,3 +206,79 @@ class HuffReader(object):
         return self.reader.unpack(section)
 
 
+worker_reader = None
+
+
+def unpack_records(records, common_data=None):
+    ''' Entry point for worker processes, the HUFF/CDIC records are passed as
+    common_data and the reader for them is re-used across jobs. '''
+    global worker_reader
+    if worker_reader is None or worker_reader[0] is not common_data:
+        worker_reader = (common_data, HuffReader(common_data))
+    return map(worker_reader[1].unpack, records)
+
+
+def decompress_records(huffs, records, max_workers=None):
+    ''' Return the decompressed text of all the text records, using a pool of
+    worker processes for large books. '''
+    if len(records) < MIN_RECORDS_FOR_POOL or max_workers == 0:
+        return map(HuffReader(huffs).unpack, records)
+
+    from calibre.utils.ipc.pool import Pool, Failure
+    pool = Pool(max_workers=max_workers, name='HuffDecompress')
+    try:
+        pool.set_common_data(huffs)
+        chunks = {}
+        for i in xrange(0, len(records), CHUNK_SIZE):
+            pool(i, __name__, 'unpack_records', records[i:i+CHUNK_SIZE])
+            chunks[i] = None
+        pending = len(chunks)
+        while pending:
+            try:
+                worker_result = pool.results.get(True, 0.1)
+            except Empty:
+                if pool.failed:
+                    raise Failure(pool.terminal_failure)
+                continue
+            pending -= 1
+            if worker_result.is_terminal_failure:
+                raise Failure(pool.terminal_failure)
+            result = worker_result.result
+            if result.err is not None:
+                raise MobiError('Failed to decompress text with error: %s\n%s' % (result.err, result.traceback))
+            chunks[worker_result.id] = result.value
+    finally:
+        pool.shutdown(), pool.join()
+    ans = []
+    for i in sorted(chunks):
+        ans.extend(chunks[i])
+    return ans
+
+
+def benchmark(path, max_workers=None):
+    ''' Compare the speed and output of the original and current decoders on
+    a HUFF/CDIC compressed MOBI file, run with:
+    calibre-debug -c "from calibre.ebooks.mobi.huffcdic import benchmark; benchmark('file.mobi')" '''
+    import time
+    from calibre.ebooks.mobi.reader.mobi6 import MobiReader
+    from calibre.utils.logging import default_log
+    mr = MobiReader(path, default_log)
+    bh = mr.book_header
+    if bh.compression_type != b'DH':
+        raise SystemExit('%s is not HUFF/CDIC compressed' % path)
+    huffs = [mr.sections[i][0] for i in xrange(bh.huff_offset, bh.huff_offset + bh.huff_number)]
+    records = [mr.text_section(i) for i in xrange(1, min(bh.records + 1, len(mr.sections)))]
+    st = time.time()
+    reader = HuffReader(huffs).reader
+    reference = map(reader.unpack_reference, records)
+    reference_time = time.time() - st
+    st = time.time()
+    serial = map(HuffReader(huffs).unpack, records)
+    serial_time = time.time() - st
+    st = time.time()
+    parallel = decompress_records(huffs, records, max_workers=max_workers)
+    parallel_time = time.time() - st
+    if serial != reference or parallel != reference:
+        raise SystemExit('Decompressed text differs from that of the original decoder')
+    print('Decompressed %d records (%d bytes): original: %.2fs table driven: %.2fs parallel: %.2fs' % (
+        len(records), sum(map(len, reference)), reference_time, serial_time, parallel_time))
@@ -15,7 +15,7 @@ from calibre.utils.cleantext import clean_ascii_chars
 from calibre.ebooks import DRMError, unit_convert
 from calibre.ebooks.chardet import ENCODING_PATS
 from calibre.ebooks.mobi import MobiError
-from calibre.ebooks.mobi.huffcdic import HuffReader
+from calibre.ebooks.mobi.huffcdic import decompress_records
 from calibre.ebooks.compression.palmdoc import decompress_doc
 from calibre.ebooks.metadata import MetaInformation
 from calibre.ebooks.metadata.opf2 import OPFCreator, OPF
@@ -790,17 +790,15 @@ class MobiReader(object):
                     self.book_header.huff_offset + self.book_header.huff_number)]
             processed_records += list(xrange(self.book_header.huff_offset,
                 self.book_header.huff_offset + self.book_header.huff_number))
-            huff = HuffReader(huffs)
-            unpack = huff.unpack
+            # Large books are decompressed in parallel
+            text_sections = decompress_records(huffs, text_sections)
 
         elif self.book_header.compression_type == '\x00\x02':
-            unpack = decompress_doc
+            text_sections = map(decompress_doc, text_sections)
 
-        elif self.book_header.compression_type == '\x00\x01':
-            unpack = lambda x: x
-        else:
+        elif self.book_header.compression_type != '\x00\x01':
             raise MobiError('Unknown compression algorithm: %s' % repr(self.book_header.compression_type))
-        self.mobi_html = b''.join(map(unpack, text_sections))
+        self.mobi_html = b''.join(text_sections)
         if self.mobi_html.endswith(b'#'):
             self.mobi_html = self.mobi_html[:-1]
 
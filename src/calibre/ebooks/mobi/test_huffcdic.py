@@ -0,0 +1,107 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import random
+import struct
+import unittest
+
+from calibre.ebooks.mobi.huffcdic import HuffReader, decompress_records
+
+# The number of codes of each length, from 3 to 26 bits, they use up the whole
+# code space. The codes longer than 16 bits are decoded without the lookup
+# table and those longer than 24 bits are not cached.
+CODE_COUNTS = [(3, 4), (4, 6), (5, 3)] + [(l, 1) for l in xrange(6, 26)] + [(26, 2)]
+
+
+class Encoder(object):
+
+    ' Create the HUFF and CDIC records of a canonical Huffman code, as used in MOBI files '
+
+    def __init__(self, phrases, cdic_bits=5):
+        self.codes, mincodes, maxcodes = [], [0] * 33, [0] * 33
+        top, index = 1 << 32, 0
+        for codelen in xrange(1, 33):
+            count = dict(CODE_COUNTS).get(codelen, 0)
+            # Shorter codes have larger values, so that a code is longer when
+            # it is less than the smallest code of a length
+            max_c = (top >> (32 - codelen)) - 1
+            min_c = max_c - count + 1
+            # Symbol index + code == maxcode for all codes of a length
+            mincodes[codelen], maxcodes[codelen] = min_c, index + max_c
+            self.codes.extend((codelen, max_c - i) for i in xrange(count))
+            index += count
+            top = min_c << (32 - codelen)
+        dict1 = []
+        for prefix in xrange(256):
+            code = prefix << 24
+            codelen = next(l for l in xrange(1, 33) if code >= mincodes[l] << (32 - l))
+            if codelen <= 8:
+                dict1.append(codelen | 0x80 | (maxcodes[codelen] << 8))
+            else:
+                dict1.append(9)
+        dict2 = []
+        for codelen in xrange(1, 33):
+            dict2.extend((mincodes[codelen], maxcodes[codelen]))
+        self.huff = b'HUFF\x00\x00\x00\x18' + struct.pack(b'>LL8x', 24, 24 + 1024) + struct.pack(
+            b'>256L', *dict1) + struct.pack(b'>64L', *dict2)
+
+        self.cdics = []
+        per_cdic = 1 << cdic_bits
+        for i in xrange(0, len(phrases), per_cdic):
+            entries, offsets, pos = [], [], 2 * len(phrases[i:i+per_cdic])
+            for data, literal in phrases[i:i+per_cdic]:
+                entry = struct.pack(b'>H', len(data) | (0x8000 if literal else 0)) + data
+                offsets.append(pos)
+                entries.append(entry)
+                pos += len(entry)
+            self.cdics.append(b'CDIC\x00\x00\x00\x10' + struct.pack(b'>LL', len(phrases), cdic_bits) +
+                              struct.pack(b'>%dH' % len(offsets), *offsets) + b''.join(entries))
+
+    def encode(self, symbols):
+        bits = ''.join(bin(code)[2:].zfill(codelen) for codelen, code in (self.codes[s] for s in symbols))
+        bits += '0' * (-len(bits) % 8)
+        return b''.join(struct.pack(b'>B', int(bits[i:i+8], 2)) for i in xrange(0, len(bits), 8))
+
+
+def sample_data(num_records=40):
+    ''' The HUFF/CDIC records and text records for a dictionary with literal
+    phrases, including non-ASCII bytes, and phrases that are themselves
+    compressed and refer to other, possibly compressed, phrases. '''
+    rand = random.Random(1)
+    num_symbols = sum(count for codelen, count in CODE_COUNTS)
+    literals = [b' ', b'e', b't', b'the ', b'<p>', b'</p>', b'\xc3\xa9', b'\xe2\x80\x9c', b'\x00', b'\xff\xfe']
+    literals += [b'word%d ' % i for i in xrange(num_symbols - len(literals) - 8)]
+    phrases = [(x, True) for x in literals]
+    encoder = Encoder(phrases)  # Only the codes are needed to encode phrases
+    while len(phrases) < num_symbols:
+        # Each compressed phrase refers only to earlier phrases
+        phrases.append((encoder.encode([rand.randrange(len(phrases)) for i in xrange(rand.randint(1, 6))]), False))
+    encoder = Encoder(phrases)
+    records = [encoder.encode([rand.randrange(num_symbols) for i in xrange(rand.randint(0, 400))]) for r in xrange(num_records)]
+    return [encoder.huff] + encoder.cdics, records
+
+
+class HuffCdicTest(unittest.TestCase):
+
+    def test_decoder(self):
+        huffs, records = sample_data()
+        self.assertGreater(len(huffs), 2, 'The dictionary should be spread over more than one CDIC record')
+        reference = HuffReader(huffs).reader
+        expected = map(reference.unpack_reference, records)
+        self.assertIn(b'\xe2\x80\x9c', b''.join(expected))
+        reader = HuffReader(huffs)
+        self.assertEqual(map(reader.unpack, records), expected)
+        # The expanded phrases and cached long codes are re-used
+        self.assertEqual(map(reader.unpack, records), expected)
+        self.assertEqual(decompress_records(huffs, records, max_workers=0), expected)
+
+
+def find_tests():
+    return unittest.defaultTestLoader.loadTestsFromTestCase(HuffCdicTest)
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=4).run(find_tests())
@@ -13,7 +13,7 @@ from struct import pack
 
 from calibre.ebooks import normalize
 from calibre.ebooks.mobi.writer2.serializer import Serializer
-from calibre.ebooks.compression.palmdoc import compress_doc
+from calibre.ebooks.compression.palmdoc import compress_doc_records
 from calibre.ebooks.mobi.langcodes import iana2mobi
 from calibre.utils.filenames import ascii_filename
 from calibre.ebooks.mobi.writer2 import (PALMDOC, UNCOMPRESSED)
@@ -169,11 +169,14 @@ class MobiWriter(object):
         if self.compression != UNCOMPRESSED:
             self.oeb.logger.info('  Compressing markup content...')
 
+        text_records = []
         while text.tell() < self.text_length:
-            data, overlap = create_text_record(text)
-            if self.compression == PALMDOC:
-                data = compress_doc(data)
+            text_records.append(create_text_record(text))
+        compressed = [data for data, overlap in text_records]
+        if self.compression == PALMDOC:
+            compressed = compress_doc_records(compressed)
 
+        for data, (uncompressed, overlap) in zip(compressed, text_records):
             data += overlap
             data += pack(b'>B', len(overlap))
 
@@ -20,7 +20,7 @@ from lxml import etree
 from calibre import isbytestring, force_unicode
 from calibre.ebooks.mobi.utils import (create_text_record, to_base,
         is_guide_ref_start)
-from calibre.ebooks.compression.palmdoc import compress_doc
+from calibre.ebooks.compression.palmdoc import compress_doc_records
 from calibre.ebooks.oeb.base import (OEB_DOCS, OEB_STYLES, SVG_MIME, XPath,
         extract, XHTML, urlnormalize)
 from calibre.ebooks.oeb.normalize_css import condense_sheet
@@ -345,12 +345,15 @@ class KF8Writer(object):
         if self.compress:
             self.oeb.logger.info('\tCompressing markup...')
 
+        text_records = []
         while text.tell() < self.text_length:
-            data, overlap = create_text_record(text)
-            self.uncompressed_record_lengths.append(len(data))
-            if self.compress:
-                data = compress_doc(data)
+            text_records.append(create_text_record(text))
+        compressed = [data for data, overlap in text_records]
+        if self.compress:
+            compressed = compress_doc_records(compressed)
 
+        for data, (uncompressed, overlap) in zip(compressed, text_records):
+            self.uncompressed_record_lengths.append(len(uncompressed))
             data += overlap
             data += pack(b'>B', len(overlap))
 
@@ -14,6 +14,7 @@ from calibre.ebooks.oeb.base import OEB_STYLES, OEB_DOCS, XPath
 from calibre.ebooks.oeb.polish.container import OEB_FONTS
 from calibre.ebooks.oeb.polish.utils import guess_type
 from calibre.utils.fonts.sfnt.subset import subset
+from calibre.utils.fonts.sfnt.subset_cache import subset_cache
 from calibre.utils.fonts.sfnt.errors import UnsupportedFont
 from calibre.utils.fonts.utils import get_font_names
 
@@ -66,7 +67,7 @@ def subset_all_fonts(container, font_stats, report):
             container.log('Subsetting font: %s'%(font_name or name))
             try:
                 nraw, old_sizes, new_sizes = subset(raw, chars,
-                                                warnings=warnings)
+                                                warnings=warnings, cache=subset_cache())
             except UnsupportedFont as e:
                 container.log.warning(
                     'Unsupported font: %s, ignoring.  Error: %s'%(
@@ -11,6 +11,7 @@ from collections import defaultdict
 
 from calibre.ebooks.oeb.base import urlnormalize
 from calibre.utils.fonts.sfnt.subset import subset, NoGlyphs, UnsupportedFont
+from calibre.utils.fonts.sfnt.subset_cache import subset_cache
 from tinycss.fonts3 import parse_font_family
 
 
@@ -157,7 +158,7 @@ class SubsetFonts(object):
                 remove(font)
                 continue
             try:
-                raw, old_stats, new_stats = subset(font['item'].data, font['chars'])
+                raw, old_stats, new_stats = subset(font['item'].data, font['chars'], cache=subset_cache())
             except NoGlyphs:
                 self.log('The font %s has no used glyphs. Removing it.'%font['src'])
                 remove(font)
@@ -25,7 +25,7 @@ class Writer(FormatWriter):
         self.log = log
 
     def write_content(self, oeb_book, out_stream, metadata=None):
-        from calibre.ebooks.compression.palmdoc import compress_doc
+        from calibre.ebooks.compression.palmdoc import compress_doc_records
 
         title = self.opts.title if self.opts.title else oeb_book.metadata.title[0].value if oeb_book.metadata.title != [] else _('Unknown')
 
@@ -34,10 +34,8 @@ class Writer(FormatWriter):
 
         section_lengths = [len(header_record)]
         self.log.info('Compessing data...')
-        for i in range(0, len(txt_records)):
-            self.log.debug('\tCompressing record %i' % i)
-            txt_records[i] = compress_doc(txt_records[i])
-            section_lengths.append(len(txt_records[i]))
+        txt_records = compress_doc_records(txt_records)
+        section_lengths.extend(map(len, txt_records))
 
         out_stream.seek(0)
         hb = PdbHeaderBuilder('TEXtREAd', title)
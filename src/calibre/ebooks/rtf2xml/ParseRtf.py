@@ -25,6 +25,7 @@ from calibre.ebooks.rtf2xml import headings_to_sections, \
     body_styles, preamble_rest, group_styles, \
     inline
 from calibre.ebooks.rtf2xml.old_rtf import OldRtf
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file, discard_memory_files
 
 """
 Here is an example script using the ParseRTF module directly
@@ -186,7 +187,14 @@ class ParseRtf:
         Returns:
             A parsed file in XML, either to standard output or to a file,
             depending on the value of 'output' when the instance was created.
+        Logic:
+            The intermediate results are kept in memory, see tempfiles.py.
+            Only the debug copies are written to disk.
         """
+        with discard_memory_files():
+            return self.__parse_rtf()
+
+    def __parse_rtf(self):
         self.__temp_file = self.__make_temp_file(self.__file)
         # if the self.__deb_dir is true, then create a copy object,
         # set the directory to write to, remove files, and copy
@@ -252,7 +260,7 @@ class ParseRtf:
                                     else self.__file.encode('utf-8')
                 msg +='\nFile %s does not appear to be correctly encoded.\n' % file_name
             try:
-                os.remove(self.__temp_file)
+                remove_file(self.__temp_file)
             except OSError:
                 pass
             raise InvalidRtfException(msg)
@@ -540,7 +548,7 @@ class ParseRtf:
                 out_file=self.__out_file,
             )
         output_obj.output()
-        os.remove(self.__temp_file)
+        remove_file(self.__temp_file)
         return self.__exit_level
 
     def __bracket_match(self, file_name):
@@ -561,9 +569,59 @@ class ParseRtf:
 
     def __make_temp_file(self,file):
         """Make a temporary file to parse"""
-        write_file="rtf_write_file"
+        write_file = mktemp()
         read_obj = file if hasattr(file, 'read') else open(file,'r')
-        with open(write_file, 'wb') as write_obj:
-            for line in read_obj:
-                write_obj.write(line)
+        with open_file(write_file, 'wb') as write_obj:
+            write_obj.write(read_obj.read())
         return write_file
+
+
+def generate_rtf(num_paragraphs):
+    """Generate an RTF document using the most common constructs"""
+    header = (
+        r'{\rtf1\ansi\ansicpg1252\deff0\deflang1033'
+        r'{\fonttbl{\f0\froman\fcharset0 Times New Roman;}{\f1\fswiss\fcharset0 Arial;}}'
+        r'{\colortbl;\red0\green0\blue0;\red255\green0\blue0;\red0\green0\blue255;}'
+        r'{\stylesheet{\s0\f0\fs24 Normal;}{\s1\sb240\sa60\keepn\b\f1\fs32 heading 1;}}'
+        r'{\info{\title Generated document}{\author calibre}}'
+        '\n'
+        r'{\header\pard\plain\qc\f1\fs18 Running header\par}'
+        '\n'
+    )
+    body = []
+    for i in xrange(num_paragraphs):
+        if i % 200 == 0:
+            body.append(r'\pard\plain\s1\f1\fs32\b Chapter %d\par' % (i // 200 + 1))
+        if i % 50 == 25:
+            body.append(r'\trowd\trgaph108\cellx3000\cellx6000 \pard\intbl Cell %d\cell '
+                        r'\pard\intbl {\cf2 red} cell\cell \row\pard' % i)
+        body.append(
+            r'\pard\plain\s0\f0\fs24 Paragraph %d with {\b bold}, {\i italic}, {\ul underlined} '
+            r'and {\cf3 blue} text, some accented characters \'e9\'e8\'e0, a unicode \u8364? '
+            r'character and a {\field{\*\fldinst HYPERLINK "http://example.com/%d"}{\fldrslt link}} '
+            r'to follow.' % (i, i))
+        if i % 40 == 10:
+            body.append(r'{\super\chftn}{\footnote\pard\plain\f0\fs20{\super\chftn} Footnote %d.}' % i)
+        body.append('\\par\n')
+    return header + ''.join(body) + '}'
+
+
+def benchmark(num_paragraphs=20000):
+    """
+    Time the conversion of a large generated document, run with:
+    calibre-debug -c "from calibre.ebooks.rtf2xml.ParseRtf import benchmark; benchmark()"
+    """
+    import time
+    from calibre.ptempfile import TemporaryDirectory
+    raw = generate_rtf(num_paragraphs)
+    with TemporaryDirectory('_rtf2xml_benchmark') as tdir:
+        in_file, out_file = os.path.join(tdir, 'in.rtf'), os.path.join(tdir, 'out.xml')
+        with open(in_file, 'wb') as f:
+            f.write(raw)
+        st = time.time()
+        ParseRtf(in_file=in_file, out_file=out_file, convert_symbol=1,
+                 convert_zapf=1, convert_wingdings=1, convert_caps=1,
+                 form_lists=1, headings_to_sections=1, group_styles=1,
+                 group_borders=1, empty_paragraphs=1).parse_rtf()
+        taken = time.time() - st
+    sys.stdout.write('Converted %.1f MB of RTF in %.1f seconds\n' % (len(raw) / 1024.0 / 1024.0, taken))
@@ -11,10 +11,10 @@
 #                                                                       #
 #                                                                       #
 #########################################################################
-import sys, os
+import sys
 
 from calibre.ebooks.rtf2xml import copy, check_brackets
-from calibre.ptempfile import better_mktemp
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file
 
 
 class AddBrackets:
@@ -44,7 +44,7 @@ class AddBrackets:
         self.__file = in_file
         self.__bug_handler = bug_handler
         self.__copy = copy
-        self.__write_to = better_mktemp()
+        self.__write_to = mktemp()
         self.__run_level = run_level
         self.__state_dict = {
             'before_body'           : self.__before_body_func,
@@ -201,8 +201,8 @@ class AddBrackets:
         """
         """
         self.__initiate_values()
-        with open(self.__file, 'r') as read_obj:
-            with open(self.__write_to, 'w') as self.__write_obj:
+        with open_file(self.__file, 'r') as read_obj:
+            with open_file(self.__write_to, 'w') as self.__write_obj:
                 for line in read_obj:
                     self.__token_info = line[:16]
                     if self.__token_info == 'ob<nu<open-brack':
@@ -226,4 +226,4 @@ class AddBrackets:
                 sys.stderr.write(
                     'Sorry, but this files has a mix of old and new RTF.\n'
                     'Some characteristics cannot be converted.\n')
-        os.remove(self.__write_to)
+        remove_file(self.__write_to)
@@ -10,6 +10,7 @@
 #                                                                       #
 #                                                                       #
 #########################################################################
+from calibre.ebooks.rtf2xml.tempfiles import open_file
 
 
 class CheckBrackets:
@@ -41,7 +42,7 @@ class CheckBrackets:
 
     def check_brackets(self):
         line_count = 0
-        with open(self.__file, 'r') as read_obj:
+        with open_file(self.__file, 'r') as read_obj:
             for line in read_obj:
                 line_count += 1
                 self.__token_info = line[:16]
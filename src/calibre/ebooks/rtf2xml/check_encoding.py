@@ -1,6 +1,8 @@
 #!/usr/bin/env python2
 import sys
 
+from calibre.ebooks.rtf2xml.tempfiles import open_file
+
 
 class CheckEncoding:
 
@@ -18,7 +20,7 @@ class CheckEncoding:
 
     def check_encoding(self, path, encoding='us-ascii', verbose=True):
         line_num = 0
-        with open(path, 'r') as read_obj:
+        with open_file(path, 'r') as read_obj:
             for line in read_obj:
                 line_num += 1
                 try:
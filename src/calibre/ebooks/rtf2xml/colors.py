@@ -10,10 +10,10 @@
 #                                                                       #
 #                                                                       #
 #########################################################################
-import sys, os, re
+import sys, re
 
 from calibre.ebooks.rtf2xml import copy
-from calibre.ptempfile import better_mktemp
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file
 
 
 class Colors:
@@ -41,7 +41,7 @@ class Colors:
         self.__copy = copy
         self.__bug_handler = bug_handler
         self.__line = 0
-        self.__write_to = better_mktemp()
+        self.__write_to = mktemp()
         self.__run_level = run_level
 
     def __initiate_values(self):
@@ -236,8 +236,8 @@ class Colors:
             info, and substitute the number with the hex number.
         """
         self.__initiate_values()
-        with open(self.__file, 'r') as read_obj:
-            with open(self.__write_to, 'w') as self.__write_obj:
+        with open_file(self.__file, 'r') as read_obj:
+            with open_file(self.__write_to, 'w') as self.__write_obj:
                 for line in read_obj:
                     self.__line+=1
                     self.__token_info = line[:16]
@@ -253,4 +253,4 @@ class Colors:
         if self.__copy:
             copy_obj.copy_file(self.__write_to, "color.data")
         copy_obj.rename(self.__write_to, self.__file)
-        os.remove(self.__write_to)
+        remove_file(self.__write_to)
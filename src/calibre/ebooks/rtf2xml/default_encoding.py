@@ -56,6 +56,7 @@ Codepages as to RTF 1.9.1:
     57011	Punjabi
 '''
 import re
+from calibre.ebooks.rtf2xml.tempfiles import open_file
 
 
 class DefaultEncoding:
@@ -124,7 +125,7 @@ class DefaultEncoding:
         return self.__platform
 
     def _encoding(self):
-        with open(self.__file, 'r') as read_obj:
+        with open_file(self.__file, 'r') as read_obj:
             cpfound = False
             if not self.__fetchraw:
                 for line in read_obj:
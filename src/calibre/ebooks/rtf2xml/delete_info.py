@@ -10,10 +10,10 @@
 #                                                                       #
 #                                                                       #
 #########################################################################
-import sys, os
+import sys
 
 from calibre.ebooks.rtf2xml import copy
-from calibre.ptempfile import better_mktemp
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file
 
 
 class DeleteInfo:
@@ -28,7 +28,7 @@ class DeleteInfo:
         self.__file = in_file
         self.__bug_handler = bug_handler
         self.__copy = copy
-        self.__write_to = better_mktemp()
+        self.__write_to = mktemp()
         self.__run_level = run_level
         self.__initiate_allow()
         self.__bracket_count= 0
@@ -185,8 +185,8 @@ class DeleteInfo:
     def delete_info(self):
         """Main method for handling other methods. Read one line at
         a time, and determine whether to print the line based on the state."""
-        with open(self.__file, 'r') as read_obj:
-            with open(self.__write_to, 'w') as self.__write_obj:
+        with open_file(self.__file, 'r') as read_obj:
+            with open_file(self.__write_to, 'w') as self.__write_obj:
                 for line in read_obj:
                     # ob<nu<open-brack<0001
                     self.__token_info = line[:16]
@@ -206,5 +206,5 @@ class DeleteInfo:
         if self.__copy:
             copy_obj.copy_file(self.__write_to, "delete_info.data")
         copy_obj.rename(self.__write_to, self.__file)
-        os.remove(self.__write_to)
+        remove_file(self.__write_to)
         return self.__found_delete
@@ -10,9 +10,9 @@
 #                                                                       #
 #                                                                       #
 #########################################################################
-import sys, os
+import sys
 from calibre.ebooks.rtf2xml import field_strings, copy
-from calibre.ptempfile import better_mktemp
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file
 
 
 class FieldsLarge:
@@ -110,7 +110,7 @@ Examples
         self.__bug_handler = bug_handler
         self.__copy = copy
         self.__run_level = run_level
-        self.__write_to = better_mktemp()
+        self.__write_to = mktemp()
 
     def __initiate_values(self):
         """
@@ -351,8 +351,8 @@ Examples
             If the state is body, send the line to the body method.
         """
         self.__initiate_values()
-        read_obj = open(self.__file, 'r')
-        self.__write_obj = open(self.__write_to, 'w')
+        read_obj = open_file(self.__file, 'r')
+        self.__write_obj = open_file(self.__write_to, 'w')
         line_to_read = 1
         while line_to_read:
             line_to_read = read_obj.readline()
@@ -373,4 +373,4 @@ Examples
         if self.__copy:
             copy_obj.copy_file(self.__write_to, "fields_large.data")
         copy_obj.rename(self.__write_to, self.__file)
-        os.remove(self.__write_to)
+        remove_file(self.__write_to)
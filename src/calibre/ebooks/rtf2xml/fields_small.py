@@ -10,10 +10,10 @@
 #                                                                       #
 #                                                                       #
 #########################################################################
-import sys, os, re
+import sys, re
 
 from calibre.ebooks.rtf2xml import field_strings, copy
-from calibre.ptempfile import better_mktemp
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file
 
 
 class FieldsSmall:
@@ -53,7 +53,7 @@ file.
         self.__file = in_file
         self.__bug_handler = bug_handler
         self.__copy = copy
-        self.__write_to = better_mktemp()
+        self.__write_to = mktemp()
         self.__run_level = run_level
 
     def __initiate_values(self):
@@ -438,8 +438,8 @@ file.
            bookmark.
         """
         self.__initiate_values()
-        with open(self.__file, 'r') as read_obj:
-            with open(self.__write_to, 'w') as self.__write_obj:
+        with open_file(self.__file, 'r') as read_obj:
+            with open_file(self.__write_to, 'w') as self.__write_obj:
                 for line in read_obj:
                     self.__token_info = line[:16]
                     if self.__token_info == 'ob<nu<open-brack':
@@ -455,4 +455,4 @@ file.
         if self.__copy:
             copy_obj.copy_file(self.__write_to, "fields_small.data")
         copy_obj.rename(self.__write_to, self.__file)
-        os.remove(self.__write_to)
+        remove_file(self.__write_to)
@@ -10,10 +10,10 @@
 #                                                                       #
 #                                                                       #
 #########################################################################
-import sys, os
+import sys
 
 from calibre.ebooks.rtf2xml import copy
-from calibre.ptempfile import better_mktemp
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file
 
 
 class Fonts:
@@ -43,7 +43,7 @@ class Fonts:
         self.__bug_handler = bug_handler
         self.__copy = copy
         self.__default_font_num = default_font_num
-        self.__write_to = better_mktemp()
+        self.__write_to = mktemp()
         self.__run_level = run_level
 
     def __initiate_values(self):
@@ -204,8 +204,8 @@ class Fonts:
             info. Substitute a font name for a font number.
             """
         self.__initiate_values()
-        with open(self.__file, 'r') as read_obj:
-            with open(self.__write_to, 'w') as self.__write_obj:
+        with open_file(self.__file, 'r') as read_obj:
+            with open_file(self.__write_to, 'w') as self.__write_obj:
                 for line in read_obj:
                     self.__token_info = line[:16]
                     action = self.__state_dict.get(self.__state)
@@ -220,5 +220,5 @@ class Fonts:
         if self.__copy:
             copy_obj.copy_file(self.__write_to, "fonts.data")
         copy_obj.rename(self.__write_to, self.__file)
-        os.remove(self.__write_to)
+        remove_file(self.__write_to)
         return self.__special_font_dict
@@ -10,9 +10,9 @@
 #                                                                       #
 #                                                                       #
 #########################################################################
-import sys, os,  re
+import sys, re
 from calibre.ebooks.rtf2xml import copy
-from calibre.ptempfile import better_mktemp
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file
 
 
 class GroupStyles:
@@ -44,7 +44,7 @@ class GroupStyles:
         self.__bug_handler = bug_handler
         self.__copy = copy
         self.__run_level = run_level
-        self.__write_to =  better_mktemp()
+        self.__write_to =  mktemp()
         self.__wrap = wrap
 
     def __initiate_values(self):
@@ -231,8 +231,8 @@ class GroupStyles:
         Logic:
         """
         self.__initiate_values()
-        read_obj = open(self.__file, 'r')
-        self.__write_obj = open(self.__write_to, 'w')
+        read_obj = open_file(self.__file, 'r')
+        self.__write_obj = open_file(self.__write_to, 'w')
         line_to_read = 1
         while line_to_read:
             line_to_read = read_obj.readline()
@@ -247,4 +247,4 @@ class GroupStyles:
         if self.__copy:
             copy_obj.copy_file(self.__write_to, "group_styles.data")
         copy_obj.rename(self.__write_to, self.__file)
-        os.remove(self.__write_to)
+        remove_file(self.__write_to)
@@ -10,10 +10,10 @@
 #                                                                       #
 #                                                                       #
 #########################################################################
-import sys, os
+import sys
 
 from calibre.ebooks.rtf2xml import copy
-from calibre.ptempfile import better_mktemp
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file
 
 
 class Header:
@@ -33,7 +33,7 @@ class Header:
         self.__file = in_file
         self.__bug_handler = bug_handler
         self.__copy = copy
-        self.__write_to = better_mktemp()
+        self.__write_to = mktemp()
         self.__found_a_header = False
 
     def __in_header_func(self, line):
@@ -119,10 +119,10 @@ class Header:
         bottom of the main file.
         """
         self.__initiate_sep_values()
-        self.__header_holder = better_mktemp()
-        with open(self.__file) as read_obj:
-            with open(self.__write_to, 'w') as self.__write_obj:
-                with open(self.__header_holder, 'w') as self.__write_to_head_obj:
+        self.__header_holder = mktemp()
+        with open_file(self.__file) as read_obj:
+            with open_file(self.__write_to, 'w') as self.__write_obj:
+                with open_file(self.__header_holder, 'w') as self.__write_to_head_obj:
                     for line in read_obj:
                         self.__token_info = line[:16]
                         # keep track of opening and closing brackets
@@ -137,21 +137,21 @@ class Header:
                         else:
                             self.__default_sep(line)
 
-        with open(self.__header_holder, 'r') as read_obj:
-            with open(self.__write_to, 'a') as write_obj:
+        with open_file(self.__header_holder, 'r') as read_obj:
+            with open_file(self.__write_to, 'a') as write_obj:
                 write_obj.write(
                 'mi<mk<header-beg\n')
                 for line in read_obj:
                     write_obj.write(line)
                 write_obj.write(
                 'mi<mk<header-end\n')
-        os.remove(self.__header_holder)
+        remove_file(self.__header_holder)
 
         copy_obj = copy.Copy(bug_handler=self.__bug_handler)
         if self.__copy:
             copy_obj.copy_file(self.__write_to, "header_separate.data")
         copy_obj.rename(self.__write_to, self.__file)
-        os.remove(self.__write_to)
+        remove_file(self.__write_to)
 
     def update_info(self, file, copy):
         """
@@ -187,9 +187,9 @@ class Header:
         These two functions do the work of separating the footnotes form the
         body.
         """
-        with open(self.__file) as read_obj:
-            with open(self.__write_to, 'w') as self.__write_obj:
-                with open(self.__header_holder, 'w') as self.__write_to_head_obj:
+        with open_file(self.__file) as read_obj:
+            with open_file(self.__write_to, 'w') as self.__write_obj:
+                with open_file(self.__header_holder, 'w') as self.__write_to_head_obj:
                     for line in read_obj:
                         self.__token_info = line[:16]
                         if self.__state == 'body':
@@ -225,9 +225,9 @@ class Header:
         print out to the third file.
         If no footnote marker is found, simply print out the token (line).
         """
-        self.__read_from_head_obj = open(self.__header_holder, 'r')
-        self.__write_obj = open(self.__write_to2, 'w')
-        with open(self.__write_to, 'r') as read_obj:
+        self.__read_from_head_obj = open_file(self.__header_holder, 'r')
+        self.__write_obj = open_file(self.__write_to2, 'w')
+        with open_file(self.__write_to, 'r') as read_obj:
             for line in read_obj:
                 if line[:16] == 'mi<mk<header-ind':
                     line = self.__get_head_from_temp(line[17:-1])
@@ -245,7 +245,7 @@ class Header:
         """
         if not self.__found_a_header:
             return
-        self.__write_to2 = better_mktemp()
+        self.__write_to2 = mktemp()
         self.__state = 'body'
         self.__get_headers()
         self.__join_from_temp()
@@ -255,5 +255,5 @@ class Header:
         if self.__copy:
             copy_obj.copy_file(self.__write_to, "header_join.data")
         copy_obj.rename(self.__write_to, self.__file)
-        os.remove(self.__write_to)
-        os.remove(self.__header_holder)
+        remove_file(self.__write_to)
+        remove_file(self.__header_holder)
@@ -10,9 +10,9 @@
 #                                                                       #
 #                                                                       #
 #########################################################################
-import os, re
+import re
 from calibre.ebooks.rtf2xml import copy
-from calibre.ptempfile import better_mktemp
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file
 
 
 class HeadingsToSections:
@@ -38,7 +38,7 @@ class HeadingsToSections:
         self.__file = in_file
         self.__bug_handler = bug_handler
         self.__copy = copy
-        self.__write_to = better_mktemp()
+        self.__write_to = mktemp()
 
     def __initiate_values(self):
         """
@@ -207,8 +207,8 @@ class HeadingsToSections:
         Logic:
         """
         self.__initiate_values()
-        read_obj = open(self.__file, 'r')
-        self.__write_obj = open(self.__write_to, 'w')
+        read_obj = open_file(self.__file, 'r')
+        self.__write_obj = open_file(self.__write_to, 'w')
         line_to_read = 1
         while line_to_read:
             line_to_read = read_obj.readline()
@@ -222,4 +222,4 @@ class HeadingsToSections:
         if self.__copy:
             copy_obj.copy_file(self.__write_to, "sections_to_headings.data")
         copy_obj.rename(self.__write_to, self.__file)
-        os.remove(self.__write_to)
+        remove_file(self.__write_to)
@@ -10,9 +10,9 @@
 #                                                                       #
 #                                                                       #
 #########################################################################
-import sys, os, re
+import sys, re
 from calibre.ebooks.rtf2xml import copy
-from calibre.ptempfile import better_mktemp
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file
 
 
 class MakeLists:
@@ -49,7 +49,7 @@ class MakeLists:
         self.__no_headings_as_list = no_headings_as_list
         self.__headings_to_sections = headings_to_sections
         self.__copy = copy
-        self.__write_to = better_mktemp()
+        self.__write_to = mktemp()
         self.__list_of_lists = list_of_lists
         self.__write_list_info = write_list_info
 
@@ -439,8 +439,8 @@ class MakeLists:
         Logic:
         """
         self.__initiate_values()
-        read_obj = open(self.__file, 'r')
-        self.__write_obj = open(self.__write_to, 'w')
+        read_obj = open_file(self.__file, 'r')
+        self.__write_obj = open_file(self.__write_to, 'w')
         line_to_read = 1
         while line_to_read:
             line_to_read = read_obj.readline()
@@ -457,4 +457,4 @@ class MakeLists:
         if self.__copy:
             copy_obj.copy_file(self.__write_to, "make_lists.data")
         copy_obj.rename(self.__write_to, self.__file)
-        os.remove(self.__write_to)
+        remove_file(self.__write_to)
@@ -11,6 +11,7 @@
 #                                                                       #
 #########################################################################
 import sys, os
+from calibre.ebooks.rtf2xml.tempfiles import open_file
 # , codecs
 
 
@@ -83,7 +84,7 @@ class Output:
             sys.stderr.write(msg)
             user_response = raw_input()
         if user_response == 'o':
-            with open(self.__file, 'r') as read_obj:
+            with open_file(self.__file, 'r') as read_obj:
                 with open(self.output_file, 'w') as write_obj:
                     for line in read_obj:
                         write_obj.write(line)
@@ -99,7 +100,7 @@ class Output:
         Logic:
             read one line at a time. Output to standard
         """
-        with open(self.__file, 'r') as read_obj:
+        with open_file(self.__file, 'r') as read_obj:
             with open(self.__out_file, 'w') as write_obj:
                 for line in read_obj:
                     write_obj.write(line)
@@ -113,7 +114,7 @@ class Output:
         Logic:
             read one line at a time. Output to standard
         """
-        with open(self.__file, 'r') as read_obj:
+        with open_file(self.__file, 'r') as read_obj:
             for line in read_obj:
                 sys.stdout.write(line)
 
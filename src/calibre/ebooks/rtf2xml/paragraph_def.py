@@ -10,9 +10,9 @@
 #                                                                       #
 #                                                                       #
 #########################################################################
-import sys, os
+import sys
 from calibre.ebooks.rtf2xml import copy, border_parse
-from calibre.ptempfile import better_mktemp
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file
 
 
 class ParagraphDef:
@@ -72,7 +72,7 @@ if another paragraph_def is found, the state changes to collect_tokens.
         self.__default_font = default_font
         self.__copy = copy
         self.__run_level = run_level
-        self.__write_to = better_mktemp()
+        self.__write_to = mktemp()
 
     def __initiate_values(self):
         """
@@ -742,8 +742,8 @@ if another paragraph_def is found, the state changes to collect_tokens.
             the state.
         """
         self.__initiate_values()
-        read_obj = open(self.__file, 'r')
-        self.__write_obj = open(self.__write_to, 'w')
+        read_obj = open_file(self.__file, 'r')
+        self.__write_obj = open_file(self.__write_to, 'w')
         line_to_read = 1
         while line_to_read:
             line_to_read = read_obj.readline()
@@ -760,5 +760,5 @@ if another paragraph_def is found, the state changes to collect_tokens.
         if self.__copy:
             copy_obj.copy_file(self.__write_to, "paragraphs_def.data")
         copy_obj.rename(self.__write_to, self.__file)
-        os.remove(self.__write_to)
+        remove_file(self.__write_to)
         return self.__body_style_strings
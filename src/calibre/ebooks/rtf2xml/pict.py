@@ -13,7 +13,7 @@
 import sys, os
 
 from calibre.ebooks.rtf2xml import copy
-from calibre.ptempfile import better_mktemp
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file
 
 
 class Pict:
@@ -30,7 +30,7 @@ class Pict:
         self.__bug_handler = bug_handler
         self.__copy = copy
         self.__run_level = run_level
-        self.__write_to = better_mktemp()
+        self.__write_to = mktemp()
         self.__bracket_count = 0
         self.__ob_count = 0
         self.__cb_count = 0
@@ -143,8 +143,8 @@ class Pict:
 
     def process_pict(self):
         self.__make_dir()
-        with open(self.__file) as read_obj:
-            with open(self.__write_to, 'w') as write_obj:
+        with open_file(self.__file) as read_obj:
+            with open_file(self.__write_to, 'w') as write_obj:
                 for line in read_obj:
                     self.__token_info = line[:16]
                     if self.__token_info == 'ob<nu<open-brack':
@@ -170,7 +170,7 @@ class Pict:
             except:
                 pass
         copy_obj.rename(self.__write_to, self.__file)
-        os.remove(self.__write_to)
+        remove_file(self.__write_to)
         if self.__pict_count == 0:
             try:
                 os.rmdir(self.__dir_name)
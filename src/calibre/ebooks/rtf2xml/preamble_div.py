@@ -10,9 +10,9 @@
 #                                                                       #
 #                                                                       #
 #########################################################################
-import sys, os
+import sys
 from calibre.ebooks.rtf2xml import copy, override_table, list_table
-from calibre.ptempfile import better_mktemp
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file
 
 
 class PreambleDiv:
@@ -40,7 +40,7 @@ class PreambleDiv:
         self.__bug_handler = bug_handler
         self.__copy = copy
         self.__no_namespace = no_namespace
-        self.__write_to = better_mktemp()
+        self.__write_to = mktemp()
         self.__run_level = run_level
 
     def __initiate_values(self):
@@ -561,8 +561,8 @@ cw<ci<font-style<nu<0
 
     def make_preamble_divisions(self):
         self.__initiate_values()
-        read_obj = open(self.__file, 'r')
-        self.__write_obj = open(self.__write_to, 'w')
+        read_obj = open_file(self.__file, 'r')
+        self.__write_obj = open_file(self.__write_to, 'w')
         line_to_read = 1
         while line_to_read:
             line_to_read = read_obj.readline()
@@ -584,5 +584,5 @@ cw<ci<font-style<nu<0
         if self.__copy:
             copy_obj.copy_file(self.__write_to, "preamble_div.data")
         copy_obj.rename(self.__write_to, self.__file)
-        os.remove(self.__write_to)
+        remove_file(self.__write_to)
         return self.__all_lists
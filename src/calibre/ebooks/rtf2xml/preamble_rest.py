@@ -10,9 +10,10 @@
 #                                                                       #
 #                                                                       #
 #########################################################################
-import sys,os
+import sys
 
 from calibre.ebooks.rtf2xml import copy
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file
 
 
 class Preamble:
@@ -50,10 +51,7 @@ class Preamble:
         self.__default_font = default_font
         self.__code_page = code_page
         self.__platform = platform
-        if temp_dir:
-            self.__write_to = os.path.join(temp_dir,"info_table_info.data")
-        else:
-            self.__write_to = "info_table_info.data"
+        self.__write_to = mktemp()
 
     def __initiate_values(self):
         """
@@ -139,8 +137,8 @@ class Preamble:
             the list table.
         """
         self.__initiate_values()
-        with open(self.__file, 'r') as read_obj:
-            with open(self.__write_to, 'w') as self.__write_obj:
+        with open_file(self.__file, 'r') as read_obj:
+            with open_file(self.__write_to, 'w') as self.__write_obj:
                 for line in read_obj:
                     self.__token_info = line[:16]
                     action = self.__state_dict.get(self.__state)
@@ -152,4 +150,4 @@ class Preamble:
         if self.__copy:
             copy_obj.copy_file(self.__write_to, "preamble_div.data")
         copy_obj.rename(self.__write_to, self.__file)
-        os.remove(self.__write_to)
+        remove_file(self.__write_to)
@@ -10,10 +10,10 @@
 #                                                                       #
 #                                                                       #
 #########################################################################
-import os, re
+import re
 
 from calibre.ebooks.rtf2xml import copy, check_brackets
-from calibre.ptempfile import better_mktemp
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file
 
 
 class ProcessTokens:
@@ -34,7 +34,7 @@ class ProcessTokens:
         self.__bug_handler = bug_handler
         self.__copy = copy
         self.__run_level = run_level
-        self.__write_to = better_mktemp()
+        self.__write_to = mktemp()
         self.initiate_token_dict()
         # self.initiate_token_actions()
         self.compile_expressions()
@@ -784,8 +784,8 @@ class ProcessTokens:
     def process_tokens(self):
         """Main method for handling other methods. """
         line_count = 0
-        with open(self.__file, 'r') as read_obj:
-            with open(self.__write_to, 'wb') as write_obj:
+        with open_file(self.__file, 'r') as read_obj:
+            with open_file(self.__write_to, 'wb') as write_obj:
                 for line in read_obj:
                     token = line.replace("\n","")
                     line_count += 1
@@ -829,7 +829,7 @@ class ProcessTokens:
         if self.__copy:
             copy_obj.copy_file(self.__write_to, "processed_tokens.data")
         copy_obj.rename(self.__write_to, self.__file)
-        os.remove(self.__write_to)
+        remove_file(self.__write_to)
 
         bad_brackets = self.__check_brackets(self.__file)
         if bad_brackets:
@@ -10,11 +10,10 @@
 #                                                                       #
 #                                                                       #
 #########################################################################
-import os
 
 from calibre.ebooks.rtf2xml import copy
 from calibre.utils.cleantext import clean_ascii_chars
-from calibre.ptempfile import better_mktemp
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file
 
 
 class ReplaceIllegals:
@@ -30,17 +29,17 @@ class ReplaceIllegals:
         self.__file = in_file
         self.__copy = copy
         self.__run_level = run_level
-        self.__write_to = better_mktemp()
+        self.__write_to = mktemp()
 
     def replace_illegals(self):
         """
         """
-        with open(self.__file, 'r') as read_obj:
-            with open(self.__write_to, 'w') as write_obj:
+        with open_file(self.__file, 'r') as read_obj:
+            with open_file(self.__write_to, 'w') as write_obj:
                 for line in read_obj:
                     write_obj.write(clean_ascii_chars(line))
         copy_obj = copy.Copy()
         if self.__copy:
             copy_obj.copy_file(self.__write_to, "replace_illegals.data")
         copy_obj.rename(self.__write_to, self.__file)
-        os.remove(self.__write_to)
+        remove_file(self.__write_to)
@@ -10,9 +10,8 @@
 #                                                                       #
 #                                                                       #
 #########################################################################
-import os
 from calibre.ebooks.rtf2xml import copy
-from calibre.ptempfile import better_mktemp
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file
 
 # note to self. This is the first module in which I use tempfile. A good idea?
 """
@@ -47,14 +46,14 @@ class TableInfo:
         self.__copy = copy
         self.__table_data = table_data
         self.__run_level = run_level
-        self.__write_to = better_mktemp()
+        self.__write_to = mktemp()
         # self.__write_to = 'table_info.data'
 
     def insert_info(self):
         """
         """
-        read_obj = open(self.__file, 'r')
-        self.__write_obj = open(self.__write_to, 'w')
+        read_obj = open_file(self.__file, 'r')
+        self.__write_obj = open_file(self.__write_to, 'w')
         line_to_read = 1
         while line_to_read:
             line_to_read = read_obj.readline()
@@ -83,4 +82,4 @@ class TableInfo:
         if self.__copy:
             copy_obj.copy_file(self.__write_to, "table_info.data")
         copy_obj.rename(self.__write_to, self.__file)
-        os.remove(self.__write_to)
+        remove_file(self.__write_to)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2017, Kovid Goyal <kovid at kovidgoyal.net>'
+
+'''
+In-memory files for the intermediate results of the rtf2xml passes.
+
+Every pass reads the whole document and writes a transformed copy of it,
+which then replaces the original. Doing that with temporary files on disk
+means each pass pays for writing, copying and reading back the entire
+document. Instead, the passes get names from mktemp() and open them with
+open_file(), the data is held in memory and renaming just moves a reference.
+Real paths are passed through to the filesystem, so the debug copies of the
+intermediate results are still written to disk.
+'''
+
+import os, sys, errno, shutil, threading
+from contextlib import contextmanager
+from cStringIO import StringIO
+from itertools import count
+
+PREFIX = 'rtf2xml-memory:'
+_names = count()
+_state = threading.local()
+
+
+def memory_files():
+    ans = getattr(_state, 'files', None)
+    if ans is None:
+        ans = _state.files = {}
+    return ans
+
+
+def is_memory_file(name):
+    return isinstance(name, basestring) and name.startswith(PREFIX)
+
+
+def mktemp():
+    ''' Return the name of a new, empty, in-memory file. '''
+    name = '%s%d' % (PREFIX, next(_names))
+    memory_files()[name] = b''
+    return name
+
+
+def get_data(name):
+    try:
+        return memory_files()[name]
+    except KeyError:
+        raise IOError(errno.ENOENT, 'No such in-memory file', name)
+
+
+def join(parts):
+    try:
+        data = b''.join(parts)
+    except UnicodeDecodeError:
+        data = None
+    if not isinstance(data, bytes):
+        # Encode unicode the same way as a file opened with open() would
+        encoding = sys.getdefaultencoding()
+        data = b''.join(x.encode(encoding) if isinstance(x, unicode) else x for x in parts)
+    return data
+
+
+class MemoryFile(object):
+
+    def __init__(self, name, mode):
+        self.name, self.mode, self.closed = name, mode, False
+        self.writing = 'r' not in mode
+        if self.writing:
+            # Appending to a list is much faster than writing to a StringIO
+            self.parts = [get_data(name)] if 'a' in mode else []
+            memory_files()[name] = b''
+            self.write, self.writelines = self.parts.append, self.parts.extend
+        else:
+            self.buf = StringIO(get_data(name))
+            self.read, self.readline, self.readlines = self.buf.read, self.buf.readline, self.buf.readlines
+
+    def __iter__(self):
+        return iter(self.buf)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self.writing:
+                memory_files()[self.name] = join(self.parts)
+                del self.parts[:]
+            else:
+                self.buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_file(name, mode='r'):
+    ''' Open the in-memory file name, or the file at the path name. '''
+    if is_memory_file(name):
+        return MemoryFile(name, mode)
+    return open(name, mode)
+
+
+def remove_file(name):
+    if is_memory_file(name):
+        memory_files().pop(name, None)
+    else:
+        os.remove(name)
+
+
+def copy_file(source, dest):
+    ''' Copy source to dest, either of which can be in memory. Copying between
+    in-memory files does not copy any data. '''
+    if is_memory_file(source):
+        data = get_data(source)
+        if is_memory_file(dest):
+            memory_files()[dest] = data
+        else:
+            with open(dest, 'wb') as f:
+                f.write(data)
+    elif is_memory_file(dest):
+        with open(source, 'rb') as f:
+            memory_files()[dest] = f.read()
+    else:
+        shutil.copyfile(source, dest)
+
+
+@contextmanager
+def discard_memory_files():
+    ''' Free any in-memory files created in this thread, during the block. '''
+    before = set(memory_files())
+    try:
+        yield
+    finally:
+        files = memory_files()
+        for name in set(files) - before:
+            del files[name]
@@ -10,11 +10,11 @@
 #                                                                       #
 #                                                                       #
 #########################################################################
-import os, re
+import re
 
 from calibre.ebooks.rtf2xml import copy
 from calibre.utils.mreplace import MReplace
-from calibre.ptempfile import better_mktemp
+from calibre.ebooks.rtf2xml.tempfiles import mktemp, open_file, remove_file
 
 
 class Tokenize:
@@ -30,7 +30,7 @@ class Tokenize:
         self.__file = in_file
         self.__bug_handler = bug_handler
         self.__copy = copy
-        self.__write_to = better_mktemp()
+        self.__write_to = mktemp()
         # self.__write_to = out_file
         self.__compile_expressions()
         # variables
@@ -174,7 +174,7 @@ class Tokenize:
         , uses method self.sub_reg to make basic substitutions,\
         and process tokens by itself"""
         # read
-        with open(self.__file, 'r') as read_obj:
+        with open_file(self.__file, 'r') as read_obj:
             input_file = read_obj.read()
 
         # process simple replacements and split giving us a correct list
@@ -186,14 +186,14 @@ class Tokenize:
         tokens = filter(lambda x: len(x) > 0, tokens)
 
         # write
-        with open(self.__write_to, 'wb') as write_obj:
+        with open_file(self.__write_to, 'wb') as write_obj:
             write_obj.write('\n'.join(tokens))
         # Move and copy
         copy_obj = copy.Copy(bug_handler=self.__bug_handler)
         if self.__copy:
             copy_obj.copy_file(self.__write_to, "tokenize.data")
         copy_obj.rename(self.__write_to, self.__file)
-        os.remove(self.__write_to)
+        remove_file(self.__write_to)
 
         # self.__special_tokens = [ '_', '~', "'", '{', '}' ]
 
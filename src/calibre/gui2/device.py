@@ -3,7 +3,7 @@ __license__   = 'GPL v3'
 __copyright__ = '2008, Kovid Goyal <kovid at kovidgoyal.net>'
 
 # Imports {{{
-import os, traceback, Queue, time, cStringIO, re, sys, weakref
+import os, traceback, Queue, time, cStringIO, sys, weakref
 from threading import Thread, Event
 
 from PyQt5.Qt import (
@@ -23,7 +23,6 @@ from calibre.devices.scanner import DeviceScanner
 from calibre.gui2 import (config, error_dialog, Dispatcher, dynamic,
         warning_dialog, info_dialog, choose_dir, FunctionDispatcher,
         show_restart_warning, gprefs, question_dialog)
-from calibre.ebooks.metadata import authors_to_string
 from calibre import preferred_encoding, prints, force_unicode, as_unicode, sanitize_file_name2
 from calibre.utils.filenames import ascii_filename
 from calibre.devices.errors import (FreeSpaceError, WrongDestinationError,
@@ -1713,7 +1712,7 @@ class DeviceMixin(object):  # {{{
             return
 
         if not self.device_manager.is_device_connected or \
-                        not hasattr(self, 'db_book_uuid_cache'):
+                        not getattr(self, 'device_books_matched', False):
             return loc
 
         if self.book_db_id_cache is None:
@@ -1769,12 +1768,6 @@ class DeviceMixin(object):  # {{{
         except:
             return False
 
-        string_pat = re.compile('(?u)\W|[_]')
-
-        def clean_string(x):
-            x = x.lower() if x else ''
-            return string_pat.sub('', x)
-
         update_metadata = (
            device_prefs['manage_device_metadata'] == 'on_connect' or force_send)
 
@@ -1785,32 +1778,6 @@ class DeviceMixin(object):  # {{{
                 get_covers = True
                 desired_thumbnail_height = self.device_manager.device.THUMBNAIL_HEIGHT
 
-        # Force a reset if the caches are not initialized
-        if reset or not hasattr(self, 'db_book_title_cache'):
-            # Build a cache (map) of the library, so the search isn't On**2
-            db_book_title_cache = {}
-            db_book_uuid_cache = {}
-
-            for id_ in db.data.iterallids():
-                title = clean_string(db.title(id_, index_is_id=True))
-                if title not in db_book_title_cache:
-                    db_book_title_cache[title] = \
-                                {'authors':{}, 'author_sort':{}, 'db_ids':{}}
-                # If there are multiple books in the library with the same title
-                # and author, then remember the last one. That is OK, because as
-                # we can't tell the difference between the books, one is as good
-                # as another.
-                authors = clean_string(db.authors(id_, index_is_id=True))
-                if authors:
-                    db_book_title_cache[title]['authors'][authors] = id_
-                if db.author_sort(id_, index_is_id=True):
-                    aus = clean_string(db.author_sort(id_, index_is_id=True))
-                    db_book_title_cache[title]['author_sort'][aus] = id_
-                db_book_title_cache[title]['db_ids'][id_] = id_
-                db_book_uuid_cache[db.uuid(id_, index_is_id=True)] = id_
-            self.db_book_title_cache = db_book_title_cache
-            self.db_book_uuid_cache = db_book_uuid_cache
-
         book_ids_to_refresh = set()
         book_formats_to_send = []
         books_with_future_dates = []
@@ -1852,11 +1819,10 @@ class DeviceMixin(object):  # {{{
                 return True
 
         # Now iterate through all the books on the device, setting the
-        # in_library field. If the UUID matches a book in the library, then
-        # do not consider that book for other matching. In all cases set
-        # the application_id to the db_id of the matching book. This value
-        # will be used by books_on_device to indicate matches. While we are
-        # going by, update the metadata for a book if automatic management is on
+        # in_library field. In all cases set the application_id to the db_id
+        # of the matching book. This value will be used by books_on_device to
+        # indicate matches. While we are going by, update the metadata for a
+        # book if automatic management is on
 
         total_book_count = 0
         for booklist in booklists:
@@ -1869,6 +1835,8 @@ class DeviceMixin(object):  # {{{
         start_time = time.time()
 
         with BusyCursor():
+            matches = iter(db.new_api.match_device_books(book for booklist in booklists for book in booklist))
+            self.device_books_matched = True
             current_book_count = 0
             for booklist in booklists:
                 for book in booklist:
@@ -1887,57 +1855,18 @@ class DeviceMixin(object):  # {{{
                         QCoreApplication.processEvents(
                             flags=QEventLoop.ExcludeUserInputEvents|QEventLoop.ExcludeSocketNotifiers)
                     current_book_count += 1
-                    book.in_library = None
-                    if getattr(book, 'uuid', None) in self.db_book_uuid_cache:
-                        id_ = db_book_uuid_cache[book.uuid]
+                    id_, book.in_library = next(matches)
+                    if book.in_library == 'UUID':
                         if updateq(id_, book):
                             update_book(id_, book)
-                        book.in_library = 'UUID'
-                        # ensure that the correct application_id is set
-                        book.application_id = id_
+                    elif book.in_library is not None:
+                        update_book(id_, book)
+                    # Set the application_id to the id of the matching book, or
+                    # to None to prevent book_on_device from accidentally
+                    # matching on it
+                    book.application_id = id_
+                    if book.in_library in ('UUID', 'APP_ID', 'DB_ID'):
                         continue
-                    # No UUID exact match. Try metadata matching.
-                    book_title = clean_string(book.title)
-                    d = self.db_book_title_cache.get(book_title, None)
-                    if d is not None:
-                        # At this point we know that the title matches. The book
-                        # will match if any of the db_id, author, or author_sort
-                        # also match.
-                        if getattr(book, 'application_id', None) in d['db_ids']:
-                            id_ = getattr(book, 'application_id', None)
-                            update_book(id_, book)
-                            book.in_library = 'APP_ID'
-                            # app_id already matches a db_id. No need to set it.
-                            continue
-                        # Sonys know their db_id independent of the application_id
-                        # in the metadata cache. Check that as well.
-                        if getattr(book, 'db_id', None) in d['db_ids']:
-                            update_book(book.db_id, book)
-                            book.in_library = 'DB_ID'
-                            book.application_id = book.db_id
-                            continue
-                        # We now know that the application_id is not right. Set it
-                        # to None to prevent book_on_device from accidentally
-                        # matching on it. It will be set to a correct value below if
-                        # the book is matched with one in the library
-                        book.application_id = None
-                        if book.authors:
-                            # Compare against both author and author sort, because
-                            # either can appear as the author
-                            book_authors = clean_string(authors_to_string(book.authors))
-                            if book_authors in d['authors']:
-                                id_ = d['authors'][book_authors]
-                                update_book(id_, book)
-                                book.in_library = 'AUTHOR'
-                                book.application_id = id_
-                            elif book_authors in d['author_sort']:
-                                id_ = d['author_sort'][book_authors]
-                                update_book(id_, book)
-                                book.in_library = 'AUTH_SORT'
-                                book.application_id = id_
-                    else:
-                        # Book definitely not matched. Clear its application ID
-                        book.application_id = None
                     # Set author_sort if it isn't already
                     asort = getattr(book, 'author_sort', None)
                     if not asort and book.authors:
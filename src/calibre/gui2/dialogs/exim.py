@@ -11,7 +11,8 @@ import os, stat
 from PyQt5.Qt import (
     QSize, QStackedLayout, QWidget, QVBoxLayout, QLabel, QPushButton,
     QListWidget, QListWidgetItem, QIcon, Qt, pyqtSignal, QGridLayout,
-    QProgressBar, QDialog, QDialogButtonBox, QScrollArea, QLineEdit, QFrame
+    QProgressBar, QDialog, QDialogButtonBox, QScrollArea, QLineEdit, QFrame,
+    QCheckBox
 )
 
 from calibre import human_readable, as_unicode
@@ -212,6 +213,12 @@ class EximDialog(Dialog):
             i.setSelected(True)
         self.update_disk_usage.connect((
             lambda i, sz: self.lib_list.item(i).setText(self.export_lib_text(self.lib_list.item(i).data(Qt.UserRole), sz))), type=Qt.QueuedConnection)
+        self.incremental_export = ie = QCheckBox(_('Only export the files that changed since a &previous export'), self)
+        ie.setToolTip('<p>' + _(
+            'You will be asked for the folder of a previous export. Files that have not changed since'
+            ' then are not copied again, so the previous export must be kept, importing the new'
+            ' export reads them from it.'))
+        l.addWidget(ie)
 
     def get_lib_sizes(self):
         for i in xrange(self.lib_list.count()):
@@ -343,6 +350,19 @@ class EximDialog(Dialog):
                 'The directory you choose to export the data to must be empty.'), show=True)
             return False
         self.export_dir = path
+        self.previous_export_dir = None
+        if self.incremental_export.isChecked():
+            prev = choose_dir(self, 'previous-export-calibre-dir', _('Choose the folder of the previous export'))
+            if not prev:
+                return False
+            try:
+                Importer(prev)
+            except Exception as e:
+                import traceback
+                error_dialog(self, _('Not valid'), _(
+                    'The folder {0} is not valid: {1}').format(prev, as_unicode(e)), det_msg=traceback.format_exc(), show=True)
+                return False
+            self.previous_export_dir = prev
         return True
 
     def run_export_action(self):
@@ -354,7 +374,8 @@ class EximDialog(Dialog):
             db = gui.current_db
             dbmap[db.library_path] = db.new_api
         return RunAction(_('Exporting all calibre data...'), _(
-            'Failed to export data.'), partial(export, self.export_dir, library_paths=library_paths, dbmap=dbmap),
+            'Failed to export data.'), partial(
+                export, self.export_dir, library_paths=library_paths, dbmap=dbmap, previous_export_dir=self.previous_export_dir),
                       parent=self).exec_() == Dialog.Accepted
 
     def run_import_action(self):
@@ -63,103 +63,47 @@ def group_numbers(numbers):
         yield first, last[1]
 
 
-class ColumnColor(object):  # {{{
-
-    def __init__(self, formatter):
-        self.mi = None
-        self.formatter = formatter
-
-    def __call__(self, id_, key, fmt, db, color_cache, template_cache):
-        key += str(hash(fmt))
-        if id_ in color_cache and key in color_cache[id_]:
-            self.mi = None
-            color = color_cache[id_][key]
-            if color.isValid():
-                return color
-            return None
-        try:
-            if self.mi is None:
-                self.mi = db.new_api.get_proxy_metadata(id_)
-            color = QColor(self.formatter.safe_format(fmt, self.mi, '', self.mi,
-                                                  column_name=key,
-                                                  template_cache=template_cache))
-            color_cache[id_][key] = color
-            if color.isValid():
-                self.mi = None
-                return color
-        except:
-            pass
-# }}}
-
-
 class ColumnIcon(object):  # {{{
 
-    def __init__(self, formatter, model):
-        self.mi = None
-        self.formatter = formatter
+    def __init__(self, model):
         self.model = model
         self.dpr = QApplication.instance().devicePixelRatio()
 
-    def __call__(self, id_, fmts, cache_index, db, icon_cache, icon_bitmap_cache,
-             template_cache):
-        if id_ in icon_cache and cache_index in icon_cache[id_]:
-            self.mi = None
-            return icon_cache[id_][cache_index]
+    def __call__(self, icon_string, icon_bitmap_cache):
+        if icon_string in icon_bitmap_cache:
+            return icon_bitmap_cache[icon_string]
+        result = None
         try:
-            if self.mi is None:
-                self.mi = db.new_api.get_proxy_metadata(id_)
-            icons = []
-            for dex, (kind, fmt) in enumerate(fmts):
-                rule_icons = self.formatter.safe_format(fmt, self.mi, '', self.mi,
-                                    column_name=cache_index+str(dex),
-                                    template_cache=template_cache)
-                if not rule_icons:
-                    continue
-                icon_list = [ic.strip() for ic in rule_icons.split(':')]
-                icons.extend(icon_list)
-                if icon_list and not kind.endswith('_composed'):
-                    break
-
-            if icons:
-                icon_string = ':'.join(icons)
-                if icon_string in icon_bitmap_cache:
-                    icon_bitmap = icon_bitmap_cache[icon_string]
-                    icon_cache[id_][cache_index] = icon_bitmap
-                    return icon_bitmap
-
-                icon_bitmaps = []
-                total_width = 0
-                rh = max(2, self.model.row_height - 4)
-                dim = int(self.dpr * rh)
-                for icon in icons:
-                    d = os.path.join(config_dir, 'cc_icons', icon)
-                    if (os.path.exists(d)):
-                        bm = QPixmap(d)
-                        scaled, nw, nh = fit_image(bm.width(), bm.height(), bm.width(), dim)
-                        bm = bm.scaled(nw, nh, aspectRatioMode=Qt.IgnoreAspectRatio, transformMode=Qt.SmoothTransformation)
-                        bm.setDevicePixelRatio(self.dpr)
-                        icon_bitmaps.append(bm)
-                        total_width += bm.width()
-                if len(icon_bitmaps) > 1:
-                    i = len(icon_bitmaps)
-                    result = QPixmap(total_width + ((i-1)*2), dim)
-                    result.setDevicePixelRatio(self.dpr)
-                    result.fill(Qt.transparent)
-                    painter = QPainter(result)
-                    x = 0
-                    for bm in icon_bitmaps:
-                        painter.drawPixmap(x, 0, bm)
-                        x += int(bm.width() / self.dpr) + 2
-                    painter.end()
-                else:
-                    result = icon_bitmaps[0]
-
-                icon_cache[id_][cache_index] = result
-                icon_bitmap_cache[icon_string] = result
-                self.mi = None
-                return result
+            icon_bitmaps = []
+            total_width = 0
+            rh = max(2, self.model.row_height - 4)
+            dim = int(self.dpr * rh)
+            for icon in icon_string.split(':'):
+                d = os.path.join(config_dir, 'cc_icons', icon)
+                if (os.path.exists(d)):
+                    bm = QPixmap(d)
+                    scaled, nw, nh = fit_image(bm.width(), bm.height(), bm.width(), dim)
+                    bm = bm.scaled(nw, nh, aspectRatioMode=Qt.IgnoreAspectRatio, transformMode=Qt.SmoothTransformation)
+                    bm.setDevicePixelRatio(self.dpr)
+                    icon_bitmaps.append(bm)
+                    total_width += bm.width()
+            if len(icon_bitmaps) > 1:
+                i = len(icon_bitmaps)
+                result = QPixmap(total_width + ((i-1)*2), dim)
+                result.setDevicePixelRatio(self.dpr)
+                result.fill(Qt.transparent)
+                painter = QPainter(result)
+                x = 0
+                for bm in icon_bitmaps:
+                    painter.drawPixmap(x, 0, bm)
+                    x += int(bm.width() / self.dpr) + 2
+                painter.end()
+            elif icon_bitmaps:
+                result = icon_bitmaps[0]
         except:
             pass
+        icon_bitmap_cache[icon_string] = result
+        return result
 # }}}
 
 
@@ -193,9 +137,9 @@ class BooksModel(QAbstractTableModel):  # {{{
         self.db = None
 
         self.formatter = SafeFormat()
+        self.rule_results = None
         self._clear_caches()
-        self.column_color = ColumnColor(self.formatter)
-        self.column_icon = ColumnIcon(self.formatter, self)
+        self.column_icon = ColumnIcon(self)
 
         self.book_on_device = None
         self.editable_cols = ['title', 'authors', 'rating', 'publisher',
@@ -229,16 +173,50 @@ class BooksModel(QAbstractTableModel):  # {{{
         self.read_config()
 
     def _clear_caches(self):
-        self.color_cache = defaultdict(dict)
-        self.icon_cache = defaultdict(dict)
+        self.color_cache = {}
         self.icon_bitmap_cache = {}
         self.cover_grid_emblem_cache = defaultdict(dict)
         self.cover_grid_bitmap_cache = {}
-        self.color_row_fmt_cache = None
-        self.color_template_cache = {}
-        self.icon_template_cache = {}
         self.cover_grid_template_cache = {}
 
+    def update_rule_results(self):
+        ''' The results of the coloring and icon rules are computed in the
+        background and kept up to date by the database, they only need to be
+        recomputed when the rules change. '''
+        if self.db is None:
+            self.stop_rule_results()
+            return
+        color_rules, icon_rules = self.db.prefs['column_color_rules'], self.db.prefs['column_icon_rules']
+        if self.rule_results is None or self.rule_results.rules_changed(color_rules, icon_rules):
+            from calibre.db.rule_results import RuleResults
+            self.stop_rule_results()
+            self.rule_results = RuleResults(color_rules, icon_rules, QColor.isValidColor)
+            self.db.new_api.add_rule_cache(self.rule_results)
+            self.rule_results.start(self.db.new_api)
+
+    def stop_rule_results(self):
+        if self.rule_results is not None:
+            self.rule_results.shutdown()
+            if self.db is not None:
+                self.db.new_api.remove_rule_cache(self.rule_results)
+            self.rule_results = None
+
+    def rule_result(self, target, index):
+        return self.rule_results.result(self.db.new_api, target, self.id(index))
+
+    def rule_color(self, target, index):
+        name = self.rule_result(target, index)
+        if name is not None:
+            ans = self.color_cache.get(name)
+            if ans is None:
+                ans = self.color_cache[name] = QColor(name)
+            return ans
+
+    def rule_icon(self, target, index):
+        icon_string = self.rule_result(target, index)
+        if icon_string is not None:
+            return self.column_icon(icon_string, self.icon_bitmap_cache)
+
     def set_row_height(self, height):
         self.row_height = height
 
@@ -283,6 +261,7 @@ class BooksModel(QAbstractTableModel):  # {{{
         self.alignment_map = {}
         self.ids_to_highlight_set = set()
         self.current_highlighted_idx = None
+        self.stop_rule_results()
         self.db = db
         self.custom_columns = self.db.field_metadata.custom_field_metadata()
         self.column_map = list(self.orig_headers.keys()) + \
@@ -335,6 +314,7 @@ class BooksModel(QAbstractTableModel):  # {{{
 
     def close(self):
         if self.db is not None:
+            self.stop_rule_results()
             self.db.close()
             self.db = None
             self.beginResetModel(), self.endResetModel()
@@ -499,6 +479,7 @@ class BooksModel(QAbstractTableModel):  # {{{
 
     def beginResetModel(self):
         self._clear_caches()
+        self.update_rule_results()
         QAbstractTableModel.beginResetModel(self)
 
     def reset(self):
@@ -866,26 +847,8 @@ class BooksModel(QAbstractTableModel):  # {{{
         if col >= len(self.column_to_dc_map):
             return None
         if role == Qt.DisplayRole:
-            rules = self.db.prefs['column_icon_rules']
-            if rules:
-                key = self.column_map[col]
-                id_ = None
-                fmts = []
-                for kind, k, fmt in rules:
-                    if k == key and kind in {'icon_only', 'icon_only_composed'}:
-                        if id_ is None:
-                            id_ = self.id(index)
-                            self.column_icon.mi = None
-                        fmts.append((kind, fmt))
-
-                if fmts:
-                    cache_index = key + ':DisplayRole'
-                    ccicon = self.column_icon(id_, fmts, cache_index, self.db,
-                                      self.icon_cache, self.icon_bitmap_cache,
-                                      self.icon_template_cache)
-                    if ccicon is not None:
-                        return None
-                    self.icon_cache[id_][cache_index] = None
+            if self.rule_icon(('icon_only', self.column_map[col]), index) is not None:
+                return None
             return self.column_to_dc_map[col](index.row())
         elif role == Qt.ToolTipRole:
             return self.column_to_tc_map[col](index.row())
@@ -896,19 +859,9 @@ class BooksModel(QAbstractTableModel):  # {{{
                 return (QColor('lightgreen'))
         elif role == Qt.ForegroundRole:
             key = self.column_map[col]
-            id_ = self.id(index)
-            self.column_color.mi = None
-
-            if self.color_row_fmt_cache is None:
-                self.color_row_fmt_cache = tuple(fmt for key, fmt in
-                    self.db.prefs['column_color_rules'] if key == color_row_key)
-
-            for k, fmt in self.db.prefs['column_color_rules']:
-                if k == key:
-                    ccol = self.column_color(id_, key, fmt, self.db,
-                                         self.color_cache, self.color_template_cache)
-                    if ccol is not None:
-                        return ccol
+            ccol = self.rule_color(('color', key), index)
+            if ccol is not None:
+                return ccol
 
             if self.is_custom_column(key) and \
                         self.custom_columns[key]['datatype'] == 'enumeration':
@@ -920,48 +873,21 @@ class BooksModel(QAbstractTableModel):  # {{{
                     try:
                         color = QColor(colors[values.index(txt)])
                         if color.isValid():
-                            self.column_color.mi = None
                             return (color)
                     except:
                         pass
 
-            for fmt in self.color_row_fmt_cache:
-                ccol = self.column_color(id_, color_row_key, fmt, self.db,
-                                         self.color_cache, self.color_template_cache)
-                if ccol is not None:
-                    return ccol
-
-            self.column_color.mi = None
-            return None
+            return self.rule_color(('color', color_row_key), index)
         elif role == Qt.DecorationRole:
             default_icon = None
             if self.column_to_dc_decorator_map[col] is not None:
                 default_icon = self.column_to_dc_decorator_map[index.column()](index.row())
-            rules = self.db.prefs['column_icon_rules']
-            if rules:
-                key = self.column_map[col]
-                id_ = None
-                need_icon_with_text = False
-                fmts = []
-                for kind, k, fmt in rules:
-                    if k == key and kind.startswith('icon'):
-                        if id_ is None:
-                            id_ = self.id(index)
-                            self.column_icon.mi = None
-                        fmts.append((kind, fmt))
-                        if kind in ('icon', 'icon_composed'):
-                            need_icon_with_text = True
-                if fmts:
-                    cache_index = key + ':DecorationRole'
-                    ccicon = self.column_icon(id_, fmts, cache_index, self.db,
-                                  self.icon_cache, self.icon_bitmap_cache,
-                                  self.icon_template_cache)
-                    if ccicon is not None:
-                        return ccicon
-                    if need_icon_with_text and default_icon is None:
-                        self.icon_cache[id_][cache_index] = self.bool_blank_icon
-                        return self.bool_blank_icon
-                    self.icon_cache[id_][cache_index] = None
+            key = self.column_map[col]
+            ccicon = self.rule_icon(('icon', key), index)
+            if ccicon is not None:
+                return ccicon
+            if default_icon is None and key in self.rule_results.icons_with_text:
+                return self.bool_blank_icon
             return default_icon
         elif role == Qt.TextAlignmentRole:
             cname = self.column_map[index.column()]
@@ -3,12 +3,12 @@ __copyright__ = '2008, Kovid Goyal <kovid at kovidgoyal.net>'
 ''' Code to manage ebook library'''
 
 
-def db(path=None, read_only=False):
+def db(path=None, read_only=False, lazy_tables=False, compact_tables=False):
     from calibre.db.legacy import LibraryDatabase
     from calibre.utils.config import prefs
     from calibre.utils.filenames import expanduser
     return LibraryDatabase(expanduser(path) if path else prefs['library_path'],
-            read_only=read_only)
+            read_only=read_only, lazy_tables=lazy_tables, compact_tables=compact_tables)
 
 
 def generate_test_db(library_path,  # {{{
@@ -0,0 +1,191 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+from __future__ import (unicode_literals, division, absolute_import,
+                        print_function)
+
+__license__ = 'GPL v3'
+__copyright__ = '2017, Kovid Goyal <kovid at kovidgoyal.net>'
+
+# Rendering of the per-book Description pages of the EPUB/MOBI catalog. The
+# catalog builder pre-computes all per-book data (see
+# CatalogBuilder.generate_description_data()) so that rendering needs nothing
+# but the template and can be farmed out to worker processes.
+
+import os, time
+from Queue import Empty
+
+from lxml import html
+
+from calibre.ebooks.chardet import substitute_entites
+
+CHUNK_SIZE = 200
+# Below this many books the cost of launching worker processes dominates
+MIN_BOOKS_FOR_POOL = 400
+VOID_ELEMENTS = frozenset('area base br col hr img input link meta param'.split())
+
+
+def remove_element(elem):
+    parent = elem.getparent()
+    if parent is None:
+        return
+    if elem.tail:
+        prev = elem.getprevious()
+        if prev is None:
+            parent.text = (parent.text or '') + elem.tail
+        else:
+            prev.tail = (prev.tail or '') + elem.tail
+    parent.remove(elem)
+
+
+def set_text(elem, text):
+    for child in tuple(elem):
+        elem.remove(child)
+    elem.text = text
+
+
+def find(root, tag, cls):
+    for elem in root.iter(tag):
+        if elem.get('class') == cls:
+            yield elem
+
+
+def render_description(template, data):
+    ''' Fill in the description template with the pre-computed data for a
+    single book and return the serialized page as a UTF-8 bytestring. '''
+    raw = substitute_entites(template.format(**data['args']))
+    root = html.fromstring(raw)
+    body = root.find('body')
+
+    # The title anchor for inbound links
+    div = body.makeelement('div', {})
+    div.append(body.makeelement('a', {'id': 'book%d' % data['id']}))
+    body.insert(0, div)
+
+    for a in tuple(find(body, 'a', 'series_id')):
+        if data['series_href'] is None:
+            if data['remove_series']:
+                remove_element(a)
+        else:
+            a.set('href', data['series_href'])
+
+    if data['author_href'] is not None:
+        for a in find(body, 'a', 'author'):
+            a.set('href', data['author_href'])
+            break
+
+    if data['no_publisher']:
+        for td in find(body, 'td', 'publisher'):
+            set_text(td, '\xa0')
+            break
+
+    if data['no_genres']:
+        for p in tuple(find(body, 'p', 'genres'))[:1]:
+            remove_element(p)
+
+    if data['no_formats']:
+        for p in tuple(find(body, 'p', 'formats'))[:1]:
+            remove_element(p)
+
+    if data['no_notes']:
+        for td in find(body, 'td', 'notes'):
+            set_text(td, '\xa0')
+            break
+
+    for td in tuple(find(body, 'td', 'empty')):
+        del td.attrib['class']
+        set_text(td, '\xa0')
+
+    # Avoid self-closed non-void tags, which break HTML parsers
+    for elem in root.iter('*'):
+        if elem.text is None and len(elem) == 0 and elem.tag not in VOID_ELEMENTS:
+            elem.text = ''
+
+    return html.tostring(root, encoding='utf-8', method='xml', pretty_print=True)
+
+
+def render_descriptions(content_dir, items, common_data=None, template=None):
+    ''' Render and write the Description pages for a chunk of books. Used
+    both in process and as the entry point for worker processes, in which case
+    the template is passed as common_data. '''
+    template = common_data if template is None else template
+    for data in items:
+        with lopen(os.path.join(content_dir, 'book_%d.html' % data['id']), 'wb') as f:
+            f.write(render_description(template, data))
+    return len(items)
+
+
+def chunks(items, size=CHUNK_SIZE):
+    for i in xrange(0, len(items), size):
+        yield items[i:i+size]
+
+
+def generate_descriptions(content_dir, items, template, notify=lambda done, total: None, max_workers=None):
+    ''' Write the Description pages for all items to content_dir, using a pool
+    of worker processes for large catalogs. notify is called with the number
+    of pages written so far and the total number of pages. '''
+    total = len(items)
+    if total < MIN_BOOKS_FOR_POOL or max_workers == 0:
+        done = 0
+        for chunk in chunks(items):
+            done += render_descriptions(content_dir, chunk, template=template)
+            notify(done, total)
+        return
+
+    from calibre.utils.ipc.pool import Pool, Failure
+    pool = Pool(max_workers=max_workers, name='CatalogDescriptions')
+    try:
+        pool.set_common_data(template)
+        num_jobs = 0
+        for i, chunk in enumerate(chunks(items)):
+            pool(i, __name__, 'render_descriptions', content_dir, chunk)
+            num_jobs += 1
+        done = 0
+        while num_jobs:
+            try:
+                worker_result = pool.results.get(True, 0.1)
+            except Empty:
+                if pool.failed:
+                    raise Failure(pool.terminal_failure)
+                continue
+            num_jobs -= 1
+            if worker_result.is_terminal_failure:
+                raise Failure(pool.terminal_failure)
+            result = worker_result.result
+            if result.err is not None:
+                raise Exception('Failed to render catalog descriptions with error: %s\n%s' % (result.err, result.traceback))
+            done += result.value
+            notify(done, total)
+    finally:
+        pool.shutdown(), pool.join()
+
+
+def benchmark(num_books=50000, max_workers=None):
+    ''' Time rendering of the Description pages of a synthetic library, run
+    with: calibre-debug -c "from calibre.library.catalogs.descriptions import benchmark; benchmark()" '''
+    from calibre.ebooks.oeb.base import XHTML_NS
+    from calibre.ptempfile import TemporaryDirectory
+    template = P('catalog/template.xhtml', data=True).decode('utf-8')
+    comments = '<p>%s</p>' % ' '.join(['Some words of description.'] * 40)
+    items = []
+    for book_id in xrange(1, num_books + 1):
+        args = dict(
+            author='Author %d' % (book_id % 997), author_prefix='by ',
+            comments=comments, css='', formats='EPUB &middot; MOBI',
+            genres='<a href="Genre_fiction.html">Fiction</a> &middot; <a>History</a>',
+            note_content='', note_source='', pubdate='Jan 2017', publisher='Publisher',
+            pubmonth='Jan', pubyear='2017', rating='&#9733;&#9733;&#9734;&#9734;&#9734; <br/>',
+            series='Series %d' % (book_id % 113), series_index='%d' % (book_id % 7),
+            thumb='<img src="../images/thumbnail_default.jpg" alt="cover thumbnail" />',
+            title='Book %d' % book_id, title_str='Book %d' % book_id, xmlns=XHTML_NS)
+        items.append(dict(
+            id=book_id, args=args, series_href='BySeries.html#series_%d' % (book_id % 113), remove_series=False,
+            author_href='ByAlphaAuthor.html#author_%d' % (book_id % 997), no_publisher=False,
+            no_genres=False, no_formats=False, no_notes=True))
+    with TemporaryDirectory('_catalog_benchmark') as tdir:
+        st = time.time()
+        generate_descriptions(tdir, items, template, max_workers=0)
+        serial = time.time() - st
+        st = time.time()
+        generate_descriptions(tdir, items, template, max_workers=max_workers)
+        parallel = time.time() - st
+    print('Rendered %d descriptions serially in %.1f seconds and in parallel in %.1f seconds' % (num_books, serial, parallel))
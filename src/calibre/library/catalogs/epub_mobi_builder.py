@@ -13,7 +13,6 @@ from calibre.constants import isosx, cache_dir
 from calibre.customize.conversion import DummyReporter
 from calibre.customize.ui import output_profiles
 from calibre.ebooks.BeautifulSoup import BeautifulSoup, BeautifulStoneSoup, Tag, NavigableString
-from calibre.ebooks.chardet import substitute_entites
 from calibre.ebooks.metadata import author_to_author_sort
 from calibre.library.catalogs import AuthorSortMismatchException, EmptyCatalogException, \
                                      InvalidGenresSourceFieldException
@@ -2623,51 +2622,24 @@ class CatalogBuilder(object):
         outfile.close()
         self.html_filelist_1.append("content/ByAlphaTitle.html")
 
-    def generate_html_description_header(self, book):
-        """ Generate the HTML Description header from template.
+    def generate_description_data(self, book):
+        """ Generate the data needed to render the HTML Description for a book.
 
-        Create HTML Description from book metadata and template.
+        Compute the template arguments and post-processing instructions from
+        book metadata, so that the Description can be rendered without access
+        to the catalog builder, possibly in a worker process.
         Called by generate_html_descriptions()
 
         Args:
          book (dict): book metadata
 
         Return:
-         soup (BeautifulSoup): HTML Description for book
+         (dict): template arguments and post-processing instructions, see
+          calibre.library.catalogs.descriptions.render_description()
         """
 
         from calibre.ebooks.oeb.base import XHTML_NS
 
-        def _generate_html():
-            args = dict(
-                        author=author,
-                        author_prefix=author_prefix,
-                        comments=comments,
-                        css=css,
-                        formats=formats,
-                        genres=genres,
-                        note_content=note_content,
-                        note_source=note_source,
-                        pubdate=pubdate,
-                        publisher=publisher,
-                        pubmonth=pubmonth,
-                        pubyear=pubyear,
-                        rating=rating,
-                        series=series,
-                        series_index=series_index,
-                        thumb=thumb,
-                        title=title,
-                        title_str=title_str,
-                        xmlns=XHTML_NS,
-                        )
-            for k, v in args.iteritems():
-                if isbytestring(v):
-                    args[k] = v.decode('utf-8')
-            generated_html = P('catalog/template.xhtml',
-                    data=True).decode('utf-8').format(**args)
-            generated_html = substitute_entites(generated_html)
-            return BeautifulSoup(generated_html)
-
         # Generate the template arguments
         css = P('catalog/stylesheet.css', data=True).decode('utf-8')
         title_str = title = escape(book['title'])
@@ -2692,23 +2664,16 @@ class CatalogBuilder(object):
         # Genres
         genres = ''
         if 'genres' in book:
-            _soup = BeautifulSoup('')
-            genresTag = Tag(_soup, 'p')
-            gtc = 0
-            for (i, tag) in enumerate(sorted(book.get('genres', []))):
-                aTag = Tag(_soup, 'a')
+            links = []
+            for tag in sorted(book.get('genres', [])):
+                href = ''
                 if self.opts.generate_genres:
                     try:
-                        aTag['href'] = "Genre_%s.html" % self.genre_tags_dict[tag]
+                        href = ' href="Genre_%s.html"' % self.genre_tags_dict[tag]
                     except KeyError:
                         pass
-                aTag.insert(0, escape(NavigableString(tag)))
-                genresTag.insert(gtc, aTag)
-                gtc += 1
-                if i < len(book['genres']) - 1:
-                    genresTag.insert(gtc, NavigableString(' &middot; '))
-                    gtc += 1
-            genres = genresTag.renderContents()
+                links.append('<a%s>%s</a>' % (href, escape(force_unicode(tag))))
+            genres = ' &middot; '.join(links)
 
         # Formats
         formats = []
@@ -2725,13 +2690,11 @@ class CatalogBuilder(object):
             pubdate = pubyear = pubmonth = ''
 
         # Thumb
-        _soup = BeautifulSoup('<html>', selfClosingTags=['img'])
-        thumb = Tag(_soup, "img")
         if 'cover' in book and book['cover']:
-            thumb['src'] = "../images/thumbnail_%d.jpg" % int(book['id'])
+            thumb = "../images/thumbnail_%d.jpg" % int(book['id'])
         else:
-            thumb['src'] = "../images/thumbnail_default.jpg"
-        thumb['alt'] = "cover thumbnail"
+            thumb = "../images/thumbnail_default.jpg"
+        thumb = '<img src="%s" alt="cover thumbnail" />' % thumb
 
         # Publisher
         publisher = ' '
@@ -2758,67 +2721,55 @@ class CatalogBuilder(object):
         if 'description' in book and book['description'] > '':
             comments = book['description']
 
-        # >>>> Populate the template <<<<
-        soup = _generate_html()
-
-        # >>>> Post-process the template <<<<
-        body = soup.find('body')
-        btc = 0
-        # Insert the title anchor for inbound links
-        aTag = Tag(soup, "a")
-        aTag['id'] = "book%d" % int(book['id'])
-        divTag = Tag(soup, 'div')
-        divTag.insert(0, aTag)
-        body.insert(btc, divTag)
-        btc += 1
-
-        # Insert the link to the series or remove <a class="series">
-        aTag = body.find('a', attrs={'class': 'series_id'})
-        if aTag:
-            if book['series']:
-                if self.opts.generate_series:
-                    aTag['href'] = "%s.html#%s" % ('BySeries', self.generate_series_anchor(book['series']))
-            else:
-                aTag.extract()
-
-        # Insert the author link
-        aTag = body.find('a', attrs={'class': 'author'})
-        if self.opts.generate_authors and aTag:
-            aTag['href'] = "%s.html#%s" % ("ByAlphaAuthor",
-                                        self.generate_author_anchor(book['author']))
-
-        if publisher == ' ':
-            publisherTag = body.find('td', attrs={'class': 'publisher'})
-            if publisherTag:
-                publisherTag.contents[0].replaceWith('&nbsp;')
-
-        if not genres:
-            genresTag = body.find('p', attrs={'class': 'genres'})
-            if genresTag:
-                genresTag.extract()
-
-        if not formats:
-            formatsTag = body.find('p', attrs={'class': 'formats'})
-            if formatsTag:
-                formatsTag.extract()
-
-        if note_content == '':
-            tdTag = body.find('td', attrs={'class': 'notes'})
-            if tdTag:
-                tdTag.contents[0].replaceWith('&nbsp;')
-
-        emptyTags = body.findAll('td', attrs={'class': 'empty'})
-        for mt in emptyTags:
-            newEmptyTag = Tag(BeautifulSoup(), 'td')
-            newEmptyTag.insert(0, NavigableString('&nbsp;'))
-            mt.replaceWith(newEmptyTag)
-
-        return soup
+        args = dict(
+                    author=author,
+                    author_prefix=author_prefix,
+                    comments=comments,
+                    css=css,
+                    formats=formats,
+                    genres=genres,
+                    note_content=note_content,
+                    note_source=note_source,
+                    pubdate=pubdate,
+                    publisher=publisher,
+                    pubmonth=pubmonth,
+                    pubyear=pubyear,
+                    rating=rating,
+                    series=series,
+                    series_index=series_index,
+                    thumb=thumb,
+                    title=title,
+                    title_str=title_str,
+                    xmlns=XHTML_NS,
+                    )
+        for k, v in args.iteritems():
+            if isbytestring(v):
+                args[k] = v.decode('utf-8')
+
+        # Instructions for post-processing the populated template
+        series_href = author_href = None
+        if book['series'] and self.opts.generate_series:
+            series_href = "%s.html#%s" % ('BySeries', self.generate_series_anchor(book['series']))
+        if self.opts.generate_authors:
+            author_href = "%s.html#%s" % ("ByAlphaAuthor", self.generate_author_anchor(book['author']))
+
+        return dict(
+            id=int(book['id']),
+            args=args,
+            series_href=series_href,
+            remove_series=not book['series'],
+            author_href=author_href,
+            no_publisher=publisher == ' ',
+            no_genres=not genres,
+            no_formats=not formats,
+            no_notes=note_content == '',
+        )
 
     def generate_html_descriptions(self):
         """ Generate Description HTML for each book.
 
-        Loop though books, write Description HTML for each book.
+        Collect the Description data for each book, render and write the
+        Description HTML, in worker processes for large catalogs.
 
         Inputs:
          books_by_title (list)
@@ -2827,21 +2778,19 @@ class CatalogBuilder(object):
          (files): Description HTML for each book
         """
 
+        from calibre.library.catalogs.descriptions import generate_descriptions
+
         self.update_progress_full_step(_("Descriptions HTML"))
 
-        for (title_num, title) in enumerate(self.books_by_title):
-            self.update_progress_micro_step("%s %d of %d" %
-                                            (_("Description HTML"),
-                                            title_num, len(self.books_by_title)),
-                                            float(title_num * 100 / len(self.books_by_title)) / 100)
+        items = [self.generate_description_data(title) for title in self.books_by_title]
+        template = P('catalog/template.xhtml', data=True).decode('utf-8')
 
-            # Generate the header from user-customizable template
-            soup = self.generate_html_description_header(title)
+        def notify(done, total):
+            self.update_progress_micro_step("%s %d of %d" %
+                                            (_("Description HTML"), done, total),
+                                            float(done * 100 / total) / 100)
 
-            # Write the book entry to content_dir
-            outfile = open("%s/book_%d.html" % (self.content_dir, int(title['id'])), 'w')
-            outfile.write(soup.prettify())
-            outfile.close()
+        generate_descriptions(self.content_dir, items, template, notify=notify)
 
     def generate_html_empty_header(self, title):
         """ Return a boilerplate HTML header.
@@ -319,10 +319,14 @@ def update_metadata(mi, fmt, stream, plugboards, cdata, error_report=None, plugb
             error_report(fmt, traceback.format_exc())
 
 
-def do_save_book_to_disk(db, book_id, mi, plugboards,
-        formats, root, opts, length):
+def save_cover_and_opf(db, book_id, mi, root, opts, length, opf_path=None):
+    '''
+    Save the cover and OPF of the book, as requested by opts. If opf_path is
+    not None, the OPF is written to it when opts does not ask for the OPF to be
+    saved. Returns the base path of the files of the book, the cover data (None
+    if the cover was not saved) and the path the OPF was written to.
+    '''
     originals = mi.cover, mi.pubdate, mi.timestamp
-    formats_written = False
     try:
         if mi.pubdate:
             mi.pubdate = as_local_time(mi.pubdate)
@@ -348,12 +352,21 @@ def do_save_book_to_disk(db, book_id, mi, plugboards,
                     f.write(cdata)
                 mi.cover = base_name+'.jpg'
         if opts.write_opf:
+            opf_path = base_path + '.opf'
+        if opf_path is not None:
             from calibre.ebooks.metadata.opf2 import metadata_to_opf
             opf = metadata_to_opf(mi)
-            with lopen(base_path+'.opf', 'wb') as f:
+            with lopen(opf_path, 'wb') as f:
                 f.write(opf)
     finally:
         mi.cover, mi.pubdate, mi.timestamp = originals
+    return base_path, cdata, opf_path
+
+
+def do_save_book_to_disk(db, book_id, mi, plugboards,
+        formats, root, opts, length):
+    formats_written = False
+    base_path, cdata = save_cover_and_opf(db, book_id, mi, root, opts, length)[:2]
 
     if not formats:
         return not formats_written, book_id, mi.title
@@ -451,3 +464,257 @@ def update_serialized_metadata(book, common_data=None):
                     report_error(fmt, traceback.format_exc())
 
     return result
+
+
+# Mirroring {{{
+
+MIRROR_MANIFEST = '.calibre-mirror.json'
+MIRROR_VERSION = 1
+
+
+def mirror_options_key(db, opts):
+    ''' All books are saved again when anything that affects how they are
+    saved changes '''
+    import hashlib, json
+    data = [MIRROR_VERSION, db.pref('user_template_functions', [])] + [getattr(opts, x) for x in (
+        'template', 'formats', 'update_metadata', 'write_opf', 'save_cover', 'asciiize',
+        'timefmt', 'to_lowercase', 'replace_whitespace', 'single_dir')]
+    if opts.update_metadata:
+        data.append(db.pref('plugboards', {}))
+    return hashlib.sha1(json.dumps(data, sort_keys=True)).hexdigest()
+
+
+def mirror_state(db, book_id, formats, opts):
+    ''' The state of the book in the library, a book is saved again only when
+    its state changes '''
+    fmts = {}
+    for fmt in formats:
+        # Do not use the cache, the files could have been changed by another
+        # calibre program since it was filled
+        fm = db.format_metadata(book_id, fmt, allow_cache=False)
+        if fm:
+            fmts[fmt] = [fm['size'], fm['mtime'].isoformat()]
+    cover = db.cover_last_modified(book_id) if opts.save_cover else None
+    return {
+        'last_modified': db.field_for('last_modified', book_id).isoformat(),
+        'cover': None if cover is None else cover.isoformat(),
+        'formats': fmts,
+    }
+
+
+def read_mirror_manifest(root):
+    import json
+    try:
+        with lopen(os.path.join(root, MIRROR_MANIFEST), 'rb') as f:
+            ans = json.load(f)
+    except (EnvironmentError, ValueError):
+        ans = {}
+    if ans.get('version') != MIRROR_VERSION:
+        ans = {'version': MIRROR_VERSION, 'options': None, 'books': {}}
+    return ans
+
+
+def write_mirror_manifest(root, manifest):
+    import json
+    from calibre.utils.filenames import atomic_rename
+    path = os.path.join(root, MIRROR_MANIFEST)
+    with lopen(path + '.tmp', 'wb') as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+    atomic_rename(path + '.tmp', path)
+
+
+def remove_mirrored_files(root, names):
+    ''' Remove the files and then any directories left empty '''
+    dirs = set()
+    for name in names:
+        path = os.path.join(root, *name.split('/'))
+        try:
+            os.remove(path)
+        except EnvironmentError:
+            pass
+        dirs.add(os.path.dirname(path))
+    for path in sorted(dirs, key=len, reverse=True):
+        while len(path) > len(root):
+            try:
+                os.rmdir(path)
+            except EnvironmentError:
+                break
+            path = os.path.dirname(path)
+
+
+def prepare_mirrored_book(db, book_id, formats, root, opts, length, tdir):
+    ''' Save the cover and OPF of the book. Returns the path of the book, its
+    files and the job that copies its formats and updates their metadata. '''
+    mi = db.get_metadata(book_id)
+    opf_path = os.path.join(tdir, '%d.opf' % book_id) if opts.update_metadata else None
+    base_path, cdata, opf_path = save_cover_and_opf(db, book_id, mi, root, opts, length, opf_path=opf_path)
+    files = []
+    if cdata:
+        files.append(base_path + '.jpg')
+    if opts.write_opf:
+        files.append(base_path + '.opf')
+    job = {'copy': [], 'last_modified': mi.last_modified.isoformat()}
+    if opts.update_metadata:
+        job['opf'] = opf_path
+        if cdata:
+            job['cover'] = base_path + '.jpg'
+    for fmt in formats:
+        src = db.format_abspath(book_id, fmt)
+        if src is not None:
+            dest = base_path + '.' + fmt
+            job['copy'].append((fmt, src, dest))
+            files.append(dest)
+    relpath = lambda x: os.path.relpath(x, root).replace(os.sep, '/')
+    return relpath(base_path), map(relpath, files), job
+
+
+def mirror_book(book, common_data=None):
+    ''' Run in the worker processes used by :func:`mirror_to_disk`. Copy the
+    formats of a book and update the metadata in the copies. '''
+    import shutil
+    from calibre.customize.ui import can_set_metadata
+    errors, copied = [], []
+    for fmt, src, dest in book['copy']:
+        try:
+            shutil.copyfile(src, dest)
+        except Exception:
+            errors.append(traceback.format_exc())
+        else:
+            copied.append((fmt, dest))
+    metadata_errors = []
+    if copied and book.get('opf'):
+        book['fmts'] = [dest for fmt, dest in copied if can_set_metadata(fmt)]
+        metadata_errors = update_serialized_metadata(book, common_data)
+    return errors, metadata_errors
+
+
+def mirror_to_disk(db, ids, root, opts=None, callback=None, max_workers=None):
+    '''
+    Maintain a mirror of books from the database ``db`` in the directory
+    ``root``. The books are saved as by :func:`save_to_disk`, but what was
+    saved is recorded in a manifest in ``root``. Subsequent runs only save the
+    books that have changed since, and remove the files of books that were
+    deleted from the database or whose paths have changed. The formats are
+    copied and their metadata updated in worker processes, unless
+    ``max_workers`` is zero.
+
+    The other arguments and the return value are the same as for
+    :func:`save_to_disk`.
+    '''
+    from Queue import Empty
+    from calibre.ptempfile import TemporaryDirectory
+    from calibre.utils.ipc.pool import Pool, Failure
+    db = getattr(db, 'new_api', db)
+    root, opts, length = sanitize_args(root, opts)
+    try:
+        os.makedirs(root)
+    except EnvironmentError as err:
+        if err.errno != errno.EEXIST:
+            raise
+    ids = tuple(ids)
+    manifest = read_mirror_manifest(root)
+    books = manifest['books']
+    options = mirror_options_key(db, opts)
+    if manifest['options'] != options:
+        for entry in books.itervalues():
+            entry['state'] = None
+    manifest['options'] = options
+    # Files that are no longer part of the mirror
+    stale = set()
+    for key in tuple(books):
+        if not db.has_id(int(key)):
+            stale |= set(books.pop(key)['files'])
+
+    plugboards = db.pref('plugboards', {})
+    plugboards_cache = {fmt:find_plugboard(plugboard_save_to_disk_value, fmt, plugboards) for fmt in {
+        fmt.lower() for book_id in ids for fmt in db.formats(book_id, verify_formats=False)}}
+    failures = []
+    pool, pending = None, {}
+
+    def keep_files(key, files):
+        # The book is saved again by the next run, at which time the files
+        # saved previously are removed, if they are not saved again
+        entry = books.get(key, {})
+        books[key] = {'state': None, 'path': entry.get('path'), 'files': sorted(set(entry.get('files', ())) | set(files))}
+
+    def finish(book_id, title, state, path, files, no_formats, errors, metadata_errors=()):
+        for fmt, tb in metadata_errors:
+            prints('Failed to set metadata for the', fmt, 'format of', title)
+            prints(tb)
+        key = unicode(book_id)
+        if errors:
+            keep_files(key, files)
+            failed, tb = True, '\n\n'.join(errors)
+        else:
+            stale.update(set(books.get(key, {}).get('files', ())) - set(files))
+            books[key] = {'state': state, 'path': path, 'files': files}
+            failed, tb = no_formats, _('Requested formats not available') if no_formats else ''
+        if failed:
+            failures.append((book_id, title, tb))
+        return not callable(callback) or callback(int(book_id), title, failed, tb)
+
+    with TemporaryDirectory('_mirror_to_disk') as tdir:
+        try:
+            todo = iter(ids)
+            aborted = False
+            while True:
+                while not aborted and (pool is None or len(pending) < 2 * pool.max_workers):
+                    book_id = next(todo, None)
+                    if book_id is None:
+                        break
+                    key = unicode(book_id)
+                    title = db.field_for('title', book_id)
+                    entry = books.get(key)
+                    try:
+                        formats = get_formats(db.formats(book_id), opts.formats)
+                        state = mirror_state(db, book_id, formats, opts)
+                        if entry is not None and entry['state'] == state and all(
+                                os.path.exists(os.path.join(root, *name.split('/'))) for name in entry['files']):
+                            if callable(callback) and not callback(int(book_id), title, False, ''):
+                                aborted = True
+                            continue
+                        path, files, job = prepare_mirrored_book(db, book_id, formats, root, opts, length, tdir)
+                    except Exception:
+                        aborted = not finish(book_id, title, None, None, [], False, [traceback.format_exc()])
+                        continue
+                    args = book_id, title, state, path, files, not job['copy']
+                    if not job['copy']:
+                        aborted = not finish(*args, errors=[])
+                    elif max_workers == 0:
+                        errors, metadata_errors = mirror_book(job, plugboards_cache)
+                        aborted = not finish(*args, errors=errors, metadata_errors=metadata_errors)
+                    else:
+                        if pool is None:
+                            pool = Pool(max_workers=max_workers, name='MirrorToDisk')
+                            pool.set_common_data(plugboards_cache)
+                        pending[book_id] = args
+                        pool(book_id, __name__, 'mirror_book', job)
+                if aborted or not pending:
+                    break
+                try:
+                    worker_result = pool.results.get(True, 0.1)
+                except Empty:
+                    if pool.failed:
+                        raise Failure(pool.terminal_failure)
+                    continue
+                if worker_result.is_terminal_failure:
+                    raise Failure(pool.terminal_failure)
+                args = pending.pop(worker_result.id)
+                result = worker_result.result
+                if result.err is None:
+                    errors, metadata_errors = result.value
+                else:
+                    errors, metadata_errors = ['%s\n%s' % (result.err, result.traceback)], ()
+                aborted = not finish(*args, errors=errors, metadata_errors=metadata_errors)
+        finally:
+            if pool is not None:
+                pool.shutdown(), pool.join()
+            for args in pending.itervalues():
+                keep_files(unicode(args[0]), args[4])
+            # Files saved for more than one book, because the template
+            # evaluated to the same path for them, are not removed
+            stale -= {name for entry in books.itervalues() for name in entry['files']}
+            remove_mirrored_files(root, stale)
+            write_mirror_manifest(root, manifest)
+    return failures
+# }}}
@@ -15,7 +15,7 @@ from lzma.xz import decompress
 from calibre.constants import cache_dir, iswindows
 from calibre.customize.ui import plugin_for_input_format
 from calibre.srv.metadata import book_as_json
-from calibre.srv.render_book import RENDER_VERSION
+from calibre.srv.render_book import PARTIAL_MANIFEST_NAME, RENDER_VERSION
 from calibre.srv.errors import HTTPNotFound, BookNotFound
 from calibre.srv.routes import endpoint, json
 from calibre.srv.utils import get_library_data, get_db
@@ -23,6 +23,10 @@ from calibre.srv.utils import get_library_data, get_db
 cache_lock = RLock()
 queued_jobs = {}
 failed_jobs = {}
+# The staging directories of books that are being rendered, the ready files of
+# a book are served from it while the rest of the book is rendered
+staging_dirs = {}
+partial_manifests = {}
 
 
 def abspath(x):
@@ -79,9 +83,10 @@ def queue_job(ctx, copy_format_to, bhash, fmt, book_id, size, mtime):
         copy_format_to(f)
     tdir = tempfile.mkdtemp('', '', tdir)
     job_id = ctx.start_job('Render book %s (%s)' % (book_id, fmt), 'calibre.srv.render_book', 'render', args=(
-        pathtoebook, tdir, {'size':size, 'mtime':mtime, 'hash':bhash}),
+        pathtoebook, tdir, {'size':size, 'mtime':mtime, 'hash':bhash}), kwargs={'progressive': True},
         job_done_callback=job_done, job_data=(bhash, pathtoebook, tdir))
     queued_jobs[bhash] = job_id
+    staging_dirs[bhash] = tdir
     return job_id
 
 
@@ -109,6 +114,8 @@ def job_done(job):
     with cache_lock:
         bhash, pathtoebook, tdir = job.data
         queued_jobs.pop(bhash, None)
+        staging_dirs.pop(bhash, None)
+        partial_manifests.pop(bhash, None)
         safe_remove(pathtoebook)
         if job.failed:
             failed_jobs[bhash] = (job.was_aborted, job.traceback)
@@ -124,10 +131,31 @@ def job_done(job):
                 failed_jobs[bhash] = (False, traceback.format_exc())
 
 
+def partial_manifest(bhash):
+    ''' Return the latest partial manifest for a book that is being rendered
+    or None. Must be called with the cache_lock held. '''
+    tdir = staging_dirs.get(bhash)
+    if tdir is None:
+        return
+    path = os.path.join(tdir, PARTIAL_MANIFEST_NAME)
+    try:
+        mtime = os.path.getmtime(path)
+        cached = partial_manifests.get(bhash)
+        if cached is None or cached[0] != mtime:
+            with lopen(path, 'rb') as f:
+                cached = partial_manifests[bhash] = mtime, jsonlib.load(f)
+    except EnvironmentError:
+        return
+    return cached[1]
+
+
 @endpoint('/book-manifest/{book_id}/{fmt}', postprocess=json, types={'book_id':int})
 def book_manifest(ctx, rd, book_id, fmt):
     db, library_id = get_library_data(ctx, rd)[:2]
     force_reload = rd.query.get('force_reload') == '1'
+    # Clients that can read a book while it is being rendered get the manifest
+    # of the files that are ready, marked with render_complete=False
+    allow_partial = rd.query.get('allow_partial') == '1'
     if plugin_for_input_format(fmt) is None:
         raise HTTPNotFound('The format %s cannot be viewed' % fmt.upper())
     if not ctx.has_id(rd, db, book_id):
@@ -159,7 +187,14 @@ def book_manifest(ctx, rd, book_id, fmt):
             job_id = queued_jobs.get(bhash)
             if job_id is None:
                 job_id = queue_job(ctx, partial(db.copy_format_to, book_id, fmt), bhash, fmt, book_id, size, mtime)
+            pm = partial_manifest(bhash) if allow_partial else None
     status, result, tb, aborted = ctx.job_status(job_id)
+    if pm is not None:
+        ans = pm.copy()
+        ans['metadata'] = book_as_json(db, book_id)
+        ans['last_read_positions'] = db.get_last_read_positions(book_id, fmt, rd.username or None)
+        ans['job_status'], ans['job_id'] = status, job_id
+        return ans
     return {'aborted': aborted, 'traceback':tb, 'job_status':status, 'job_id':job_id}
 
 
@@ -173,12 +208,21 @@ def book_file(ctx, rd, book_id, fmt, size, mtime, name):
     mpath = abspath(os.path.join(base, bhash, name))
     if not mpath.startswith(base):
         raise HTTPNotFound('No book file with hash: %s and name: %s' % (bhash, name))
-    try:
-        return rd.filesystem_file_with_custom_etag(lopen(mpath, 'rb'), bhash, name)
-    except EnvironmentError as e:
-        if e.errno != errno.ENOENT:
-            raise
-        raise HTTPNotFound('No book file with hash: %s and name: %s' % (bhash, name))
+    paths = [mpath]
+    with cache_lock:
+        pm = partial_manifest(bhash)
+        if pm is not None and name in pm['files']:
+            # The book is still being rendered, but this file is ready. The
+            # staging directory is moved into place when rendering completes,
+            # so fall back to the final location after it.
+            paths += [abspath(os.path.join(staging_dirs[bhash], name)), mpath]
+    for path in paths:
+        try:
+            return rd.filesystem_file_with_custom_etag(lopen(path, 'rb'), bhash, name)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                raise
+    raise HTTPNotFound('No book file with hash: %s and name: %s' % (bhash, name))
 
 
 @endpoint('/book-get-last-read-position/{library_id}/{+which}', postprocess=json)
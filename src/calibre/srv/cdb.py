@@ -8,6 +8,7 @@ from functools import partial
 
 from calibre import as_unicode
 from calibre.db.cli import module_for_cmd
+from calibre.db.cli.transport import UPLOAD_MIME, read_upload_body
 from calibre.srv.errors import HTTPBadRequest, HTTPNotFound, HTTPForbidden
 from calibre.srv.routes import endpoint, msgpack_or_json
 from calibre.srv.utils import get_library_data
@@ -31,13 +32,15 @@ def cdb_run(ctx, rd, which, version):
     db = get_library_data(ctx, rd, strict_library_id=True)[0]
     if ctx.restriction_for(rd, db):
         raise HTTPForbidden('Cannot use the command-line db interface with a user who has per library restrictions')
-    raw = rd.read()
     ct = rd.inheaders.get('Content-Type', all=True)
     try:
-        if MSGPACK_MIME in ct:
-            args = msgpack_loads(raw)
+        if UPLOAD_MIME in ct:
+            # The files are read from the spooled request body as needed
+            args = read_upload_body(rd.request_body_file)
+        elif MSGPACK_MIME in ct:
+            args = msgpack_loads(rd.read())
         elif 'application/json' in ct:
-            args = json_loads(raw)
+            args = json_loads(rd.read())
         else:
             raise HTTPBadRequest('Only JSON or msgpack requests are supported')
     except Exception:
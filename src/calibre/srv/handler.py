@@ -24,6 +24,7 @@ class Context(object):
     jobs_manager = None
     CATEGORY_CACHE_SIZE = 25
     SEARCH_CACHE_SIZE = 100
+    OPDS_ENTRY_CACHE_SIZE = 1000
 
     def __init__(self, libraries, opts, testing=False, notify_changes=None):
         self.opts = opts
@@ -87,9 +87,9 @@ class LibraryBroker(object):
             self.library_name_map[library_id] = basename(original_path)
             self.original_path_map[path] = original_path
         self.loaded_dbs = {}
-        self.category_caches, self.search_caches, self.tag_browser_caches = (
+        self.category_caches, self.search_caches, self.tag_browser_caches, self.opds_entry_caches = (
             defaultdict(OrderedDict), defaultdict(OrderedDict),
-            defaultdict(OrderedDict))
+            defaultdict(OrderedDict), defaultdict(OrderedDict))
 
     def get(self, library_id=None):
         with self:
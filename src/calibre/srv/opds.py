@@ -5,9 +5,11 @@ __license__   = 'GPL v3'
 __copyright__ = '2010, Kovid Goyal <kovid@kovidgoyal.net>'
 __docformat__ = 'restructuredtext en'
 
-import hashlib, binascii
+import hashlib, binascii, os
+from copy import deepcopy
 from functools import partial
 from collections import OrderedDict, namedtuple
+from threading import Lock
 from urllib import urlencode
 
 from lxml import etree, html
@@ -23,6 +25,7 @@ from calibre.utils.date import as_utc, timestampfromdt, is_date_undefined
 from calibre.utils.search_query_parser import ParseException
 
 from calibre.srv.errors import HTTPNotFound, HTTPInternalServerError
+from calibre.srv.http_response import ETaggedDynamicOutput, parse_if_none_match
 from calibre.srv.routes import endpoint
 from calibre.srv.utils import get_library_data, http_date, Offsets
 
@@ -37,14 +40,26 @@ def unhexlify(x):
     return binascii.unhexlify(x).decode('utf-8')
 
 
+ATOM_CONTENT_TYPE = 'application/atom+xml; charset=UTF-8'
+# Distinguishes the ETags of feeds from different runs of the server, as the
+# number of changes made to a library starts at zero for every run
+instance_id = binascii.hexlify(os.urandom(8))
+entry_cache_lock = Lock()
+
+
 def atom(ctx, rd, endpoint, output):
-    rd.outheaders.set('Content-Type', 'application/atom+xml; charset=UTF-8', replace_all=True)
+    rd.outheaders.set('Content-Type', ATOM_CONTENT_TYPE, replace_all=True)
+    if isinstance(output, ETaggedDynamicOutput):
+        return output  # Already serialized by RequestContext.etagged_feed()
+    return serialize_feed(output)
+
+
+def serialize_feed(output):
     if isinstance(output, bytes):
         ans = output  # Assume output is already UTF-8 XML
     elif isinstance(output, type('')):
         ans = output.encode('utf-8')
     else:
-        from lxml import etree
         ans = etree.tostring(output, encoding='utf-8', xml_declaration=True, pretty_print=True)
     return ans
 
@@ -242,6 +257,27 @@ def ACQUISITION_ENTRY(book_id, updated, request_context):
     return ans
 
 
+def CACHED_ACQUISITION_ENTRY(book_id, updated, request_context):
+    ''' The same as ACQUISITION_ENTRY() but re-uses the entry created for a
+    previous request, unless the book has been modified since then. '''
+    db, ctx = request_context.db, request_context.ctx
+    key = (db.field_for('last_modified', book_id), request_context.library_id,
+           tuple(filter(ctx.is_field_displayable, db.field_metadata.ignorable_field_keys())))
+    cache = ctx.library_broker.opds_entry_caches[db.server_library_id]
+    with entry_cache_lock:
+        old = cache.pop(book_id, None)
+        if old is not None and old[0] == key:
+            cache[book_id] = old
+            return deepcopy(old[1])
+    ans = ACQUISITION_ENTRY(book_id, updated, request_context)
+    with entry_cache_lock:
+        # Store a copy, as ans will become part of the feed
+        cache[book_id] = (key, deepcopy(ans))
+        if len(cache) > ctx.OPDS_ENTRY_CACHE_SIZE:
+            cache.popitem(last=False)
+    return ans
+
+
 # }}}
 
 default_feed_title = __appname__ + ' ' + _('Library')
@@ -332,7 +368,7 @@ class AcquisitionFeed(NavFeed):
     def __init__(self, id_, updated, request_context, items, offsets, page_url, up_url, title=None):
         NavFeed.__init__(self, id_, updated, request_context, offsets, page_url, up_url, title=title)
         for book_id in items:
-            self.root.append(ACQUISITION_ENTRY(book_id, updated, request_context))
+            self.root.append(CACHED_ACQUISITION_ENTRY(book_id, updated, request_context))
 
 
 class CategoryFeed(NavFeed):
@@ -389,6 +425,31 @@ class RequestContext(object):
     def search(self, query):
         return self.ctx.search(self.rd, self.db, query)
 
+    def etagged_feed(self, build_feed, *etag_parts):
+        '''
+        Return the feed created by build_feed() with an ETag that changes
+        whenever the library is changed, so that clients polling the feed get
+        a 304 Not Modified response if they already have it. The feed is only
+        created if the client does not have it.
+
+        :param etag_parts: Anything other than the requested URL, the library
+        and the user that determines the contents of the feed.
+        '''
+        db, rd = self.db, self.rd
+        etag = hashlib.sha1()
+        for x in (instance_id, id(db), db.clear_search_cache_count, self.last_modified().isoformat(),
+                  self.library_id, sorted(self.library_map.iteritems()),
+                  rd.username, self.ctx.restriction_for(rd, db),
+                  rd.path, sorted(rd.query.iteritems())) + etag_parts:
+            etag.update(repr(x))
+        etag = '"%s"' % etag.hexdigest()
+        none_match = parse_if_none_match(rd.inheaders.get('If-None-Match', ''))
+        if '*' in none_match or etag in none_match:
+            data = b''  # The server will send 304 Not Modified
+        else:
+            data = serialize_feed(build_feed())
+        return rd.etagged_dynamic_response(etag, lambda: data, content_type=ATOM_CONTENT_TYPE)
+
 
 def get_acquisition_feed(rc, ids, offset, page_url, up_url, id_,
         sort_by='title', ascending=True, feed_title=None):
@@ -402,7 +463,11 @@ def get_acquisition_feed(rc, ids, offset, page_url, up_url, id_,
         items = items[offsets.offset:offsets.offset+max_items]
         lm = rc.last_modified()
         rc.outheaders['Last-Modified'] = http_date(timestampfromdt(lm))
-        return AcquisitionFeed(id_, lm, rc, items, offsets, page_url, up_url, title=feed_title).root
+
+    def build_feed():
+        with rc.db.safe_read_lock:
+            return AcquisitionFeed(id_, lm, rc, items, offsets, page_url, up_url, title=feed_title).root
+    return rc.etagged_feed(build_feed, id_, feed_title, page_url, up_url, items)
 
 
 def get_all_books(rc, which, page_url, up_url, offset=0):
@@ -442,7 +507,7 @@ def get_navcatalog(request_context, which, page_url, up_url, offset=0):
         max_items = request_context.opts.max_opds_items
         offsets = Offsets(offset, max_items, len(items))
         items = list(items)[offsets.offset:offsets.offset+max_items]
-        ans = CategoryFeed(items, which, id_, updated, request_context, offsets,
+        build_feed = partial(CategoryFeed, items, which, id_, updated, request_context, offsets,
             page_url, up_url, title=feed_title)
     else:
         Group = namedtuple('Group', 'text count')
@@ -460,12 +525,12 @@ def get_navcatalog(request_context, which, page_url, up_url, offset=0):
         max_items = request_context.opts.max_opds_items
         offsets = Offsets(offset, max_items, len(items))
         items = items[offsets.offset:offsets.offset+max_items]
-        ans = CategoryGroupFeed(items, which, id_, updated, request_context, offsets,
+        build_feed = partial(CategoryGroupFeed, items, which, id_, updated, request_context, offsets,
             page_url, up_url, title=feed_title)
 
     request_context.outheaders['Last-Modified'] = http_date(timestampfromdt(updated))
 
-    return ans.root
+    return request_context.etagged_feed(lambda: build_feed().root)
 
 
 @endpoint('/opds', postprocess=atom)
@@ -500,7 +565,7 @@ def opds(ctx, rd):
         cats.append((meta['name'], meta['name'], 'N'+category))
     last_modified = db.last_modified()
     rd.outheaders['Last-Modified'] = http_date(timestampfromdt(last_modified))
-    return TopLevel(last_modified, cats, rc).root
+    return rc.etagged_feed(lambda: TopLevel(last_modified, cats, rc).root)
 
 
 @endpoint('/opds/navcatalog/{which}', postprocess=atom)
@@ -616,7 +681,7 @@ def opds_categorygroup(ctx, rd, category, which):
 
     rc.outheaders['Last-Modified'] = http_date(timestampfromdt(updated))
 
-    return CategoryFeed(items, category, id_, updated, rc, offsets, page_url, up_url, title=feed_title).root
+    return rc.etagged_feed(lambda: CategoryFeed(items, category, id_, updated, rc, offsets, page_url, up_url, title=feed_title).root)
 
 
 @endpoint('/opds/search/{query=""}', postprocess=atom)
@@ -28,10 +28,14 @@ from calibre.ebooks.oeb.polish.utils import extract
 from calibre.ebooks.css_transform_rules import StyleDeclaration
 from calibre.ebooks.oeb.polish.toc import get_toc, get_landmarks
 from calibre.ebooks.oeb.polish.utils import guess_type
+from calibre.utils.filenames import atomic_rename
+from calibre.utils.monotonic import monotonic
 from calibre.utils.short_uuid import uuid4
 from calibre.utils.logging import default_log
 
 RENDER_VERSION = 1
+PARTIAL_MANIFEST_NAME = 'calibre-book-partial-manifest.json'
+PUBLISH_INTERVAL = 1  # seconds
 
 BLANK_JPEG = b'\xff\xd8\xff\xdb\x00C\x00\x03\x02\x02\x02\x02\x02\x03\x02\x02\x02\x03\x03\x03\x03\x04\x06\x04\x04\x04\x04\x04\x08\x06\x06\x05\x06\t\x08\n\n\t\x08\t\t\n\x0c\x0f\x0c\n\x0b\x0e\x0b\t\t\r\x11\r\x0e\x0f\x10\x10\x11\x10\n\x0c\x12\x13\x12\x10\x13\x0f\x10\x10\x10\xff\xc9\x00\x0b\x08\x00\x01\x00\x01\x01\x01\x11\x00\xff\xcc\x00\x06\x00\x10\x10\x05\xff\xda\x00\x08\x01\x01\x00\x00?\x00\xd2\xcf \xff\xd9'  # noqa
 
@@ -172,7 +176,7 @@ class Container(ContainerBase):
 
     tweak_mode = True
 
-    def __init__(self, path_to_ebook, tdir, log=None, book_hash=None):
+    def __init__(self, path_to_ebook, tdir, log=None, book_hash=None, progressive=False):
         log = log or default_log
         book_fmt, opfpath, input_fmt = extract_book(path_to_ebook, tdir, log=log)
         ContainerBase.__init__(self, tdir, opfpath, log)
@@ -202,39 +206,87 @@ class Container(ContainerBase):
             'toc_anchor_map': toc_anchor_map(toc),
             'landmarks': landmarks,
             'link_to_map': {},
+            'files': {},
         }
-        # Mark the spine as dirty since we have to ensure it is normalized
-        for name in data['spine']:
-            self.parsed(name), self.dirty(name)
-        self.transform_css()
         self.virtualized_names = set()
-        self.virtualize_resources()
-
-        def manifest_data(name):
-            mt = (self.mime_map.get(name) or 'application/octet-stream').lower()
-            ans = {
-                'size':os.path.getsize(self.name_path_map[name]),
-                'is_virtualized': name in self.virtualized_names,
-                'mimetype':mt,
-                'is_html': mt in OEB_DOCS,
-            }
-            if ans['is_html']:
-                root = self.parsed(name)
-                ans['length'] = l = get_length(root)
-                self.book_render_data['total_length'] += l
-                if name in data['spine']:
-                    self.book_render_data['spine_length'] += l
-                ans['has_maths'] = hm = check_for_maths(root)
-                if hm:
-                    self.book_render_data['has_maths'] = True
-                ans['anchor_map'] = anchor_map(root)
-            return ans
-        data['files'] = {name:manifest_data(name) for name in set(self.name_path_map) - excluded_names}
+        self.progressive, self.last_published = progressive, None
+
+        # The files are processed one at a time, resources first, as they are
+        # needed by the HTML files, then the HTML files in spine order. When
+        # rendering progressively, a partial manifest listing the files that
+        # are ready is published as soon as the first spine item is ready and
+        # periodically thereafter.
+        names = set(self.name_path_map) - excluded_names
+        docs = [name for name in spine if name in names]
+        docs += sorted(name for name in names - set(docs) if self.mime_map[name].lower() in OEB_DOCS)
+        for name in sorted(names - set(docs)):
+            self.render_item(name)
+        for i, name in enumerate(docs):
+            self.render_item(name)
+            self.publish(force=i == 0)
         self.commit()
         for name in excluded_names:
             os.remove(self.name_path_map[name])
+        for name, amap in data['link_to_map'].iteritems():
+            for k, v in tuple(amap.iteritems()):
+                amap[k] = tuple(v)  # needed for JSON serialization
         with lopen(os.path.join(self.root, 'calibre-book-manifest.json'), 'wb') as f:
             f.write(json.dumps(self.book_render_data, ensure_ascii=False).encode('utf-8'))
+        if self.last_published is not None:
+            os.remove(os.path.join(self.root, PARTIAL_MANIFEST_NAME))
+
+    def render_item(self, name):
+        mt = self.mime_map[name].lower()
+        names = [name]
+        if mt in OEB_DOCS:
+            # Mark the file as dirty since we have to ensure it is normalized
+            self.parsed(name), self.dirty(name)
+            names += self.transform_css([name])
+        elif mt in OEB_STYLES:
+            self.transform_css(names)
+        self.virtualize_resources(names)
+        files = self.book_render_data['files']
+        for x in names:
+            files[x] = ans = self.manifest_data(x)
+            if x in self.dirtied:
+                self.commit_item(x)
+            else:
+                self.parsed_cache.pop(x, None)
+            ans['size'] = os.path.getsize(self.name_path_map[x])
+
+    def manifest_data(self, name):
+        data = self.book_render_data
+        mt = (self.mime_map.get(name) or 'application/octet-stream').lower()
+        ans = {
+            'is_virtualized': name in self.virtualized_names,
+            'mimetype':mt,
+            'is_html': mt in OEB_DOCS,
+        }
+        if ans['is_html']:
+            root = self.parsed(name)
+            ans['length'] = l = get_length(root)
+            data['total_length'] += l
+            if name in data['spine']:
+                data['spine_length'] += l
+            ans['has_maths'] = hm = check_for_maths(root)
+            if hm:
+                data['has_maths'] = True
+            ans['anchor_map'] = anchor_map(root)
+        return ans
+
+    def publish(self, force=False):
+        if not self.progressive:
+            return
+        now = monotonic()
+        if not force and self.last_published is not None and now - self.last_published < PUBLISH_INTERVAL:
+            return
+        self.last_published = now
+        data = self.book_render_data.copy()
+        data['render_complete'] = False
+        path = os.path.join(self.root, PARTIAL_MANIFEST_NAME)
+        with lopen(path + '.tmp', 'wb') as f:
+            f.write(json.dumps(data, ensure_ascii=False, default=list).encode('utf-8'))
+        atomic_rename(path + '.tmp', path)
 
     def create_cover_page(self, input_fmt):
         templ = '''
@@ -270,13 +322,16 @@ class Container(ContainerBase):
         self.dirty(self.opf_name)
         return raster_cover_name, titlepage_name
 
-    def transform_css(self):
-        transform_css(self, transform_sheet=transform_sheet, transform_style=transform_declaration)
+    def transform_css(self, names):
+        ''' Transform the CSS in the specified files, returning the names of
+        any stylesheets created from <style> tags '''
+        transform_css(self, transform_sheet=transform_sheet, transform_style=transform_declaration, names=names)
         # Firefox flakes out sometimes when dynamically creating <style> tags,
         # so convert them to external stylesheets to ensure they never fail
         style_xpath = XPath('//h:style')
-        for name, mt in tuple(self.mime_map.iteritems()):
-            mt = mt.lower()
+        added = []
+        for name in names:
+            mt = self.mime_map[name].lower()
             if mt in OEB_DOCS:
                 head = ensure_head(self.parsed(name))
                 for style in style_xpath(self.parsed(name)):
@@ -292,8 +347,10 @@ class Container(ContainerBase):
                         style.set('rel', 'stylesheet')
                         sname = self.add_file(name + '.css', css.encode('utf-8'), modify_name_if_needed=True)
                         style.set('href', self.name_to_href(sname, name))
+                        added.append(sname)
+        return added
 
-    def virtualize_resources(self):
+    def virtualize_resources(self, names):
 
         changed = set()
         link_uid = self.book_render_data['link_uid']
@@ -331,8 +388,8 @@ class Container(ContainerBase):
 
         ltm = self.book_render_data['link_to_map']
 
-        for name, mt in self.mime_map.iteritems():
-            mt = mt.lower()
+        for name in names:
+            mt = self.mime_map[name].lower()
             if mt in OEB_STYLES:
                 replaceUrls(self.parsed(name), partial(link_replacer, name))
                 self.virtualized_names.add(name)
@@ -367,10 +424,6 @@ class Container(ContainerBase):
                 for elem in xlink_xpath(self.parsed(name)):
                     elem.set(xlink, link_replacer(name, elem.get(xlink)))
 
-        for name, amap in ltm.iteritems():
-            for k, v in tuple(amap.iteritems()):
-                amap[k] = tuple(v)  # needed for JSON serialization
-
         tuple(map(self.dirty, changed))
 
     def serialize_item(self, name):
@@ -518,8 +571,8 @@ def html_as_dict(root):
     return {'ns_map':ns_map, 'tag_map':tags, 'tree':tree}
 
 
-def render(pathtoebook, output_dir, book_hash=None):
-    Container(pathtoebook, output_dir, book_hash=book_hash)
+def render(pathtoebook, output_dir, book_hash=None, progressive=False):
+    Container(pathtoebook, output_dir, book_hash=book_hash, progressive=progressive)
 
 
 if __name__ == '__main__':
@@ -6,7 +6,7 @@ from __future__ import (unicode_literals, division, absolute_import,
 __license__ = 'GPL v3'
 __copyright__ = '2015, Kovid Goyal <kovid at kovidgoyal.net>'
 
-import httplib, zlib, json, base64, os
+import httplib, zlib, json, base64, os, binascii
 from functools import partial
 from urllib import urlencode
 from httplib import OK, NOT_FOUND, FORBIDDEN
@@ -82,6 +82,39 @@ class ContentTest(LibraryBaseTest):
             self.ae(set(data['book_ids']), {2})
     # }}}
 
+    def test_opds_etags(self):  # {{{
+        'Test conditional GET and the entry cache for OPDS feeds'
+        with self.create_server() as server:
+            db = server.handler.router.ctx.library_broker.get(None)
+            entry_cache = server.handler.router.ctx.library_broker.opds_entry_caches[db.server_library_id]
+            conn = server.connect()
+            url = '/opds/navcatalog/' + binascii.hexlify(b'Otitle')
+            request = partial(make_request, conn, url, prefix='')
+
+            r, feed = request()
+            self.ae(r.status, httplib.OK)
+            etag = r.getheader('ETag')
+            self.assertTrue(etag)
+            self.assertIn(b'Title One', feed)
+            self.ae(set(entry_cache), set(db.all_book_ids()))
+            r, data = request(headers={'If-None-Match':etag})
+            self.ae(r.status, httplib.NOT_MODIFIED)
+            self.ae(data, b'')
+            r, data = request()
+            self.ae(r.getheader('ETag'), etag)
+            self.ae(data, feed)
+
+            db.set_field('title', {1:'Changed title'})
+            r, data = request(headers={'If-None-Match':etag})
+            self.ae(r.status, httplib.OK)
+            self.assertNotEqual(r.getheader('ETag'), etag)
+            self.assertIn(b'Changed title', data)
+            self.assertNotIn(b'Title Two', data)
+            self.assertIn(b'Title One', data)
+            r, data = request(headers={'If-None-Match':r.getheader('ETag')})
+            self.ae(r.status, httplib.NOT_MODIFIED)
+    # }}}
+
     def test_srv_restrictions(self):
         ' Test that virtual lib. + search restriction works on all end points'
         with self.create_server(auth=True, auth_mode='basic') as server:
@@ -224,3 +224,67 @@ class ContentTest(LibraryBaseTest):
             self.ae(zlib.decompress(raw, 16+zlib.MAX_WBITS), data)
 
     # }}}
+
+    def test_render_book(self):  # {{{
+        'Test rendering of books for the browser reader'
+        from calibre.ptempfile import TemporaryDirectory
+        from calibre.srv.render_book import Container, PARTIAL_MANIFEST_NAME
+
+        class Recorder(Container):
+
+            def __init__(self, *args, **kwargs):
+                self.rendered, self.published = [], []
+                Container.__init__(self, *args, **kwargs)
+
+            def render_item(self, name):
+                self.rendered.append(name)
+                return Container.render_item(self, name)
+
+            def publish(self, force=False):
+                before = self.last_published
+                Container.publish(self, force=force)
+                if self.last_published != before:
+                    with open(os.path.join(self.root, PARTIAL_MANIFEST_NAME), 'rb') as f:
+                        self.published.append((len(self.rendered), json.load(f)))
+
+        for progressive in (False, True):
+            with TemporaryDirectory('_render_book') as tdir:
+                c = Recorder(P('quick_start/eng.epub'), tdir, progressive=progressive)
+                self.assertFalse(os.path.exists(os.path.join(tdir, PARTIAL_MANIFEST_NAME)))
+                with open(os.path.join(tdir, 'calibre-book-manifest.json'), 'rb') as f:
+                    manifest = json.load(f)
+                files, spine = manifest['files'], manifest['spine']
+                self.assertNotIn('render_complete', manifest)
+                self.ae(len(c.rendered), len(set(c.rendered)), 'A file was rendered more than once')
+                # The only other files are the stylesheets created from <style> tags
+                extra = set(files) - set(c.rendered)
+                self.ae(len(extra) + len(c.rendered), len(files))
+                for name in extra:
+                    self.ae(files[name]['mimetype'], 'text/css', name)
+
+                # Resources first, then the HTML files in spine order
+                is_html = [files[name]['is_html'] for name in c.rendered]
+                self.ae(is_html, sorted(is_html))
+                docs = [name for name in c.rendered if files[name]['is_html']]
+                self.ae(docs[:len(spine)], spine)
+
+                # The manifest has the sizes of the rendered files
+                for name, data in files.iteritems():
+                    self.ae(data['size'], os.path.getsize(c.name_path_map[name]), name)
+                    if data['is_html']:
+                        with open(c.name_path_map[name], 'rb') as f:
+                            self.assertIn('tree', json.loads(f.read()), name)
+
+                if not progressive:
+                    self.ae(c.published, [])
+                    continue
+                # The partial manifest is published as soon as the first
+                # spine item is ready and lists only the files that are ready
+                self.assertTrue(c.published)
+                self.ae(c.published[0][0], c.rendered.index(spine[0]) + 1)
+                for num_rendered, data in c.published:
+                    self.assertIs(data['render_complete'], False)
+                    self.ae(set(data['files']) - extra, set(c.rendered[:num_rendered]))
+                    for name in data['files']:
+                        self.ae(data['files'][name]['size'], files[name]['size'], name)
+    # }}}
@@ -6,28 +6,150 @@ from __future__ import (unicode_literals, division, absolute_import,
                         print_function)
 import os, json, struct, hashlib, sys, errno, tempfile, time, shutil, uuid
 from binascii import hexlify
-from collections import Counter
+from collections import Counter, namedtuple
+from io import BytesIO
+from Queue import Queue, Full
+from threading import Thread, Event, Semaphore
 
-from calibre import prints
+from calibre import as_unicode, prints, human_readable
 from calibre.constants import config_dir, iswindows, filesystem_encoding
 from calibre.utils.config_base import prefs, StringConfig, create_global_prefs
 from calibre.utils.config import JSONConfig
 from calibre.utils.filenames import samefile
+from calibre.utils.monotonic import monotonic
+
+# Files up to this size are read (and hashed) into memory by a pool of
+# threads, ahead of being written sequentially, larger files are streamed
+PREFETCH_SIZE = 16 * 1024 * 1024
+PREFETCH_THREADS = 4
+PREFETCH_DEPTH = 8
+
+
+def chunk_size_for(size):
+    # Use larger buffers for larger files, to reduce per call overhead
+    return (8 << 20) if size > (256 << 20) else (1 << 20)
+
+
+def read_ahead(f, chunksize, depth=4):
+    # Read chunks from f in a separate thread, so that reading overlaps with
+    # whatever the consumer does with the chunks
+    q, stop = Queue(depth), Event()
+
+    def put(x):
+        while not stop.is_set():
+            try:
+                q.put(x, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def run():
+        try:
+            while True:
+                raw = f.read(chunksize)
+                if not put(raw) or not raw:
+                    break
+        except Exception as err:
+            put(err)
+
+    t = Thread(target=run, name='ExImReadAhead')
+    t.daemon = True
+    t.start()
+    try:
+        while True:
+            raw = q.get()
+            if isinstance(raw, Exception):
+                raise raw
+            if not raw:
+                break
+            yield raw
+    finally:
+        stop.set()
+        t.join()
+
+
+def prefetch(func, items, num_threads=PREFETCH_THREADS, depth=PREFETCH_DEPTH):
+    ''' Apply func to items in a pool of threads, yielding the results in the
+    order of items. At most depth results are computed ahead of being consumed. '''
+    from multiprocessing.pool import ThreadPool
+    slots, done = Semaphore(depth), Event()
+
+    def tasks():
+        for item in items:
+            slots.acquire()
+            if done.is_set():
+                break
+            yield item
+
+    pool = ThreadPool(num_threads)
+    try:
+        for result in pool.imap(func, tasks()):
+            slots.release()
+            yield result
+    finally:
+        done.set()
+        for i in xrange(depth):
+            slots.release()
+        pool.terminate()
+
+
+class Throughput(object):
+
+    def __init__(self):
+        self.start_time = monotonic()
+        self.transferred = 0
+
+    @property
+    def rate(self):
+        return self.transferred / max(0.001, monotonic() - self.start_time)
+
+    def __call__(self, msg):
+        return '%s (%s/s)' % (msg, human_readable(self.rate))
 
 
 # Export {{{
 
-def send_file(from_obj, to_obj, chunksize=1<<20):
+def file_digest(f, chunksize=1<<20):
     m = hashlib.sha1()
     while True:
-        raw = from_obj.read(chunksize)
+        raw = f.read(chunksize)
         if not raw:
             break
         m.update(raw)
+    return type('')(m.hexdigest())
+
+
+def send_file(from_obj, to_obj, chunksize=1<<20, size=None):
+    m = hashlib.sha1()
+    if size is not None and size > 4 * chunksize:
+        chunks = read_ahead(from_obj, chunksize)
+    else:
+        chunks = iter(lambda: from_obj.read(chunksize), b'')
+    for raw in chunks:
+        m.update(raw)
         to_obj.write(raw)
     return type('')(m.hexdigest())
 
 
+ExportFile = namedtuple('ExportFile', 'key path data digest mtime reused context')
+
+
+def read_for_export(exporter, key, path, context):
+    # Runs in a prefetch thread, must not modify the exporter
+    try:
+        st = os.stat(path)
+    except EnvironmentError:
+        return ExportFile(key, path, None, None, None, None, context)
+    reused = exporter.previous_entry(key, path, st)
+    data = digest = None
+    if reused is None and st.st_size <= PREFETCH_SIZE:
+        with lopen(path, 'rb') as f:
+            data = f.read()
+        digest = type('')(hashlib.sha1(data).hexdigest())
+    return ExportFile(key, path, data, digest, st.st_mtime, reused, context)
+
+
 class FileDest(object):
 
     def __init__(self, key, exporter, mtime=None):
@@ -35,7 +157,7 @@ class FileDest(object):
         self.hasher = hashlib.sha1()
         self.start_pos = exporter.f.tell()
         self._discard = False
-        self.mtime = None
+        self.mtime = mtime
 
     def discard(self):
         self._discard = True
@@ -57,6 +179,7 @@ class FileDest(object):
             size = self.exporter.f.tell() - self.start_pos
             digest = type('')(self.hasher.hexdigest())
             self.exporter.file_metadata[self.key] = (len(self.exporter.parts), self.start_pos, size, digest, self.mtime)
+            self.exporter.throughput.transferred += size
         del self.exporter, self.hasher
 
     def __enter__(self):
@@ -68,18 +191,39 @@ class FileDest(object):
 
 class Exporter(object):
 
-    VERSION = 0
+    # Version 1 exports can contain references to files stored in previous
+    # exports, see reuse_file()
+    VERSION = 1
     TAIL_FMT = b'!II?'  # part_num, version, is_last
     MDATA_SZ_FMT = b'!Q'
     EXT = '.calibre-data'
 
-    def __init__(self, path_to_export_dir, part_size=(1 << 30)):
+    def __init__(self, path_to_export_dir, part_size=(1 << 30), previous=None, verify_digests=False):
+        '''
+        :param previous: An :class:`Importer` for a previous export. If
+            specified, the export is incremental, files that are unchanged
+            since the previous export are not copied, instead they are stored
+            as references to the data in the previous export, see
+            :meth:`reuse_file`. The previous export must be kept around for as
+            long as this export is needed.
+        :param verify_digests: If True, unchanged files are also checked
+            against the digest stored in the previous export. Slower, as
+            every file has to be read, but does not rely on file sizes and
+            modification times.
+        '''
         self.part_size = part_size
         self.base = os.path.abspath(path_to_export_dir)
+        self.previous = previous if previous is not None and previous.export_id else None
+        self.verify_digests = verify_digests
+        self.version = 0 if self.previous is None else 1
         self.parts = []
         self.new_part()
         self.file_metadata = {}
-        self.metadata = {'file_metadata': self.file_metadata}
+        self.throughput = Throughput()
+        self.export_id = uuid.uuid4().hex
+        self.metadata = {'file_metadata': self.file_metadata, 'export_id': self.export_id}
+        if self.previous is not None:
+            self.metadata['previous_export'] = {'id': self.previous.export_id, 'path': self.previous.base}
 
     def set_metadata(self, key, val):
         if key in self.metadata:
@@ -95,7 +239,7 @@ class Exporter(object):
             self.base, 'part-{:04d}{}'.format(len(self.parts) + 1, self.EXT)), 'wb'))
 
     def commit_part(self, is_last=False):
-        self.f.write(struct.pack(self.TAIL_FMT, len(self.parts), self.VERSION, is_last))
+        self.f.write(struct.pack(self.TAIL_FMT, len(self.parts), self.version, is_last))
         self.f.close()
         self.parts[-1] = self.f.name
 
@@ -123,14 +267,88 @@ class Exporter(object):
         fileobj.seek(0)
         self.ensure_space(size)
         pos = self.f.tell()
-        digest = send_file(fileobj, self.f)
+        digest = send_file(fileobj, self.f, chunksize=chunk_size_for(size), size=size)
         size = self.f.tell() - pos
         mtime = os.fstat(fileobj.fileno()).st_mtime
         self.file_metadata[key] = (len(self.parts), pos, size, digest, mtime)
+        self.throughput.transferred += size
+
+    def add_data(self, key, data, digest, mtime):
+        self.ensure_space(len(data))
+        pos = self.f.tell()
+        self.f.write(data)
+        self.file_metadata[key] = (len(self.parts), pos, len(data), digest, mtime)
+        self.throughput.transferred += len(data)
+
+    def add_files(self, items, abort=None):
+        ''' Add the files specified by items, an iterable of (key, path,
+        context) tuples. Files are read, hashed and compared against the
+        previous export in a pool of threads, while being written to the
+        export sequentially, in the order of items, so the layout of the export
+        does not depend on timing. Missing files are skipped. The context of
+        every item is yielded once its file has been added, together with a
+        boolean indicating whether the file was present. '''
+        func = lambda item: read_for_export(self, *item)
+        for ef in prefetch(func, items):
+            if abort is not None and abort.is_set():
+                return
+            if ef.mtime is None:
+                yield ef.context, False
+                continue
+            if ef.reused is not None:
+                self.file_metadata[ef.key] = ef.reused
+            elif ef.data is not None:
+                self.add_data(ef.key, ef.data, ef.digest, ef.mtime)
+            else:
+                try:
+                    f = lopen(ef.path, 'rb')
+                except EnvironmentError:
+                    if not iswindows:
+                        raise
+                    time.sleep(1)
+                    f = lopen(ef.path, 'rb')
+                with f:
+                    self.add_file(f, ef.key)
+            yield ef.context, True
 
     def start_file(self, key, mtime=None):
         return FileDest(key, self, mtime=mtime)
 
+    def previous_entry(self, key, path, st=None):
+        ''' Return the entry referencing the copy of the file at path in the
+        previous export or None if there is no such copy or the file has
+        changed since. Does not modify the exporter. '''
+        if self.previous is None or path is None:
+            return
+        entry = self.previous.file_metadata.get(key)
+        if entry is None:
+            return
+        partnum, pos, size, digest, mtime = entry[:5]
+        if st is None:
+            try:
+                st = os.stat(path)
+            except EnvironmentError:
+                return
+        if mtime is None or st.st_size != size or abs(st.st_mtime - mtime) > 0.01:
+            return
+        if self.verify_digests:
+            with lopen(path, 'rb') as f:
+                if file_digest(f) != digest:
+                    return
+        export_id = entry[5] if len(entry) > 5 else self.previous.export_id
+        return (partnum, pos, size, digest, mtime, export_id)
+
+    def reuse_file(self, key, path):
+        ''' Store a reference to the copy of the file at path in the previous
+        export, instead of copying it again. Returns False if the file is not
+        present in the previous export or has changed since, in which case it
+        must be added normally. '''
+        entry = self.previous_entry(key, path)
+        if entry is None:
+            return False
+        self.file_metadata[key] = entry
+        return True
+
     def export_dir(self, path, dir_key):
         pkey = hexlify(dir_key)
         self.metadata[dir_key] = files = []
@@ -139,6 +357,9 @@ class Exporter(object):
                 fpath = os.path.join(dirpath, fname)
                 rpath = os.path.relpath(fpath, path).replace(os.sep, '/')
                 key = '%s:%s' % (pkey, rpath)
+                files.append((key, rpath))
+                if self.reuse_file(key, fpath):
+                    continue
                 try:
                     with lopen(fpath, 'rb') as f:
                         self.add_file(f, key)
@@ -148,7 +369,6 @@ class Exporter(object):
                     time.sleep(1)
                     with lopen(fpath, 'rb') as f:
                         self.add_file(f, key)
-                files.append((key, rpath))
 
 
 def all_known_libraries():
@@ -169,14 +389,18 @@ def all_known_libraries():
     return added
 
 
-def export(destdir, library_paths=None, dbmap=None, progress1=None, progress2=None, abort=None):
+def export(destdir, library_paths=None, dbmap=None, progress1=None, progress2=None, abort=None, previous_export_dir=None):
+    ''' Export the specified libraries and the calibre settings to destdir. If
+    previous_export_dir is specified, only files that have changed since that
+    export are copied, see :class:`Exporter`. '''
     from calibre.db.cache import Cache
     from calibre.db.backend import DB
     if library_paths is None:
         library_paths = all_known_libraries()
     dbmap = dbmap or {}
     dbmap = {os.path.normcase(os.path.abspath(k)):v for k, v in dbmap.iteritems()}
-    exporter = Exporter(destdir)
+    previous = None if previous_export_dir is None else Importer(previous_export_dir)
+    exporter = Exporter(destdir, previous=previous)
     exporter.metadata['libraries'] = libraries = {}
     total = len(library_paths) + 1
     for i, (lpath, count) in enumerate(library_paths.iteritems()):
@@ -235,10 +459,34 @@ class FileSource(object):
         self.hasher = self.f = None
 
 
+class DataSource(BytesIO):
+
+    def __init__(self, data, mtime):
+        BytesIO.__init__(self, data)
+        self.mtime = mtime
+
+
+def read_for_import(importer, key, description, context):
+    # Runs in a prefetch thread, must only read from the importer
+    if key is None or importer.file_metadata[key][2] > PREFETCH_SIZE:
+        return context, key, description, None, None
+    src = importer.start_file(key, description)
+    data = src.read()
+    src.close()
+    return context, key, description, data, src.mtime
+
+
 class Importer(object):
 
-    def __init__(self, path_to_export_dir):
+    def __init__(self, path_to_export_dir, previous_export_dirs=()):
+        '''
+        :param previous_export_dirs: Locations of the previous exports an
+            incremental export refers to. Previous exports that are not
+            specified are looked for at the location they were exported to.
+        '''
         self.corrupted_files = []
+        self.throughput = Throughput()
+        self.base = os.path.abspath(path_to_export_dir)
         part_map = {}
         tail_size = struct.calcsize(Exporter.TAIL_FMT)
         for name in os.listdir(path_to_export_dir):
@@ -273,16 +521,69 @@ class Importer(object):
             f.seek(- sz - offset, os.SEEK_END)
             self.metadata = json.loads(f.read(sz))
             self.file_metadata = self.metadata['file_metadata']
+        self.export_id = self.metadata.get('export_id')
+        self.previous_exports = {}
+        required = {entry[5] for entry in self.file_metadata.itervalues() if len(entry) > 5} - {self.export_id}
+        if required:
+            self.load_previous_exports(required, previous_export_dirs)
+
+    def load_previous_exports(self, required, previous_export_dirs):
+        candidates = list(previous_export_dirs)
+        prev = self.metadata.get('previous_export')
+        if prev:
+            candidates.append(prev['path'])
+        seen = set()
+        while candidates and required - set(self.previous_exports):
+            path = os.path.abspath(candidates.pop(0))
+            if path in seen or not os.path.isdir(path):
+                continue
+            seen.add(path)
+            importer = Importer(path, previous_export_dirs=previous_export_dirs)
+            if importer.export_id in required:
+                self.previous_exports[importer.export_id] = importer
+            self.previous_exports.update(importer.previous_exports)
+            prev = importer.metadata.get('previous_export')
+            if prev:
+                candidates.append(prev['path'])
+        missing = required - set(self.previous_exports)
+        if missing:
+            raise ValueError('The exported data in %s is incremental and some of the previous exports'
+                             ' it depends on could not be found' % self.base)
 
     def part(self, num):
         return lopen(self.part_map[num], 'rb')
 
     def start_file(self, key, description):
-        partnum, pos, size, digest, mtime = self.file_metadata[key]
-        f = self.part(partnum)
+        entry = self.file_metadata[key]
+        partnum, pos, size, digest, mtime = entry[:5]
+        source = self
+        if len(entry) > 5 and entry[5] != self.export_id:
+            source = self.previous_exports[entry[5]]
+        f = source.part(partnum)
         f.seek(pos)
         return FileSource(f, size, digest, description, mtime, self)
 
+    def read_files(self, items, abort=None):
+        ''' Read the files specified by items, an iterable of (key,
+        description, context) tuples, reading and verifying files ahead in a
+        pool of threads. Yields (context, stream) pairs in the order of items,
+        the stream must be closed after use. Items with a key of None yield a
+        stream of None. '''
+        func = lambda item: read_for_import(self, *item)
+        for context, key, description, data, mtime in prefetch(func, items):
+            if abort is not None and abort.is_set():
+                return
+            if key is None:
+                yield context, None
+                continue
+            if data is None:
+                stream = self.start_file(key, description)
+                self.throughput.transferred += stream.size
+            else:
+                stream = DataSource(data, mtime)
+                self.throughput.transferred += len(data)
+            yield context, stream
+
     def export_config(self, base_dir, library_usage_stats):
         for key, relpath in self.metadata['config_dir']:
             f = self.start_file(key, relpath)
@@ -393,12 +694,20 @@ def run_exporter():
         raise SystemExit('%s is not a folder' % export_dir)
     if os.listdir(export_dir):
         raise SystemExit('%s is not empty' % export_dir)
+    previous_export_dir = raw_input(
+        'Enter path to a previous export to only export the files that changed since then,'
+        ' the previous export must be kept (leave blank to export everything): ').decode(filesystem_encoding) or None
+    if previous_export_dir is not None:
+        try:
+            Importer(previous_export_dir)
+        except (EnvironmentError, ValueError) as err:
+            raise SystemExit('%s is not a valid export: %s' % (previous_export_dir, as_unicode(err)))
     library_paths = {}
     for lpath, lus in all_known_libraries().iteritems():
         if raw_input('Export the library %s [y/n]: ' % lpath) == b'y':
             library_paths[lpath] = lus
     if library_paths:
-        export(export_dir, progress1=cli_report, progress2=cli_report, library_paths=library_paths)
+        export(export_dir, progress1=cli_report, progress2=cli_report, library_paths=library_paths, previous_export_dir=previous_export_dir)
     else:
         raise SystemExit('No libraries selected for export')
 
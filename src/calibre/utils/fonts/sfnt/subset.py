@@ -7,15 +7,19 @@ __license__   = 'GPL v3'
 __copyright__ = '2012, Kovid Goyal <kovid at kovidgoyal.net>'
 __docformat__ = 'restructuredtext en'
 
+import hashlib
 import traceback
 from collections import OrderedDict
 from operator import itemgetter
 from functools import partial
+from threading import Lock
 
 from calibre.utils.icu import safe_chr
 from calibre.utils.fonts.sfnt.container import Sfnt
 from calibre.utils.fonts.sfnt.errors import UnsupportedFont, NoGlyphs
 
+MAX_PARSED_FONTS = 4  # The number of recently subset fonts to keep parsed
+
 # TrueType outlines {{{
 
 
@@ -68,12 +72,85 @@ def subset_truetype(sfnt, character_map, extra_glyphs):
 # }}}
 
 
-def subset_postscript(sfnt, character_map, extra_glyphs):
+def subset_postscript(sfnt, character_map, extra_glyphs, parsed_cff=None):
     cff = sfnt[b'CFF ']
-    cff.decompile()
+    if parsed_cff is None:
+        cff.decompile()
+    else:
+        cff.cff = parsed_cff
     cff.subset(character_map, extra_glyphs)
 
 
+class ParsedFont(object):
+
+    '''
+    The tables of a font that subsetting only reads, parsed the first time
+    they are needed. The most recently subset fonts are kept parsed, so that
+    subsetting a font again, for the next book in a series or for a different
+    set of characters, does not parse the character map, the substitution
+    rules or the CFF table again. The tables are parsed lazily and subsetting
+    modifies the parsed CFF table, so :attr:`lock` must be held while the font
+    is used.
+    '''
+
+    def __init__(self, raw):
+        self.lock = Lock()
+        self.sfnt = Sfnt(raw)
+        self.gsub_errors = None
+        self._cff = None
+
+    def character_map(self, chars):
+        try:
+            cmap = self.sfnt[b'cmap']
+        except KeyError:
+            raise UnsupportedFont('This font has no cmap table')
+        return cmap.get_character_map(chars)
+
+    def substitutions(self, glyph_ids, warn):
+        ''' Return the glyphs that can be substituted for glyph_ids, parsing all
+        the substitution rules to ensure that they are not removed. '''
+        if b'GSUB' not in self.sfnt:
+            return set()
+        gsub = self.sfnt[b'GSUB']
+        if self.gsub_errors is None and not hasattr(gsub, 'lookup_list_table'):
+            try:
+                gsub.decompile()
+            except UnsupportedFont as e:
+                self.gsub_errors = ('Usupported GSUB table: %s'%e,)
+            except Exception:
+                self.gsub_errors = ('Failed to decompile GSUB table:', traceback.format_exc())
+        if self.gsub_errors is not None:
+            warn(*self.gsub_errors)
+            return set()
+        try:
+            return gsub.all_substitutions(glyph_ids)
+        except Exception:
+            warn('Failed to decompile GSUB table:', traceback.format_exc())
+        return set()
+
+    @property
+    def cff(self):
+        if self._cff is None:
+            self.sfnt[b'CFF '].decompile()
+            self._cff = self.sfnt[b'CFF '].cff
+        return self._cff
+
+
+parsed_fonts = OrderedDict()
+parsed_fonts_lock = Lock()
+
+
+def parsed_font(digest, raw):
+    with parsed_fonts_lock:
+        ans = parsed_fonts.pop(digest, None)
+        if ans is None:
+            ans = ParsedFont(raw)
+        parsed_fonts[digest] = ans
+        while len(parsed_fonts) > MAX_PARSED_FONTS:
+            parsed_fonts.popitem(last=False)
+        return ans
+
+
 def do_warn(warnings, *args):
     for arg in args:
         for line in arg.splitlines():
@@ -105,9 +182,11 @@ def pdf_subset(sfnt, glyphs):
                 'or PostScript outlines')
 
 
-def subset(raw, individual_chars, ranges=(), warnings=None):
-    warn = partial(do_warn, warnings)
-
+def subset(raw, individual_chars, ranges=(), warnings=None, cache=None):
+    ''' Subset the font in raw, keeping only the glyphs needed for the
+    characters in individual_chars and ranges. If cache, a
+    :class:`calibre.utils.fonts.sfnt.subset_cache.SubsetCache`, is specified,
+    the result is looked up in and stored in it. '''
     chars = set(map(ord, individual_chars))
     for r in ranges:
         chars |= set(xrange(ord(r[0]), ord(r[1])+1))
@@ -116,6 +195,38 @@ def subset(raw, individual_chars, ranges=(), warnings=None):
     if ord(' ') not in chars:
         chars.add(ord(' '))
 
+    digest = hashlib.sha1(raw).digest()
+    if cache is None:
+        return _subset(raw, digest, chars, partial(do_warn, warnings))
+    key = cache.key(digest, chars)
+    cached = cache.get(key)
+    if cached is None:
+        ans = error = None
+        lines = []
+        try:
+            ans = _subset(raw, digest, chars, partial(do_warn, lines))
+        except (NoGlyphs, UnsupportedFont) as e:
+            error = e
+        cache.set(key, ans, lines, error)
+    else:
+        ans, lines, error = cached
+    if warnings is None:
+        for line in lines:
+            print(line)
+    else:
+        warnings.extend(lines)
+    if error is not None:
+        raise error
+    return ans
+
+
+def _subset(raw, digest, chars, warn):
+    parsed = parsed_font(digest, raw)
+    with parsed.lock:
+        return subset_parsed(raw, parsed, chars, warn)
+
+
+def subset_parsed(raw, parsed, chars, warn):
     sfnt = Sfnt(raw)
     old_sizes = sfnt.sizes()
 
@@ -134,40 +245,22 @@ def subset(raw, individual_chars, ranges=(), warnings=None):
         if tag not in core_tables:
             del sfnt[tag]
 
-    try:
-        cmap = sfnt[b'cmap']
-    except KeyError:
-        raise UnsupportedFont('This font has no cmap table')
-
     # Get mapping of chars to glyph ids for all specified chars
-    character_map = cmap.get_character_map(chars)
-
-    extra_glyphs = set()
-
-    if b'GSUB' in sfnt:
-        # Parse all substitution rules to ensure that glyphs that can be
-        # substituted for the specified set of glyphs are not removed
-        gsub = sfnt[b'GSUB']
-        try:
-            gsub.decompile()
-            extra_glyphs = gsub.all_substitutions(character_map.itervalues())
-        except UnsupportedFont as e:
-            warn('Usupported GSUB table: %s'%e)
-        except Exception as e:
-            warn('Failed to decompile GSUB table:', traceback.format_exc())
+    character_map = parsed.character_map(chars)
+    extra_glyphs = parsed.substitutions(character_map.itervalues(), warn)
 
     if b'loca' in sfnt and b'glyf' in sfnt:
         # TrueType Outlines
         subset_truetype(sfnt, character_map, extra_glyphs)
     elif b'CFF ' in sfnt:
         # PostScript Outlines
-        subset_postscript(sfnt, character_map, extra_glyphs)
+        subset_postscript(sfnt, character_map, extra_glyphs, parsed.cff)
     else:
         raise UnsupportedFont('This font does not contain TrueType '
                 'or PostScript outlines')
 
     # Restrict the cmap table to only contain entries for the resolved glyphs
-    cmap.set_character_map(character_map)
+    sfnt[b'cmap'].set_character_map(character_map)
 
     if b'kern' in sfnt:
         try:
@@ -316,6 +409,46 @@ def test():
         raise Exception('Subsetting failed')
 
 
+def benchmark(path, num_books=10, num_chars=3500):
+    ''' Time subsetting the font at path, typically a CJK font, for a series of
+    num_books books, each using num_chars characters, most of them common to
+    all the books. Run with:
+
+        calibre-debug -c "from calibre.utils.fonts.sfnt.subset import benchmark; benchmark('/path/to/font.ttf')"
+    '''
+    import random, shutil, tempfile, time
+    from calibre.utils.fonts.sfnt.subset_cache import SubsetCache
+    with open(path, 'rb') as f:
+        raw = f.read()
+    codes = sorted(Sfnt(raw)[b'cmap'].get_character_map(xrange(0x21, 0xffff)))
+    rnd = random.Random(42)
+    common = rnd.sample(codes, min(len(codes), num_chars * 4 // 5))
+    books = [set(map(safe_chr, common + rnd.sample(codes, min(len(codes), num_chars // 5)))) for i in xrange(num_books)]
+    # The last books are converted again, with the same characters
+    books += books[-(num_books // 2):]
+    print('Font has %d glyphs for %d characters, subsetting for %d books' % (
+        Sfnt(raw)[b'maxp'].num_glyphs, len(codes), len(books)))
+
+    def run(title, cache=None, keep_parsed=True):
+        parsed_fonts.clear()
+        st = time.time()
+        for chars in books:
+            if not keep_parsed:
+                parsed_fonts.clear()
+            subset(raw, chars, warnings=[], cache=cache)
+        taken = time.time() - st
+        print('%-50s %8.3f s total %8.3f s per book' % (title, taken, taken / len(books)))
+    run('Parsing the font for every book', keep_parsed=False)
+    run('Reusing the parsed font')
+    tdir = tempfile.mkdtemp()
+    try:
+        cache = SubsetCache(tdir)
+        run('With an empty subset cache', cache)
+        run('With a populated subset cache', cache)
+    finally:
+        shutil.rmtree(tdir)
+
+
 def all():
     from calibre.utils.fonts.scanner import font_scanner
     failed = []
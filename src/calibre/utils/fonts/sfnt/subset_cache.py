@@ -0,0 +1,157 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+'''
+An on-disk cache of subset fonts, keyed by the digest of the font and the
+digest of the set of characters it is subset to. The books in a series, or a
+book that is converted many times, embed the same fonts and use the same
+characters, so each font is subset only once. Fonts that cannot be subset are
+remembered as well.
+'''
+
+import hashlib
+import json
+import os
+import time
+from binascii import hexlify
+from collections import OrderedDict
+from threading import Lock
+
+from calibre import as_unicode
+from calibre.constants import cache_dir
+from calibre.utils.filenames import atomic_rename
+from calibre.utils.fonts.sfnt.errors import NoGlyphs, UnsupportedFont
+
+VERSION = 1  # Increase when changes to subsetting change its results
+MAX_AGE = 60 * 24 * 3600  # Entries not used for this long are removed
+MAX_SIZE = 100 * 1024 * 1024
+ERRORS = {cls.__name__: cls for cls in (NoGlyphs, UnsupportedFont)}
+
+
+def default_cache_path():
+    return os.path.join(cache_dir(), 'font-subsets')
+
+
+def as_sizes(items):
+    return OrderedDict((tag.encode('ascii'), size) for tag, size in items)
+
+
+class SubsetCache(object):
+
+    '''
+    Used by :func:`calibre.utils.fonts.sfnt.subset.subset`. Each entry is a
+    single file, written atomically, so the cache can be used by many
+    processes at once.
+    '''
+
+    def __init__(self, path=None, max_age=MAX_AGE, max_size=MAX_SIZE):
+        self.path = path or default_cache_path()
+        self.max_age, self.max_size = max_age, max_size
+        try:
+            os.makedirs(self.path)
+        except EnvironmentError:
+            if not os.path.isdir(self.path):
+                raise
+        self.hits = self.misses = 0
+
+    def key(self, font_digest, codepoints):
+        chars = b'%d:' % VERSION + b','.join(b'%x' % c for c in sorted(codepoints))
+        return '%s-%s' % (hexlify(font_digest).decode('ascii'), hashlib.sha1(chars).hexdigest())
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key + '.font')
+
+    def get(self, key):
+        ''' Return the subset font, the warnings and the error for key, or None
+        if it is not in the cache. '''
+        path = self.entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline())
+                raw = f.read()
+            if len(raw) != header['size']:
+                raise ValueError('Truncated cache entry')
+        except (EnvironmentError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            os.utime(path, None)
+        except EnvironmentError:
+            pass
+        ans = error = None
+        if header['error'] is None:
+            ans = raw, as_sizes(header['old_sizes']), as_sizes(header['new_sizes'])
+        else:
+            name, msg = header['error']
+            error = ERRORS[name](msg)
+        return ans, header['warnings'], error
+
+    def set(self, key, result, warnings, error=None):
+        header = {'warnings': warnings, 'error': None, 'size': 0}
+        if error is None:
+            raw, old_sizes, new_sizes = result
+            header.update(size=len(raw), old_sizes=list(old_sizes.iteritems()), new_sizes=list(new_sizes.iteritems()))
+        else:
+            raw = b''
+            header['error'] = (error.__class__.__name__, as_unicode(error))
+        path = self.entry_path(key)
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            with open(temp, 'wb') as f:
+                f.write(json.dumps(header).encode('utf-8') + b'\n')
+                f.write(raw)
+            atomic_rename(temp, path)
+        except EnvironmentError:
+            # The cache is only an optimization
+            pass
+
+    def prune(self):
+        ''' Remove the entries that have not been used for max_age seconds and
+        then the least recently used entries till the cache is no larger than
+        max_size. '''
+        limit = time.time() - self.max_age
+        entries = []
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            try:
+                st = os.stat(path)
+                if st.st_mtime < limit:
+                    os.remove(path)
+                else:
+                    entries.append((st.st_mtime, st.st_size, path))
+            except EnvironmentError:
+                pass
+        total = sum(e[1] for e in entries)
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except EnvironmentError:
+                pass
+            total -= size
+
+
+_subset_cache = None
+_subset_cache_lock = Lock()
+
+
+def subset_cache():
+    ''' The cache used when converting and polishing books, None if it cannot
+    be created. '''
+    global _subset_cache
+    with _subset_cache_lock:
+        if _subset_cache is None:
+            try:
+                _subset_cache = SubsetCache()
+                _subset_cache.prune()
+            except EnvironmentError:
+                import traceback
+                traceback.print_exc()
+                _subset_cache = False
+        return _subset_cache or None
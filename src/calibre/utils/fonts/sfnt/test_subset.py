@@ -0,0 +1,60 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from calibre.utils.fonts.sfnt.container import Sfnt
+from calibre.utils.fonts.sfnt.errors import UnsupportedFont
+from calibre.utils.fonts.sfnt.subset import parsed_fonts, subset
+from calibre.utils.fonts.sfnt.subset_cache import SubsetCache
+
+
+class SubsetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.raw = P('fonts/liberation/LiberationSerif-Regular.ttf', data=True)
+        self.tdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tdir)
+
+    def test_character_map(self):
+        cmap = Sfnt(self.raw)[b'cmap']
+        all_codes = cmap.bmp_table.get_glyph_map(frozenset(xrange(1, 0x10000)))
+        self.assertEqual(dict(cmap.get_character_map(xrange(0x10000))), all_codes)
+
+    def test_subset_cache(self):
+        cache = SubsetCache(self.tdir)
+        parsed_fonts.clear()
+        expected = subset(self.raw, 'abc', (('0', '9'),))
+        self.assertEqual(len(parsed_fonts), 1)
+        w = []
+        for i in range(2):
+            self.assertEqual(subset(self.raw, 'cba', (('0', '9'),), warnings=w, cache=cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(w, [])
+        subset(self.raw, 'abcd', cache=cache)
+        self.assertEqual(cache.misses, 2)
+
+        bad = b'XXXX' + self.raw[4:]
+        for i in range(2):
+            self.assertRaises(UnsupportedFont, subset, bad, 'a', cache=cache)
+        self.assertEqual(cache.hits, 2)
+
+        cache.max_size = 0
+        cache.prune()
+        self.assertEqual(len(os.listdir(self.tdir)), 0)
+
+
+def find_tests():
+    return unittest.defaultTestLoader.loadTestsFromTestCase(SubsetTest)
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=4).run(find_tests())
@@ -20,6 +20,7 @@ import sys, operator, weakref, re
 
 from calibre.constants import preferred_encoding
 from calibre.utils.icu import sort_key
+from calibre.utils.monotonic import monotonic
 from calibre import prints
 
 
@@ -295,8 +296,17 @@ class SearchQueryParser(object):
       * `author:Asimov tag:unread` [search for books by Asimov that have been tagged as unread]
       * `author:Asimov or author:Hardy` [search for books by Asimov or Hardy]
       * `(author:Asimov or author:Hardy) and not tag:read` [search for unread books by Asimov or Hardy]
+
+    Before evaluation, the parsed query is turned into a plan (see
+    :meth:`plan`): chains of `and`/`or` are flattened and their terms are
+    ordered by the cost and selectivity estimated by :meth:`estimate_cost`, so
+    that cheap, selective terms narrow the candidates for the expensive ones.
+    Use :meth:`explain` to see the plan for a query.
     '''
 
+    # Set while explain() is running, maps id(node) -> [calls, time, candidates, matches]
+    sqp_explain_stats = None
+
     @staticmethod
     def run_tests(parser, result, tests):
         failed = []
@@ -352,29 +362,142 @@ class SearchQueryParser(object):
                 self.sqp_parse_cache[query] = res
         if candidates is None:
             candidates = self.universal_set()
+        estimates = {}
+        res = self.plan(res, estimates)
+        if self.sqp_explain_stats is not None:
+            self.sqp_explain_plans.append((res, estimates))
         t = self.evaluate(res, candidates)
         self.recurse_level -= 1
         return t
 
+    # Planning {{{
+    def estimate_cost(self, location, query):
+        '''
+        Return an estimate of the cost of matching a single candidate against
+        :param:`query` in :param:`location` and the fraction of candidates
+        that will match, used to order the terms of `and` and `or`
+        expressions. The defaults give all terms the same cost, subclasses
+        should override this using whatever they know about locations.
+        '''
+        return 1.0, 0.5
+
+    def plan(self, parse_result, estimates=None):
+        '''
+        Return the parse tree rewritten for evaluation. Nested `and`/`or`
+        expressions become n-ary expressions, whose terms are ordered so that
+        for `and` the cheapest terms that eliminate the most candidates come
+        first and for `or` the cheapest terms that match the most candidates
+        come first. If :param:`estimates` is not None, it is filled with
+        id(node) -> (cost, selectivity) for every node in the result.
+        '''
+        return self._plan(parse_result, {} if estimates is None else estimates)[0]
+
+    def _plan(self, node, estimates):
+        op = node[0]
+        if op == 'token':
+            cost, selectivity = self.estimate_cost(node[1], node[2])
+        elif op == 'not':
+            child, cost, selectivity = self._plan(node[1], estimates)
+            node, selectivity = ['not', child], 1 - selectivity
+        else:
+            terms = []
+            self._flatten(node, op, terms)
+            terms = [self._plan(term, estimates) for term in terms]
+            if op == 'and':
+                terms.sort(key=lambda x: x[1] / max(1 - x[2], 0.01))
+            else:
+                terms.sort(key=lambda x: x[1] / max(x[2], 0.01))
+            # Every term is evaluated only on the candidates left over by the
+            # previous terms
+            cost, remaining = 0, 1.0
+            for term, tcost, tselectivity in terms:
+                cost += tcost * remaining
+                remaining *= tselectivity if op == 'and' else 1 - tselectivity
+            selectivity = remaining if op == 'and' else 1 - remaining
+            node = [op] + [term[0] for term in terms]
+        estimates[id(node)] = (cost, selectivity)
+        return node, cost, selectivity
+
+    def _flatten(self, node, op, terms):
+        for child in node[1:]:
+            if child[0] == op:
+                self._flatten(child, op, terms)
+            else:
+                terms.append(child)
+
+    def explain(self, query):
+        '''
+        Evaluate :param:`query` and return a textual description of the plan
+        used, with the estimated cost and selectivity and the actual time
+        taken and number of matches for every step. Useful for finding out
+        why a search is slow.
+        '''
+        self.sqp_explain_stats, self.sqp_explain_plans = {}, []
+        try:
+            st = monotonic()
+            matches = self.parse(query)
+            total = monotonic() - st
+            plan, estimates = self.sqp_explain_plans[0]
+            lines = ['%d matches in %.2f ms for: %s' % (len(matches), total * 1000, query)]
+            self._explain_node(plan, estimates, self.sqp_explain_stats, lines, 0)
+        finally:
+            self.sqp_explain_stats = self.sqp_explain_plans = None
+        return '\n'.join(lines)
+
+    def _explain_node(self, node, estimates, stats, lines, level):
+        op = node[0]
+        desc = '%s:%s' % (node[1], node[2]) if op == 'token' else op
+        cost, selectivity = estimates.get(id(node), (0, 0))
+        line = '%s%s [cost: %.3g selectivity: %.3g]' % ('  ' * level, desc, cost, selectivity)
+        st = stats.get(id(node))
+        if st is None:
+            line += ' not evaluated'
+        else:
+            calls, taken, candidates, matches = st
+            line += ' %d/%d matched in %.2f ms' % (matches, candidates, taken * 1000)
+            if calls > 1:
+                line += ' (%d calls)' % calls
+        lines.append(line)
+        if op != 'token':
+            for child in node[1:]:
+                self._explain_node(child, estimates, stats, lines, level + 1)
+    # }}}
+
     def method(self, group_name):
         return getattr(self, 'evaluate_'+group_name)
 
     def evaluate(self, parse_result, candidates):
+        if self.sqp_explain_stats is not None:
+            st = monotonic()
+            ans = self.method(parse_result[0])(parse_result[1:], candidates)
+            stats = self.sqp_explain_stats.setdefault(id(parse_result), [0, 0, 0, 0])
+            stats[0] += 1
+            stats[1] += monotonic() - st
+            stats[2] += len(candidates)
+            stats[3] += len(ans)
+            return ans
         return self.method(parse_result[0])(parse_result[1:], candidates)
 
     def evaluate_and(self, argument, candidates):
-        # RHS checks only those items matched by LHS
-        # returns result of RHS check: RHmatches(LHmatches(c))
-        #  return self.evaluate(argument[0]).intersection(self.evaluate(argument[1]))
-        l = self.evaluate(argument[0], candidates)
-        return l.intersection(self.evaluate(argument[1], l))
+        # Each term checks only those items matched by the previous terms
+        # returns: Tn(...T2(T1(c)))
+        for term in argument:
+            if not candidates:
+                return set()
+            candidates = candidates.intersection(self.evaluate(term, candidates))
+        return candidates
 
     def evaluate_or(self, argument, candidates):
-        # RHS checks only those elements not matched by LHS
-        # returns LHS union RHS: LHmatches(c) + RHmatches(c-LHmatches(c))
-        #  return self.evaluate(argument[0]).union(self.evaluate(argument[1]))
-        l = self.evaluate(argument[0], candidates)
-        return l.union(self.evaluate(argument[1], candidates.difference(l)))
+        # Each term checks only those items not matched by the previous terms
+        # returns: T1(c) + T2(c-T1(c)) + ...
+        matches = set()
+        for term in argument:
+            if not candidates:
+                break
+            m = self.evaluate(term, candidates)
+            matches |= m
+            candidates = candidates.difference(m)
+        return matches
 
     def evaluate_not(self, argument, candidates):
         # unary op checks only candidates. Result: list of items matching
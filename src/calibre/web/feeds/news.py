@@ -22,6 +22,8 @@ from calibre.web import Recipe
 from calibre.ebooks.metadata.toc import TOC
 from calibre.ebooks.metadata import MetaInformation
 from calibre.web.feeds import feed_from_xml, templates, feeds_from_index, Feed
+from calibre.web.fetch.cache import HTTPCache
+from calibre.web.fetch.scheduler import Scheduler
 from calibre.web.fetch.simple import option_parser as web2disk_option_parser, RecursiveFetcher, AbortArticle
 from calibre.web.fetch.utils import prepare_masthead_image
 from calibre.utils.threadpool import WorkRequest, ThreadPool, NoResultsPending
@@ -77,8 +79,9 @@ class BasicNewsRecipe(Recipe):
     #: Number of levels of links to follow on article webpages
     recursions             = 0
 
-    #: Delay between consecutive downloads in seconds. The argument may be a
-    #: floating point number to indicate a more precise time.
+    #: Delay between consecutive downloads from the same server in seconds.
+    #: The argument may be a floating point number to indicate a more precise
+    #: time.
     delay                  = 0
 
     #: Publication type
@@ -87,12 +90,22 @@ class BasicNewsRecipe(Recipe):
     publication_type = 'unknown'
 
     #: Number of simultaneous downloads. Set to 1 if the server is picky.
-    #: Automatically reduced to 1 if :attr:`BasicNewsRecipe.delay` > 0
     simultaneous_downloads = 5
 
+    #: Maximum number of simultaneous downloads from the same server. By
+    #: default, the same as :attr:`BasicNewsRecipe.simultaneous_downloads`.
+    #: Automatically reduced to 1 if :attr:`BasicNewsRecipe.delay` > 0
+    simultaneous_downloads_per_host = None
+
     #: Timeout for fetching files from server in seconds
     timeout                = 120.0
 
+    #: If True, the pages, images and stylesheets of articles are stored in an
+    #: on-disk cache and later downloads reuse them, as allowed by the
+    #: caching headers sent by the server. Set to False if the server sends
+    #: incorrect caching headers.
+    use_http_cache = True
+
     #: The format string for the date shown on the first page.
     #: By default: Day_Name, Day_Number Month_Name Year
     timefmt                = ' [%a, %d %b %Y]'
@@ -939,9 +952,17 @@ class BasicNewsRecipe(Recipe):
         self.web2disk_options.preprocess_image = self.preprocess_image
         self.web2disk_options.encoding = self.encoding
         self.web2disk_options.preprocess_raw_html = self.preprocess_raw_html_
-
-        if self.delay > 0:
-            self.simultaneous_downloads = 1
+        self.http_cache = HTTPCache(log=self.log) if self.use_http_cache else None
+        self.web2disk_options.http_cache = self.http_cache
+
+        # The delay and the limit on simultaneous downloads are applied to
+        # each server separately, so that articles from different servers are
+        # downloaded in parallel
+        per_host = 1 if self.delay > 0 else (self.simultaneous_downloads_per_host or self.simultaneous_downloads)
+        self.scheduler = Scheduler(
+            delay=self.delay, max_per_host=per_host, resource_threads=self.simultaneous_downloads,
+            clone_browser=self.clone_browser, log=self.log)
+        self.web2disk_options.scheduler = self.scheduler
 
         self.navbar = templates.TouchscreenNavBarTemplate() if self.touchscreen else \
                       templates.NavBarTemplate()
@@ -1040,6 +1061,9 @@ class BasicNewsRecipe(Recipe):
             return res
         finally:
             self.cleanup()
+            self.scheduler.close()
+            if self.http_cache is not None:
+                self.http_cache.close()
 
     @property
     def lang_for_html(self):
@@ -1621,15 +1645,14 @@ class BasicNewsRecipe(Recipe):
                 url = 'http'+url[4:]
             self.report_progress(0, _('Fetching feed')+' %s...'%(title if title else url))
             try:
-                with closing(self.browser.open(url)) as f:
-                    parsed_feeds.append(feed_from_xml(f.read(),
-                                          title=title,
-                                          log=self.log,
-                                          oldest_article=self.oldest_article,
-                                          max_articles_per_feed=self.max_articles_per_feed,
-                                          get_article_url=self.get_article_url))
-                    if (self.delay > 0):
-                        time.sleep(self.delay)
+                with self.scheduler.slot(url), closing(self.browser.open(url)) as f:
+                    raw = f.read()
+                parsed_feeds.append(feed_from_xml(raw,
+                                      title=title,
+                                      log=self.log,
+                                      oldest_article=self.oldest_article,
+                                      max_articles_per_feed=self.max_articles_per_feed,
+                                      get_article_url=self.get_article_url))
             except Exception as err:
                 feed = Feed()
                 msg = 'Failed feed: %s'%(title if title else url)
@@ -1762,7 +1785,12 @@ class CustomIndexRecipe(BasicNewsRecipe):
         fetcher.base_dir = self.output_dir
         fetcher.current_dir = self.output_dir
         fetcher.show_progress = False
-        res = fetcher.start_fetch(url)
+        try:
+            res = fetcher.start_fetch(url)
+        finally:
+            self.scheduler.close()
+            if self.http_cache is not None:
+                self.http_cache.close()
         self.create_opf()
         return res
 
@@ -0,0 +1,273 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+'''
+An on-disk HTTP cache for downloading news. Responses are stored along with
+their validators (ETag and Last-Modified) and the time until which they are
+fresh (from Cache-Control and Expires). Later downloads use a stored response
+without contacting the server while it is fresh, and with a conditional
+request once it is stale. Within a single download, every URL is fetched at
+most once, even by concurrent fetchers, and identical resources are saved only
+once.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from email.utils import mktime_tz, parsedate_tz
+from threading import Lock
+
+from calibre import human_readable
+from calibre.constants import cache_dir
+from calibre.utils.filenames import atomic_rename
+
+MAX_AGE = 14 * 24 * 3600  # Entries not used for this long are removed
+STATS = (
+    ('downloaded', 'downloaded'),
+    ('fresh', 'fresh in the cache'),
+    ('revalidated', 'not modified on the server'),
+    ('reused', 'already fetched in this download'),
+    ('deduplicated', 'identical to an already saved file'),
+)
+
+
+def default_cache_path():
+    return os.path.join(cache_dir(), 'news-http')
+
+
+def parse_http_date(val):
+    try:
+        return mktime_tz(parsedate_tz(val))
+    except Exception:
+        return None
+
+
+def cache_control(headers):
+    ans = {}
+    for part in (headers.get('Cache-Control') or '').split(','):
+        key, val = part.partition('=')[::2]
+        key = key.strip().lower()
+        if key:
+            ans[key] = val.strip().strip('"')
+    return ans
+
+
+def fresh_until(headers, now):
+    ''' Return the time until which the response is fresh, 0 if it must be
+    revalidated before it is used and None if it must not be stored. '''
+    cc = cache_control(headers)
+    if 'no-store' in cc or headers.get('Set-Cookie'):
+        return None
+    if (headers.get('Vary') or '').strip().lower() not in ('', 'accept-encoding'):
+        return None
+    if 'no-cache' in cc:
+        return 0
+    if 'max-age' in cc:
+        try:
+            age = int(headers.get('Age') or 0)
+            return now + int(cc['max-age']) - age
+        except ValueError:
+            return 0
+    expires = headers.get('Expires')
+    if expires:
+        expires = parse_http_date(expires)
+        if expires is None:
+            # An invalid Expires header means already expired
+            return 0
+        # Use the time of the server, in case its clock is not correct
+        date = parse_http_date(headers.get('Date') or '') or now
+        return now + expires - date
+    return 0
+
+
+class HTTPCache(object):
+
+    '''
+    Fetch URLs with :meth:`fetch`, using ``open_url(url, headers)`` to make
+    any requests needed. ``open_url`` must return the body of the response,
+    the final URL after any redirects and the response headers. It must raise
+    an exception that has a ``code`` attribute of 304 and the response headers
+    as ``hdrs`` for a Not Modified response.
+
+    An instance is used for a single download and is safe to use from many
+    threads. Call :meth:`close` at the end of the download.
+    '''
+
+    def __init__(self, path=None, log=None):
+        self.path = path or default_cache_path()
+        self.log = log
+        try:
+            os.makedirs(self.path)
+        except EnvironmentError:
+            if not os.path.isdir(self.path):
+                raise
+        self.lock = Lock()
+        self.url_locks = {}
+        # The responses fetched in this download, that cannot be stored in
+        # the cache, are kept here till the download is finished
+        self.session_dir = None
+        self.session = {}
+        self.saved_files = {}
+        self.stats = {k: 0 for k, desc in STATS}
+        self.bytes_not_downloaded = 0
+
+    # Storage {{{
+    def entry_path(self, key, ext):
+        return os.path.join(self.path, key + ext)
+
+    def read_entry(self, key):
+        try:
+            with open(self.entry_path(key, '.json'), 'rb') as f:
+                return json.load(f)
+        except (EnvironmentError, ValueError):
+            return None
+
+    def read_file(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except EnvironmentError:
+            return None
+
+    def write_file(self, path, data):
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp, 'wb') as f:
+            f.write(data)
+        # Other processes may be reading the cache
+        atomic_rename(temp, path)
+
+    def store(self, key, url, data, newurl, headers, now):
+        expires = fresh_until(headers, now)
+        entry = {
+            'url': url, 'newurl': newurl, 'expires': expires,
+            'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified'),
+        }
+        if expires is not None and (expires > now or entry['etag'] or entry['last_modified']):
+            self.write_file(self.entry_path(key, '.data'), data)
+            self.write_file(self.entry_path(key, '.json'), json.dumps(entry))
+            return self.entry_path(key, '.data')
+        with self.lock:
+            if self.session_dir is None:
+                from calibre.ptempfile import PersistentTemporaryDirectory
+                self.session_dir = PersistentTemporaryDirectory('_news_http')
+        path = os.path.join(self.session_dir, key)
+        self.write_file(path, data)
+        return path
+
+    def touch(self, key):
+        for ext in ('.json', '.data'):
+            try:
+                os.utime(self.entry_path(key, ext), None)
+            except EnvironmentError:
+                pass
+    # }}}
+
+    def lock_for(self, url):
+        with self.lock:
+            ans = self.url_locks.get(url)
+            if ans is None:
+                ans = self.url_locks[url] = Lock()
+            return ans
+
+    def count(self, name, size=0):
+        with self.lock:
+            self.stats[name] += 1
+            if name not in ('downloaded', 'deduplicated'):
+                self.bytes_not_downloaded += size
+
+    def fetch(self, url, open_url):
+        ''' Return the body of the response for url and the final URL after any
+        redirects. '''
+        if isinstance(url, type('')):
+            url = url.encode('utf-8')
+        with self.lock_for(url):
+            if url in self.session:
+                path, newurl = self.session[url]
+                data = self.read_file(path)
+                if data is not None:
+                    self.count('reused', len(data))
+                    return data, newurl
+            key = hashlib.sha1(url).hexdigest()
+            entry = self.read_entry(key)
+            now = time.time()
+            data = None
+            if entry is not None and entry['expires'] > now:
+                path = self.entry_path(key, '.data')
+                data = self.read_file(path)
+                if data is not None:
+                    self.count('fresh', len(data))
+                    self.touch(key)
+                    newurl = entry['newurl']
+            if data is None:
+                headers = {}
+                if entry is not None:
+                    if entry['etag']:
+                        headers['If-None-Match'] = entry['etag']
+                    if entry['last_modified']:
+                        headers['If-Modified-Since'] = entry['last_modified']
+                data, newurl, path = self.fetch_from_server(key, url, entry, headers, open_url, now)
+            self.session[url] = path, newurl
+            return data, newurl
+
+    def fetch_from_server(self, key, url, entry, headers, open_url, now):
+        try:
+            data, newurl, rheaders = open_url(url, headers)
+        except Exception as err:
+            if not headers or getattr(err, 'code', None) != 304:
+                raise
+            path = self.entry_path(key, '.data')
+            data = self.read_file(path)
+            if data is None:
+                # Removed by another process since the entry was read
+                return self.fetch_from_server(key, url, None, {}, open_url, now)
+            self.count('revalidated', len(data))
+            expires = fresh_until(getattr(err, 'hdrs', None) or {}, now)
+            if expires is not None and expires != entry['expires']:
+                entry['expires'] = expires
+                self.write_file(self.entry_path(key, '.json'), json.dumps(entry))
+            self.touch(key)
+            return data, entry['newurl'], path
+        self.count('downloaded')
+        return data, newurl, self.store(key, url, data, newurl, rheaders, now)
+
+    def deduplicate(self, data, path):
+        ''' Return the path of a file with the same contents as data that was
+        saved earlier in this download, or None, in which case data must be
+        saved as path. '''
+        digest = hashlib.sha1(data).digest()
+        with self.lock:
+            ans = self.saved_files.get(digest)
+            if ans is None:
+                self.saved_files[digest] = path
+            else:
+                self.stats['deduplicated'] += 1
+        return ans
+
+    def summary(self):
+        parts = ['%d %s' % (self.stats[k], desc) for k, desc in STATS]
+        return 'HTTP cache: %s. Did not download %s' % (', '.join(parts), human_readable(self.bytes_not_downloaded))
+
+    def prune(self, max_age=MAX_AGE):
+        ''' Remove the entries that have not been used for max_age seconds '''
+        limit = time.time() - max_age
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            try:
+                if os.path.getmtime(path) < limit:
+                    os.remove(path)
+            except EnvironmentError:
+                pass
+
+    def close(self):
+        if self.session_dir is not None:
+            shutil.rmtree(self.session_dir, ignore_errors=True)
+            self.session_dir = None
+        self.session.clear()
+        self.prune()
+        if self.log is not None:
+            self.log(self.summary())
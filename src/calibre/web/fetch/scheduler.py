@@ -0,0 +1,166 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+'''
+Scheduling of the fetches made when downloading news. The number of
+simultaneous fetches from a host and the delay between consecutive fetches
+from it are limited per host, so that articles from different hosts are
+downloaded in parallel, without overloading any one of them. Resources such as
+images are fetched by a separate pool of threads, so that all the images of an
+article are fetched in parallel, while other articles are being fetched.
+'''
+
+import time
+import urlparse
+from collections import defaultdict
+from contextlib import contextmanager
+from Queue import Queue
+from threading import Condition, Event, Lock, Thread, local
+
+
+def default_clone_browser(br):
+    return br.clone_browser()
+
+
+def host_for_url(url):
+    try:
+        return (urlparse.urlsplit(url).hostname or '').lower()
+    except Exception:
+        return ''
+
+
+class HostState(object):
+
+    __slots__ = ('active', 'last_finish', 'requests', 'fetch_time', 'wait_time')
+
+    def __init__(self):
+        self.active = self.requests = 0
+        self.last_finish = self.fetch_time = self.wait_time = 0.
+
+
+class Batch(object):
+
+    def __init__(self, size):
+        self.results = [None] * size
+        self.remaining = size
+        self.lock = Lock()
+        self.done = Event()
+
+    def set_result(self, i, result):
+        self.results[i] = result
+        with self.lock:
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.done.set()
+
+
+class Scheduler(object):
+
+    '''
+    Fetches must be made in a :meth:`slot` for the URL. ``delay`` is the
+    minimum time between consecutive fetches from a host and
+    ``max_per_host`` the maximum number of simultaneous fetches from it. An
+    instance is used for a single download, call :meth:`close` at the end of
+    it.
+    '''
+
+    def __init__(self, delay=0, max_per_host=1, resource_threads=4, clone_browser=default_clone_browser, log=None):
+        self.delay = delay
+        self.max_per_host = max(1, max_per_host)
+        self.num_resource_threads = resource_threads
+        self.clone_browser = clone_browser
+        self.log = log
+        self.local = local()
+        self.cond = Condition()
+        self.hosts = defaultdict(HostState)
+        self.queue = Queue()
+        self.workers = []
+
+    @contextmanager
+    def slot(self, url):
+        ''' Wait till a fetch from the host of url is allowed and hold it for
+        the duration of the with block. '''
+        start = time.time()
+        with self.cond:
+            state = self.hosts[host_for_url(url)]
+            while True:
+                if state.active < self.max_per_host:
+                    wait = state.last_finish + self.delay - time.time()
+                    if wait <= 0:
+                        break
+                    self.cond.wait(wait)
+                else:
+                    self.cond.wait()
+            state.active += 1
+            state.wait_time += time.time() - start
+        start = time.time()
+        try:
+            yield
+        finally:
+            with self.cond:
+                state.active -= 1
+                state.requests += 1
+                state.last_finish = time.time()
+                state.fetch_time += state.last_finish - start
+                self.cond.notify_all()
+
+    # Resource threads {{{
+    def browser(self, default):
+        ''' The browser to use in the current thread. mechanize is not thread
+        safe, so the resource threads use their own clones of the browser. '''
+        if not getattr(self.local, 'is_resource_thread', False):
+            return default
+        if self.local.browser is None:
+            self.local.browser = self.clone_browser(default)
+        return self.local.browser
+
+    def run_worker(self):
+        self.local.is_resource_thread, self.local.browser = True, None
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            batch, i, func, item = job
+            try:
+                result = func(item)
+            except Exception as err:
+                result = err
+            batch.set_result(i, result)
+
+    def map(self, func, items):
+        ''' Call func for every item in the resource threads. Returns the
+        results, in order, with the exception raised by func as the result if
+        it failed. '''
+        items = tuple(items)
+        if not items:
+            return []
+        with self.cond:
+            while len(self.workers) < min(self.num_resource_threads, len(items)):
+                t = Thread(name='NewsResourceFetcher', target=self.run_worker)
+                t.daemon = True
+                t.start()
+                self.workers.append(t)
+        batch = Batch(len(items))
+        for i, item in enumerate(items):
+            self.queue.put((batch, i, func, item))
+        batch.done.wait()
+        return batch.results
+    # }}}
+
+    def summary(self):
+        ans = []
+        for host, state in sorted(self.hosts.iteritems(), key=lambda x: x[1].fetch_time, reverse=True):
+            ans.append('%s: %d fetches in %.1f seconds, %.1f seconds waiting' % (
+                host or 'unknown host', state.requests, state.fetch_time, state.wait_time))
+        return '\n'.join(ans)
+
+    def close(self):
+        for w in self.workers:
+            self.queue.put(None)
+        self.workers = []
+        if self.log is not None and self.hosts:
+            self.log('Time spent fetching from each host:')
+            self.log(self.summary())
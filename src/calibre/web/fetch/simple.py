@@ -8,6 +8,7 @@ Fetch a webpage and its links recursively. The webpages are saved to disk in
 UTF-8 encoding with any charset declarations removed.
 '''
 import sys, socket, os, urlparse, re, time, urllib2, threading, traceback
+from collections import OrderedDict
 from urllib import url2pathname, quote
 from httplib import responses
 from base64 import b64decode
@@ -167,6 +168,8 @@ class RecursiveFetcher(object):
         self.show_progress = True
         self.failed_links = []
         self.job_info = job_info
+        self.http_cache = getattr(options, 'http_cache', None)
+        self.scheduler = getattr(options, 'scheduler', None)
 
     def get_soup(self, src, url=None):
         nmassage = []
@@ -251,9 +254,6 @@ class RecursiveFetcher(object):
             self.log.debug('Fetched %s in %.1f seconds' % (url, time.time() - st))
             return data
 
-        delta = time.time() - self.last_fetch_at
-        if delta < self.delay:
-            time.sleep(self.delay - delta)
         if isinstance(url, unicode):
             url = url.encode('utf-8')
         # Not sure is this is really needed as I think mechanize
@@ -264,28 +264,69 @@ class RecursiveFetcher(object):
             for i in range(2, 6):
                 purl[i] = quote(purl[i])
             url = urlparse.urlunparse(purl)
-        open_func = getattr(self.browser, 'open_novisit', self.browser.open)
         try:
-            with closing(open_func(url, timeout=self.timeout)) as f:
-                data = response(f.read()+f.read())
-                data.newurl = f.geturl()
+            if self.http_cache is None:
+                raw, newurl = self.open_url(url)[:2]
+            else:
+                raw, newurl = self.http_cache.fetch(url, self.open_url)
         except urllib2.URLError as err:
             if hasattr(err, 'code') and err.code in responses:
                 raise FetchError(responses[err.code])
+            raise
+        data = response(raw)
+        data.newurl = newurl
+        self.log.debug('Fetched %s in %f seconds' % (url, time.time() - st))
+        return data
+
+    def open_url(self, url, headers=None):
+        ''' Download url, sending the extra headers, if any. Returns the data,
+        the final URL after any redirects and the response headers. '''
+        if self.scheduler is not None:
+            with self.scheduler.slot(url):
+                return self.do_open_url(url, headers)
+        delta = time.time() - self.last_fetch_at
+        if delta < self.delay:
+            time.sleep(self.delay - delta)
+        try:
+            return self.do_open_url(url, headers)
+        finally:
+            self.last_fetch_at = time.time()
+
+    def do_open_url(self, url, headers):
+        br = self.browser if self.scheduler is None else self.scheduler.browser(self.browser)
+        open_func = getattr(br, 'open_novisit', br.open)
+        req = url
+        if headers:
+            import mechanize
+            req = mechanize.Request(url, headers=headers)
+        try:
+            with closing(open_func(req, timeout=self.timeout)) as f:
+                return f.read()+f.read(), f.geturl(), f.info()
+        except urllib2.HTTPError:
+            # The server replied, for example with 304 Not Modified to a
+            # conditional request, retrying is pointless
+            raise
+        except urllib2.URLError as err:
             if getattr(err, 'reason', [0])[0] == 104 or \
-                getattr(getattr(err, 'args', [None])[0], 'errno', None) in (-2,
+                getattr((err.args or (None,))[0], 'errno', None) in (-2,
                         -3):  # Connection reset by peer or Name or service not known
                 self.log.debug('Temporary error, retrying in 1 second')
                 time.sleep(1)
-                with closing(open_func(url, timeout=self.timeout)) as f:
-                    data = response(f.read()+f.read())
-                    data.newurl = f.geturl()
+                with closing(open_func(req, timeout=self.timeout)) as f:
+                    return f.read()+f.read(), f.geturl(), f.info()
             else:
                 raise err
-        finally:
-            self.last_fetch_at = time.time()
-        self.log.debug('Fetched %s in %f seconds' % (url, time.time() - st))
-        return data
+
+    def save_resource(self, data, path):
+        ''' Save data as path, unless an identical file was already saved
+        during this download. Returns the path of the saved file. '''
+        if self.http_cache is not None:
+            existing = self.http_cache.deduplicate(data, path)
+            if existing is not None:
+                return existing
+        with open(path, 'wb') as x:
+            x.write(data)
+        return path
 
     def start_fetch(self, url):
         soup = BeautifulSoup(u'<a href="'+url+'" />')
@@ -335,11 +376,9 @@ class RecursiveFetcher(object):
                 except Exception:
                     self.log.exception('Could not fetch stylesheet ', iurl)
                     continue
-                stylepath = os.path.join(diskpath, 'style'+str(c)+'.css')
+                stylepath = self.save_resource(data, os.path.join(diskpath, 'style'+str(c)+'.css'))
                 with self.stylemap_lock:
                     self.stylemap[iurl] = stylepath
-                with open(stylepath, 'wb') as x:
-                    x.write(data)
                 tag['href'] = stylepath
             else:
                 for ns in tag.findAll(text=True):
@@ -359,23 +398,42 @@ class RecursiveFetcher(object):
                             self.log.exception('Could not fetch stylesheet ', iurl)
                             continue
                         c += 1
-                        stylepath = os.path.join(diskpath, 'style'+str(c)+'.css')
+                        stylepath = self.save_resource(data, os.path.join(diskpath, 'style'+str(c)+'.css'))
                         with self.stylemap_lock:
                             self.stylemap[iurl] = stylepath
-                        with open(stylepath, 'wb') as x:
-                            x.write(data)
                         ns.replaceWith(src.replace(m.group(1), stylepath))
 
     def rescale_image(self, data):
         return rescale_image(data, self.scale_news_images, self.compress_news_images_max_size, self.compress_news_images_auto_size)
 
+    def prefetch(self, urls):
+        ''' Fetch the resources not already downloaded in parallel, in the
+        resource threads of the scheduler. Returns a mapping of URL to data or
+        the error that prevented fetching it. '''
+        if self.scheduler is None:
+            return {}
+        with self.imagemap_lock:
+            urls = tuple(OrderedDict.fromkeys(u for u in urls if u not in self.imagemap))
+        if len(urls) < 2:
+            return {}
+        return dict(zip(urls, self.scheduler.map(self.fetch_url, urls)))
+
     def process_images(self, soup, baseurl):
         diskpath = unicode_path(os.path.join(self.current_dir, 'images'))
         if not os.path.exists(diskpath):
             os.mkdir(diskpath)
         c = 0
+        images = []
         for tag in soup.findAll(lambda tag: tag.name.lower()=='img' and tag.has_key('src')):  # noqa
             iurl = tag['src']
+            if not iurl.startswith('data:image/'):
+                if callable(self.image_url_processor):
+                    iurl = self.image_url_processor(baseurl, iurl)
+                if not urlparse.urlsplit(iurl).scheme:
+                    iurl = urlparse.urljoin(baseurl, iurl, False)
+            images.append((tag, iurl))
+        prefetched = self.prefetch(iurl for tag, iurl in images if not iurl.startswith('data:image/'))
+        for tag, iurl in images:
             if iurl.startswith('data:image/'):
                 try:
                     data = b64decode(iurl.partition(',')[-1])
@@ -383,16 +441,16 @@ class RecursiveFetcher(object):
                     self.log.exception('Failed to decode embedded image')
                     continue
             else:
-                if callable(self.image_url_processor):
-                    iurl = self.image_url_processor(baseurl, iurl)
-                if not urlparse.urlsplit(iurl).scheme:
-                    iurl = urlparse.urljoin(baseurl, iurl, False)
                 with self.imagemap_lock:
                     if self.imagemap.has_key(iurl):  # noqa
                         tag['src'] = self.imagemap[iurl]
                         continue
                 try:
-                    data = self.fetch_url(iurl)
+                    data = prefetched.pop(iurl, None)
+                    if isinstance(data, Exception):
+                        raise data
+                    if data is None:
+                        data = self.fetch_url(iurl)
                     if data == 'GIF89a\x01':
                         # Skip empty GIF files as PIL errors on them anyway
                         continue
@@ -409,11 +467,9 @@ class RecursiveFetcher(object):
             itype = what(None, data)
             if itype == 'svg' or (itype is None and b'<svg' in data[:1024]):
                 # SVG image
-                imgpath = os.path.join(diskpath, fname+'.svg')
+                imgpath = self.save_resource(data, os.path.join(diskpath, fname+'.svg'))
                 with self.imagemap_lock:
                     self.imagemap[iurl] = imgpath
-                with open(imgpath, 'wb') as x:
-                    x.write(data)
                 tag['src'] = imgpath
             else:
                 try:
@@ -430,11 +486,9 @@ class RecursiveFetcher(object):
                     # Moon+ apparently cannot handle .jpeg files
                     if itype == 'jpeg':
                         itype = 'jpg'
-                    imgpath = os.path.join(diskpath, fname+'.'+itype)
+                    imgpath = self.save_resource(data, os.path.join(diskpath, fname+'.'+itype))
                     with self.imagemap_lock:
                         self.imagemap[iurl] = imgpath
-                    with open(imgpath, 'wb') as x:
-                        x.write(data)
                     tag['src'] = imgpath
                 except Exception:
                     traceback.print_exc()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import shutil
+import tempfile
+import unittest
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import Counter
+from threading import Thread
+
+from calibre.utils.logging import DevNull
+from calibre.web.fetch.cache import HTTPCache
+from calibre.web.fetch.simple import RecursiveFetcher, option_parser
+
+LAST_MODIFIED = 'Mon, 02 Jan 2017 10:00:00 GMT'
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests[self.path] += 1
+        headers = {}
+        if self.path == '/fresh':
+            headers['Cache-Control'] = 'max-age=3600'
+        elif self.path == '/etag':
+            if self.headers.get('If-None-Match') == '"v1"':
+                return self.reply(304, {'ETag': '"v1"'})
+            headers['ETag'] = '"v1"'
+        elif self.path == '/modified':
+            if self.headers.get('If-Modified-Since') == LAST_MODIFIED:
+                return self.reply(304, {})
+            headers['Last-Modified'] = LAST_MODIFIED
+        elif self.path == '/nostore':
+            headers['Cache-Control'] = 'no-store'
+        self.reply(200, headers, b'body of ' + self.path.encode('ascii'))
+
+    def reply(self, code, headers, body=b''):
+        self.send_response(code)
+        for k, v in headers.iteritems():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class HTTPCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.server.requests = Counter()
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.tdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tdir)
+
+    def download(self, paths):
+        ' Fetch the paths as a news download does, returning the cache statistics '
+        cache = HTTPCache(self.tdir + '/cache')
+        options = option_parser().parse_args(['--base-dir', self.tdir + '/fetch'])[0]
+        options.http_cache = cache
+        fetcher = RecursiveFetcher(options, DevNull())
+        for path in paths:
+            self.assertEqual(fetcher.fetch_url(self.base_url + path), b'body of ' + path.encode('ascii'))
+        cache.close()
+        return cache.stats
+
+    def test_http_cache(self):
+        paths = ('/fresh', '/etag', '/modified', '/nostore')
+        stats = self.download(paths + paths)
+        self.assertEqual(self.server.requests, {p: 1 for p in paths})
+        self.assertEqual((stats['downloaded'], stats['reused']), (4, 4))
+        self.server.requests.clear()
+        stats = self.download(paths)
+        self.assertEqual(self.server.requests, {'/etag': 1, '/modified': 1, '/nostore': 1})
+        self.assertEqual((stats['fresh'], stats['revalidated'], stats['downloaded']), (1, 2, 1))
+
+    def test_deduplicate(self):
+        cache = HTTPCache(self.tdir)
+        self.assertIsNone(cache.deduplicate(b'image', 'a.png'))
+        self.assertIsNone(cache.deduplicate(b'other', 'b.png'))
+        self.assertEqual(cache.deduplicate(b'image', 'c.png'), 'a.png')
+        self.assertEqual(cache.stats['deduplicated'], 1)
+
+
+def find_tests():
+    return unittest.defaultTestLoader.loadTestsFromTestCase(HTTPCacheTest)
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=4).run(find_tests())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python2
+# vim:fileencoding=utf-8
+# License: GPLv3 Copyright: 2017, Kovid Goyal <kovid at kovidgoyal.net>
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import time
+import unittest
+from collections import Counter, defaultdict
+from threading import Lock, current_thread
+
+from calibre.web.fetch.scheduler import Scheduler
+
+
+class Recorder(object):
+
+    ' Fetches that record when they were made and how many were active '
+
+    def __init__(self, scheduler, duration=0.02):
+        self.scheduler, self.duration = scheduler, duration
+        self.lock = Lock()
+        self.active, self.max_active = Counter(), Counter()
+        self.max_total = 0
+        self.times = defaultdict(list)
+
+    def __call__(self, url):
+        host = url.split('/')[2]
+        with self.scheduler.slot(url):
+            with self.lock:
+                self.active[host] += 1
+                self.max_active[host] = max(self.max_active[host], self.active[host])
+                self.max_total = max(self.max_total, sum(self.active.itervalues()))
+                start = time.time()
+            time.sleep(self.duration)
+            with self.lock:
+                self.active[host] -= 1
+                self.times[host].append((start, time.time()))
+        return url
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_per_host_concurrency(self):
+        s = Scheduler(max_per_host=2, resource_threads=8)
+        r = Recorder(s, duration=0.05)
+        urls = ['http://%s/%d' % (host, i) for i in range(6) for host in ('one.com', 'two.com')]
+        try:
+            self.assertEqual(s.map(r, urls), urls)
+        finally:
+            s.close()
+        self.assertEqual(r.max_active, {'one.com': 2, 'two.com': 2})
+        self.assertEqual(r.max_total, 4, 'Different hosts were not fetched from in parallel')
+        self.assertEqual({h: st.requests for h, st in s.hosts.iteritems()}, {'one.com': 6, 'two.com': 6})
+
+    def test_delay(self):
+        delay = 0.1
+        s = Scheduler(delay=delay, resource_threads=4)
+        r = Recorder(s, duration=0)
+        urls = ['http://one.com/%d' % i for i in range(3)] + ['http://two.com/0']
+        try:
+            s.map(r, urls)
+        finally:
+            s.close()
+        times = sorted(r.times['one.com'])
+        self.assertEqual(len(times), 3)
+        for (start, finish), (next_start, next_finish) in zip(times, times[1:]):
+            self.assertGreaterEqual(next_start - finish, delay * 0.9)
+        # Fetches from other hosts are not delayed
+        self.assertLess(r.times['two.com'][0][0] - times[0][0], delay)
+
+    def test_map(self):
+        s = Scheduler(resource_threads=3, clone_browser=lambda br: (br, current_thread().name))
+
+        def func(x):
+            if x == 3:
+                raise ValueError('failed')
+            time.sleep(0.01)
+            return x * 2, s.browser('default')
+
+        try:
+            self.assertEqual(s.map(func, ()), [])
+            results = s.map(func, range(6))
+        finally:
+            s.close()
+        self.assertIsInstance(results[3], ValueError)
+        self.assertEqual([x[0] for i, x in enumerate(results) if i != 3], [0, 2, 4, 8, 10])
+        browsers = {x[1] for i, x in enumerate(results) if i != 3}
+        self.assertTrue(all(br[0] == 'default' for br in browsers))
+        self.assertLessEqual(len(browsers), 3)
+        # The browser is not cloned outside the resource threads
+        self.assertEqual(s.browser('default'), 'default')
+
+
+def find_tests():
+    return unittest.defaultTestLoader.loadTestsFromTestCase(SchedulerTest)
+
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=4).run(find_tests())